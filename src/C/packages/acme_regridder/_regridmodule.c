@@ -1,178 +1,244 @@
 #include <Python.h>
 #include "numpy/ndarrayobject.h"
 #include <stdbool.h>
+#include <math.h>
 
-static PyObject *
-  PyACME_apply_weights_masked(PyObject *self,PyObject *args)
+/*
+  Both kernels compute out[i,row[k]] += S[k]*data[i,col[k]] for every slice i of the leading
+  dimensions of data, and every weight k.
+
+  data may be float32 or float64, and is read without conversion; other types are converted
+  to float64.  Its last dimension must be contiguous, but the leading dimensions may have any
+  strides, e.g. a time step sliced out of a larger array.
+
+  The optional keyword out is an array, of shape (nindep,n2) and type float32 or float64,
+  to write the result into, e.g. the same array for each time step.  It is returned.  If out
+  is not supplied, a new array is made, of type float32 if the keyword single is true, and
+  otherwise float64.
+
+  Arithmetic is done in the precision of the output array.
+*/
+
+/* Returns a pointer to the start of slice i (numbered as in C order) of the leading dimensions
+   of a. */
+static char *
+  slice_pointer(PyArrayObject *a, npy_intp i)
 {
-  PyObject *row_obj,*col_obj,*S_obj,*data_obj;
-  PyArrayObject *row=NULL,*col=NULL,*S=NULL,*dest_field=NULL,*data=NULL;
-  double *S_vals;
-  int *row_vals,*col_vals;
-  char type;
-  void *data_vals;
-  double *out;
-  bool *is_missing;
-  PyObject *Missing;
-  double missingd;
-  float missingf;
-  int missingi;
-  long missingl;
-  int n2;
-
-  if (!PyArg_ParseTuple(args,"OOOOiO",&data_obj,&S_obj,&row_obj,&col_obj,&n2,&Missing))
-    return NULL;
+  char *p = PyArray_BYTES(a);
+  int d;
+  for (d=PyArray_NDIM(a)-2;d>=0;d--) {
+    npy_intp n = PyArray_DIM(a,d);
+    p += (i%n)*PyArray_STRIDE(a,d);
+    i /= n;
+  }
+  return p;
+}
 
-    S =(PyArrayObject *) PyArray_FromObject(S_obj,NPY_FLOAT64,1,1);
-    col =(PyArrayObject *) PyArray_FromObject(col_obj,NPY_INT32,1,1);
-    row =(PyArrayObject *) PyArray_FromObject(row_obj,NPY_INT32,1,1);
-    data =(PyArrayObject *) PyArray_FromObject(data_obj,NPY_NOTYPE,1,0);
+/* Prepares the arguments common to both kernels.  On success, returns 0 and sets the arrays,
+   which the caller must release with release_arrays().  On failure, returns -1 with an
+   exception set. */
+static int
+  get_arrays(PyObject *data_obj,PyObject *S_obj,PyObject *row_obj,PyObject *col_obj,int n2,
+             PyObject *out_obj,int single,PyArrayObject **data,PyArrayObject **S,
+             PyArrayObject **row,PyArrayObject **col,PyArrayObject **out,npy_intp *nindep)
+{
+  int i,type;
+  npy_intp k,n1;
+  *data = *S = *row = *col = *out = NULL;
 
-    type = data->descr->type;
+  *S = (PyArrayObject *) PyArray_FROMANY(S_obj,NPY_FLOAT64,1,1,NPY_ARRAY_IN_ARRAY);
+  *col = (PyArrayObject *) PyArray_FROMANY(col_obj,NPY_INT32,1,1,NPY_ARRAY_IN_ARRAY);
+  *row = (PyArrayObject *) PyArray_FROMANY(row_obj,NPY_INT32,1,1,NPY_ARRAY_IN_ARRAY);
+  if (*S==NULL || *col==NULL || *row==NULL) goto fail;
+  if (PyArray_DIM(*col,0)!=PyArray_DIM(*S,0) || PyArray_DIM(*row,0)!=PyArray_DIM(*S,0)) {
+    PyErr_SetString(PyExc_ValueError,"S, row and col must have the same length");
+    goto fail;
+  }
 
-    if ((type=='d') || (type=='f')) {
-      if (PyFloat_Check(Missing) == 1 ) {
-        missingd = PyFloat_AsDouble(Missing);
-        missingf = missingd;
-      }
-      else {
-        return NULL;
-      }
-    }
-    else if ((type=='i') || (type=='l') ) {
-      if (PyInt_Check(Missing) == 1) {
-        missingl = PyInt_AsLong(Missing);
-      }
-      else if (PyLong_Check(Missing) == 1) {
-        missingl = PyLong_AsLong(Missing);
-      }
-      else {
-        return NULL;
+  *data = (PyArrayObject *) PyArray_FROMANY(data_obj,NPY_NOTYPE,1,0,NPY_ARRAY_ALIGNED);
+  if (*data==NULL) goto fail;
+  type = PyArray_TYPE(*data);
+  if ((type!=NPY_FLOAT32 && type!=NPY_FLOAT64) ||
+      PyArray_STRIDE(*data,PyArray_NDIM(*data)-1)!=PyArray_ITEMSIZE(*data)) {
+    PyArrayObject *tmp;
+    tmp = (PyArrayObject *) PyArray_FROMANY((PyObject *)*data,
+                                            (type==NPY_FLOAT32) ? NPY_FLOAT32 : NPY_FLOAT64,
+                                            1,0,NPY_ARRAY_IN_ARRAY);
+    Py_DECREF(*data);
+    *data = tmp;
+    if (*data==NULL) goto fail;
+  }
+  n1 = PyArray_DIM(*data,PyArray_NDIM(*data)-1);
+  *nindep = 1;
+  for (i=0;i<PyArray_NDIM(*data)-1;i++) {
+    *nindep *= PyArray_DIM(*data,i);
+  }
+
+  {
+    int32_t *row_vals = (int32_t *) PyArray_DATA(*row);
+    int32_t *col_vals = (int32_t *) PyArray_DATA(*col);
+    for (k=0;k<PyArray_DIM(*S,0);k++) {
+      if (row_vals[k]<0 || row_vals[k]>=n2 || col_vals[k]<0 || col_vals[k]>=n1) {
+        PyErr_SetString(PyExc_IndexError,"row or col index out of range");
+        goto fail;
       }
-      missingi = (int) missingl;
-      missingd = (double) missingl;
     }
-    else {
-      return NULL;
-    }
-
+  }
 
-    int nindep=1;
-    int i,j;
-    for (i=0;i<data->nd-1;i++) {
-      nindep*=data->dimensions[i];
-    }
-    /* Construct dest array */
-    int n1 = data->dimensions[data->nd-1];
+  if (out_obj==NULL || out_obj==Py_None) {
     npy_intp newdims[2];
-    newdims[0]=nindep;
+    newdims[0] = *nindep;
     newdims[1] = n2;
-    out=malloc(newdims[0]*newdims[1]*sizeof(double));
-    is_missing=malloc(newdims[0]*newdims[1]*sizeof(bool));
-    #pragma omp parallel for
-    for (j=0;j<newdims[0]*newdims[1];j++) {
-      out[j]=0;
-      is_missing[j] = true;
+    *out = (PyArrayObject *) PyArray_SimpleNew(2,newdims,single ? NPY_FLOAT32 : NPY_FLOAT64);
+    if (*out==NULL) goto fail;
+  }
+  else {
+    if (!PyArray_Check(out_obj)) {
+      PyErr_SetString(PyExc_TypeError,"out must be an array");
+      goto fail;
     }
-
-    dest_field = PyArray_SimpleNew(2,newdims,NPY_FLOAT64);
-
-    S_vals = (double *)S->data;
-    row_vals = (int *) row->data;
-    col_vals = (int *) col->data;
-    data_vals = (void *) data->data;
-    #pragma omp parallel for private(j) schedule(guided) if (nindep > 5)
-    for (i=0;i<nindep;i++) {
-        for (j=0;j<S->dimensions[0];j++) {
-          if (((float *)data_vals)[i*n1+col_vals[j]] != missingf)  {
-            out[i*n2+row_vals[j]] = out[i*n2+row_vals[j]] + (double)S_vals[j]*((float *)data_vals)[i*n1+col_vals[j]];
-            is_missing[i*n2+row_vals[j]] = false;
-          }
-        }
-      /*
-      for (j=0;j<n2;j++) {
-        if (fracb_vals[j]>0.) out[i*n2+j]=out[i*n2+j]/(float)fracb_vals[j];
-      }
-      */
-    }
-    #pragma omp parallel for
-    for (j=0;j<newdims[0]*newdims[1];j++) {
-      if (is_missing[j]) out[j] = missingf;
+    *out = (PyArrayObject *) out_obj;
+    Py_INCREF(*out);
+    if ((PyArray_TYPE(*out)!=NPY_FLOAT32 && PyArray_TYPE(*out)!=NPY_FLOAT64) ||
+        PyArray_NDIM(*out)!=2 || PyArray_DIM(*out,0)!=*nindep || PyArray_DIM(*out,1)!=n2 ||
+        !PyArray_ISCARRAY(*out)) {
+      PyErr_SetString(PyExc_ValueError,
+                      "out must be a writable contiguous float32 or float64 array of shape (nindep,n2)");
+      goto fail;
     }
-    dest_field->data=out;
-    Py_DECREF(S);
-    Py_DECREF(col);
-    Py_DECREF(row);
-    Py_DECREF(data);
-    free(is_missing);
-  return Py_BuildValue("N",dest_field);
+  }
+  return 0;
+
+ fail:
+  Py_XDECREF(*data);
+  Py_XDECREF(*S);
+  Py_XDECREF(*row);
+  Py_XDECREF(*col);
+  Py_XDECREF(*out);
+  *data = *S = *row = *col = *out = NULL;
+  return -1;
 }
+
+static void
+  release_arrays(PyArrayObject *data,PyArrayObject *S,PyArrayObject *row,PyArrayObject *col)
+{
+  Py_DECREF(data);
+  Py_DECREF(S);
+  Py_DECREF(row);
+  Py_DECREF(col);
+}
+
+/* The loop of apply_weights, for input of type INTYPE and output of type OUTTYPE. */
+#define APPLY_WEIGHTS(INTYPE,OUTTYPE) {                                   \
+    _Pragma("omp parallel for private(j) schedule(guided) if (nindep > 5)") \
+    for (i=0;i<nindep;i++) {                                              \
+      const INTYPE *in = (const INTYPE *) slice_pointer(data,i);          \
+      OUTTYPE *o = ((OUTTYPE *) PyArray_DATA(out)) + i*n2;                \
+      for (j=0;j<n2;j++) o[j] = 0;                                        \
+      for (j=0;j<ns;j++) {                                                \
+        o[row_vals[j]] += (OUTTYPE)S_vals[j]*in[col_vals[j]];             \
+      }                                                                   \
+    }                                                                     \
+  }
+
+/* The loop of apply_weights_masked.  To avoid a separate array to record which destination
+   points have no valid source points, such points hold NaN until the end.  So NaN source
+   values are treated as missing. */
+#define APPLY_WEIGHTS_MASKED(INTYPE,OUTTYPE) {                            \
+    const INTYPE missing_in = (INTYPE) missing;                           \
+    _Pragma("omp parallel for private(j) schedule(guided) if (nindep > 5)") \
+    for (i=0;i<nindep;i++) {                                              \
+      const INTYPE *in = (const INTYPE *) slice_pointer(data,i);          \
+      OUTTYPE *o = ((OUTTYPE *) PyArray_DATA(out)) + i*n2;                \
+      for (j=0;j<n2;j++) o[j] = NAN;                                      \
+      for (j=0;j<ns;j++) {                                                \
+        INTYPE x = in[col_vals[j]];                                       \
+        if (x != missing_in && !isnan(x)) {                               \
+          OUTTYPE *oj = o+row_vals[j];                                    \
+          if (isnan(*oj)) *oj = (OUTTYPE)S_vals[j]*x;                     \
+          else *oj += (OUTTYPE)S_vals[j]*x;                               \
+        }                                                                 \
+      }                                                                   \
+      for (j=0;j<n2;j++) if (isnan(o[j])) o[j] = (OUTTYPE) missing;       \
+    }                                                                     \
+  }
+
+static char *apply_weights_kwlist[] = {"data","S","row","col","n2","out","single",NULL};
+
 static PyObject *
-  PyACME_apply_weights(PyObject *self,PyObject *args)
+  PyACME_apply_weights(PyObject *self,PyObject *args,PyObject *kwds)
 {
-  PyObject *row_obj,*col_obj,*S_obj,*data_obj;
-  PyArrayObject *row=NULL,*col=NULL,*S=NULL,*dest_field=NULL,*data=NULL;
+  PyObject *row_obj,*col_obj,*S_obj,*data_obj,*out_obj=NULL;
+  PyArrayObject *row,*col,*S,*data,*out;
   double *S_vals;
-  int *row_vals,*col_vals;
-  char type;
-  void *data_vals;
-  double *out;
-  int n2;
+  int32_t *row_vals,*col_vals;
+  npy_intp nindep,ns,i,j;
+  int n2,single=0;
 
-  if (!PyArg_ParseTuple(args,"OOOOi",&data_obj,&S_obj,&row_obj,&col_obj,&n2))
+  if (!PyArg_ParseTupleAndKeywords(args,kwds,"OOOOi|Oi",apply_weights_kwlist,
+                                   &data_obj,&S_obj,&row_obj,&col_obj,&n2,&out_obj,&single))
+    return NULL;
+  if (get_arrays(data_obj,S_obj,row_obj,col_obj,n2,out_obj,single,
+                 &data,&S,&row,&col,&out,&nindep)<0)
     return NULL;
 
-    S =(PyArrayObject *) PyArray_FromObject(S_obj,NPY_FLOAT64,1,1);
-    col =(PyArrayObject *) PyArray_FromObject(col_obj,NPY_INT32,1,1);
-    row =(PyArrayObject *) PyArray_FromObject(row_obj,NPY_INT32,1,1);
-    data =(PyArrayObject *) PyArray_FromObject(data_obj,NPY_NOTYPE,1,0);
+  S_vals = (double *) PyArray_DATA(S);
+  row_vals = (int32_t *) PyArray_DATA(row);
+  col_vals = (int32_t *) PyArray_DATA(col);
+  ns = PyArray_DIM(S,0);
+  if (PyArray_TYPE(data)==NPY_FLOAT32) {
+    if (PyArray_TYPE(out)==NPY_FLOAT32) APPLY_WEIGHTS(float,float)
+    else APPLY_WEIGHTS(float,double)
+  }
+  else {
+    if (PyArray_TYPE(out)==NPY_FLOAT32) APPLY_WEIGHTS(double,float)
+    else APPLY_WEIGHTS(double,double)
+  }
+  release_arrays(data,S,row,col);
+  return PyArray_Return(out);
+}
 
-    type = data->descr->type;
+static char *apply_weights_masked_kwlist[] = {"data","S","row","col","n2","missing","out",
+                                              "single",NULL};
 
-    int nindep=1;
-    int i,j;
-    for (i=0;i<data->nd-1;i++) {
-      nindep*=data->dimensions[i];
-    }
-    /* Construct dest array */
-    int n1 = data->dimensions[data->nd-1];
-    npy_intp newdims[2];
-    newdims[0]=nindep;
-    newdims[1] = n2;
-    out=malloc(newdims[0]*newdims[1]*sizeof(double));
-    #pragma omp parallel for
-    for (j=0;j<newdims[0]*newdims[1];j++) {
-      out[j]=0;
-    }
+static PyObject *
+  PyACME_apply_weights_masked(PyObject *self,PyObject *args,PyObject *kwds)
+{
+  PyObject *row_obj,*col_obj,*S_obj,*data_obj,*out_obj=NULL;
+  PyArrayObject *row,*col,*S,*data,*out;
+  double *S_vals;
+  int32_t *row_vals,*col_vals;
+  npy_intp nindep,ns,i,j;
+  int n2,single=0;
+  double missing;
 
-    dest_field = PyArray_SimpleNew(2,newdims,NPY_FLOAT64);
-
-    S_vals = (double *)S->data;
-    row_vals = (int *) row->data;
-    col_vals = (int *) col->data;
-    data_vals = (void *) data->data;
-    #pragma omp parallel for private(j) schedule(guided) if (nindep > 5)
-    for (i=0;i<nindep;i++) {
-        for (j=0;j<S->dimensions[0];j++) {
-            out[i*n2+row_vals[j]] = out[i*n2+row_vals[j]] + (double)S_vals[j]*((float *)data_vals)[i*n1+col_vals[j]];
-        }
-      /*
-      for (j=0;j<n2;j++) {
-        if (fracb_vals[j]>0.) out[i*n2+j]=out[i*n2+j]/(float)fracb_vals[j];
-      }
-      */
-    }
-    dest_field->data=out;
-    Py_DECREF(S);
-    Py_DECREF(col);
-    Py_DECREF(row);
-    Py_DECREF(data);
-  return Py_BuildValue("N",dest_field);
+  if (!PyArg_ParseTupleAndKeywords(args,kwds,"OOOOid|Oi",apply_weights_masked_kwlist,
+                                   &data_obj,&S_obj,&row_obj,&col_obj,&n2,&missing,
+                                   &out_obj,&single))
+    return NULL;
+  if (get_arrays(data_obj,S_obj,row_obj,col_obj,n2,out_obj,single,
+                 &data,&S,&row,&col,&out,&nindep)<0)
+    return NULL;
+
+  S_vals = (double *) PyArray_DATA(S);
+  row_vals = (int32_t *) PyArray_DATA(row);
+  col_vals = (int32_t *) PyArray_DATA(col);
+  ns = PyArray_DIM(S,0);
+  if (PyArray_TYPE(data)==NPY_FLOAT32) {
+    if (PyArray_TYPE(out)==NPY_FLOAT32) APPLY_WEIGHTS_MASKED(float,float)
+    else APPLY_WEIGHTS_MASKED(float,double)
+  }
+  else {
+    if (PyArray_TYPE(out)==NPY_FLOAT32) APPLY_WEIGHTS_MASKED(double,float)
+    else APPLY_WEIGHTS_MASKED(double,double)
+  }
+  release_arrays(data,S,row,col);
+  return PyArray_Return(out);
 }
 
 static PyMethodDef MyExtractMethods[]= {
-  {"apply_weights",PyACME_apply_weights, METH_VARARGS},
-  {"apply_weights_masked",PyACME_apply_weights_masked, METH_VARARGS},
+  {"apply_weights",(PyCFunction)PyACME_apply_weights, METH_VARARGS|METH_KEYWORDS},
+  {"apply_weights_masked",(PyCFunction)PyACME_apply_weights_masked, METH_VARARGS|METH_KEYWORDS},
   {NULL, NULL} /*sentinel */
 };
 
@@ -180,7 +246,7 @@ PyMODINIT_FUNC init_regrid(void)
 {
   (void) Py_InitModule("_regrid", MyExtractMethods);
   import_array();
-  
+
 }
 
 /* int main(int argc,char **argv) */
@@ -190,4 +256,3 @@ PyMODINIT_FUNC init_regrid(void)
 /*   init_cmor(); */
 /*   return 0; */
 /* } */
-
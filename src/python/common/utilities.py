@@ -105,6 +105,14 @@ def hashfile(filename):
         # probably there is no script
         return 0
 
+def file_stamp(filename):
+    """returns a tuple (size, mtime) for the file; which will change if the file is changed.
+    If there is no such file, returns (0,0)."""
+    if os.path.isfile(filename):
+        return ( os.path.getsize(filename), os.path.getmtime(filename) )
+    else:
+        return ( 0, 0 )
+
 provdic = {}
 def provenance_dict( script_file_name=None ):
 
@@ -106,18 +106,6 @@ class derived_var(basic_id):
             if hasattr(self,'filetable'):  output.filetable = self.filetable
             self._file_attributes.update( getattr(output,'_file_attributes',{}) )
 
-            # Compute the mean right away.  Clearing the weight cache and especially this method
-            # for doing it just once, are a temporary expedients;
-            outaxes = [ax.axis for ax in output.getAxisList() if hasattr(ax,'axis')]
-            outaxes.sort()
-            if outaxes==['X','Y','Z'] and 'mass' in getattr(output.filetable,'weights',{}):
-                # This is the kind of domain we want to save mass weights for.
-                # Whatever mass weights are in the filetable might be bad - that happens if it has
-                # mass weights for hybrid levels and we're now using pressure levels.
-                # So clear it out. New ones will get computed.
-                # This operation will be unnecessary once I implement something better than (latsize,lonsize)
-                # for looking up mass weights.
-                output.filetable.weights['mass']={}
             output.mean = None  # ensures that set_mean will compute a new mean.
             #   Note that the previous calculation may have transmitted the :mean attribute from an
             #   input variable to output, which would be incorrect.
@@ -4,7 +4,7 @@
 
 import sys, traceback, pdb
 import cdms2, math, itertools, operator, numpy, subprocess, re, MV2, logging
-import hashlib, os
+import hashlib, os, cdtime, collections
 from pprint import pprint
 import cdutil.times
 from math import radians, log10
@@ -15,6 +15,8 @@ from numbers import Number
 import datetime
 from unidata import udunits
 from metrics.fileio.filetable import *
+from metrics.fileio.multifile import aggregate_files, open_datafile
+from metrics.fileio.rvcache import rvcache_key
 from metrics.computation.units import *
 #from climo_test import cdutil_climatology
 import metrics.frontend.defines as defines
@@ -29,6 +31,25 @@ logger = logging.getLogger(__name__)
 
 regridded_vars = {}  # experimental
 
+# If numpy_climatology is True, calculate_seasonal_climatology() computes the climatology of the
+# seasons in defines.season_months itself, with weights cached in climatology_weights, rather than
+# with cdutil.  See seasonal_weights().  It is much faster, and the same as cdutil's for complete
+# years without missing data.  But cdutil averages yearly seasonal means and drops incomplete
+# seasons, while this averages all the time steps in the season; so the two differ for partial
+# seasons at the ends of a run, and where the data is missing in some years but not others.
+# diags sets this from --climatology-engine.
+numpy_climatology = False
+climatology_weights = collections.OrderedDict()   # time axis key : time_axis_weights
+climatology_weights_size = 20    # maximum number of time axes in climatology_weights
+
+# A reduced_variable made with chunked=True doesn't read a variable with more than
+# chunked_reduction_bytes bytes of data (unless it's None).  Instead, its reduction function gets a
+# chunked_variable, from which reduce2any() reads the data in time chunks of at most
+# reduction_chunk_bytes bytes.  That is done only with numpy_climatology (--climatology-engine
+# numpy): cdutil's climatology needs all the data at once, so then variables are read whole.
+chunked_reduction_bytes = 2**30
+reduction_chunk_bytes = 2**27
+
 seasonsyr=cdutil.times.Seasons('JFMAMJJASOND')
 
 # -------- Axis Utilities ---------
@@ -266,6 +287,59 @@ def set_mean( mv, season=seasonsyr, region=None, gw=None ):
 
     return mvmean
 
+def find_mass_weights( mv ):
+    """Returns (lev,lat,lon)-shaped mass weights for averaging the variable mv, or None if there
+    are none.  They are looked up in the mass weight cache of mv's filetable (see
+    fileio/weightcache.py) or, failing that, computed from mv and saved there.  If mv lacks some
+    of these axes, cached weights for a variable from the same file which has them are returned,
+    for fill_mass_weights() to sum over the missing directions."""
+    from metrics.fileio.weightcache import mass_weights_key
+    from metrics.packages.amwg.derivations.massweighting import mass_weights
+    cache = getattr( getattr(mv,'filetable',None), 'massweights', None )
+    key = mass_weights_key( mv )
+    if cache is not None:
+        wts = cache.find( key )
+        if wts is not None:
+            return wts
+    if None in key[0:3]:
+        # mv doesn't have the three axes needed to compute mass weights.
+        # This currently happens in plot sets 4 and 4a, where the variable to be plotted
+        # lives on a hybrid of the model and obs grids.  Suitable mass weights don't exist.
+        logger.warning("Cannot compute mass weights for %s",
+                       getattr(mv,'id',getattr(mv,'_id','unknown')))
+        return None
+    wts = mass_weights( mv )
+    if cache is not None:
+        cache.put( key, wts )
+    return wts
+
+def fill_mass_weights( avweights, latlon_wts ):
+    """Sets avweights, a variable, to the mass weights for it, derived from latlon_wts, mass weights
+    of shape (lev,lat,lon).  If avweights has no level axis, the bottom level is used.  If it has
+    no latitude or longitude axis, the weights are summed over latitude or longitude."""
+    axes = avweights.getAxisList()
+    klevs = [ i for i,a in enumerate(axes) if a.isLevel() ][0:1]
+    klats = [ i for i,a in enumerate(axes) if a.isLatitude() ][0:1]
+    klons = [ i for i,a in enumerate(axes) if a.isLongitude() ][0:1]
+    if len(klevs)==0 and len(klats)==0 and len(klons)==0:
+        # No levels, latitudes, no longitudes!
+        # Probably something's wrong, there's basically nothing to do.
+        # But we can go on with something sensible anyway.
+        logger.warning("Computing a mass-weighted average of %s with no spatial axes",
+                       getattr(avweights,'id',getattr(avweights,'_id','unknown')))
+    wts = numpy.ma.asarray( latlon_wts )
+    if len(klons)==0:
+        wts = wts.sum( axis=2 )
+    if len(klats)==0:
+        wts = wts.sum( axis=1 )
+    if len(klevs)==0:
+        wts = wts[-1]   # means use the bottom, usually best if there are no levels
+    # wts has the (lev,lat,lon) axes which avweights has.  Put them in avweights' order, with
+    # length 1 for its other axes, and broadcast.
+    present = klevs+klats+klons
+    wts = numpy.ma.asarray( wts ).transpose( numpy.argsort(present) )
+    avweights[...] = wts.reshape([ n if i in present else 1 for i,n in enumerate(avweights.shape) ])
+
 # -------- end of Miscellaneous  Utilities ---------
 
 def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=True, weights=None, exclude_axes=[] ):
@@ -298,17 +372,28 @@ def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=Tru
         return mv
     if vid is None:   # Note that the averager function returns a variable with meaningless id.
         vid = 'reduced_'+mv.id
-    if region is None or region=="global" or region=="Global" or\
-            getattr(region,'filekey',None)=="Global" or str(region)=="Global":
-        mvr = mv
+    if isinstance( mv, chunked_variable ):
+        # mv is still in its file.  Read only what's needed for the climatology, a chunk at a time.
+        mvrs = mv.seasonal_climatology( season, region )
+        if mvrs is None:
+            return None
+        for att in ['filename', 'filetable', 'weighting', 'diags_gw']:
+            if att in mv.__dict__:
+                setattr( mvrs, att, getattr(mv,att) )
+        # From here on, the climatology has everything we need to know about mv.
+        mv = mvrs
     else:
-        mvr = select_region(mv, region)
-    mvrs = calculate_seasonal_climatology(mvr, season)
-    if mvrs is None:
-        # Among other cases, this can happen if mv has all missing values.
-        return None
-    mvrs.filename = getattr(mvr,'filename',None)
-    mvrs.filetable = getattr(mvr,'filetable',None)
+        if region is None or region=="global" or region=="Global" or\
+                getattr(region,'filekey',None)=="Global" or str(region)=="Global":
+            mvr = mv
+        else:
+            mvr = select_region(mv, region)
+        mvrs = calculate_seasonal_climatology(mvr, season)
+        if mvrs is None:
+            # Among other cases, this can happen if mv has all missing values.
+            return None
+        mvrs.filename = getattr(mvr,'filename',None)
+        mvrs.filetable = getattr(mvr,'filetable',None)
 
     mv_axes = allAxes( mv )
     for a in mv_axes:
@@ -347,81 +432,7 @@ def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=Tru
             # In this case we will provide the averager with a full weight array, i.e.
             # "of the same shape as V" in the language of the genutil averager() documentation (with V=mvrs)
             if weights=='mass':
-                # doesn't work for atmos set 7: latlon_wts = mvrs.filetable.weights['mass']  # array of shape (lev,lat,lon)
-                from metrics.packages.amwg.derivations.massweighting import mass_weights
-                # We don't want to recompute weights if unnecessary.  So here, when possible, we are
-                # retrieving cached weights, based on the (lev,lat,lon) if we have a (lev,lat,lon)
-                # variable.  If the variable has fewer axes, we find weights which agree on the size of
-                # the axes it has, and add up over the other directions.  This works at the moment, but
-                # there are plenty of possibilities for it to fail - e.g. if you have two regions of the
-                # same shape, you need to compute weights in both of them, and this won't do that.
-                # Eventually we should have a more robust cacheing system: it should look at the actual
-                # range of lat,lon values, the region, the season; and maybe do something about levels.
-                lev = mvrs.getLevel()
-                if lev is None: llev = -1
-                else:llev = len(lev)
-                lat = mvrs.getLatitude()
-                if lat is None: llat = -1
-                else:llat = len(lat)
-                lon = mvrs.getLongitude()
-                if lon is None: llon = -1
-                else: llon = len(lon)
-                if 'mass' in mvrs.filetable.weights and (llev,llat,llon) in mvrs.filetable.weights['mass']:
-                    latlon_wts = mvrs.filetable.weights['mass'][(llev,llat,llon)]
-                elif 'mass' in mvrs.filetable.weights and lon is None and\
-                        llev in [k[0] for k in mvrs.filetable.weights['mass'].keys()] and\
-                        llat in [k[1] for k in mvrs.filetable.weights['mass'].keys()]:
-                    # No lon.  Get weights with lon (and the same lev,lat), and sum over lon.
-                    # Cross our fingers and hope that the first possibility is correct!
-                    newllon = [k[2] for k in mvrs.filetable.weights['mass'] if k[0]==llev and k[1]==llat][0]
-                    latlon_wts = mvrs.filetable.weights['mass'][(llev,llat,newllon)]
-                    # ... array of shape (lev,lat,lon); the sum over longitudes will happen later.
-                elif 'mass' in mvrs.filetable.weights and lat is None and\
-                        llev in [k[0] for k in mvrs.filetable.weights['mass'].keys()] and\
-                        llon in [k[2] for k in mvrs.filetable.weights['mass'].keys()]:
-                    # No lat.  Get weights with lat (and the same lev,lon), and sum over lat.
-                    # Cross our fingers and hope that the first possibility is correct!
-                    newllat = [k[1] for k in mvrs.filetable.weights['mass'] if k[0]==llev and k[2]==llon][0]
-                    latlon_wts = mvrs.filetable.weights['mass'][(llev,newllat,llon)]
-                    # ... array of shape (lev,lat,lon); the sum over latitudes will happen later.
-                elif 'mass' in mvrs.filetable.weights and lev is None and\
-                        llat in [k[1] for k in mvrs.filetable.weights['mass'].keys()] and\
-                        llon in [k[2] for k in mvrs.filetable.weights['mass'].keys()]:
-                    # No lev.  Get weights with lev (and the same lat,lon), and sum over lev.
-                    # Cross our fingers and hope that the first possibility is correct!
-                    newllev = [k[0] for k in mvrs.filetable.weights['mass'] if k[1]==llat and k[2]==llon][0]
-                    latlon_wts = mvrs.filetable.weights['mass'][(newllev,llat,llon)]
-                    # ... array of shape (lev,lat,lon); the sum over latitudes will happen later.
-                elif 'mass' in mvrs.filetable.weights and lat is None and lon is None and\
-                        llev in [k[0] for k in mvrs.filetable.weights['mass'].keys()]:
-                    # No lat or lon.  Get weights with lat and lon, and sum over lat,lon.
-                    # Cross our fingers and hope that the first possibility is correct!
-                    if len(mvrs.filetable.weights['mass'].keys())<1:
-                        log.error("Cannot compute mass weights for spatially reduced variable %s",mvrs.id)
-                    if len(mvrs.filetable.weights['mass'].keys())>1:
-                        log.warning("Multiple candidate mass weights for spatially reduced variable %s; will choose one",mvrs.id)
-                    newllon = [k[2] for k in mvrs.filetable.weights['mass']][0]
-                    newllat = [k[1] for k in mvrs.filetable.weights['mass']][0]
-                    latlon_wts = mvrs.filetable.weights['mass'][(llev,newllat,newllon)]
-                    # ... array of shape (lev,lat,lon); the sum over lat,lon will happen later.
-                # >>>> cases not considered: no lev,lat; no lev,lon; no lev,lat,lon <<<<
-                else:
-                    # Note that mass_weights() requires mvrs to have lev,lat,lon axes.
-                    if mvrs.getLevel() is None or mvrs.getLatitude() is None or mvrs.getLongitude() is None:
-                        # We're in trouble.  mvrs.filetable.weights['mass'] doesn't have what we need,
-                        # and mvrs doesn't have the three axes needed to compute mass weights.
-                        # When this happens, it means that we have to do more work someplace, to
-                        # make it possible to compute mass weights.
-                        # This currently happens in plot sets 4 and 4a, where the variable to be plotted
-                        # lives on a hybrid of the model and obs grids.  Suitable mass weights don't exist.
-                        logger.warning("Cannot compute mass weights for %s",
-                                       getattr(mvrs,'id',getattr(mvrs,'_id','unknown')))
-                        latlon_wts = None
-                    else:
-                        if 'mass' not in mvrs.filetable.weights:
-                            mvrs.filetable.weights['mass'] = {}
-                        latlon_wts = mass_weights( mvrs )    # array of shape (lev,lat,lon) ...
-                        mvrs.filetable.weights['mass'][(llev,llat,llon)] = latlon_wts
+                latlon_wts = find_mass_weights( mvrs )
                 # Previously I simply stored weights in the filetable, but it did't work in the occasional
                 # case that mvrs had been regridded to match another filetable!  These asserts helped catch
                 # such situations:
@@ -434,24 +445,6 @@ def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=Tru
                         assert len(mvrs.getLevel())==len(latlon_wts.getLevel())
             else:
                 latlon_wts = weights
-            if latlon_wts is None:
-                klevs = []
-                klats = []
-                klons = []
-            else:
-                klevs = [i for i,j in enumerate([a.isLevel() for a in axes]) if j==True]
-                klats = [i for i,j in enumerate([a.isLatitude() for a in axes]) if j==True]
-                klons = [i for i,j in enumerate([a.isLongitude() for a in axes]) if j==True]
-            #assert( len(klats)>0 ), "no latitudes exist"
-            ## equivalent to assert( any( [a.isLatitude() for a in axes] ) )
-            #assert( len(klons)>0 ), "no longitudes exist"
-            ## equivalent to assert( any( [a.isLongitude() for a in axes] ) )
-            if len(klats)>0:
-                klat = klats[0]        # thus axes[klat].isLatitude() is True
-            if len(klons)>0:
-                klon = klons[0]        # thus axes[klon].isLongitude() is True
-            if len(klevs)>0:
-                klev = klevs[0]
             avweights = mvrs.clone()
 
             # The variable mv, hence mvrs and avweights may have been expanded in longitude after
@@ -460,7 +453,7 @@ def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=Tru
             # N.B.  It would likely be better to do this with genutil.grower().
             if latlon_wts is None:
                 pass   # no mass weights available
-            elif len(klons)>0:
+            elif avweights.getLongitude() is not None:
                 ll_lon = latlon_wts.getLongitude()
                 av_lon = avweights.getLongitude()
                 av_lat = avweights.getLatitude()
@@ -471,80 +464,13 @@ def reduce2any( mv, target_axes, vid=None, season=seasonsyr, region=None, gw=Tru
                     # line in a more general location until another case turns up...
                     latlon_wts = latlon_wts( latitude=( av_lat[0], av_lat[-1] ) )
 
-            # Compute this variable's mass weight array based on the (lev,lat,lon) weight array in
-            # the filetable.  We just have to add up weights along any axis missing from the variable.
-            if latlon_wts is None:
-                pass   # no mass weights available
-            elif len(klevs)>0 and len(klats)>0 and len(klons)>0:
-                # We have all three: levels, latitudes and longitudes
-                if klevs==[0] and klats==[1] and klons==[2] and avweights.shape==latlon_wts.shape:
-                    # test code useful if you think you may not be recalculating mass_weights often enough...
-                    #dwt = latlon_wts - mass_weights( mvrs )
-                    #assert( dwt.min()==0 and dwt.max()==0 )
-                    # ...jfp test code
-                    # avweights and latlon_wts are compatible
-                    numpy.copyto( avweights, latlon_wts ) # avweights[:,:,...]=latlon_wts[:,:,...]
-                else:
-                    # avweights and latlon_wts are structured differently.  This loop is slow.
-                    for inds in numpy.ndindex(avweights.shape):
-                        ilev = inds[klev]
-                        ilat = inds[klat]
-                        ilon = inds[klon]
-                        avweights[inds] = latlon_wts[ilev,ilat,ilon]
-            elif len(klevs)==0 and len(klats)>0 and len(klons)>0:
-                # We have latitudes and longitudes, no levels.  We'll just use the bottom level.
-                ilev = -1   # means use the bottom, usually best if there are no levels
-                for inds in numpy.ndindex(avweights.shape):
-                    ilat = inds[klat]
-                    ilon = inds[klon]
-                    avweights[inds] = latlon_wts[ilev,ilat,ilon]
-            elif len(klevs)>0 and len(klats)>0 and len(klons)==0:
-                # We have levels and latitudes, no longitudes.  Normally this means that the variable
-                # represents a sum or average over longitudes.  For weights, sum over longitudes.
-                for inds in numpy.ndindex(avweights.shape):
-                    ilev = inds[klev]
-                    ilat = inds[klat]
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,ilat,:] )
-            elif len(klevs)>0 and len(klats)==0 and len(klons)>0:
-                # We have levels and longitudes, no latitudes.  Normally this means that the variable
-                # represents a sum or average over latitudes.  For weights, sum over latitudes.
-                for inds in numpy.ndindex(avweights.shape):
-                    ilev = inds[klev]
-                    ilon = inds[klon]
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,:,ilon] )
-            elif len(klevs)==0 and len(klats)>0 and len(klons)==0:
-                # We have latitudes, no levels or longitudes.  Use the bottom level and sum over
-                # the longitudes
-                ilev = -1   # means use the bottom, usually best if there are no levels
-                for inds in numpy.ndindex(avweights.shape):
-                    ilat = inds[klat]
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,ilat,:] )
-            elif len(klevs)==0 and len(klats)==0 and len(klons)>0:
-                # We have longitudes, no levels or latitudes.  Use the bottom level and sum over
-                # the latitudes
-                ilev = -1   # means use the bottom, usually best if there are no levels
-                for inds in numpy.ndindex(avweights.shape):
-                    ilon = inds[klon]
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,:,ilon] )
-            elif len(klevs)>0 and len(klats)==0 and len(klons)==0:
-                # We have levels, no latitudes or longitudes.  Sum over latitudes and longitudes.
-                for inds in numpy.ndindex(avweights.shape):
-                    ilev = inds[klev]
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,:,:] )
-            else:
-                # No levels, latitudes, no longitudes!
-                # Probably something's wrong, there's basically nothing to do.
-                # But we can go on with something sensible anyway.
-                logger.warning("Computing a mass-weighted average of %s with no spatial axes",\
-                                   getattr(mvrs,'id',getattr(mvrs,'_id','unknown')))
-                ilev = -1   # means use the bottom, usually best if there are no levels
-                for inds in numpy.ndindex(avweights.shape):
-                    avweights[inds] = numpy.sum( latlon_wts[ilev,:,:] )
-
+            # Compute this variable's mass weight array based on the (lev,lat,lon) weight array.
+            # We just have to add up weights along any axis missing from the variable.
             if latlon_wts is None:
                 # Although we have chosen mass weights, they are not available.
                 avmv = averager( mvrs, axis=axes_string )   # "normal" averaging
             else:
+                fill_mass_weights( avweights, latlon_wts )
                 avmv = averager( mvrs, axis=axes_string, weights=avweights )
 
         elif gw is None or mvrs.getLatitude() is None:
@@ -1684,13 +1610,117 @@ def reduce_time_seasonal( mv, season=seasonsyr, region=None, vid=None ):
         avmv.units = mv.units
     return avmv
 
+class time_axis_weights:
+    """For a time axis, the month and the length of each time step, from which the weights of the
+    steps in a season are computed.  Those weights are kept, for later variables on the same
+    axis."""
+    def __init__( self, tax ):
+        bounds = tax.getBounds()
+        calendar = tax.getCalendar()
+        # A time step belongs to the month containing the middle of its bounds.
+        middles = 0.5*(bounds[:,0]+bounds[:,1])
+        self.months = numpy.array( [ cdtime.reltime(t,tax.units).tocomp(calendar).month
+                                     for t in middles ] )
+        self.lengths = numpy.abs( bounds[:,1]-bounds[:,0] ).astype(numpy.float64)
+        self.seasons = {}   # season name : weights
+    def weights( self, sname ):
+        """Returns a 1-D array of weights, one per time step: the length of the step if it is in
+        the season named sname, otherwise 0."""
+        if sname not in self.seasons:
+            inseason = numpy.in1d( self.months, defines.season_months[sname] )
+            self.seasons[sname] = numpy.where( inseason, self.lengths, 0.0 )
+        return self.seasons[sname]
+
+def seasonal_weights( tax, sname ):
+    """Returns the weights with which calculate_seasonal_climatology() averages over the time
+    axis tax for the season named sname, or None if they can't be computed here (the season
+    isn't in defines.season_months, or the axis lacks bounds or has units other than days,
+    hours, minutes or seconds since a date).
+    The weights depend only on the axis and season, so they are cached in climatology_weights,
+    keyed on the axis values, bounds, units and calendar."""
+    units = getattr( tax, 'units', '' ).strip()
+    if sname not in defines.season_months or\
+            units.split(' ')[0] not in ['days','hours','minutes','seconds'] or\
+            ' since ' not in units or tax.getBounds() is None:
+        return None
+    bounds = numpy.ascontiguousarray( tax.getBounds(), dtype=numpy.float64 )
+    key = hashlib.sha1( numpy.ascontiguousarray( tax[:], dtype=numpy.float64 ) )
+    key.update( bounds )
+    key.update( "%s %s" % (units, tax.getCalendar()) )
+    key = key.hexdigest()
+    if key in climatology_weights:
+        axis_weights = climatology_weights.pop( key )
+    else:
+        try:
+            axis_weights = time_axis_weights( tax )
+        except Exception as e:
+            logger.debug( "cannot compute seasonal weights for time axis %s: %s", tax.id, e )
+            return None
+    climatology_weights[key] = axis_weights    # most recently used last
+    while len(climatology_weights) > climatology_weights_size:
+        climatology_weights.popitem( last=False )
+    return axis_weights.weights( sname )
+
+def time_weighted_sums( mv, tax, weights ):
+    """Returns, as 1-D arrays over the non-time elements of the variable mv, the sums over its
+    time axis tax of the data times weights, and of the weights of the valid data.  Missing data
+    is ignored.  weights is a 1-D array with an element for each time of mv."""
+    ti = mv.getAxisIndex( tax.id )
+    data = numpy.ma.asarray( mv )
+    tdata = numpy.rollaxis( data, ti, 0 ).reshape( (len(weights), -1) )   # time, everything else
+    count = numpy.dot( weights, ~numpy.ma.getmaskarray(tdata) )
+    total = numpy.dot( weights, tdata.filled(0) )
+    return total, count
+
+def time_weighted_variable( mv, tax, weights, total, count ):
+    """Returns the weighted mean over the time axis tax, computed from the sums total and count
+    of time_weighted_sums(), as a variable with a time axis of length 1.  weights has an element
+    for each time of tax.  mv is the variable, or any part of it with all of its other axes; it
+    provides those axes, the id and the type."""
+    ti = mv.getAxisIndex( tax.id )
+    data = numpy.ma.asarray( mv )
+    rest = data.shape[:ti] + data.shape[ti+1:]
+    mean = numpy.ma.masked_where( count==0, total/numpy.where( count==0, 1.0, count ) )
+    if data.dtype.kind=='f':
+        mean = mean.astype( data.dtype )
+    mean = numpy.rollaxis( mean.reshape( (1,)+rest ), 0, ti+1 )
+    newtax = cdms2.createAxis( [ numpy.dot(weights, tax[:])/weights.sum() ], id=tax.id )
+    newtax.units = tax.units
+    newtax.designateTime( calendar=tax.getCalendar() )
+    axes = mv.getAxisList()
+    axes[ti] = newtax
+    return cdms2.createVariable( mean, axes=axes, id=mv.id, fill_value=data.fill_value )
+
+def time_weighted_mean( mv, tax, weights ):
+    """Returns the weighted mean of the variable mv over its time axis tax, ignoring missing
+    data, as a variable with a time axis of length 1.  weights is a 1-D array with an element for
+    each time."""
+    total, count = time_weighted_sums( mv, tax, weights )
+    return time_weighted_variable( mv, tax, weights, total, count )
+
+def climatology_season_name( season ):
+    """Returns the name of the season (a cdutil.times.Seasons object, a string, or None for the
+    whole year) for seasonal_weights(), or None if it isn't a single season."""
+    if season is None:
+        return 'ANN'
+    elif type(season) == str:
+        return season
+    elif type(getattr(season,'seasons',None)) is list and len(season.seasons)==1:
+        return str(season.seasons[0])
+    else:
+        return None
+
 def calculate_seasonal_climatology(mv, season):
     """Averages the variable mv within the specified season to produce its climatology, and
     returns that as a new variable.
-    Note: presently this uses the UV-CDAT function climatology().  If performance is a concern,
-    the best solution is to convert the data to climatology files before running the diagnostics.
-    In the future we may consider replacing climatology() by the functions in inc_reduce.py.
+    For the seasons in defines.season_months (if numpy_climatology is True), this is the mean of
+    all the time steps in the season, each weighted by its length, computed in one pass over the
+    time axis; see seasonal_weights().  Other seasons, and time axes it can't handle, use the
+    UV-CDAT function climatology(), which is slow.  Then if performance is a concern, the best
+    solution is to convert the data to climatology files before running the diagnostics.
     """
+    # The season's name, for the weights computed here.
+    sname = climatology_season_name( season )
     # Convert season to a season object if it isn't already
     if season is None or season=='ANN' or getattr(season,'seasons',[None])[0] == 'ANN':
         season=seasonsyr
@@ -1739,7 +1769,15 @@ def calculate_seasonal_climatology(mv, season):
             mvt = mv
         else:
             mv.setAxis(mv.getAxisIndex(tax.id), tax)
-            mvt = season.climatology( mv )
+            weights = None
+            if numpy_climatology:
+                weights = seasonal_weights( tax, sname )
+            if weights is None:
+                mvt = season.climatology( mv )
+            elif weights.sum()>0:
+                mvt = time_weighted_mean( mv, tax, weights )
+            else:
+                mvt = None
         if mvt is None:
             logger.warning("Cannot compute climatology for %s, %s",mv.id,season.seasons)
             logger.warning("...probably there is no data for times in the requested season.")
@@ -1753,6 +1791,116 @@ def calculate_seasonal_climatology(mv, season):
         mvt.units = mv.units
     return mvt
 
+def time_chunks( steps, n ):
+    """Divides steps, an increasing sequence of time indices, into runs of consecutive indices
+    with at most n indices in each.  Returns them as a list of (first, last+1) pairs."""
+    chunks = []
+    i0 = steps[0]
+    i1 = i0+1
+    for i in steps[1:]:
+        if i==i1 and i1-i0<n:
+            i1 += 1
+        else:
+            chunks.append( (i0,i1) )
+            i0 = i
+            i1 = i+1
+    chunks.append( (i0,i1) )
+    return chunks
+
+class chunked_variable:
+    """A variable which is left in its data file, so that reduce2any() can read it a time chunk at
+    a time, rather than all at once; see chunked_read().  Its axes, attributes, etc. are those of
+    its first time step, which is read when this object is made.  f is the open file or
+    multifile_dataset, and tax the variable's time axis.  selectors are cdms2 selectors for
+    every read, as from reduced_variable.read_selectors()."""
+    def __init__( self, f, varid, tax, first, selectors={} ):
+        self.first = first
+        self.dataset = f
+        self.id = varid
+        self.tax = tax
+        self.selectors = selectors
+    def __getattr__( self, att ):
+        # Only attributes which this object doesn't have come here.
+        return getattr( self.first, att )
+    def __call__( self, *args, **kwargs ):
+        """Reads the variable, with the usual cdms2 selectors."""
+        selectors = dict( self.selectors )
+        selectors.update( kwargs )
+        var = self.dataset( self.id, *args, **selectors )
+        var.filename = getattr( self, 'filename', None )
+        return var
+    def seasonal_climatology( self, season, region=None ):
+        """Returns the same as calculate_seasonal_climatology( select_region(var,region), season ),
+        where var is all of the variable.  But only the times in the season and the region are
+        read, at most reduction_chunk_bytes bytes at a time; and their weighted sums are
+        accumulated as they are read."""
+        selectors = region_selectors( region )
+        weights = None
+        if numpy_climatology:
+            weights = seasonal_weights( self.tax, climatology_season_name(season) )
+        if weights is None:
+            # chunked_read() checked the weights for the reduced variable's season, but this may
+            # be another.  The climatology will be computed by cdutil, which needs all the data.
+            return calculate_seasonal_climatology( self(**selectors), season )
+        steps = numpy.nonzero( weights )[0]
+        if len(steps)==0:
+            logger.warning("Cannot compute climatology for %s, %s",self.id,season.seasons)
+            logger.warning("...probably there is no data for times in the requested season.")
+            return None
+        stepbytes = self.first.size * self.first.dtype.itemsize
+        times = self.tax[:]
+        total, count = 0, 0
+        for i0,i1 in time_chunks( steps, max( 1, reduction_chunk_bytes//stepbytes ) ):
+            chunk = self( time=(times[i0], times[i1-1], 'cc'), **selectors )
+            ctax = chunk.getTime()
+            if ctax is None or len(ctax)!=i1-i0:
+                logger.warning("Cannot read %s by time chunks, will read it all", self.id)
+                return calculate_seasonal_climatology( self(**selectors), season )
+            ctotal, ccount = time_weighted_sums( chunk, ctax, weights[i0:i1] )
+            total = total + ctotal
+            count = count + ccount
+        mvt = time_weighted_variable( chunk, self.tax, weights, total, count )
+        mvt = delete_singleton_axis( mvt, vid='time' )
+        if hasattr( self.first, 'units' ):
+            mvt.units = self.first.units
+        return mvt
+
+def file_variable_axes( f, varid ):
+    """Returns the axes of the variable varid in the open file (or multifile_dataset) f, without
+    reading the variable."""
+    axids = f.variables[varid]
+    if hasattr( axids, 'getAxisIds' ):
+        # a cdms2 FileVariable.  A multifile_dataset just has a list of axis ids.
+        axids = axids.getAxisIds()
+    return [ f.getAxis(axid) for axid in axids ]
+
+def read_first_time( f, varid, tax, selectors={} ):
+    """Reads only the first time of the variable varid, with time axis tax, from the open file (or
+    multifile_dataset) f."""
+    return f( varid, time=(tax[0], tax[0], 'cc'), **selectors )
+
+def chunked_read( f, varid, selectors={}, season=None ):
+    """Returns a chunked_variable for the variable varid in the open file (or multifile_dataset) f,
+    if numpy_climatology is True and the variable has a time axis and more than
+    chunked_reduction_bytes of data.  If supplied, season is that of the climatology to be
+    computed; the variable isn't chunked if seasonal_weights() can't handle it.  Otherwise,
+    returns None, having read nothing; then the variable should simply be read.  Every read
+    will use the cdms2 selectors."""
+    if not numpy_climatology or chunked_reduction_bytes is None or varid not in f.variables.keys():
+        return None
+    taxes = [ ax for ax in file_variable_axes( f, varid ) if ax is not None and ax.isTime() ]
+    if len(taxes)==0 or len(taxes[0])<=1:
+        return None
+    tax = taxes[0]
+    fvar = f[varid]
+    if numpy.prod( fvar.shape ) * numpy.dtype( fvar.typecode() ).itemsize <= chunked_reduction_bytes:
+        return None
+    if season is not None and seasonal_weights( tax, climatology_season_name(season) ) is None:
+        return None
+    first = read_first_time( f, varid, tax, selectors )
+    logger.debug("will read %s by time chunks", varid)
+    return chunked_variable( f, varid, tax, first, selectors )
+
 def select_lev( mv, slev ):
     """Input is a level-dependent variable mv and a level slev to select.
     slev is an instance of udunits - thus it has a value and a units attribute.
@@ -1762,17 +1910,7 @@ def select_lev( mv, slev ):
     levax = levAxis(mv)
     if levax is None:
         return None
-    # Get ig, the first index for which levax[ig]>slev
-    # Assume that levax values are monotonic.
-    dummy,slev = reconcile_units( levax, slev )  # new slev has same units as levax
-    if levax[0]<=levax[-1]:
-        ids = numpy.where( levax[:]>=slev.value )    # assumes levax values are monotonic increasing
-    else:
-        ids = numpy.where( levax[:]<=slev.value )    # assumes levax values are monotonic decreasing
-    if ids is None or len(ids)==0:
-        ig = len(levax)-1
-    else:
-        ig = ids[0][0]
+    ig = select_lev_index( levax, slev )
     # Crude first cut: don't interpolate, just return a value
     if levax == mv.getAxisList()[0]:
         mvs = cdms2.createVariable( mv[ig:ig+1,...], copy=1 )  # why ig:ig+1 rather than ig?  bug workaround.
@@ -1786,6 +1924,22 @@ def select_lev( mv, slev ):
     mvs = delete_singleton_axis(mvs, vid=levax.id)
     return mvs
 
+def select_lev_index( levax, slev ):
+    """Returns the index of the level which select_lev() would select from the level axis levax.
+    slev is an instance of udunits."""
+    # Get ig, the first index for which levax[ig]>slev
+    # Assume that levax values are monotonic.
+    dummy,slev = reconcile_units( levax, slev )  # new slev has same units as levax
+    if levax[0]<=levax[-1]:
+        ids = numpy.where( levax[:]>=slev.value )    # assumes levax values are monotonic increasing
+    else:
+        ids = numpy.where( levax[:]<=slev.value )    # assumes levax values are monotonic decreasing
+    if ids is None or len(ids)==0:
+        ig = len(levax)-1
+    else:
+        ig = ids[0][0]
+    return ig
+
 def latvar( mv ):
     """returns a transient variable which is dimensioned along the lat axis
     but whose values are the latitudes"""
@@ -3024,7 +3178,8 @@ class reduced_variable(ftrow,basic_id):
                   latrange=None, lonrange=None, levelrange=None,
                   season=seasonsyr, region=None, reduced_var_id=None,
                   reduction_function=(lambda x,vid=None: x),
-                  filetable=None, filefilter=None, axes=None, duvs={}, rvs={}
+                  filetable=None, filefilter=None, axes=None, duvs={}, rvs={}, chunked=False,
+                  read_region=None, read_level=None
                   ):
         self._season = season
         self._region = interpret_region(region) # this could probably change lat/lon range, or lat/lon ranges could be passed in
@@ -3038,6 +3193,14 @@ class reduced_variable(ftrow,basic_id):
             basic_id.__init__( self, variableid, seasonid, filetable, filefilter, region )
         ftrow.__init__( self, fileid, variableid, timerange, latrange, lonrange, levelrange )
         self._reduction_function = reduction_function
+        # If chunked is True, the reduction function must be based on reduce2any(), which can
+        # read big variables a time chunk at a time.  See chunked_read().
+        self._chunked = chunked
+        # The reduction function may declare that it only uses the data in a region read_region
+        # (a region name or rectregion), or at a level read_level (a udunits object, the level
+        # select_lev() would choose).  Then only that will be read; see read_selectors().
+        self._read_region = read_region
+        self._read_level = read_level
         self._axes = axes
         if filetable is None:
             logger.warning("No filetable specified for reduced_variable instance %s",variableid)
@@ -3047,6 +3210,7 @@ class reduced_variable(ftrow,basic_id):
         self._duvs = duvs
         self._rvs = rvs
         self.filename = None  # will be set later.  This attribute shouldn't be used, but sometimes it's just too tempting.
+        self._datafiles = []  # names of the data files, set by get_variable_file()
     def __repr__(self):
         return self._strid
 
@@ -3092,7 +3256,9 @@ class reduced_variable(ftrow,basic_id):
 
     def get_variable_file( self, variableid ):
         """returns the name of a file containing data for a variable specified by name.
-        If there are several such files, cdscan is run and the resulting xml file is returned."""
+        If there are several such files, the name of a multifile_dataset joining them is returned.
+        Use open_datafile() to open it.  If the files cannot be joined that way, cdscan is run
+        and the resulting xml file is returned."""
         rows = self.filetable.find_files( variableid, time_range=self.timerange,
                                            lat_range=self.latrange, lon_range=self.lonrange,
                                            level_range=self.levelrange,
@@ -3104,6 +3270,7 @@ class reduced_variable(ftrow,basic_id):
         # To make it even easier on the first cut, I won't worry about missing data and
         # anything else inconvenient, and I'll assume CF compliance.
         files = list(set([r.fileid for r in rows]))
+        self._datafiles = files
         if len(files)>1:
             # Piece together the data from multiple files.  That's what cdscan is for...
             # One problem is there may be more than one file family in the same
@@ -3122,14 +3289,18 @@ class reduced_variable(ftrow,basic_id):
             else:
                 fam = families[0]
 
-            # We'll run cdscan to combine the multiple files into one logical file.
-            # To save (a lot of) time, we'll re-use an xml file if a suitable one already exists.
-            # To do this safely, incorporate the file list (names,lengths,dates) into the xml file name.
             famfiles = [f for f in files if famdict[f]==fam]
-
-            cache_path = self.filetable.cache_path()
-            xml_name = run_cdscan( fam, famfiles, cache_path )
-            filename = xml_name
+            # Normally the filetable knows the time range of each file; then we can join them
+            # without reading anything, and later read only the files we need.
+            filename = aggregate_files( fam, [r for r in rows if r.fileid in famfiles],
+                                        self._season.seasons[0] )
+            if filename is None:
+                # We'll run cdscan to combine the multiple files into one logical file.
+                # To save (a lot of) time, we'll re-use an xml file if a suitable one already exists.
+                # To do this safely, incorporate the file list (names,lengths,dates) into the xml file name.
+                cache_path = self.filetable.cache_path()
+                xml_name = run_cdscan( fam, famfiles, cache_path )
+                filename = xml_name
         else:
             # the easy case, just one file has all the data on this variable
             filename = files[0]
@@ -3151,6 +3322,189 @@ class reduced_variable(ftrow,basic_id):
                 return None
 
 
+    def rvcache_key( self, vid=None, gw=None, duv=None ):
+        """Returns a key identifying the result of reduce(vid,gw) in the filetable's cache of
+        reduced variables; or None if there is no such cache.  get_variable_file() should have
+        been called first.  If the variable is a derived unreduced variable, duv should be its
+        derived_var; then its inputs identify it instead of a data file."""
+        if getattr( self.filetable, 'rvcache', None ) is None:
+            return None
+        datafiles = self._datafiles
+        duvparts = None
+        if duv is not None:
+            datafiles = []
+            for fv in duv._inputs:
+                if self.get_variable_file( fv ) is not None:
+                    datafiles += self._datafiles
+            duvparts = ( duv._inputs, duv._outputs, duv._special, duv._func,
+                         self._duv_rv_inputs( duv ) )
+        idt = self.id()
+        if isinstance( idt, tuple ) and hasattr( idt, 'ft1' ):
+            # The filetable's id is just a sequence number, so the data files identify it instead.
+            idparts = ( idt.classid, idt.var, idt.season, idt.region, idt.ffilt1 )
+        else:
+            idparts = idt
+        extras = ( vid, self.timerange, self.latrange, self.lonrange, self.levelrange,
+                   None if gw is None else numpy.ma.filled(gw,0), str(self._read_region),
+                   None if self._read_level is None else str(self._read_level), duvparts,
+                   'numpy' if numpy_climatology else 'cdutil' )
+        try:
+            return rvcache_key( idparts, sorted(set(datafiles)), extras, self._reduction_function )
+        except Exception as e:
+            logger.debug("no cache key for %s: %s", self._strid, e)
+            return None
+
+    def cacheable_key( self, vid=None, gw=None ):
+        """Returns the key under which reduce(vid,gw) would store its result in the filetable's
+        cache of reduced variables; or None if it won't, because there is no cache or no data,
+        or the result has been found before not to be cacheable."""
+        if self.filetable is None or getattr( self.filetable, 'rvcache', None ) is None:
+            return None
+        if vid is None:
+            vid = self._strid
+        duv = None
+        if self.get_variable_file( self.variableid ) is None:
+            if self.variableid not in self._duvs:
+                return None
+            duv = self._duvs[self.variableid]
+        key = self.rvcache_key( vid, gw, duv )
+        if key is None or self.filetable.rvcache.refused( key ):
+            return None
+        return key
+
+    def read_selectors( self, f, varid ):
+        """Returns a dict of cdms2 selectors for reading the variable varid from the open file (or
+        multifile_dataset) f.  They restrict it to the region read_region and level read_level,
+        as far as the variable has the axes for that."""
+        selectors = region_selectors( self._read_region )
+        if self._read_level is not None and varid in f.variables.keys():
+            for ax in file_variable_axes( f, varid ):
+                if ax is not None and ax.isLevel() and len(ax)>1:
+                    # a copy, because select_lev_index() may change its units
+                    levax = cdms2.createAxis( ax[:], id=ax.id )
+                    if hasattr( ax, 'units' ):
+                        levax.units = ax.units
+                    ig = select_lev_index( levax, self._read_level )
+                    selectors[ax.id] = slice( ig, ig+1 )
+        return selectors
+
+    def _reduce_datafile( self, filename, vid, gw ):
+        """Reads self.variableid from the data file filename and applies the reduction function.
+        Returns the reduced data and the kind of weighting (see weighting_choice) which is
+        appropriate for averaging it further."""
+        from metrics.packages.amwg.derivations.massweighting import weighting_choice
+        reduced_data = None
+        weighting = None
+        f = open_datafile( filename )
+        self._file_attributes.update(f.attributes)
+        if self.variableid in f.variables.keys():
+            selectors = self.read_selectors( f, self.variableid )
+            var = None
+            if self._chunked and os.path.basename(filename)[0:5]!='CERES':
+                var = chunked_read( f, self.variableid, selectors, self._season )
+            if var is None:
+                var = f( self.variableid, **selectors )
+            var.filename = self.filename
+            if os.path.basename(filename)[0:5]=='CERES':
+                var = special_case_fixed_variable( 'CERES', var )
+            if not hasattr( var, 'filetable'): var.filetable = self.filetable
+            weighting = weighting_choice(var)
+            if weighting=='mass' and not isinstance( var, chunked_variable ):
+                # Save some mass weights before we possibly reduce away the lat,lon axes.
+                # (For a chunked_variable, reduce2any() will compute them from the climatology.)
+                from metrics.fileio.weightcache import mass_weights_key
+                from metrics.packages.amwg.derivations.massweighting import mass_weights
+                cache = getattr( var.filetable, 'massweights', None )
+                if cache is not None and var.getLevel() is not None and\
+                        var.getLatitude() is not None and var.getLongitude() is not None:
+                    if len(selectors)==0:
+                        wvar = var
+                    else:
+                        # The weights are for the whole domain, as if there were no selectors.
+                        # They depend only on the axes, so one time will do.
+                        tax = var.getTime()
+                        if tax is None:
+                            wvar = f( self.variableid )
+                        else:
+                            wvar = read_first_time( f, self.variableid, tax )
+                        wvar.filename = self.filename
+                    # The key includes the file, whose surface pressure determines the weights.
+                    key = mass_weights_key( wvar )
+                    wts = cache.get( key )
+                    if wts is None:
+                        wts = mass_weights( wvar )
+                        cache.put( key, wts )
+                    if len(selectors)>0:
+                        # Also save them for the domain which was read, so that they can be found
+                        # for it after its lat or lon axis has been reduced away.
+                        wts = wts( **selectors )
+                        wts.filename = self.filename
+                        cache.put( mass_weights_key(wts), wts )
+            reduced_data = self.reduce_reduction_function( var, vid=vid, gw=gw )
+        elif self.variableid in f.axes.keys():
+            taxis = cdms2.createAxis(f[self.variableid])   # converts the FileAxis to a TransientAxis.
+            taxis.id = f[self.variableid].id
+            weighting = weighting_choice(taxis)
+            if not hasattr( taxis, 'filetable'): taxis.filetable = self.filetable
+            reduced_data = self.reduce_reduction_function( taxis, vid=vid, gw=gw )
+        else:
+            logger.error("Reduce failed to find variable %s in file %s. It did find variables %s and axes %s.",
+                         self.variableid, filename, sorted(f.variables.keys()), sorted(f.axes.keys()))
+        if reduced_data is not None and type(reduced_data) is not list and\
+                not isinstance(reduced_data,Number):
+            reduced_data._vid = vid
+            reduced_data.weighting = weighting  # needed if we have to average it further later on
+        f.close()
+        return reduced_data, weighting
+
+    def _reduce_duv( self, duv, vid, gw ):
+        """Computes the derived unreduced variable duv (a derived_var) from its inputs, and
+        applies the reduction function to it."""
+        # DUVs (derived unreduced variables) would logically be treated as a separate stage
+        # equal to reduced and derived variables, within the plan-compute paradigm.  That
+        # would save time (compute each DUV only once) but cost memory space (you have to
+        # keep the computed DUV until you don't need it any more).  DUVs are big, so the
+        # memory issue is paramont.  Also DUVs will be rare.  Also doing it this way avoids
+        # complexities with differing reduced variables needing the same DUV on differing
+        # domains (lat-lon ranges).  Thus this block of code here...
+
+        # Find the reduced variables it depends on (if any) and compute their values
+        # self._rvs could contain reduced_variable objects, which need to have reduce()
+        # applied to them.  Or reduce() may already have been applied, and the results are
+        # in there:
+
+        duv_inputs = { rvid:self._rvs[rvid].reduce() for rvid in duv._inputs
+                        if rvid in self._rvs and hasattr( self._rvs[rvid],'reduce' ) }
+
+        duv_inputs = self._duv_rv_inputs( duv )
+        # Find the model variables it depends on and read them in from files.
+        for fv in duv._inputs:
+            filename = self.get_variable_file( fv )
+            if filename is not None:
+                f = open_datafile( filename )
+                self._file_attributes.update(f.attributes)
+                duv_inputs[fv] = f( fv, **self.read_selectors( f, fv ) )
+                f.close()
+        for key,val in duv_inputs.iteritems():
+            # straightforward approaches involving "all" or "in" don't work.
+            if val is None:
+                logger.warning("missing data; duv_inputs[%s]=%s", key, val)
+                return None
+        # Stick the season in duv_inputs.  Region or other GUI parameters could be passed
+        # this way too.  Note that the following line converts a cdutil.times.Seasons object
+        # to a string.  Such objects can represent a list of seasons, but in the Diagnostics
+        # we expect them to contain but one season.
+        duv_inputs.update( { 'seasonid':self._season.seasons[0] } )
+        # Finally, we can compute the value of this DUV.
+        duv_value = duv.derive( duv_inputs )
+        return self._reduction_function( duv_value, vid=vid, gw=gw )
+
+    def _duv_rv_inputs( self, duv ):
+        """Returns a dict of the inputs of the derived unreduced variable duv which are already
+        reduced, i.e. values rather than reduced_variable objects in self._rvs."""
+        return { rvid:self._rvs[rvid] for rvid in duv._inputs
+                 if rvid in self._rvs and not hasattr( self._rvs[rvid],'reduce' ) }
+
     def reduce( self, vid=None, gw=None ):
         """Finds and opens the files containing data required for the variable,
         Applies the reduction function to the data, and returns an MV.
@@ -3166,8 +3520,6 @@ class reduced_variable(ftrow,basic_id):
         Latitude Gaussian weights gw may be provided.  They will be passed on to the reduction
         function and used if appropriate.
         """
-
-        from metrics.packages.amwg.derivations.massweighting import weighting_choice
         if self.filetable is None:
             if self.variableid[-4:]=='_var':
                 # This is a variance; requires climatology variance files which are rarely computed.
@@ -3183,6 +3535,7 @@ class reduced_variable(ftrow,basic_id):
             vid = self._strid
 
         filename = self.get_variable_file( self.variableid )
+        duv = None
         if filename is None:
             if self.variableid not in self._duvs:
                 if self.variableid[-4:]=='_var':
@@ -3196,94 +3549,50 @@ class reduced_variable(ftrow,basic_id):
                                  self.timerange, self.latrange, self.lonrange, self.levelrange)
                     logger.debug("(2) filetable is %s",self.filetable)
                 return None
+            duv = self._duvs[self.variableid]   # an instance of derived_var
+
+        key = self.rvcache_key( vid, gw, duv )
+        cache = self.filetable.rvcache if key is not None else None
+        if cache is not None and cache.refused( key ):
+            cache = None   # It's been found before that this can't be cached.
+        # Reading a mass-weighted variable saves mass weights in the filetable's weight cache.
+        # They are cached along with the result, and put back when it is loaded.
+        mwcache = getattr( self.filetable, 'massweights', None )
+        claimed = False
+        if cache is not None:
+            reduced_data, file_attributes = cache.load( key, mwcache )
+            if reduced_data is None:
+                # Another process, e.g. a diags run for another plot set, may be computing the
+                # same thing.  If so, wait for its result rather than compute it again.
+                claimed = cache.claim( key )
+                if not claimed:
+                    reduced_data, file_attributes = cache.wait( key, mwcache )
+            if reduced_data is not None:
+                self._file_attributes.update(file_attributes)
+                reduced_data.filename = self.filename
+                reduced_data.filetable = self.filetable
+                return reduced_data
+        recorder = None
+        if cache is not None and mwcache is not None:
+            recorder = mwcache.start_recording()
+        try:
+            if duv is None:
+                reduced_data, weighting = self._reduce_datafile( filename, vid, gw )
             else:
-                # DUVs (derived unreduced variables) would logically be treated as a separate stage
-                # equal to reduced and derived variables, within the plan-compute paradigm.  That
-                # would save time (compute each DUV only once) but cost memory space (you have to
-                # keep the computed DUV until you don't need it any more).  DUVs are big, so the
-                # memory issue is paramont.  Also DUVs will be rare.  Also doing it this way avoids
-                # complexities with differing reduced variables needing the same DUV on differing
-                # domains (lat-lon ranges).  Thus this block of code here...
-
-                # First identify the DUV we want to compute
-                duv = self._duvs[self.variableid]   # an instance of derived_var
-                # Find the reduced variables it depends on (if any) and compute their values
-                # self._rvs could contain reduced_variable objects, which need to have reduce()
-                # applied to them.  Or reduce() may already have been applied, and the results are
-                # in there:
-
-                duv_inputs = { rvid:self._rvs[rvid].reduce() for rvid in duv._inputs
-                                if rvid in self._rvs and hasattr( self._rvs[rvid],'reduce' ) }
-
-                duv_inputs = { rvid:self._rvs[rvid] for rvid in duv._inputs
-                               if rvid in self._rvs and not hasattr( self._rvs[rvid],'reduce' ) }
-                # Find the model variables it depends on and read them in from files.
-                for fv in duv._inputs:
-                    filename = self.get_variable_file( fv )
-                    if filename is not None:
-                        f = cdms2.open( filename )
-                        self._file_attributes.update(f.attributes)
-                        duv_inputs[fv] = f(fv)
-                        f.close()
-                for key,val in duv_inputs.iteritems():
-                    # straightforward approaches involving "all" or "in" don't work.
-                    if val is None:
-                        logger.warning("missing data; duv_inputs[%s]=%s", key, val)
-                        return None
-                # Stick the season in duv_inputs.  Region or other GUI parameters could be passed
-                # this way too.  Note that the following line converts a cdutil.times.Seasons object
-                # to a string.  Such objects can represent a list of seasons, but in the Diagnostics
-                # we expect them to contain but one season.
-                duv_inputs.update( { 'seasonid':self._season.seasons[0] } )
-                # Finally, we can compute the value of this DUV.
-                duv_value = duv.derive( duv_inputs )
-                reduced_data = self._reduction_function( duv_value, vid=vid, gw=gw )
-        else:
-            f = cdms2.open( filename )
-            self._file_attributes.update(f.attributes)
-            if self.variableid in f.variables.keys():
-                var = f(self.variableid)
-                var.filename = self.filename
-                if os.path.basename(filename)[0:5]=='CERES':
-                    var = special_case_fixed_variable( 'CERES', var )
-                if not hasattr( var, 'filetable'): var.filetable = self.filetable
-                weighting = weighting_choice(var)
-                if weighting=='mass':
-                    # Save some mass weights before we possibly reduce away the lat,lon axes.
-                    # It would be better to index with more detailed domain information than llat,llon.
-                    from metrics.packages.amwg.derivations.massweighting import mass_weights
-                    lev = var.getLevel()
-                    if lev is None: llev=-1
-                    else: llev = len(lev)
-                    lat = var.getLatitude()
-                    if lat is None: llat=-1
-                    else: llat=len(lat)
-                    lon = var.getLongitude()
-                    if lon is None: llon=-1
-                    else: llon=len(lon)
-                    if 'mass' not in var.filetable.weights:
-                        var.filetable.weights['mass'] = {}
-                    if llev>0 and llat>0 and llon>0:
-                        # This check would make it faster:
-                        #if (llev,llat,llon) not in var.filetable.weights['mass']:
-                        # but it's wrong for plot set 10, where you have to read out of several files.
-                        # They have different times, hence different PS, hence different mass_weights.
-                        var.filetable.weights['mass'][(llev,llat,llon)] = mass_weights(var)
-                reduced_data = self.reduce_reduction_function( var, vid=vid, gw=gw )
-            elif self.variableid in f.axes.keys():
-                taxis = cdms2.createAxis(f[self.variableid])   # converts the FileAxis to a TransientAxis.
-                taxis.id = f[self.variableid].id
-                weighting = weighting_choice(taxis)
-                if not hasattr( taxis, 'filetable'): taxis.filetable = self.filetable
-                reduced_data = self.reduce_reduction_function( taxis, vid=vid, gw=gw )
-            else:
-                logger.error("Reduce failed to find variable %s in file %s. It did find variables %s and axes %s.",
-                             self.variableid, filename, sorted(f.variables.keys()), sorted(f.axes.keys()))
-            if reduced_data is not None and type(reduced_data) is not list and\
-                    not isinstance(reduced_data,Number):
-                reduced_data._vid = vid
-                reduced_data.weighting = weighting  # needed if we have to average it further later on
-            f.close()
+                reduced_data = self._reduce_duv( duv, vid, gw )
+            if cache is not None:
+                if isinstance( reduced_data, cdms2.tvariable.TransientVariable ) and\
+                        not ( hasattr(reduced_data,'mask') and reduced_data.mask.all() ):
+                    cache.store( key, reduced_data, self._file_attributes,
+                                 [] if recorder is None else recorder.items() )
+                else:
+                    # Other processes shouldn't wait for this, now or later.
+                    cache.refuse( key )
+        finally:
+            if recorder is not None:
+                mwcache.stop_recording( recorder )
+            if claimed:
+                cache.release( key )
         if not isinstance(reduced_data,Number):
             if hasattr(reduced_data,'mask') and reduced_data.mask.all():
                 reduced_data = None
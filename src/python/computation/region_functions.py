@@ -20,14 +20,22 @@ def interpret_region( region ):
             region = None
     return region
 
-def select_region(mv, region=None):
-    # Select lat-lon region
+def region_selectors( region ):
+    """Returns a dict of the cdms2 selectors (latitude, longitude) which restrict a variable to the
+    region, as select_region() does.  For the global region, it's empty."""
     if region is None or region=='' or region=="global" or region=="Global" or\
             getattr(region,'filekey',None)=="Global" or str(region)=="Global":
+        return {}
+    region = interpret_region(region)
+    return { 'latitude':(region[0], region[1]), 'longitude':(region[2], region[3]) }
+
+def select_region(mv, region=None):
+    # Select lat-lon region
+    selectors = region_selectors(region)
+    if len(selectors)==0:
         mvreg = mv
     else:
-        region = interpret_region(region)
-        mvreg = mv(latitude=(region[0], region[1]), longitude=(region[2], region[3]))
+        mvreg = mv(**selectors)
 
     if hasattr(mv,'units'):
         mvreg.units = mv.units
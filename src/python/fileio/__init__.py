@@ -3,6 +3,9 @@ import base
 import filetable
 import findfiles
 import filters
+import multifile
+import memdataset
+import rvcache
 import git
 import metrics.common.debug
 
@@ -4,11 +4,15 @@
 #   file_id,  variable_id,  time_range,  lat_range,  lon_range,  level_range
 # subject to change!
 
-import sys, os, cdms2, re, logging
+import sys, os, cdms2, re, logging, multiprocessing, bisect
 import pdb
 from metrics.frontend.options import Options
 from metrics.common.id import *
 from metrics.common import *
+from metrics.common.utilities import file_stamp
+from metrics.fileio.filters import basic_filter, filter_key
+from metrics.fileio.rvcache import rvcache
+from metrics.fileio.weightcache import weightcache
 from pprint import pprint
 logger = logging.getLogger(__name__)
 
@@ -56,11 +60,13 @@ class ftrow:
     If the file has several variables, there will be several rows for the file."""
     # One can think of lots of cases where this is too simple, but it's a start.
     def __init__( self, fileid, variableid, timerange, latrange, lonrange, levelrange=None,
-                  filefmt=None, varaxisnames=[], latn=None, lonn = None, levn=None ):
+                  filefmt=None, varaxisnames=[], latn=None, lonn = None, levn=None,
+                  varshape=None ):
         self.fileid = fileid          # file name
         self.filetype = filefmt       # file format/type, e.g. "NCAR CAM" or "CF CMIP5"
         self.variableid = variableid  # variable name
         self.varaxisnames = varaxisnames # list of names (ids) of axes of the variable
+        self.varshape = varshape      # shape of the variable in this file, if known
         if timerange is None:
            self.timerange = drange()
         else:
@@ -154,10 +160,13 @@ class basic_filetable(basic_id):
             return (_NestedClassGetter(), (basic_filetable, self.__class__.__name__, ))
     IDtuple.__reduce__ = IDtuple__reduce__
 
-    def __init__( self, filelist, opts, ftid='', nickname=''):
+    def __init__( self, filelist, opts, ftid='', nickname='', scancache=None ):
         """filelist is a list of strings, each of which is the path to a file.
         ftid is a human-readable id string.  In common use, it comes via a method
-        dirtree_datafiles.short_name from the name of the directory containing the files."""
+        dirtree_datafiles.short_name from the name of the directory containing the files.
+        scancache, if supplied, is a dict of header scans from an earlier filetable, with
+        items path:(size,mtime,rows,filefmt).  Files whose size and mtime are unchanged
+        will not be read again.  Entries for the other files are added or replaced."""
         try:
          # is this a dirtree that was passed, or a directory?
          options = filelist.opts
@@ -184,6 +193,7 @@ class basic_filetable(basic_id):
         self.lataxes = []  # list of latitude axis names (usually just one)
         self.lonaxes = []  # list of longitude axis names (usually just one)
         self.levaxes = []  # list of level axis names (sometimes a few of them)
+        self._reset_indices()
         self._type = None
         self._climos = None
         self._name = None
@@ -191,13 +201,38 @@ class basic_filetable(basic_id):
         #print "filelist=",filelist,type(filelist)
         self._filelist = filelist # just used for __repr__ and root_dir
         self._cache_path=options._opts['cachepath']
+        if options.get('rvcache',False) and self._cache_path is not None:
+            rvcachesize = options.get('rvcachesize',None)
+            self.rvcache = rvcache( self._cache_path,
+                                    None if rvcachesize is None else int(rvcachesize*1024*1024) )
+        else:
+            self.rvcache = None   # don't cache reduced variables
+        mwcachesize = options.get('mwcachesize',None)
+        self.massweights = weightcache(
+            None if mwcachesize is None else int(mwcachesize*1024*1024),
+            self._cache_path if options.get('mwcache',False) else None )
         if filelist is None: return
         self._files = []
         self.filefmt = None     # file type, e.g. "NCAR CAM" or "CF CMIP5", as for ftrow
         # ... self.filefmt=="various" if more than one file type contributes to this filetable.
 
+        if scancache is None:
+            scancache = {}
+        stamps = { filep:file_stamp(filep) for filep in filelist.files }
+        toscan = [ filep for filep in filelist.files
+                   if filep not in scancache or tuple(scancache[filep][0:2])!=stamps[filep] ]
+        nworkers = options.get('scanworkers',1)
+        if nworkers is None or nworkers<=1 or len(toscan)<=1:
+            scans = []
+            for filep in toscan:
+                rows, filefmt, self.maxfilewarn = scan_datafile( filep, options, self.maxfilewarn )
+                scans.append( (rows, filefmt) )
+        else:
+            scans = self._scanfiles_parallel( toscan, options, nworkers )
+        for filep,(rows,filefmt) in zip( toscan, scans ):
+            scancache[filep] = stamps[filep] + (rows, filefmt)
         for filep in filelist.files:
-            self.addfile( filep, options )
+            self._addrows( *scancache[filep][2:] )
             self._files.append(filep)
 
         self.lataxes = list(set(self.lataxes))
@@ -208,7 +243,7 @@ class basic_filetable(basic_id):
         self.levaxes.sort()
 
         self.weights = {}   # dictionary for storing weights used for averaging over a grid
-        #                     This is unlikely to work if there is more than one lev,lat,lon axis.
+        #                     Mass weights are kept in self.massweights instead.
 
     def __repr__(self):
        return 'filetable from '+str(self._filelist)[:100]+'...'
@@ -254,96 +289,118 @@ class basic_filetable(basic_id):
         """Extract essential header information from a file filep,
         and put the results in the table.
         filep should be a string consisting of the path to the file."""
-        fileid = filep
+        rows, filefmt, self.maxfilewarn = scan_datafile( filep, options, self.maxfilewarn )
+        self._addrows( rows, filefmt )
+
+    def _scanfiles_parallel( self, filelist, options, nworkers ):
+        """Reads the headers of the files in filelist with a pool of nworkers processes.
+        Returns a list of (rows,filefmt) from scan_datafile(), in the order of filelist."""
+        pool = multiprocessing.Pool( nworkers, _scan_worker_init, (options,) )
         try:
-           dfile = cdms2.open( fileid )
-        except cdms2.error.CDMSError as e:
-           # probably "Cannot open file", but whatever the problem is, don't bother with it.
-           #print "Couldn't add file",filep
-           #print "This might just be an unsupported file type"
-           return
-        bad,self.maxfilewarn = is_file_bad( dfile, self.maxfilewarn )
-        filesupp = get_datafile_filefmt( dfile, options )
+            chunksize = max( 1, len(filelist)/(4*nworkers) )
+            scans = []
+            # The workers return the files' problems, and they are reported here in the order of
+            # filelist, with the same budget of bad-file warnings as the serial case.
+            for rows, filefmt, problems in pool.imap( _scan_worker, filelist, chunksize ):
+                bad, self.maxfilewarn = report_file_problems( problems, self.maxfilewarn )
+                scans.append( (rows, filefmt) )
+        finally:
+            pool.close()
+            pool.join()
+        return scans
+
+    def _addrows( self, rows, filefmt ):
+        """Adds to the table and indices the rows computed by scan_datafile() for one file."""
+        if filefmt is None:
+            return   # file couldn't be opened
+        self._reset_indices()
         if self.filefmt is None:
-           self.filefmt = filesupp.name
-        elif self.filefmt!= filesupp.name:
+           self.filefmt = filefmt
+        elif self.filefmt!= filefmt:
            self.filefmt = "various"
-        vars = filesupp.interesting_variables()
-        if len(vars)>0:
-            timerange = filesupp.get_timerange()
-            # After testing (see asserts below), these 3 lines will be obsolete:
-            # Note that ranges may be variable-dependent.  This is especially true for levels,
-            # where there may several level axes of different lengths and physical ranges.
-            latrange = filesupp.get_latrange()
-            lonrange = filesupp.get_lonrange()
-            levelrange = filesupp.get_levelrange()
-            for var in vars:
-                variableid = var
-                if dfile[var] is not None and hasattr(dfile[var],'domain'):
-                    varaxisnames = [a[0].id for a in dfile[var].domain]
-                    vlat = dfile[var].getLatitude()
-                    vlon = dfile[var].getLongitude()
-                    vlev = dfile[var].getLevel()
-                elif var in dfile.axes.keys():
-                    varaxisnames = [var]
-                    vlat = None
-                    vlon = None
-                    vlev = None
-                    if dfile[var].isLatitude():
-                        vlat = dfile[var]
-                    elif dfile[var].isLongitude():
-                        vlon = dfile[var]
-                    elif dfile[var].isLevel():
-                        vlev = dfile[var]
-                else:
+        for newrow in rows:
+            if newrow.latname is not None:
+                self.lataxes.append(newrow.latname)
+            if newrow.lonname is not None:
+                self.lonaxes.append(newrow.lonname)
+            if newrow.levname is not None:
+                self.levaxes.append(newrow.levname)
+            self._table.append( newrow )
+            fileid = newrow.fileid
+            if fileid in self._fileindex.keys():
+                self._fileindex[fileid].append(newrow)
+            else:
+                self._fileindex[fileid] = [newrow]
+            variableid = newrow.variableid
+            if variableid in self._varindex.keys():
+                self._varindex[variableid].append(newrow)
+            else:
+                self._varindex[variableid] = [newrow]
+
+    def _reset_indices( self ):
+        """Discards the search indices and memoized results used by find_files().  They will be
+        rebuilt when needed.  This must be called whenever rows are added to the table."""
+        self._seasonindex = {} # variable: {season: [rows]}, for climatology rows
+        self._timeindex = {}   # variable: (rows for all times, {units: (los, maxhis, entries)})
+        self._findmemo = {}    # memoized results of find_files()
+
+    def _season_index( self, variable ):
+        """Returns a dict whose keys are the seasons of the climatology rows for the variable,
+        and whose values are lists of those rows, in table order."""
+        if variable not in self._seasonindex:
+            seasons = {}
+            for row in self._varindex[variable]:
+                if type(row.timerange) is str:
+                    seasons.setdefault( row.timerange, [] ).append(row)
+            self._seasonindex[variable] = seasons
+        return self._seasonindex[variable]
+
+    def _time_index( self, variable ):
+        """Returns an index of the time-dependent rows for the variable: a tuple (alltimes, byunits).
+        alltimes is a list of (position,row) for rows with an unlimited time range.  byunits is a
+        dict with time units as keys.  Each value is a tuple (los, maxhis, entries) where entries
+        is a list of (position,row) sorted on the start of the time range, los is the list of those
+        starts, and maxhis[i] is the largest end of the time ranges of entries[0:i+1].
+        position is the index of the row in self._varindex[variable]."""
+        if variable not in self._timeindex:
+            alltimes = []
+            byunits = {}
+            for pos,row in enumerate(self._varindex[variable]):
+                tr = row.timerange
+                if not isinstance( tr, drange ):
                     continue
-                if hasattr(filesupp,'season'): # climatology file
-                   timern = timerange      # this should be the season like the above example
-                elif 'time' in varaxisnames:
-                   timern = timerange
-                elif parse_climo_filename(fileid):    # filename like foo_SSS_climo.nc is a climatology file for season SSS.
-                   (root,season)=parse_climo_filename(fileid)
-                   timern = season
-                elif hasattr(dfile,'season'):  # climatology file
-                   timern = timerange   # this should be the season like the above example
-                else:
-                   timern = None
-                if vlat is not None:
-                    latrn = filesupp.get_latrange( vlat )
-                    latn = vlat.id
-                    self.lataxes.append(latn)
-                else:
-                   latrn = None
-                   latn = None
-                if vlon is not None:
-                    lonrn = filesupp.get_lonrange( vlon )
-                    lonn = vlon.id
-                    self.lonaxes.append(lonn)
-                else:
-                   lonrn = None
-                   lonn = None
-                if vlev is not None:
-                    levrn = filesupp.get_levelrange( vlev )
-                    levn = vlev.id
-                    self.levaxes.append(levn)
+                if tr.lo==float('-inf') and tr.hi==float('inf'):
+                    alltimes.append( (pos,row) )
                 else:
-                   levrn = None
-                   levn = None
-                newrow = ftrow( fileid, variableid, timern, latrn, lonrn, levrn, filefmt=filesupp.name,
-                                varaxisnames=varaxisnames, latn=latn, lonn=lonn, levn=levn )
-                if hasattr(filesupp,'season'):
-                    # so we can detect that it's climatology data:
-                    newrow.season = filesupp.season
-                self._table.append( newrow )
-                if fileid in self._fileindex.keys():
-                    self._fileindex[fileid].append(newrow)
-                else:
-                    self._fileindex[fileid] = [newrow]
-                if variableid in self._varindex.keys():
-                    self._varindex[variableid].append(newrow)
-                else:
-                    self._varindex[variableid] = [newrow]
-        dfile.close()
+                    byunits.setdefault( tr.units, [] ).append( (pos,row) )
+            for units,entries in byunits.items():
+                entries.sort( key=(lambda e: e[1].timerange.lo) )
+                los = [ e[1].timerange.lo for e in entries ]
+                maxhis = []
+                for e in entries:
+                    if len(maxhis)==0 or e[1].timerange.hi>maxhis[-1]:
+                        maxhis.append( e[1].timerange.hi )
+                    else:
+                        maxhis.append( maxhis[-1] )
+                byunits[units] = ( los, maxhis, entries )
+            self._timeindex[variable] = ( alltimes, byunits )
+        return self._timeindex[variable]
+
+    def _time_candidates( self, variable, time_range ):
+        """Returns the rows for the variable whose time ranges overlap time_range (a drange),
+        in table order.  Rows for climatology files are not included."""
+        alltimes, byunits = self._time_index( variable )
+        found = list(alltimes)
+        for units,(los,maxhis,entries) in byunits.iteritems():
+            if time_range.units!=units and time_range.units!=None and units!=None:
+                continue   # no units conversion, as in drange.overlaps_with
+            # entries[first:last] are the only rows which may satisfy lo<time_range.hi and
+            # hi>time_range.lo.  Normally, files don't overlap in time and all of them do.
+            first = bisect.bisect_right( maxhis, time_range.lo )
+            last = bisect.bisect_left( los, time_range.hi )
+            found += [ e for e in entries[first:last] if e[1].timerange.hi>time_range.lo ]
+        found.sort( key=(lambda e: e[0]) )
+        return [ e[1] for e in found ]
 
     def find_files( self, variable, time_range=None,
                     lat_range=drange(), lon_range=drange(), level_range=drange(),
@@ -359,15 +416,25 @@ class basic_filetable(basic_id):
           logger.warning('Couldnt find variable %s in %s. If needed, we will try to compute it', variable, self)
           # print "  variables of",self,"are:",self._varindex.keys()
           return None
-       candidates = self._varindex[ variable ]
-       found = []
-       if seasonid is not None:
-          # the usual case, we're dealing with climatologies not time ranges.
-          if seasonid=='JFMAMJJASOND':
-             seasonid='ANN'
+       if not hasattr( self, '_findmemo' ):
+          self._reset_indices()   # e.g. an old pickled filetable
+       if seasonid=='JFMAMJJASOND':
+          seasonid='ANN'
+       rangekey = lambda r: None if r is None else (r.lo, r.hi, r.units)
+       fkey = filter_key( filefilter )
+       if filefilter is None or fkey is not None:
+          # A filter is identified by its class and attributes.  Other filters aren't memoized.
+          memokey = ( variable, rangekey(time_range), rangekey(lat_range), rangekey(lon_range),
+                      rangekey(level_range), seasonid, fkey )
+          if memokey in self._findmemo:
+             return list(self._findmemo[memokey])
+       else:
+          memokey = None
+
+       def spacefilter( candidates ):
+          found = []
           for ftrow in candidates:
-             if seasonid==ftrow.timerange and\
-                    lat_range.overlaps_with( ftrow.latrange ) and\
+             if lat_range.overlaps_with( ftrow.latrange ) and\
                     lon_range.overlaps_with( ftrow.lonrange ) and\
                     level_range.overlaps_with( ftrow.levelrange ):
                 if filefilter is None:
@@ -375,40 +442,23 @@ class basic_filetable(basic_id):
                 else:
                    if filefilter(ftrow.fileid):
                       found.append( ftrow )
+          return found
+
+       if seasonid is not None:
+          # the usual case, we're dealing with climatologies not time ranges.
+          found = spacefilter( self._season_index(variable).get( seasonid, [] ) )
           if found==[]:
              # No suitable season matches (climatology files) found, we will have to use
              # time-dependent data.  Theoretically we could have to use both climatology
              # and time-dep't data, but I don't think we'll see that in practice.
-             for ftrow in candidates:
-                if lat_range.overlaps_with( ftrow.latrange ) and\
-                       lon_range.overlaps_with( ftrow.lonrange ) and\
-                       level_range.overlaps_with( ftrow.levelrange ):
-                   if filefilter is None:
-                      found.append( ftrow )
-                   else:
-                      if filefilter(ftrow.fileid):
-                         found.append( ftrow )
+             found = spacefilter( self._varindex[ variable ] )
+       elif time_range is None:
+          found = spacefilter( self._varindex[ variable ] )
        else:
-          for ftrow in candidates:
-                if time_range is None and\
-                       lat_range.overlaps_with( ftrow.latrange ) and\
-                       lon_range.overlaps_with( ftrow.lonrange ) and\
-                       level_range.overlaps_with( ftrow.levelrange ):
-                   if filefilter is None:
-                       found.append( ftrow )
-                   else:
-                      if filefilter(ftrow.fileid):
-                         found.append( ftrow )
-                elif time_range.overlaps_with( ftrow.timerange ) and\
-                       lat_range.overlaps_with( ftrow.latrange ) and\
-                       lon_range.overlaps_with( ftrow.lonrange ) and\
-                       level_range.overlaps_with( ftrow.levelrange ):
-                   if filefilter is None:
-                      found.append( ftrow )
-                   else:
-                      if filefilter(ftrow.fileid):
-                         found.append( ftrow )
-       return found
+          found = spacefilter( self._time_candidates( variable, time_range ) )
+       if memokey is not None:
+          self._findmemo[memokey] = found
+       return list(found)
     def list_variables_incl_axes(self):
        """lists the variables in the filetable, possibly including axes"""
        vars = list(set([ r.variableid for r in self._table ]))
@@ -434,6 +484,111 @@ class basic_filetable(basic_id):
        else:
           return True
 
+def scan_datafile( filep, options, maxfilewarn=0, problems=None ):
+    """Extract essential header information from a file filep, which should be a string
+    consisting of the path to the file.
+    Returns a tuple (rows, filefmt, maxfilewarn) where rows is a list of ftrow objects, filefmt
+    the name of the file format, and maxfilewarn the remaining number of bad-file warnings
+    (see is_file_bad).  If the file cannot be opened, rows is [] and filefmt is None.
+    If problems is a list, the file's problems are appended to it, see file_problems(), rather
+    than printed; then maxfilewarn is returned unchanged."""
+    fileid = filep
+    rows = []
+    try:
+       dfile = cdms2.open( fileid )
+    except cdms2.error.CDMSError as e:
+       # probably "Cannot open file", but whatever the problem is, don't bother with it.
+       #print "Couldn't add file",filep
+       #print "This might just be an unsupported file type"
+       return rows, None, maxfilewarn
+    if problems is None:
+        bad,maxfilewarn = is_file_bad( dfile, maxfilewarn )
+    else:
+        problems.extend( file_problems(dfile) )
+    filesupp = get_datafile_filefmt( dfile, options )
+    vars = filesupp.interesting_variables()
+    if len(vars)>0:
+        timerange = filesupp.get_timerange()
+        # After testing (see asserts below), these 3 lines will be obsolete:
+        # Note that ranges may be variable-dependent.  This is especially true for levels,
+        # where there may several level axes of different lengths and physical ranges.
+        latrange = filesupp.get_latrange()
+        lonrange = filesupp.get_lonrange()
+        levelrange = filesupp.get_levelrange()
+        for var in vars:
+            variableid = var
+            varshape = None
+            if dfile[var] is not None and hasattr(dfile[var],'domain'):
+                varaxisnames = [a[0].id for a in dfile[var].domain]
+                varshape = tuple( dfile[var].shape )
+                vlat = dfile[var].getLatitude()
+                vlon = dfile[var].getLongitude()
+                vlev = dfile[var].getLevel()
+            elif var in dfile.axes.keys():
+                varaxisnames = [var]
+                vlat = None
+                vlon = None
+                vlev = None
+                if dfile[var].isLatitude():
+                    vlat = dfile[var]
+                elif dfile[var].isLongitude():
+                    vlon = dfile[var]
+                elif dfile[var].isLevel():
+                    vlev = dfile[var]
+            else:
+                continue
+            if hasattr(filesupp,'season'): # climatology file
+               timern = timerange      # this should be the season like the above example
+            elif 'time' in varaxisnames:
+               timern = timerange
+            elif parse_climo_filename(fileid):    # filename like foo_SSS_climo.nc is a climatology file for season SSS.
+               (root,season)=parse_climo_filename(fileid)
+               timern = season
+            elif hasattr(dfile,'season'):  # climatology file
+               timern = timerange   # this should be the season like the above example
+            else:
+               timern = None
+            if vlat is not None:
+                latrn = filesupp.get_latrange( vlat )
+                latn = vlat.id
+            else:
+               latrn = None
+               latn = None
+            if vlon is not None:
+                lonrn = filesupp.get_lonrange( vlon )
+                lonn = vlon.id
+            else:
+               lonrn = None
+               lonn = None
+            if vlev is not None:
+                levrn = filesupp.get_levelrange( vlev )
+                levn = vlev.id
+            else:
+               levrn = None
+               levn = None
+            newrow = ftrow( fileid, variableid, timern, latrn, lonrn, levrn, filefmt=filesupp.name,
+                            varaxisnames=varaxisnames, latn=latn, lonn=lonn, levn=levn,
+                            varshape=varshape )
+            if hasattr(filesupp,'season'):
+                # so we can detect that it's climatology data:
+                newrow.season = filesupp.season
+            rows.append( newrow )
+    dfile.close()
+    return rows, filesupp.name, maxfilewarn
+
+# For parallel scanning, the Options object is passed once to each worker process by the
+# pool initializer rather than with every task.
+_scan_options = None
+def _scan_worker_init( options ):
+    global _scan_options
+    _scan_options = options
+def _scan_worker( filep ):
+    """Returns (rows, filefmt, problems) for the file filep; the parent process reports the
+    problems, so that the whole scan shares one budget of bad-file warnings."""
+    problems = []
+    rows, filefmt, maxfilewarn = scan_datafile( filep, _scan_options, problems=problems )
+    return rows, filefmt, problems
+
 class basic_filefmt:
     """Children of this class contain methods which support specific file types,
     and are used to build the file table.  Maybe later we'll put here methods
@@ -750,29 +905,47 @@ def is_file_bad( dfile, maxwarn ):
     This function will check for some kinds of non-compliance or other badness,
     and print a warning if such a problem is found.
     """
-    bad = False
     if maxwarn<=0:
-        return bad,maxwarn
+        return False,maxwarn
+    return report_file_problems( file_problems(dfile), maxwarn )
+
+def file_problems( dfile ):
+    """The input dfile is an open file.  Checks it as is_file_bad() does, but rather than printing
+    warnings, returns a list with an item for each axis of dfile.  The item is a list of problems,
+    each a tuple (bad, messages) where messages is a list of warnings to be printed.  This lets a
+    parallel scan report problems in the parent process, see report_file_problems()."""
+    problems = []
     for axn,ax in dfile.axes.iteritems():
+        axproblems = []
         # Maybe these warnings should be supressed if for the time axis of a climo file...
         if not hasattr(ax,'bounds'):
             if len(ax)<=1:
-                logger.warning("File %s has an axis %s with no bounds",dfile.id, axn)
-                logger.warning("As the length is 1, no bounds can be computed. \n Any computation involving this axis is likely to fail.")
-
-                bad = True
-                maxwarn -= 1
+                axproblems.append( (True, [
+                    "File %s has an axis %s with no bounds" % (dfile.id, axn),
+                    "As the length is 1, no bounds can be computed. \n Any computation involving this axis is likely to fail."]) )
             else:
-                logger.warning("file %s has an axis %s with no bounds.  An attempt will be made to compute bounds, but that is unreliable compared to bounds provided by the data file",dfile.id,axn)
-                maxwarn -= 1
+                axproblems.append( (False, [
+                    "file %s has an axis %s with no bounds.  An attempt will be made to compute bounds, but that is unreliable compared to bounds provided by the data file" % (dfile.id,axn)]) )
         if hasattr(ax,'bounds') and ax.bounds not in dfile.variables:
-            logger.warning("File %s has an axis %s whose bounds do not exist! This file is not CF-compliant, so calculations involving this axis may well fail. ",dfile.id, axn)
-
-            bad = True
-            maxwarn -= 1
+            axproblems.append( (True, [
+                "File %s has an axis %s whose bounds do not exist! This file is not CF-compliant, so calculations involving this axis may well fail. " % (dfile.id, axn)]) )
         if hasattr(ax,'_FillValue') and ax._FillValue in ax:
-            logger.warning("File %s has an axis %s with a missing value. This file is not CF-compliant, so calculations involving this axis may well fail.", dfile.id, axn)
-            bad = True
+            axproblems.append( (True, [
+                "File %s has an axis %s with a missing value. This file is not CF-compliant, so calculations involving this axis may well fail." % (dfile.id, axn)]) )
+        problems.append( axproblems )
+    return problems
+
+def report_file_problems( problems, maxwarn ):
+    """Prints warnings for problems, as returned by file_problems(), until maxwarn of them have
+    been printed.  Returns (bad, maxwarn) as is_file_bad() does."""
+    bad = False
+    if maxwarn<=0:
+        return bad,maxwarn
+    for axproblems in problems:
+        for axbad, messages in axproblems:
+            for message in messages:
+                logger.warning( message )
+            bad = bad or axbad
             maxwarn -= 1
         if maxwarn<=0:
             logger.warning("There will be no more bad data warnings from constructing this filetable.")
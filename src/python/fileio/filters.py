@@ -24,6 +24,22 @@ class basic_filter:
         If no such string can be identified, this returns ''"""
         return ''
 
+def filter_key( filt ):
+    """Returns a hashable key which identifies what the filter filt does: its class, and the
+    values of its attributes.  Returns None if that can't be determined, because filt or one of
+    its attributes is something other than a filter, string, number, or None."""
+    if filt is None or isinstance( filt, (str,unicode,int,long,float,bool) ):
+        return filt
+    if not isinstance( filt, basic_filter ):
+        return None
+    parts = []
+    for name in sorted( filt.__dict__.keys() ):
+        k = filter_key( filt.__dict__[name] )
+        if k is None and filt.__dict__[name] is not None:
+            return None
+        parts.append( (name,k) )
+    return ( filt.__class__.__module__, filt.__class__.__name__, tuple(parts) )
+
 class basic_binary_filter(basic_filter):
     def __init__( self, f1, f2 ):
         self._f1 = f1
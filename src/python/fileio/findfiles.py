@@ -44,19 +44,17 @@ class basic_datafiles:
         version to see what it is supposed to do."""
         return True
     def _cachefile( self, ftid=None ):
-        """returns a cache file based on the supplied cache path, the files list, the
-        filetable id, and the username"""
+        """returns a cache file based on the supplied cache path, the filetable id, and the
+        username.  The cache file holds header information for each file, see setup_filetable;
+        so unlike the file name, its contents depend on the files list."""
         if ftid is None:
             ftid = self.short_name()
         cache_path = self.opts['cachepath']
         cache_path = os.path.expanduser(cache_path)
         cache_path = os.path.abspath(cache_path)
         logger.debug("cache_path=%s", cache_path)
-        datafile_ls = [ f+'size'+(str(os.path.getsize(f)) if os.path.isfile(f) else '0')+\
-                            'mtime'+(str(os.path.getmtime(f)) if os.path.isfile(f) else '0')\
-                            for f in self.files ]
         search_string = ' '.join(
-            [getpass.getuser(),self.long_name(),cache_path,version,';'.join(datafile_ls)] )
+            [getpass.getuser(),self.long_name(),cache_path,version,str(self.opts.get('reltime',None))] )
         csum = hashlib.md5(search_string).hexdigest()
         cachefilename = csum+'.cache'
         cachefile=os.path.normpath( cache_path+'/'+cachefilename )
@@ -66,52 +64,77 @@ class basic_datafiles:
         in this object's files list.
         It will be useful if you provide a name for the file table, the string ftid.
         For example, this may appear in names of variables to be plotted.
-        This function will cache the file table and use it if possible.
-        If the cache be stale, call clear_filetable()."""
+        This function caches the header information of each file, keyed on the file's path,
+        size and modification time.  Next time, only new or changed files will be read.
+        If the cache be bad, call clear_filetable()."""
         if ftid is None:
             ftid = self.shortest_name()
         cachefile,ftid = self._cachefile( ftid )
         self._ftid = ftid
+        scancache = {}
         if os.path.isfile(cachefile):
             f = open(cachefile,'rb')
             try:
-                filetable = pickle.load(f)
-                self.initialize_idnumber() # otherwise we could get 2 filetables with the same id.
-                cached=True
+                scancache = pickle.load(f)
             except:
-                cached=False
+                logger.warning("Could not read filetable cache file %s; it will be rebuilt", cachefile)
+                scancache = {}
             f.close()
-        else:
-            cached=False
-        if cached==False:
-            filetable = basic_filetable( self, self.opts, ftid) 
-            f = open(cachefile,'wb')
-            pickle.dump( filetable, f )
+            if type(scancache) is not dict:
+                scancache = {}
+        oldstamps = { filep:tuple(scan[0:2]) for filep,scan in scancache.iteritems() }
+        filetable = basic_filetable( self, self.opts, ftid, scancache=scancache )
+        # Drop files which no longer belong here.
+        files = set(self.files)
+        for filep in scancache.keys():
+            if filep not in files:
+                del scancache[filep]
+        newstamps = { filep:tuple(scan[0:2]) for filep,scan in scancache.iteritems() }
+        if newstamps==oldstamps:
+            return filetable
+        logger.debug("filetable cache %s had %d entries, now %d", cachefile, len(oldstamps), len(newstamps))
+        # Write to a temporary file first, so that a concurrent process never reads a partial cache.
+        tmpfile = cachefile+'.'+str(os.getpid())
+        try:
+            f = open(tmpfile,'wb')
+            pickle.dump( scancache, f, pickle.HIGHEST_PROTOCOL )
             f.close()
+            os.rename( tmpfile, cachefile )
+        except (IOError, OSError) as e:
+            logger.warning("Could not write filetable cache file %s: %s", cachefile, e)
         return filetable
     def clear_filetable( self):
-        """Deletes (clears) the cached file table created by the corresponding call of setup_filetable"""
-        # There's a problem with this: if a file is absent we definitely want to get rid of
-        # its cached filetable, but _cachefile() won't get it because the cache file name
-        # depends on the file name, which doesn't exist!  The only real solution is to get rid
-        # of all cached data, or all old cached data.  The user can do that.
+        """Deletes (clears) the cached file header information used by the corresponding call
+        of setup_filetable"""
         cachefile,ftid = self._cachefile( self._ftid )
         if os.path.isfile(cachefile):
             os.remove(cachefile)
 
+# If keep_filetables is True, path2filetable() remembers the filetables it makes, and returns the
+# same filetable again for the same files.  This is for long-lived processes which run many
+# diagnostics on the same data, e.g. the worker processes of metadiags.
+keep_filetables = False
+_filetables = {}
+
 def path2filetable( opts, modelid=None, obsid=None):
     """Convenient way to make a filetable. Inputs: opts is an Options object, containing at least:
        'cachepath', and one or more 'model' or 'obs' objects. modelid and obsid are indeces into the
        model/obs object arrays.
     """
     datafiles = dirtree_datafiles( opts, modelid=modelid, obsid=obsid)
-    filetable = datafiles.setup_filetable()
     if modelid != None:
          ftype = 'model'
          fid = modelid
     else:
          ftype = 'obs'
          fid = obsid
+    if keep_filetables:
+        key = ( datafiles._cachefile()[0], datafiles.short_name(), tuple(datafiles.files), ftype )
+        if key not in _filetables:
+            _filetables[key] = datafiles.setup_filetable()
+        filetable = _filetables[key]
+    else:
+        filetable = datafiles.setup_filetable()
     filetable._type = ftype 
     filetable._climos = opts[ftype][fid]['climos']
     filetable._name = opts[ftype][fid]['name']
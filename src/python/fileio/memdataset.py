@@ -0,0 +1,127 @@
+# An in-memory stand-in for an open data file, for data which has just been computed (e.g.
+# regridded by acme_regrid) and is to be read by code written for files (e.g. the averaging in
+# frontend/inc_reduce.py) without being written to disk first.  A memory_dataset can be pickled,
+# so it can be returned from a multiprocessing worker.  Register it with
+# multifile.register_dataset() to make its name usable with open_datafile().
+
+import logging, numpy, cdms2
+logger = logging.getLogger(__name__)
+
+class memory_variable:
+    """What memory_dataset[varid] returns: a stand-in for a cdms2 FileVariable.  Like a
+    FileVariable, its attributes are the variable's attributes, plus id and parent.  Its data is
+    read by calling it, or by indexing it."""
+    def __init__( self, parent, varid ):
+        self.__dict__.update( parent._vardata[varid][1] )
+        self.id = varid
+        self.parent = parent
+    def __repr__( self ):
+        return "<memory_variable %s in %s>" % (self.id, self.parent.id)
+    @property
+    def dtype( self ):
+        return self.parent._vardata[self.id][0].dtype
+    @property
+    def shape( self ):
+        return self.parent._vardata[self.id][0].shape
+    def typecode( self ):
+        return self.dtype.char
+    def rank( self ):
+        return len(self.shape)
+    def __len__( self ):
+        return self.shape[0]
+    def getAxisIds( self ):
+        return list( self.parent.variables[self.id] )
+    def getAxisList( self ):
+        return [ self.parent.getAxis(axid) for axid in self.parent.variables[self.id] ]
+    def getTime( self ):
+        for ax in self.getAxisList():
+            if ax.isTime():
+                return ax
+        return None
+    def getValue( self ):
+        return self.parent( self.id )
+    def __call__( self, *args, **kwargs ):
+        return self.parent( self.id, *args, **kwargs )
+    def __getitem__( self, key ):
+        return self.parent( self.id )[key]
+
+class memory_dataset:
+    """A read-only collection of variables and their axes, held in memory.  It supports the parts
+    of the interface of an open cdms2 file which the diagnostics use: id, attributes, variables,
+    axes, __call__, __getitem__, getAxis, and close.
+    Variables are added with add_variable().  Their data is kept as numpy masked arrays, and the
+    axes as numpy arrays, so that the dataset can be pickled."""
+    def __init__( self, id, attributes={} ):
+        self.id = id
+        self.attributes = dict( attributes )
+        self.variables = {}   # variable name : list of axis names
+        self.axes = {}        # axis name : list of axis names, i.e. [axis name]
+        self._vardata = {}    # variable name : (masked array, attributes)
+        self._axisdata = {}   # axis name : (values, bounds or None, attributes)
+        self._axiscache = {}  # axis name : TransientAxis, made when first needed
+    def __repr__( self ):
+        return "<memory_dataset %s, %d variables>" % (self.id, len(self.variables))
+    def __getstate__( self ):
+        state = dict( self.__dict__ )
+        state['_axiscache'] = {}
+        return state
+    def close( self ):
+        """There is no file to close."""
+        pass
+
+    def add_variable( self, var, varid=None ):
+        """Adds a copy of the TransientVariable var, and its axes, under the name varid (by
+        default, var.id).  An axis is identified by its id, so a new axis with the same id as an
+        existing one is assumed to be the same axis."""
+        if varid is None:
+            varid = var.id
+        axids = []
+        for ax in var.getAxisList():
+            self.add_axis( ax )
+            axids.append( ax.id )
+        self.variables[varid] = axids
+        self._vardata[varid] = ( numpy.ma.array( var.asma(), copy=True ),
+                                 dict( getattr(var,'attributes',{}) ) )
+
+    def add_axis( self, ax ):
+        """Adds a copy of the axis ax, unless there already is an axis with the same id."""
+        if ax.id not in self._axisdata:
+            bounds = ax.getExplicitBounds()
+            if bounds is not None:
+                bounds = numpy.array( bounds )
+            self._axisdata[ax.id] = ( numpy.array( ax[:] ), bounds, dict(ax.attributes) )
+            self.axes[ax.id] = [ax.id]
+
+    def getAxis( self, axid ):
+        """Returns the named axis as a TransientAxis, or None if there is no such axis."""
+        if axid not in self._axisdata:
+            return None
+        if axid not in self._axiscache:
+            values, bounds, attributes = self._axisdata[axid]
+            ax = cdms2.createAxis( values, bounds, axid )
+            for att,val in attributes.items():
+                setattr( ax, att, val )
+            self._axiscache[axid] = ax
+        return self._axiscache[axid]
+
+    def __call__( self, varid, *args, **kwargs ):
+        """Returns a TransientVariable containing a copy of the data of the named variable.
+        Further arguments are a selection, as for a cdms2 file."""
+        if varid in self.axes and varid not in self.variables:
+            return self.getAxis(varid)
+        if varid not in self.variables:
+            raise cdms2.error.CDMSError( "No variable %s in %s" % (varid, self.id) )
+        data, attributes = self._vardata[varid]
+        var = cdms2.createVariable( data, copy=1, id=varid, attributes=dict(attributes),
+                                    axes=[ self.getAxis(axid) for axid in self.variables[varid] ] )
+        if len(args)>0 or len(kwargs)>0:
+            var = var( *args, **kwargs )
+        return var
+
+    def __getitem__( self, key ):
+        if key in self.variables:
+            return memory_variable( self, key )
+        elif key in self.axes:
+            return self.getAxis( key )
+        else:
+            return None
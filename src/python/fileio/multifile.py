@@ -0,0 +1,353 @@
+# Virtual aggregation of a family of data files which divide their data among themselves by time,
+# e.g. monthly CAM history files.  This is an in-process alternative to running cdscan on the
+# files and then reading the xml file which it writes.  Nothing is read from the data files
+# until data is asked for; and then only from the files which overlap the requested times.
+
+import os, hashlib, logging, numpy, cdms2, cdtime
+from metrics.common.utilities import file_stamp
+from metrics.frontend.defines import season_months
+logger = logging.getLogger(__name__)
+
+# Every multifile_dataset made by aggregate_files(), and any other dataset passed to
+# register_dataset(), is registered here, so that its name can be used like a file name, e.g.
+# by open_datafile().
+_aggregations = {}
+
+def open_datafile( filename, mode='r' ):
+    """Opens a data file and returns the file object.  filename may be the name of a real file
+    (which may be an xml file written by cdscan), in which case this is the same as cdms2.open.
+    Or it may be the name of a multifile_dataset returned by aggregate_files(), or of a dataset
+    passed to register_dataset(), in which case that dataset is returned."""
+    if filename in _aggregations:
+        return _aggregations[filename]
+    return cdms2.open( filename, mode )
+
+def register_dataset( name, dataset ):
+    """Makes dataset, an object with the interface of an open cdms2 file such as a
+    memory_dataset, available to open_datafile() under the supplied name."""
+    _aggregations[name] = dataset
+
+def unregister_dataset( name ):
+    """Undoes register_dataset()."""
+    _aggregations.pop( name, None )
+
+def aggregate_files( fam, rows, seasonid=None ):
+    """Joins the files of the supplied filetable rows (ftrow objects) along their time axis.
+    fam is the name of the file family, normally a path prefix of the files.  If seasonid is
+    supplied, data will be read only from files which have data in that season.
+    This returns the name of a multifile_dataset, suitable for open_datafile().  But if the rows
+    do not have enough information about time (finite time ranges, all in the same units) to
+    order the files, this returns None."""
+    fileids = []
+    timeranges = []
+    timelengths = {}
+    for row in rows:
+        varshape = getattr( row, 'varshape', None )
+        if varshape is not None and 'time' in row.varaxisnames and row.fileid not in timelengths:
+            timelengths[row.fileid] = varshape[ row.varaxisnames.index('time') ]
+        if row.fileid in fileids:
+            continue
+        tr = row.timerange
+        if type(tr) is str or tr.lo==float('-inf') or tr.hi==float('inf'):
+            return None
+        if len(timeranges)>0 and tr.units!=timeranges[0].units:
+            return None
+        fileids.append( row.fileid )
+        timeranges.append( tr )
+    if len(fileids)==0:
+        return None
+    idstring = ' '.join( [ f+str(file_stamp(f)) for f in sorted(fileids) ] + [str(seasonid)] )
+    name = fam+'_agg'+hashlib.md5(idstring).hexdigest()
+    if name not in _aggregations:
+        _aggregations[name] = multifile_dataset( name, fileids, timeranges, seasonid, timelengths )
+    return name
+
+def months_in_range( lo, hi, units, calendar ):
+    """Returns a set of the months (numbered 1-12) which overlap the time interval [lo,hi).
+    lo and hi are times in the supplied units and cdtime calendar."""
+    c0 = cdtime.reltime( lo, units ).tocomp( calendar )
+    c1 = cdtime.reltime( hi, units ).tocomp( calendar )
+    if hi>lo and c1.day==1 and c1.hour==0 and c1.minute==0 and c1.second==0:
+        c1 = c1.add( -1, cdtime.Month )   # hi is excluded
+    months = set()
+    year, month = c0.year, c0.month
+    while (year,month)<=(c1.year,c1.month) and len(months)<12:
+        months.add( month )
+        month += 1
+        if month>12:
+            year, month = year+1, 1
+    return months
+
+class multifile_dataset:
+    """A read-only, time-concatenated view of several data files.  It supports the parts of the
+    interface of an open cdms2 file which the diagnostics use: id, attributes, variables, axes,
+    __call__, __getitem__ (which returns a multifile_variable, reading nothing), getAxis, and
+    close.
+    Variables without a time axis are read from the first file.  Variables with a time axis are
+    read from every file which overlaps the requested time range and season, and joined."""
+    def __init__( self, id, filenames, timeranges, seasonid=None, timelengths={} ):
+        """filenames is a list of paths; timeranges is a list of the same length, of dranges for
+        the times in each file.  If seasonid is a season name, e.g. 'DJF', files with no data in
+        that season will be ignored.  timelengths is a dict of the numbers of times in the
+        files, as far as they are known; the others will be read from the files when needed."""
+        self.id = id
+        order = sorted( range(len(filenames)), key=(lambda i: timeranges[i].lo) )
+        self._files = [ filenames[i] for i in order ]
+        self._timeranges = [ timeranges[i] for i in order ]
+        self.variables = {}   # variable name : list of axis names
+        self.axes = {}        # axis name : list of axis names, i.e. [axis name]
+        self._timedim = {}    # variable name : index of its time axis, or None
+        self._varinfo = {}    # variable name : (shape in the first file, typecode, attributes)
+        self._timelengths = dict(timelengths)  # file name : number of times
+        f = cdms2.open( self._files[0] )
+        try:
+            self.attributes = dict( f.attributes )
+            for vn in f.variables.keys():
+                var = f[vn]
+                self.variables[vn] = var.getAxisIds()
+                tax = var.getTime()
+                self._timedim[vn] = None if tax is None else var.getAxisIds().index(tax.id)
+                self._varinfo[vn] = ( tuple(var.shape), var.typecode(), dict(var.attributes) )
+            for an in f.axes.keys():
+                self.axes[an] = [an]
+            tax = f.getAxis('time')
+            if tax is None:
+                self._timeid = None
+                calendar = None
+            else:
+                self._timeid = tax.id
+                calendar = tax.getCalendar()
+        finally:
+            f.close()
+        self._seasonfiles = self._files
+        if seasonid is not None and seasonid in season_months and calendar is not None:
+            smonths = set( season_months[seasonid] )
+            keep = []
+            for fn,tr in zip( self._files, self._timeranges ):
+                try:
+                    # If lo==hi we don't know what the file covers, so it has to be kept.
+                    if tr.lo==tr.hi or len(smonths & months_in_range(tr.lo,tr.hi,tr.units,calendar))>0:
+                        keep.append(fn)
+                except Exception:
+                    keep.append(fn)
+            self._seasonfiles = keep
+        logger.debug("%s joins %d files, %d of them for season %s", self.id, len(self._files),
+                     len(self._seasonfiles), seasonid)
+    def __repr__( self ):
+        return "<multifile_dataset %s, %d files>" % (self.id, len(self._files))
+    def close( self ):
+        """There are no files to close; data files are opened only for the duration of a read."""
+        pass
+
+    def _files_for_time( self, timesel ):
+        """Returns the files which should be read for the time selector timesel.  For a
+        (lo,hi,...) tuple of numbers in the units of the time ranges, that's the files which
+        overlap [lo,hi]; and for a single number, the files which include it.  Otherwise, it's
+        every file for the season."""
+        if type(timesel) is tuple and len(timesel)>=2 and\
+                all([ isinstance(t,(int,long,float)) for t in timesel[0:2] ]):
+            lo, hi = min(timesel[0:2]), max(timesel[0:2])
+        elif isinstance( timesel, (int,long,float) ):
+            lo, hi = timesel, timesel
+        else:
+            return self._seasonfiles
+        return [ fn for fn,tr in zip(self._files,self._timeranges)
+                 if fn in self._seasonfiles and tr.hi>=lo and tr.lo<=hi ]
+
+    def _time_length( self, filename ):
+        """Returns the number of times in the file.  If that wasn't supplied, the file is opened
+        to find out."""
+        if filename not in self._timelengths:
+            f = cdms2.open( filename )
+            try:
+                self._timelengths[filename] = len( f.getAxis(self._timeid) )
+            finally:
+                f.close()
+        return self._timelengths[filename]
+
+    def _index_pieces( self, sl ):
+        """Maps a slice sl of the time indices of the joined data (which is made from the files
+        for the season) onto the files.  Returns a list of (file, slice) where the slice is of
+        the file's own time indices.  Reading those and joining them gives the same data as
+        joining all the files and then taking sl; but other files are not read.  For a slice
+        with a negative step, this returns None."""
+        lengths = [ self._time_length(fn) for fn in self._seasonfiles ]
+        start, stop, step = sl.indices( sum(lengths) )
+        if step<0:
+            return None
+        pieces = []
+        offset = 0
+        for fn,n in zip( self._seasonfiles, lengths ):
+            first = start if start>=offset else start+((offset-start+step-1)//step)*step
+            last = min( stop, offset+n )
+            if first<last:
+                pieces.append( (fn, slice(first-offset, last-offset, step)) )
+            offset += n
+        return pieces
+
+    def __call__( self, varid, *args, **kwargs ):
+        if varid in self.axes and varid not in self.variables:
+            return self.getAxis(varid)
+        if varid not in self.variables:
+            raise cdms2.error.CDMSError( "No variable %s in %s" % (varid, self.id) )
+        tdim = self._timedim[varid]
+        if tdim is None:
+            f = cdms2.open( self._files[0] )
+            try:
+                return f( varid, *args, **kwargs )
+            finally:
+                f.close()
+        # The time selector may be positional (then an int or slice is an index) or the keyword
+        # time (then an int is a time value).  It is replaced, in the reads of the files, by a
+        # selector for each file's part of the joined time axis.  Selections which can't be
+        # divided among the files that way are applied after the pieces are joined.
+        args = list(args)
+        postargs = []
+        if any([ a is Ellipsis for a in args ]):
+            # The dimensions of the positional selectors are uncertain, so apply them after joining.
+            postargs, args = args, []
+        positional = len(args)>tdim
+        timesel = args[tdim] if positional else kwargs.pop( 'time', None )
+        postkw = {}
+        if 'squeeze' in kwargs:
+            postkw['squeeze'] = kwargs.pop('squeeze')
+        pieces = None
+        if isinstance( timesel, slice ) or ( positional and isinstance( timesel, (int,long) ) ):
+            if isinstance( timesel, slice ):
+                pieces = self._index_pieces( timesel )
+            else:
+                pieces = self._index_pieces( slice( timesel, timesel+1 if timesel!=-1 else None ) )
+                postargs = [slice(None)]*tdim + [0]   # removes the time axis as timesel would
+        if pieces is None:
+            files = self._files_for_time( timesel )
+            if type(timesel) is tuple:
+                pieces = [ (fn, timesel) for fn in files ]
+            else:
+                pieces = [ (fn, slice(None)) for fn in files ]
+                if timesel is not None:
+                    # e.g. a time value, a date, or a slice with a negative step
+                    if positional:
+                        postargs = [slice(None)]*tdim + [timesel]
+                    else:
+                        postkw['time'] = timesel
+        parts = []
+        for fn,sel in pieces:
+            if positional:
+                args[tdim] = sel
+            elif sel!=slice(None):
+                kwargs['time'] = sel
+            f = cdms2.open( fn )
+            try:
+                parts.append( f( varid, *args, **kwargs ) )
+            except cdms2.error.CDMSError as e:
+                if type(timesel) is not tuple:
+                    raise
+                # The time selection misses this file.
+                logger.debug("no data for %s in %s: %s", varid, fn, e)
+            finally:
+                f.close()
+        if len(parts)==0:
+            raise cdms2.error.CDMSError( "No data for %s in %s" % (varid, self.id) )
+        elif len(parts)==1:
+            data = parts[0]
+        else:
+            data = cdms2.MV2.concatenate( parts, axis=tdim )
+            data.id = varid
+            for att,val in parts[0].attributes.items():
+                if not hasattr( data, att ):
+                    setattr( data, att, val )
+        if len(postargs)>0 or len(postkw)>0:
+            data = data( *postargs, **postkw )
+        return data
+
+    def getAxis( self, axid ):
+        """Returns the named axis as a TransientAxis.  The time axis is joined from all files
+        for the season."""
+        if axid not in self.axes:
+            return None
+        if axid!=self._timeid:
+            f = cdms2.open( self._files[0] )
+            try:
+                return cdms2.createAxis( f.getAxis(axid) )
+            finally:
+                f.close()
+        pieces = []
+        for fn in self._seasonfiles:
+            f = cdms2.open( fn )
+            try:
+                pieces.append( cdms2.createAxis( f.getAxis(axid) ) )
+            finally:
+                f.close()
+        if len(pieces)==1:
+            return pieces[0]
+        return cdms2.axis.axisConcatenate( pieces, id=axid, attributes=pieces[0].attributes )
+
+    def __getitem__( self, key ):
+        if key in self.axes and key not in self.variables:
+            return self.getAxis( key )
+        elif key in self.variables:
+            return multifile_variable( self, key )
+        else:
+            return None
+
+class multifile_variable:
+    """What multifile_dataset[varid] returns: a stand-in for a cdms2 FileVariable.  Like a
+    FileVariable, its attributes are the variable's attributes, plus id and parent, and nothing is
+    read until it is called or indexed.  Then only the files which hold the selected times are
+    read."""
+    def __init__( self, parent, varid ):
+        self.__dict__.update( parent._varinfo[varid][2] )
+        self.id = varid
+        self.parent = parent
+    def __repr__( self ):
+        return "<multifile_variable %s in %s>" % (self.id, self.parent.id)
+    @property
+    def shape( self ):
+        shape = list( self.parent._varinfo[self.id][0] )
+        tdim = self.parent._timedim[self.id]
+        if tdim is not None:
+            shape[tdim] = sum([ self.parent._time_length(fn) for fn in self.parent._seasonfiles ])
+        return tuple(shape)
+    @property
+    def dtype( self ):
+        return numpy.dtype( self.typecode() )
+    def typecode( self ):
+        return self.parent._varinfo[self.id][1]
+    def rank( self ):
+        return len(self.shape)
+    def __len__( self ):
+        return self.shape[0]
+    def getAxisIds( self ):
+        return list( self.parent.variables[self.id] )
+    def getAxisList( self ):
+        return [ self.parent.getAxis(axid) for axid in self.parent.variables[self.id] ]
+    def getTime( self ):
+        if self.parent._timedim[self.id] is None:
+            return None
+        return self.parent.getAxis( self.parent._timeid )
+    def getValue( self ):
+        return self.parent( self.id )
+    def __call__( self, *args, **kwargs ):
+        return self.parent( self.id, *args, **kwargs )
+    def __getitem__( self, key ):
+        """Index selection, as for a FileVariable: an integer removes its dimension.  The
+        selection is read as index slices, so the time slice goes through the parent's
+        _index_pieces()."""
+        keys = key if type(key) is tuple else (key,)
+        if len(keys)>self.rank() or\
+                not all([ isinstance(k,(int,long,slice)) for k in keys ]):
+            # e.g. an Ellipsis or an index array
+            return self.parent( self.id )[key]
+        slices = []
+        drop = []
+        for k in keys:
+            if isinstance( k, slice ):
+                slices.append( k )
+                drop.append( slice(None) )
+            else:
+                slices.append( slice( k, k+1 if k!=-1 else None ) )
+                drop.append( 0 )
+        data = self.parent( self.id, *slices )
+        if 0 in drop:
+            data = data[tuple(drop)]
+        return data
@@ -0,0 +1,347 @@
+# Persistent cache of the results of reduced_variable.reduce(), so that a diagnostic which has
+# already been computed from the same data files, e.g. a zonal mean or a lat-lon climatology, need
+# not be computed again in a later run.
+# Each result is a NetCDF file in the subdirectory rvcache of the cache path.  Its name is a hash
+# of everything which determines the result: the reduced variable's id (variable, season, region,
+# file filter), the names, sizes, and modification times of the data files, the time and space
+# ranges, and the reduction function: its module, name and line, with the values it has captured.
+# The code of the reduction functions is identified by the commit of the metrics package and by
+# cache_version.  If some of that can only be identified by memory addresses, there is no key,
+# and nothing is cached.  Least-recently-used files are deleted when the cache grows beyond a
+# size limit.
+# Reading a mass-weighted variable has a side effect: mass weights are saved in the filetable's
+# weight cache (see fileio/weightcache.py).  Those weights are stored along with the result, and
+# put back in the weight cache when it is loaded.
+# Several processes may share a cache, e.g. the diags processes started by one metadiags run.  A
+# process which is computing a reduced variable holds a lock file for its key, and any other
+# process which needs the same variable waits for the result rather than compute it again.  If
+# the result turns out not to be cacheable, the process leaves a marker file instead, so that
+# other processes stop waiting, and won't wait in future, for that key.
+
+import os, re, ast, errno, time, socket, hashlib, logging, types, functools, numpy, cdms2
+import metrics.git
+from metrics.common.utilities import file_stamp
+logger = logging.getLogger(__name__)
+
+cache_version = 1   # Increase this to make every cached result obsolete, e.g. after changing a
+#                     reduction function in a working copy, where the commit doesn't change.
+
+class inexact_key(Exception):
+    """Raised when a cache key can't be computed exactly, e.g. because it would depend on the
+    memory address of an object, or on objects nested too deeply.  Then nothing is cached."""
+    pass
+
+def stable_repr( obj, depth=5 ):
+    """Returns a string which represents obj, and which will be the same in another process for
+    an equal object.  Thus no memory addresses are included.  depth limits recursion into the
+    attributes of objects.  If obj can't be represented exactly within that depth, or its repr()
+    includes a memory address, this raises inexact_key."""
+    if obj is None or isinstance( obj, (bool,int,long,float,str,unicode) ):
+        return repr(obj)
+    if isinstance( obj, (tuple,list) ):
+        return type(obj).__name__+'('+','.join([ stable_repr(o,depth) for o in obj ])+')'
+    if isinstance( obj, dict ):
+        return '{'+','.join([ stable_repr(k,depth)+':'+stable_repr(obj[k],depth)
+                              for k in sorted(obj.keys()) ])+'}'
+    if isinstance( obj, numpy.ndarray ):
+        mask = numpy.ma.getmaskarray( obj )
+        return 'array(%s,%s,%s,%s)' % ( obj.dtype, obj.shape,
+                                        hashlib.md5(numpy.ma.getdata(obj).tostring()).hexdigest(),
+                                        hashlib.md5(mask.tostring()).hexdigest() )
+    if isinstance( obj, (types.FunctionType, types.MethodType, functools.partial) ):
+        return function_identity( obj, depth )
+    if isinstance( obj, (type, types.ClassType) ):
+        return 'class(%s.%s)' % ( obj.__module__, obj.__name__ )
+    if hasattr( obj, '__dict__' ):
+        if depth<=0:
+            raise inexact_key( "%s is nested too deeply" % obj.__class__.__name__ )
+        return obj.__class__.__name__+stable_repr(
+            { k:_attribute( obj, v ) for k,v in obj.__dict__.items() }, depth-1 )
+    r = repr(obj)
+    if ' at 0x' in r or 'object at' in r:
+        raise inexact_key( "%s can only be identified by its address" % r )
+    return r
+
+def _attribute( obj, v ):
+    """Returns the attribute value v of obj, but for a method bound to obj, just its function;
+    so that stable_repr() does not recurse back into obj."""
+    if isinstance( v, types.MethodType ) and v.im_self is obj:
+        return v.im_func
+    return v
+
+def _names_used( code ):
+    """Returns the set of global and attribute names used by the code object, including those
+    used by functions defined within it."""
+    names = set( code.co_names )
+    for c in code.co_consts:
+        if isinstance( c, types.CodeType ):
+            names |= _names_used(c)
+    return names
+
+def _captured_identity( obj, names, depth ):
+    """Like stable_repr(obj), but for an object with attributes, only the attributes named in
+    names, or used by its methods named in names, are included.  Thus a function which captures
+    a large object, e.g. a plot plan, only to use a few of its attributes is identified by just
+    those attributes."""
+    if hasattr( obj, '__dict__' ) and not isinstance(
+        obj, (types.FunctionType, types.MethodType, functools.partial, type, types.ClassType,
+              numpy.ndarray) ):
+        if depth<=0:
+            raise inexact_key( "%s is nested too deeply" % obj.__class__.__name__ )
+        names = set(names)
+        for k in list(names):
+            m = getattr( obj.__class__, k, None )
+            if isinstance( m, types.MethodType ) and isinstance( m.im_func, types.FunctionType ):
+                names |= _names_used( m.im_func.func_code )
+        return obj.__class__.__name__+stable_repr(
+            { k:_attribute( obj, v ) for k,v in obj.__dict__.items() if k in names }, depth-1 )
+    return stable_repr( obj, depth )
+
+def function_identity( fn, depth=5 ):
+    """Returns a string identifying what a function computes: its module, name, and first line
+    (which tell lambdas apart), the values of its default arguments, and the values it has
+    captured in a closure.  Its code is not examined; rvcache_key() includes the commit of the
+    metrics package and cache_version instead.  Bound methods and functools.partial objects are
+    also supported.  If that can't be done exactly, this raises inexact_key."""
+    if isinstance( fn, functools.partial ):
+        return 'partial(%s,%s,%s)' % ( function_identity(fn.func,depth), stable_repr(fn.args,depth),
+                                       stable_repr(fn.keywords or {},depth) )
+    if isinstance( fn, types.MethodType ):
+        if not isinstance( fn.im_func, types.FunctionType ):
+            raise inexact_key( "cannot identify the method %s" % fn.__name__ )
+        names = _names_used( fn.im_func.func_code )
+        return 'method(%s,%s)' % ( function_identity(fn.im_func,depth),
+                                   _captured_identity(fn.im_self,names,depth-1) )
+    if not isinstance( fn, types.FunctionType ):
+        # e.g. a builtin function or a class; it is identified by its name
+        r = repr(fn)
+        if ' at 0x' in r or 'object at' in r:
+            raise inexact_key( "cannot identify the function %s" % r )
+        return r
+    names = _names_used( fn.func_code )
+    closure = [ _captured_identity(cell.cell_contents,names,depth-1)
+                for cell in (fn.func_closure or []) ]
+    return '%s.%s:%d(%s,%s)' % ( fn.__module__, fn.__name__, fn.func_code.co_firstlineno,
+                                 stable_repr(fn.func_defaults,depth-1), ','.join(closure) )
+
+def rvcache_key( idparts, datafiles, extras, reduction_function ):
+    """Returns a key for the cache.  idparts are the parts of the reduced variable's id which do
+    not depend on the filetable; datafiles the names of the files it reads; extras anything
+    else which can affect the result; reduction_function its reduction function.  Raises
+    inexact_key if these can't be identified exactly."""
+    stamps = [ (os.path.abspath(f),)+tuple(file_stamp(f)) for f in sorted(datafiles) ]
+    keystr = '|'.join([ stable_repr(idparts), stable_repr(stamps), stable_repr(extras),
+                        function_identity(reduction_function),
+                        str(getattr(metrics.git,'commit','')), str(cache_version) ])
+    return hashlib.md5(keystr).hexdigest()
+
+class rvcache:
+    """An on-disk cache of reduced variables, in the directory cachedir/rvcache.  maxbytes is the
+    total size to which the cache will be trimmed after each store (None for no limit)."""
+    def __init__( self, cachedir, maxbytes=None, waittime=300 ):
+        """waittime is the longest time, in seconds, which wait() will wait for another process
+        to compute a reduced variable."""
+        self.path = os.path.join( cachedir, 'rvcache' )
+        self.maxbytes = maxbytes
+        self.waittime = waittime
+    def _filename( self, key ):
+        return os.path.join( self.path, key+'.nc' )
+    def _lockname( self, key ):
+        return os.path.join( self.path, key+'.lock' )
+    def _refusedname( self, key ):
+        return os.path.join( self.path, key+'.nocache' )
+    def _weightsname( self, key, i ):
+        return os.path.join( self.path, key+'.mw%d' % i )
+
+    def refused( self, key ):
+        """Returns True if the data for key has been found not to be cacheable; see refuse()."""
+        return os.path.exists( self._refusedname(key) )
+
+    def refuse( self, key ):
+        """Records that the data for key can't be cached, e.g. because it is all missing, so that
+        other processes need not wait for it.  This should be done before releasing the claim."""
+        try:
+            open( self._refusedname(key), 'w' ).close()
+        except (IOError, OSError) as e:
+            logger.debug("cannot mark reduced variable cache key %s as not cacheable: %s", key, e)
+
+    def claim( self, key ):
+        """Declares that this process will compute the data for key, so other processes should
+        wait for it.  Returns True if successful; False if another process has already claimed
+        the key.  If the lock can't be made for any other reason, e.g. a read-only cache, this
+        returns True, as there is no point in waiting.  The claim should be released with
+        release() whether or not the data is stored."""
+        try:
+            if not os.path.isdir( self.path ):
+                os.makedirs( self.path )
+            fd = os.open( self._lockname(key), os.O_CREAT|os.O_EXCL|os.O_WRONLY )
+        except OSError as e:
+            if e.errno==errno.EEXIST and os.path.isdir( self.path ):
+                return False
+            logger.debug("cannot lock reduced variable cache key %s: %s", key, e)
+            return True
+        try:
+            os.write( fd, '%s %d' % (socket.gethostname(), os.getpid()) )
+        finally:
+            os.close( fd )
+        return True
+
+    def release( self, key ):
+        """Releases a claim made with claim()."""
+        try:
+            os.remove( self._lockname(key) )
+        except OSError:
+            pass
+
+    def _stale_lock( self, lockname ):
+        """Returns True if the lock file was made by a process on this host which no longer
+        exists."""
+        try:
+            host, pid = open( lockname ).read().split()
+            if host!=socket.gethostname():
+                return False
+            os.kill( int(pid), 0 )
+        except OSError as e:
+            return e.errno==errno.ESRCH
+        except (IOError, ValueError):
+            return False   # not yet written, or just removed
+        return False
+
+    def wait( self, key, weightcache=None ):
+        """Waits for another process, which has claimed the key, to finish computing its data.
+        Then returns (data, file_attributes) as load(key,weightcache) does.  If the other process dies or takes
+        longer than self.waittime, or finds that the data can't be cached, this returns
+        (None, None)."""
+        lockname = self._lockname(key)
+        logger.debug("waiting for another process to compute cached reduced variable %s", key)
+        t0 = time.time()
+        delay = 0.1
+        while os.path.exists( lockname ):
+            if self.refused( key ):
+                return None, None
+            if self._stale_lock( lockname ):
+                logger.info("removing stale reduced variable cache lock %s", lockname)
+                self.release( key )
+                break
+            if time.time()-t0 > self.waittime:
+                logger.warning("gave up waiting for reduced variable cache lock %s", lockname)
+                break
+            time.sleep( delay )
+            delay = min( 2*delay, 5.0 )
+        return self.load( key, weightcache )
+
+    def load( self, key, weightcache=None ):
+        """Returns (data, file_attributes) for the key, or (None, None) if the cache doesn't
+        have it.  data is a TransientVariable; file_attributes are the global attributes of the
+        data files it came from.  The mass weights stored with the data are put in weightcache,
+        a metrics.fileio.weightcache.weightcache, as computing the data would have done."""
+        fname = self._filename(key)
+        if not os.path.isfile(fname):
+            return None, None
+        try:
+            f = cdms2.open( fname )
+            try:
+                varid = f.rvcache_varid
+                data = f(varid)
+                file_attributes = { a[len('file_'):]:v for a,v in f.attributes.items()
+                                    if a.startswith('file_') }
+                data._vid = f.rvcache_vid
+                if hasattr( f, 'rvcache_weighting' ):
+                    data.weighting = f.rvcache_weighting
+                nweights = int( getattr( f, 'rvcache_nweights', 0 ) )
+            finally:
+                f.close()
+            weights = []
+            for i in range( nweights ):
+                g = cdms2.open( self._weightsname(key,i) )
+                try:
+                    weights.append( ( ast.literal_eval(g.rvcache_weights_key),
+                                      g('mass_weights') ) )
+                finally:
+                    g.close()
+            for fn in [ fname ] + [ self._weightsname(key,i) for i in range(nweights) ]:
+                os.utime( fn, None )   # for least-recently-used eviction
+        except Exception as e:
+            logger.warning("cannot read cached reduced variable %s: %s", fname, e)
+            return None, None
+        if weightcache is not None:
+            for wkey,wts in weights:
+                weightcache.put( wkey, wts )
+        logger.debug("reduced variable %s from cache file %s", varid, fname)
+        return data, file_attributes
+
+    def _write( self, fname, fill ):
+        """Writes a NetCDF file fname by calling fill on it, open for writing.  The file appears
+        under its name only when it is complete."""
+        tmpname = fname+'.%d' % os.getpid()
+        try:
+            f = cdms2.open( tmpname, 'w' )
+            try:
+                fill( f )
+            finally:
+                f.close()
+            os.rename( tmpname, fname )
+        except:
+            if os.path.isfile(tmpname):
+                os.remove(tmpname)
+            raise
+
+    def store( self, key, data, file_attributes={}, weights=[] ):
+        """Saves the TransientVariable data under the key.  file_attributes are global attributes
+        of the data files which it was computed from.  weights is a list of (key,weights) of the
+        mass weights which were saved in the weight cache while it was computed; they are saved
+        too, for load() to restore.  Failure to write is not an error."""
+        fname = self._filename(key)
+        def fill_weights( g, wkey, wts ):
+            g.write( wts, id='mass_weights' )
+            g.rvcache_weights_key = repr(wkey)
+        def fill( f ):
+            f.write( data )
+            f.rvcache_varid = data.id
+            f.rvcache_vid = getattr( data, '_vid', data.id )
+            if hasattr( data, 'weighting' ):
+                f.rvcache_weighting = data.weighting
+            f.rvcache_nweights = len(weights)
+            for a,v in file_attributes.items():
+                if isinstance( v, (str,int,long,float) ):
+                    setattr( f, 'file_'+a, v )
+        try:
+            if not os.path.isdir( self.path ):
+                os.makedirs( self.path )
+            # The data is written last, so that load() finds it only with all its weights.
+            for i,(wkey,wts) in enumerate(weights):
+                self._write( self._weightsname(key,i),
+                             lambda g,wkey=wkey,wts=wts: fill_weights( g, wkey, wts ) )
+            self._write( fname, fill )
+        except Exception as e:
+            logger.info("cannot write reduced variable cache file %s: %s", fname, e)
+            return
+        self.evict()
+
+    def evict( self ):
+        """Deletes the least-recently-used cache entries until the cache fits in self.maxbytes.
+        An entry is the files of one key: its data, mass weights, or marker of refusal."""
+        if self.maxbytes is None:
+            return
+        try:
+            entries = {}   # key : [ mtime, size, file names ]
+            for fn in os.listdir( self.path ):
+                if re.match( r'^[0-9a-f]+\.(nc|nocache|mw\d+)$', fn ):
+                    st = os.stat( os.path.join(self.path,fn) )
+                    entry = entries.setdefault( fn.split('.')[0], [0,0,[]] )
+                    entry[0] = max( entry[0], st.st_mtime )
+                    entry[1] += st.st_size
+                    entry[2].append( fn )
+        except OSError:
+            return
+        total = sum([ e[1] for e in entries.values() ])
+        for mtime,size,fns in sorted(entries.values()):
+            if total<=self.maxbytes:
+                break
+            # The data first, so that a partly deleted entry is never loaded.
+            for fn in sorted( fns, key=(lambda fn: not fn.endswith('.nc')) ):
+                try:
+                    os.remove( os.path.join(self.path,fn) )
+                except OSError:
+                    pass   # maybe another process removed it
+            total -= size
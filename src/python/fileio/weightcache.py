@@ -0,0 +1,192 @@
+# Cache of the mass weights used to average mass-weighted variables such as temperature.
+# Mass weights are (lev,lat,lon)-shaped arrays, expensive to compute because they need the surface
+# pressure.  They depend on the grid and on the surface pressure, so each is keyed by fingerprints
+# (hashes) of its level, latitude and longitude axes, and of the file it got the surface pressure
+# from.  The region is implied by the latitude and longitude values, and the season by the
+# surface pressure file.
+# A variable which lacks some of these axes, e.g. a zonal mean, needs weights summed over the
+# missing directions.  find() supports this by matching only the axes which the variable has.  But
+# the file must always match: weights from another file, e.g. a climatology of another season,
+# would be computed from the wrong surface pressure.
+# The cache is held in memory, up to a size limit, least-recently-used weights being dropped
+# first.  Optionally it is also saved to disk as NetCDF files in the subdirectory massweights of
+# the cache path, so that later runs can use it.  Each file's name is its key.
+# The weights which are used or saved while a reduced variable is computed can be recorded, so
+# that the reduced variable cache can save them along with the result (see fileio/rvcache.py).
+
+import os, hashlib, logging, collections, numpy
+from metrics.common.utilities import file_stamp
+logger = logging.getLogger(__name__)
+
+def axis_fingerprint( ax ):
+    """Returns a hash of an axis' values and units, or None if ax is None.  The values are rounded
+    so that the same axis will have the same fingerprint whether stored as float32 or float64."""
+    if ax is None:
+        return None
+    vals = numpy.round( numpy.asarray( ax[:], dtype=numpy.float64 ), 5 )
+    return hashlib.sha1( vals.tostring() + '|' + str(getattr(ax,'units','')) ).hexdigest()
+
+def source_fingerprint( filename ):
+    """Returns a hash of the name, size and modification time of the file which a variable was
+    read from, or None if filename is None."""
+    if filename is None:
+        return None
+    return hashlib.sha1( str(filename) + str(file_stamp(filename)) ).hexdigest()
+
+def mass_weights_key( mv ):
+    """Returns the cache key for mass weights suitable for the variable mv: a tuple of the
+    fingerprints of its level, latitude and longitude axes and of its data file.  A missing axis
+    or file has the fingerprint None."""
+    return ( axis_fingerprint(mv.getLevel()), axis_fingerprint(mv.getLatitude()),
+             axis_fingerprint(mv.getLongitude()), source_fingerprint(getattr(mv,'filename',None)) )
+
+class weightcache:
+    """A least-recently-used cache of mass weights, holding at most maxbytes of them in memory
+    (None for no limit).  If cachedir is not None, weights are also saved in, and looked for in,
+    cachedir/massweights, which is trimmed to maxbytes as well."""
+    def __init__( self, maxbytes=None, cachedir=None ):
+        self.maxbytes = maxbytes
+        self.path = None if cachedir is None else os.path.join( cachedir, 'massweights' )
+        self._weights = collections.OrderedDict()   # key:weights, least recently used first
+        self._nbytes = 0
+        self._recorders = []   # dicts key:weights, see start_recording()
+    def _filename( self, key ):
+        return os.path.join( self.path, '_'.join(key)+'.nc' )
+
+    def _disk_keys( self ):
+        """Returns the keys of the weights saved on disk."""
+        if self.path is None or not os.path.isdir( self.path ):
+            return []
+        keys = []
+        for fn in os.listdir( self.path ):
+            parts = fn[:-3].split('_')
+            if fn.endswith('.nc') and len(parts)==4:
+                keys.append( tuple(parts) )
+        return keys
+
+    def get( self, key ):
+        """Returns the weights stored under key, or None if there are none."""
+        if key in self._weights:
+            wts = self._weights.pop( key )
+            self._weights[key] = wts
+            self._record( key, wts )
+            return wts
+        if self.path is None or None in key:
+            return None
+        wts = self._load( key )
+        if wts is not None:
+            self._remember( key, wts )
+            self._record( key, wts )
+        return wts
+
+    def find( self, key ):
+        """Returns weights suitable for a variable with the key mass_weights_key(mv), or None.
+        If the variable lacks an axis, its key has None there, and the weights for any value of
+        that axis will do; the missing directions are for the caller to sum over.  The weights
+        must come from the same file as the variable, so if its file is unknown there are none.
+        Among several candidates, the choice is always the same one."""
+        if key[3] is None:
+            return None
+        if None not in key:
+            return self.get( key )
+        candidates = sorted( set(self._weights.keys()) | set(self._disk_keys()) )
+        matches = [ k for k in candidates
+                    if all([ p is None or p==q for p,q in zip(key,k) ]) ]
+        for k in matches:
+            wts = self.get( k )
+            if wts is not None:
+                return wts
+        return None
+
+    def put( self, key, wts ):
+        """Stores the weights wts under key, a value of mass_weights_key()."""
+        if None in key:
+            return
+        self._remember( key, wts )
+        self._record( key, wts )
+        if self.path is not None:
+            self._store( key, wts )
+
+    def start_recording( self ):
+        """Returns a dict key:weights, to which the weights which are found or put in this cache
+        will be added, until stop_recording() is called with it."""
+        recorder = collections.OrderedDict()
+        self._recorders.append( recorder )
+        return recorder
+
+    def stop_recording( self, recorder ):
+        self._recorders = [ r for r in self._recorders if r is not recorder ]
+
+    def _record( self, key, wts ):
+        for recorder in self._recorders:
+            recorder[key] = wts
+
+    def _remember( self, key, wts ):
+        if key in self._weights:
+            self._nbytes -= self._weights.pop( key ).nbytes
+        self._weights[key] = wts
+        self._nbytes += wts.nbytes
+        while self.maxbytes is not None and self._nbytes>self.maxbytes and len(self._weights)>1:
+            oldkey, oldwts = self._weights.popitem( last=False )
+            self._nbytes -= oldwts.nbytes
+
+    def _load( self, key ):
+        import cdms2
+        fname = self._filename(key)
+        if not os.path.isfile(fname):
+            return None
+        try:
+            f = cdms2.open( fname )
+            try:
+                wts = f('mass_weights')
+            finally:
+                f.close()
+            os.utime( fname, None )   # for least-recently-used eviction
+        except Exception as e:
+            logger.warning("cannot read cached mass weights %s: %s", fname, e)
+            return None
+        logger.debug("mass weights from cache file %s", fname)
+        return wts
+
+    def _store( self, key, wts ):
+        """Saves wts to disk under key.  Failure to write is not an error."""
+        import cdms2
+        fname = self._filename(key)
+        tmpname = fname+'.%d' % os.getpid()
+        try:
+            if not os.path.isdir( self.path ):
+                os.makedirs( self.path )
+            f = cdms2.open( tmpname, 'w' )
+            try:
+                f.write( wts, id='mass_weights' )
+            finally:
+                f.close()
+            os.rename( tmpname, fname )
+        except Exception as e:
+            logger.info("cannot write mass weights cache file %s: %s", fname, e)
+            if os.path.isfile(tmpname):
+                os.remove(tmpname)
+            return
+        self._evict()
+
+    def _evict( self ):
+        """Deletes the least-recently-used cache files until they fit in self.maxbytes."""
+        if self.maxbytes is None:
+            return
+        try:
+            entries = []
+            for fn in os.listdir( self.path ):
+                if fn.endswith('.nc'):
+                    st = os.stat( os.path.join(self.path,fn) )
+                    entries.append( (st.st_mtime, st.st_size, fn) )
+        except OSError:
+            return
+        total = sum([ e[1] for e in entries ])
+        for mtime,size,fn in sorted(entries):
+            if total<=self.maxbytes:
+                break
+            try:
+                os.remove( os.path.join(self.path,fn) )
+                total -= size
+            except OSError:
+                pass   # maybe another process removed it
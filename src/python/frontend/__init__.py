@@ -1,10 +1,22 @@
 #import uvcdat
 import os,sys
 import git
-import vcs
 import metrics.common.debug
-vcs_tmp_canvas = vcs.init()
-vcs_tmp_canvas.scriptrun(os.path.join(sys.prefix,"share","uvcmetrics","uvcmetrics.json"))
-vcs_tmp_canvas.scriptrun(os.path.join(sys.prefix,"share","uvcmetrics","plot_set_5.json"))
-del(vcs_tmp_canvas)
 
+# vcs is slow to import and to initialize, and many uses of the diagnostics (e.g. listing the
+# plot sets, or computing without plotting) never need it.  So it is set up by setup_vcs(), when
+# it is first needed, rather than when this package is imported.
+_vcs_ready = False
+
+def setup_vcs():
+    """Imports vcs and, the first time this is called, loads the uvcmetrics templates and
+    graphics methods into it.  Returns the vcs module."""
+    global _vcs_ready
+    import vcs
+    if not _vcs_ready:
+        vcs_tmp_canvas = vcs.init()
+        vcs_tmp_canvas.scriptrun(os.path.join(sys.prefix,"share","uvcmetrics","uvcmetrics.json"))
+        vcs_tmp_canvas.scriptrun(os.path.join(sys.prefix,"share","uvcmetrics","plot_set_5.json"))
+        del(vcs_tmp_canvas)
+        _vcs_ready = True
+    return vcs
@@ -12,7 +12,7 @@
 from metrics.packages.amwg.amwg import *
 from metrics.packages.amwg.amwg13 import *
 from metrics.packages.lmwg.lmwg import *
-import numpy
+import numpy, vcs
 
 # Required arguments for a plot are the canvas, variable, graphics method, template.
 def amwg_plot_plan_vcs_plot( self, canvas, var, gm, tm, ratio='autot', *args, **kwargs ):
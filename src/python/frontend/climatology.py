@@ -27,6 +27,7 @@ from multiprocessing import Process, Lock
 ###from Queue import Queue
 import cProfile
 from metrics.common.utilities import DiagError, store_provenance
+from metrics.fileio.multifile import open_datafile
 
 import logging
 logger = logging.getLogger(__name__)
@@ -36,6 +37,8 @@ MP = False
 queue = None
 lock = None  # for debugging; in normal use this should be None
 force_scalar_avg=False  # for testing
+prefetch = 0            # number of input files to read ahead, see inc_reduce.prefetch_datasets()
+prefetch_bytes = None   # limit on the bytes read ahead, None for no limit
 
 def restrict_to_season( datafilenames, seasonname ):
     """Returns a sorted subset of the input list of data (model output) filenames -
@@ -249,7 +252,23 @@ def clean_fileout_template( fileout_template ):
     fileout_template = os.path.join( ft_dn, ft_bn )
     return fileout_template
 
-def climos( fileout_template, seasonnames, varnames, datafilenames, omitBySeason=[] ):
+all_seasonnames = [ 'ANN', 'DJF', 'MAM', 'JJA', 'SON', 'JAN', 'FEB', 'MAR', 'APR', 'MAY',
+                    'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC' ]
+
+def omitted_files( seasonnames, omitBySeason=[] ):
+    """Converts the omitBySeason argument of climos() to a dict, season name: list of files."""
+    omit_files = {seasonname:[] for seasonname in seasonnames}
+    for omits in omitBySeason:
+        omit_files[omits[0]] = omits[1:]
+    return omit_files
+
+def climos( fileout_template, seasonnames, varnames, datafilenames, omitBySeason=[],
+            singlepass=False, file_done=None ):
+    """Computes climatologies for the listed seasons from the data files.  If singlepass is
+    True, each data file is read just once, for all seasons; see climos_singlepass().  Then
+    file_done, if supplied, is called with the name of each data file once climos() has
+    finished with it.  A caller which supplies in-memory datasets in place of files can use
+    this to free each one as soon as possible."""
 
     # NetCDF library settings for speed:
     if 'setNetcdf4Flag' in dir(cdms2):  # backwards compatible with old versions of UV-CDAT
@@ -261,13 +280,10 @@ def climos( fileout_template, seasonnames, varnames, datafilenames, omitBySeason
 
     if 'ALL' in seasonnames:
         allseasons = True
-        seasonnames = [ 'ANN', 'DJF', 'MAM', 'JJA', 'SON', 'JAN', 'FEB', 'MAR', 'APR', 'MAY',
-                        'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC' ]
+        seasonnames = all_seasonnames
     else:
         allseasons = False
-    omit_files = {seasonname:[] for seasonname in seasonnames}
-    for omits in omitBySeason:
-        omit_files[omits[0]] = omits[1:]
+    omit_files = omitted_files( seasonnames, omitBySeason )
     fileout_template = clean_fileout_template( fileout_template )
 
     if comm is None or comm.rank==0:
@@ -275,7 +291,7 @@ def climos( fileout_template, seasonnames, varnames, datafilenames, omitBySeason
         # we don't want several processors to be opening it simultaneously.
         assert( len(datafilenames)>0 )
         if lock is not None:  lock.acquire()
-        f = cdms2.open(datafilenames[0])
+        f = open_datafile(datafilenames[0])
         if lock is not None:  lock.release()
         # to do: get the time axis even if the name isn't 'time'
         data_time = f.getAxis('time') # a FileAxis.
@@ -330,6 +346,20 @@ def climos( fileout_template, seasonnames, varnames, datafilenames, omitBySeason
     dt = 0      # specifies climatology file
     redfilenames = []
 
+    if singlepass:
+        # Like the simple computation below, directly from the input model data.  But each input
+        # file is read once, rather than once for each season.  There is no attempt to compute
+        # in parallel.
+        if comm is not None and comm.rank>0:
+            return
+        t1=time.time()
+        climos_singlepass( fileout_template, seasonnames, varnames, datafilenames, omit_files,
+                           time_units, calendar, dt, force_scalar_avg, input_global_attributes,
+                           lock1=lock, file_done=file_done )
+        t2=time.time()
+        logger.info("single pass for all seasons, time is %s",t2-t1)
+        return
+
     if allseasons and len(omitBySeason)==0:
         # This block computes multi-month seasons from sngle-month climatology files.
         # I've only implemented it for "all" seasons.  And I haven't implemented it for when
@@ -555,37 +585,55 @@ def climo_one_season( seasonname, datafilenames, omit_files, varnames, fileout_t
     if len(datafilenames2)<=0:
         logger.warning('No input data, skipping season %s', seasonname)
         return False
-    season = daybounds(seasonname)
-    # ... assumes noleap calendar, returns time in days.
-
-    init_red_tbounds = numpy.array( season, dtype=numpy.int32 )
     fileout = fileout_template.replace('XXX',seasonname)
     filein = datafilenames2[0]
     if comm1 is not None and comm1.size>1 and filein in filerank and filerank[filein]>=0:
         #print "jfp receiving from",filerank[filein],"to",comm1.rank,"tag",filetag[filein],"for",filein
         comm1.recv( source=filerank[filein], tag=filetag[filein] )
 
+    g, redvars, season_tmin = init_climo_season( seasonname, fileout, filein, varnames, calendar,
+                                                 dt, lock1 )
+    redtime = g.getAxis('time')
+    redtime_wts = g['time_weights']
+    redtime_bnds = g[ redtime.bounds ]
+
+    tmin, tmax = update_time_avg_from_files( redvars, redtime_bnds, redtime_wts, datafilenames2,
+                                fun_next_tbounds = (lambda rtb,dtb,dt=dt: rtb),
+                                redfiles=[g], dt=dt,
+                                force_scalar_avg=force_scalar_avg1, lock=lock1,
+                                prefetch=prefetch, prefetch_bytes=prefetch_bytes )
+    season_tmin = min( tmin, season_tmin )
+
+    finish_climo_season( seasonname, fileout_template, fileout, g, redvars, datafilenames,
+                         season_tmin, time_units, input_global_attributes, lock1 )
+    return True
+
+def init_climo_season( seasonname, fileout, filein, varnames, calendar, dt, lock1=None ):
+    """Creates the climatology file fileout for the season seasonname, with its variables and
+    time axis set up from the data file filein.  Returns the file (open for writing), its
+    variables to be averaged, and the lowest time in filein."""
+    season = daybounds(seasonname)
+    # ... assumes noleap calendar, returns time in days.
+    init_red_tbounds = numpy.array( season, dtype=numpy.int32 )
+
     g, out_varnames, tmin, tmax = initialize_redfile_from_datafile(
         fileout, varnames, filein, dt, init_red_tbounds, lock=lock1 )
     # g is the (newly created) climatology file.  It's open in 'w' mode.
 
-    season_tmin = tmin
-    season_tmax = tmax
     redtime = g.getAxis('time')
     redtime.units = 'days since 0'
     redtime.long_name = 'climatological time'
     redtime.calendar = calendar
-    redtime_wts = g['time_weights']
-    redtime_bnds = g[ redtime.bounds ]
     redvars = [ g[varn] for varn in out_varnames ]
+    return g, redvars, tmin
 
-    tmin, tmax = update_time_avg_from_files( redvars, redtime_bnds, redtime_wts, datafilenames2,
-                                fun_next_tbounds = (lambda rtb,dtb,dt=dt: rtb),
-                                redfiles=[g], dt=dt,
-                                force_scalar_avg=force_scalar_avg1, lock=lock1 )
-    season_tmin = min( tmin, season_tmin )
-    season_tmax = max( tmax, season_tmax )
-
+def finish_climo_season( seasonname, fileout_template, fileout, g, redvars, datafilenames,
+                         season_tmin, time_units, input_global_attributes, lock1=None ):
+    """Completes the climatology file g for the season seasonname after all data has been
+    averaged into it, and closes it.  season_tmin is the lowest time of the input data."""
+    redtime = g.getAxis('time')
+    redtime_wts = g['time_weights']
+    redtime_bnds = g[ redtime.bounds ]
     if len(redtime)==2:
         # reduce_twotimes2one() will close the supplied g, and return a g opened in 'r+' mode...
         g = reduce_twotimes2one( seasonname, fileout_template, fileout, g, redtime,
@@ -625,7 +673,60 @@ def climo_one_season( seasonname, datafilenames, omit_files, varnames, fileout_t
     g.close()
     if lock is not None:  lock.release()
 
-    return True
+def singlepass_season_files( datafilenames, seasonnames, omit_files ):
+    """Returns a dict, season name: the sorted list of data files for that season, for the
+    seasons which have any data files."""
+    seasfiles = {}
+    for seasonname in seasonnames:
+        fns = [fn for fn in datafilenames if fn not in omit_files[seasonname]]
+        fns = restrict_to_season( fns, seasonname )
+        if len(fns)<=0:
+            logger.warning('No input data, skipping season %s', seasonname)
+            continue
+        seasfiles[seasonname] = fns
+    return seasfiles
+
+def climos_singlepass( fileout_template, seasonnames, varnames, datafilenames, omit_files,
+                       time_units, calendar, dt, force_scalar_avg1, input_global_attributes,
+                       lock1=None, file_done=None ):
+    """Computes climatologies for all the seasons seasonnames directly from the model output
+    files datafilenames, like climo_one_season for each season.  But rather than re-reading the
+    data for each season, each input file is read only once; and its data averaged into the
+    climatology files of every season it belongs to.  Those files are all finished and closed
+    at the end.  file_done is as for climos(); files in none of the seasons are done with as soon
+    as the climatology files have been set up."""
+    seasfiles = singlepass_season_files( datafilenames, seasonnames, omit_files )
+    if len(seasfiles)==0:
+        return
+    myseasons = [ sn for sn in seasonnames if sn in seasfiles ]
+
+    redfiles = []
+    season_tmin = {}
+    for seasonname in myseasons:
+        fileout = fileout_template.replace('XXX',seasonname)
+        g, redvars, season_tmin[seasonname] =\
+            init_climo_season( seasonname, fileout, seasfiles[seasonname][0], varnames, calendar,
+                               dt, lock1 )
+        redfiles.append( ( g, [ var.id for var in redvars ], set(seasfiles[seasonname]) ) )
+    allfiles = sorted( set( [ fn for sn in myseasons for fn in seasfiles[sn] ] ) )
+    logger.info("single pass over %d files for %d seasons", len(allfiles), len(myseasons))
+    if file_done is not None:
+        for fn in datafilenames:
+            if fn not in allfiles:
+                file_done( fn )
+
+    tminmax = update_time_avg_from_files_multi( redfiles, allfiles,
+                                                fun_next_tbounds = (lambda rtb,dtb,dt=dt: rtb),
+                                                dt=dt, force_scalar_avg=force_scalar_avg1,
+                                                lock=lock1, prefetch=prefetch,
+                                                prefetch_bytes=prefetch_bytes,
+                                                file_done=file_done )
+
+    for seasonname,(g,varids,fns),(tmin,tmax) in zip( myseasons, redfiles, tminmax ):
+        redvars = [ g[varn] for varn in varids ]
+        finish_climo_season( seasonname, fileout_template, fileout_template.replace('XXX',seasonname),
+                             g, redvars, datafilenames, min( tmin, season_tmin[seasonname] ),
+                             time_units, input_global_attributes, lock1 )
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser(description="Climatology")
@@ -648,6 +749,14 @@ if __name__ == '__main__':
                    "use the Python multiprocessing module - multiple processes per processor.")
     p.add_argument("--MPI", dest="MPI", action='store_true', help=
                    "use MPI (mpi4py) multiprocessing - multiple processesors.")
+    p.add_argument("--singlepass", dest="singlepass", action='store_true', help=
+                   "read each input file only once, computing all seasons together.  This uses"+
+                   " one process and writes all the output files at the end.")
+    p.add_argument("--prefetch", dest="prefetch", type=int, default=0, help=
+                   "number of input files to read ahead in a background process while earlier files"+
+                   " are being averaged (default 0, no read-ahead)")
+    p.add_argument("--prefetchMB", dest="prefetchMB", type=float, default=None, help=
+                   "limit, in megabytes, on the input data read ahead by --prefetch")
     p.add_argument("--forceScalarAvg", dest="forceScalarAvg", default=False, help=argparse.SUPPRESS )
     #              For testing, forces use of a simple scalar average, ignoring missing values
     p.add_argument("--bypassChecks", dest="bypassChecks", default=False, help=argparse.SUPPRESS )
@@ -666,6 +775,9 @@ if __name__ == '__main__':
         pprint(args)
 
     force_scalar_avg = args.forceScalarAvg
+    prefetch = args.prefetch
+    if args.prefetchMB is not None:
+        prefetch_bytes = int( args.prefetchMB*1024*1024 )
     if not args.oneproc:
         try:
             from mpi4py import MPI
@@ -701,10 +813,11 @@ if __name__ == '__main__':
     if profileme is True:
         prof = cProfile.Profile()
         prof.runcall( climos, args.outfile[0], args.seasons, args.variables,
-                      args.infiles, args.omitBySeason )
+                      args.infiles, args.omitBySeason, args.singlepass )
         prof.dump_stats('results_stats')
     else:
-        climos( args.outfile[0], args.seasons, args.variables, args.infiles, args.omitBySeason )
+        climos( args.outfile[0], args.seasons, args.variables, args.infiles, args.omitBySeason,
+                args.singlepass )
 
     if False:
         # For testing, print results...
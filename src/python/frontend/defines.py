@@ -90,6 +90,10 @@ station_names = ["Ascension_Island","Diego_Garcia","Truk_Island",
 all_months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
 just_seasons = ['DJF', 'MAM', 'JJA', 'SON', 'ASO', 'FMA'] # The last 2 were in some obs sets
 all_seasons = all_months+just_seasons+['ANN']
+# The months (numbered 1-12) which make up each season:
+season_months = { mon:[i+1] for i,mon in enumerate(all_months) }
+season_months.update( { 'DJF':[12,1,2], 'MAM':[3,4,5], 'JJA':[6,7,8], 'SON':[9,10,11],
+                        'ASO':[8,9,10], 'FMA':[2,3,4], 'ANN':range(1,13), 'JFMAMJJASOND':range(1,13) } )
 all_packages = ['lmwg', 'amwg']
 
 
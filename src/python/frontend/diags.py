@@ -8,13 +8,16 @@
 ###     (Idealy, just specify the exact, complete filename)
 ### Look for speed improvements
 
-import hashlib, os, pickle, sys, os, time, re, pdb, logging
+import hashlib, os, pickle, sys, os, time, re, pdb, logging, json, traceback
 from metrics import *
 from metrics.fileio.filetable import *
 from metrics.fileio.findfiles import *
 from metrics.computation.reductions import *
+import metrics.computation.reductions as reductions
 from metrics.frontend.form_filenames import *
-from metrics.frontend.amwg_plotting import *
+from metrics.frontend import setup_vcs
+# The plot sets, vcs and the plotting modules (amwg_plotting, it) are slow to import, so they are
+# imported when first needed, by run_diags() and makeplots(); see diagnostics_menu().
 # These next 5 lines really shouldn't be necessary. We should have a top level
 # file in packages/ that import them all. Otherwise, this needs done in every
 # script that does anything with diags, and would need updated if new packages
@@ -28,7 +31,6 @@ from pprint import pprint
 from metrics.common.utilities import *
 import metrics.frontend.defines as defines
 import cProfile
-from metrics.frontend.it import *
 from metrics.computation.region import *
 #import debug
 import logging
@@ -151,7 +153,46 @@ def save_regrid( opts ):
     else:
         logger.error("do not recognize regrid option %s",opts['regrid'])
 
-def run_diags( opts ):
+def save_climatology_engine( opts ):
+    """Sets what computes seasonal climatologies, cdutil or numpy; see reductions.numpy_climatology."""
+    reductions.numpy_climatology = ( opts.get('climatology_engine','cdutil') == 'numpy' )
+
+def make_canvases( opts ):
+    """Makes and returns the two VCS canvases which makeplots() draws on: vcanvas, for a single
+    plot, and vcanvas2, for the compound plot.  If no plots are to be made, returns (None,None)."""
+    if opts['output']['plots'] != True:
+        # No plots. JSON? XML? NetCDF? etc
+        # do something else
+        logger.warning('Not plotting. Do we need any setup to produce output files?')
+        return None, None
+    vcs = setup_vcs()
+    from metrics.frontend import amwg_plotting   # adds the VCS methods to the plot sets
+    vcanvas = vcs.init()
+    if opts['output']['antialiasing'] is False:
+        vcanvas.setantialiasing(0)
+    vcanvas.setcolormap('bl_to_darkred') #Set the colormap to the NCAR colors
+    vcanvas2 = vcs.init(bg=True, geometry=(1212,1628))
+    if opts['output']['antialiasing'] is False:
+        vcanvas.setantialiasing(0)
+        vcanvas2.setantialiasing(0)
+    vcanvas2.portrait()
+    vcanvas2.setcolormap('bl_to_darkred') #Set the colormap to the NCAR colors
+    if 'LINE-DIAGS' in vcs.listelements('line'):
+        LINE = vcanvas.getline('LINE-DIAGS')
+    else:
+        LINE = vcanvas.createline('LINE-DIAGS', 'default')
+        LINE.width = 3.0
+        LINE.type = 'solid'
+        LINE.color = 242
+    if opts['output']['logo'] == False:
+        vcanvas.drawlogooff()
+        vcanvas2.drawlogooff()
+    return vcanvas, vcanvas2
+
+def run_diags( opts, canvases=None ):
+    """Computes and plots the diagnostics specified by opts, an Options instance.
+    canvases may be a (vcanvas,vcanvas2) pair from make_canvases(), to be used rather than making
+    (and afterwards closing) new ones."""
     global vcs_elements
     # Setup filetable arrays
     modelfts = []
@@ -178,9 +219,14 @@ def run_diags( opts ):
         logging.info('obs %s id: %s', i, obsfts[i]._strid)
 
     # Runtime import of user-defined diagnostics
+    if opts['uservars']:
+        from metrics.packages.amwg.amwg import amwg_plot_plan
     for module in opts['uservars']:
         amwg_plot_plan.get_user_vars(module)
 
+    from metrics.packages.plotplan import plot_plan
+    plot_plan.rvworkers = opts.get('rvworkers',1) or 1
+
     # Setup some output things
     outdir = opts['output']['outputdir']
     if outdir is None:
@@ -224,38 +270,20 @@ def run_diags( opts ):
     logger.info('Using regions %s',regions)
 
     save_regrid(opts)
+    save_climatology_engine(opts)
 
     number_diagnostic_plots = 0
 
     dm = diagnostics_menu()                 # dm = diagnostics menu (package), a dict
 
     # set up some VCS things if we are going to eventually plot things
-    if opts['output']['plots'] == True:
-        vcanvas = vcs.init()
-        if opts['output']['antialiasing'] is False:
-            vcanvas.setantialiasing(0)
-        vcsx = vcanvas
-        vcanvas.setcolormap('bl_to_darkred') #Set the colormap to the NCAR colors
-        vcanvas2 = vcs.init(bg=True, geometry=(1212,1628))
-        if opts['output']['antialiasing'] is False:
-            vcanvas.setantialiasing(0)
-            vcanvas2.setantialiasing(0)
-        vcanvas2.portrait()
-        vcanvas2.setcolormap('bl_to_darkred') #Set the colormap to the NCAR colors
-        if 'LINE-DIAGS' in vcs.listelements('line'):
-            LINE = vcanvas.getline('LINE-DIAGS')
-        else:
-            LINE = vcanvas.createline('LINE-DIAGS', 'default')
-            LINE.width = 3.0
-            LINE.type = 'solid'
-            LINE.color = 242
-        if opts['output']['logo'] == False:
-            vcanvas.drawlogooff()
-            vcanvas2.drawlogooff()
+    plotting = opts['output']['plots'] == True
+    if plotting:
+        vcs = setup_vcs()
+    if canvases is None:
+        vcanvas, vcanvas2 = make_canvases( opts )
     else:
-        # No plots. JSON? XML? NetCDF? etc
-        # do something else
-        logger.warning('Not plotting. Do we need any setup to produce output files?')
+        vcanvas, vcanvas2 = canvases
 
     # Initialize our diagnostics package class
     pclass = dm[package.upper()]()
@@ -389,12 +417,13 @@ def run_diags( opts ):
                                     plotparms = { 'model':{'levels':opts['levels'], 'colormap':opts['colormaps']['model']},
                                                   'obs':{'levels':opts['levels'], 'colormap':opts['colormaps']['obs']},
                                                   'diff':{'levels':opts['difflevels'], 'colormap':opts['colormaps']['diff']} } )
-                        if vcs_elements is None:
-                            vcs_elements = dictcopy3(vcs.elements)
-                        else:
-                            vcsdisplays = vcs.elements['display']
-                            vcs.elements = dictcopy3(vcs_elements)
-                            vcs.elements['display'] = vcsdisplays
+                        if plotting:
+                            if vcs_elements is None:
+                                vcs_elements = dictcopy3(vcs.elements)
+                            else:
+                                vcsdisplays = vcs.elements['display']
+                                vcs.elements = dictcopy3(vcs_elements)
+                                vcs.elements['display'] = vcsdisplays
 
                         # Do the work (reducing variables, etc)
                         res = plot.compute(newgrid=0) # newgrid=0 for original grid, -1 for coarse
@@ -462,8 +491,9 @@ def run_diags( opts ):
                                 else:
                                     logger.info('No data to plot for %s %s', varid, aux)
 
-    vcanvas.close()
-    vcanvas2.close()
+    if canvases is None and vcanvas is not None:
+        vcanvas.close()
+        vcanvas2.close()
 #    vcanvas.destroy()
 #    vcanvas2.destroy()
     logger.info("total number of (compound) diagnostic plots generated = %s", number_diagnostic_plots)
@@ -472,6 +502,92 @@ def run_diags( opts ):
     # it will help to not have to re-open a file to re-compute the case name for the model.
     return names
 
+# The keys which a job in a --jobs file may have, and the options which they replace.
+job_keys = { 'sets':'sets', 'vars':'vars', 'seasons':'times', 'regions':'regions', 'varopts':'varopts' }
+
+def read_jobs( filename ):
+    """Reads a --jobs file.  It is JSON: a list of jobs, each an object whose keys are among
+    job_keys, and whose values are lists or single values, e.g.
+       [ {"sets":"5", "vars":["T","Z3"], "seasons":["DJF","JJA"]},
+         {"sets":"4", "vars":"T", "seasons":"ANN", "regions":"Tropics"} ]
+    Returns the jobs as a list of dicts, option name:list of values."""
+    f = open( filename )
+    try:
+        jobs = json.load( f )
+    finally:
+        f.close()
+    if type(jobs) is not list:
+        raise ValueError( "%s should contain a list of jobs" % filename )
+    optsjobs = []
+    for job in jobs:
+        if type(job) is not dict or not set(job.keys()) <= set(job_keys.keys()):
+            raise ValueError( "In %s, job %s should be an object with keys among %s" %
+                              (filename, job, job_keys.keys()) )
+        jobopts = {}
+        for key, value in job.items():
+            if type(value) is not list:
+                value = [value]
+            jobopts[job_keys[key]] = [str(v) for v in value]
+        if 'times' in jobopts:
+            jobopts['times'] = [ x for x in defines.all_seasons if x in jobopts['times'] ]
+        optsjobs.append( jobopts )
+    return optsjobs
+
+def run_diags_batch( opts ):
+    """Runs each of the jobs in the file opts['jobs'] (see read_jobs()) as run_diags() would run
+    opts with the job's options in place of the corresponding ones.  The jobs are run in this
+    process, one after another, and share the filetables (with their reduced variables, including
+    gw, and mass weights) and the VCS canvases.  A job which fails is reported, and the remaining
+    jobs are still run.
+    Returns a list of dicts, one per job, with the job's options, its status ('ok' or 'failed'),
+    its time in seconds, and the error if it failed.  They are also written as JSON to
+    diags_jobs_report.json in the output directory."""
+    from metrics.fileio import findfiles
+    jobs = read_jobs( opts['jobs'] )
+    # These options are chosen from the variable unless specified, so each job chooses its own.
+    autoopts = [ key for key in ['levels', 'difflevels', 'displayunits'] if opts.get(key,None) is None ]
+    opts.verifyOptions()
+    findfiles.keep_filetables = True
+    canvases = make_canvases( opts )
+
+    results = []
+    for job in jobs:
+        jopts = opts.clone()
+        for key in autoopts:
+            jopts[key] = None
+        for key, value in job.items():
+            jopts[key] = value
+        jopts.setDefaultLevels()
+        result = { 'job':job, 'status':'ok', 'error':None }
+        logger.info( "Starting job %s", job )
+        t0 = time.time()
+        try:
+            run_diags( jopts, canvases )
+        except (Exception, SystemExit) as e:
+            # run_diags() quits on some errors; that ends this job, not the batch.
+            logger.error( "Job %s failed:\n%s", job, traceback.format_exc() )
+            result['status'] = 'failed'
+            result['error'] = '%s: %s' % (e.__class__.__name__, e)
+        result['seconds'] = time.time() - t0
+        results.append( result )
+
+    if canvases[0] is not None:
+        canvases[0].close()
+        canvases[1].close()
+
+    for result in results:
+        print "%-6s %8.1f s  %s" % (result['status'], result['seconds'],
+                                    ' '.join([ '%s=%s' % (k,','.join(v)) for k,v in sorted(result['job'].items()) ])),
+        if result['error'] is not None:
+            print ' ', result['error'],
+        print
+    reportfile = os.path.join( opts['output']['outputdir'], 'diags_jobs_report.json' )
+    f = open( reportfile, 'w' )
+    json.dump( results, f, indent=2 )
+    f.close()
+    logger.info( "wrote job report to %s", reportfile )
+    return results
+
 
 def makeplots(res, vcanvas, vcanvas2, varid, frname, plot, package, opts, displayunits=None):
     # need to add plot and pacakge for the amwg 11,12 special cases. need to rethink how to deal with that
@@ -482,6 +598,8 @@ def makeplots(res, vcanvas, vcanvas2, varid, frname, plot, package, opts, displa
     # Here we'll count up the plots and run through them to build lists
     # of graphics methods and overlay statuses.
     # We are given the list of results from plot(), the 2 VCS canvases and a filename minus the last bit
+    import vcs
+    from metrics.frontend.it import return_templates_graphic_methods
     cdms2.setAutoBounds(True)   # makes the VCS-computed means the same as when we
     #                             compute means after calling genGenericBounds().
     frnamebase = frname
@@ -896,7 +1014,12 @@ if __name__ == '__main__':
     except ValueError:
         o = Options()
     o.parseCmdLine()
-    o.verifyOptions()
-    #print o._opts['levels']
-    #print o._opts['displayunits']
-    run_diags(o)
+    if o.get('jobs') is not None:
+        results = run_diags_batch(o)
+        if 'failed' in [ result['status'] for result in results ]:
+            sys.exit(1)
+    else:
+        o.verifyOptions()
+        #print o._opts['levels']
+        #print o._opts['displayunits']
+        run_diags(o)
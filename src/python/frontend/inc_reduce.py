@@ -38,11 +38,13 @@
 # >>>> TO DO:
 # Create a suitable time axis when reading climo data without one.
 
-import numpy, cdms2, sys, os, math, logging
+import numpy, cdms2, sys, os, math, logging, multiprocessing, Queue
 from numbers import Number
 from pprint import pprint
 import time
 from metrics.packages.acme_regridder.scripts.acme_regrid import addVariable
+from metrics.fileio.multifile import open_datafile
+from metrics.fileio.memdataset import memory_dataset
 import logging
 
 logger = logging.getLogger(__name__)
@@ -205,7 +207,7 @@ def initialize_redfile_from_datafile( redfilename, varnames, datafilen, dt=-1, i
     boundless_axes = set([])
     if lock is not None:  lock.acquire()
     #t1 = time.time()
-    f = cdms2.open( datafilen )
+    f = open_datafile( datafilen )
     #t2 = time.time()
     if lock is not None:  lock.release()
     axisdict = {}
@@ -468,8 +470,80 @@ def two_pt_avg( mv1, mv2, i, a2, sw1, sw2, aw2=None, force_scalar_avg=False ):
             pass
     return a
 
+def block_time_avg( redvar, newvar, i, js, ws, redtime_wts ):
+    """Averages the times js of newvar, with scalar time weights ws, into redvar[i] in a single
+    step.  This is what two_pt_avg would compute by adding in one time of newvar at a time.
+    redvar is a FileVariable, normally in the reduced-time file; newvar a TransientVariable with
+    time as its first axis.  redtime_wts is the weights variable for redvar's time axis, before
+    the weights ws have been added in.
+    Weighted sums and total weights are computed with numpy reductions over the time axis.
+    Missing data gets no weight.  If the resulting weights are not the same at every point,
+    e.g. because masks differ, array weights are written to the variable named by the vwgts
+    attribute of redvar, which will be created if necessary.
+    """
+    rw = float(redtime_wts[i]) if redtime_wts.initialized=='yes' else 0.0
+    ws = numpy.asarray( ws, dtype=numpy.float64 )
+    W = ws.sum()
+    nd = numpy.ma.asarray(newvar)
+    if len(js)==js[-1]-js[0]+1:
+        nd = nd[js[0]:js[-1]+1]
+    else:
+        nd = nd[js]
+    wshape = (len(js),) + (1,)*(nd.ndim-1)
+    wb = ws.reshape(wshape)
+    if hasattr( newvar, 'vwgts' ):
+        # array weights from a climatology file written earlier
+        nw = numpy.ma.asarray( newvar.from_file(newvar.vwgts) )[js]
+        wb = numpy.ma.filled( nw, 0 ) + numpy.zeros(wshape) + numpy.ma.getmaskarray(nw)*wb
+    newmask = numpy.ma.getmask(nd)
+    if newmask is numpy.ma.nomask:
+        wnew = numpy.zeros(nd.shape[1:]) + wb.sum(axis=0)
+    else:
+        wb = wb*(~newmask)
+        wnew = wb.sum(axis=0)
+    snew = ( wb*numpy.ma.filled(nd,0) ).sum(axis=0)
+
+    a1 = redvar[i]
+    if hasattr( a1, 'mask' ):
+        oldvalid = ~numpy.ma.getmaskarray(a1)
+        hasold = oldvalid.any()
+    else:
+        oldvalid = True
+        hasold = redvar.initialized=='yes'
+    f1 = redvar.parent # the (open) file corresponding to the FileVariable redvar
+    if not hasold:
+        wold = 0.0
+        old = 0.0
+    elif hasattr( redvar, 'vwgts' ):
+        wold = f1[redvar.vwgts][i]
+        wold = numpy.where( numpy.ma.getmaskarray(wold), rw, numpy.ma.filled(wold,0) )*oldvalid
+        old = numpy.ma.filled( a1, 0 )
+    else:
+        wold = rw*oldvalid
+        old = numpy.ma.filled( a1, 0 )
+    wtot = wold + wnew
+    a = numpy.ma.masked_where( wtot<=0, ( old*wold + snew )/numpy.where( wtot>0, wtot, 1 ) )
+    redvar[i] = a.astype( redvar.dtype )
+
+    # Can the weights still be represented by the scalar redtime_wts[i]?
+    uniform = numpy.all( numpy.logical_or( wtot<=0, abs(wtot-(rw+W))<=1.0e-6*(rw+W) ) )
+    if not uniform and not hasattr( redvar, 'vwgts' ):
+        # Until now, every point of redvar at time k has had the weight redtime_wts[k] unless
+        # it be missing.
+        w1id = redvar.id+'_vwgts'
+        if w1id not in f1.variables:
+            addVariable( f1, w1id, 'd', redvar.getAxisList(), {} )
+        allw = numpy.zeros( redvar.shape )
+        for k in range( redvar.shape[0] ):
+            if k!=i and redtime_wts.initialized=='yes':
+                allw[k] = redtime_wts[k]*~numpy.ma.getmaskarray(redvar[k])
+        f1[w1id][:] = allw
+        redvar.vwgts = w1id
+    if hasattr( redvar, 'vwgts' ):
+        f1[redvar.vwgts][i] = wtot
+
 def update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, next_tbounds, dt=None,
-                     new_time_weights=None, force_scalar_avg=False ):
+                     new_time_weights=None, force_scalar_avg=False, blockwise=True ):
     """Updates the time-reduced data for a list of variables.  The reduced-time and averaged
     variables are listed in redvars.  Its weights (for time averaging) are another variable,
     redtime_wts.
@@ -490,6 +564,8 @@ def update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, next_tbounds,
     to newvars.  This is expected to occur iff the data file is a climatology file written by
     an earlier use of this module.
     The optional argument force_scalar_avg argument is for testing and is passed on to two_pt_avg.
+    If blockwise is True (the default), all the times of newvars which fall in a single reduced
+    time are averaged in at once by block_time_avg, rather than one at a time by two_pt_avg.
     """
 
     # >>>> TO DO <<<< Ensure that each redvar, redtime_wts, newvar have consistent units
@@ -589,6 +665,9 @@ def update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, next_tbounds,
             for k in range(kmax+1)[1:]:
                 assert( newtime_wts[j,k] ==0 )
         newtime_wts = numpy.array([new_time_weights.data])
+    if blockwise and not force_scalar_avg:
+        update_time_avg_blocks( redvars, redtime_wts, newvars, newtime_rti, newtime_wts )
+        return redvars,redtime_wts,redtime
     for j,nt in enumerate(newtime):
         for k in range(kmax+1):
             i = int( newtime_rti[j][k] )
@@ -676,9 +755,165 @@ def update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, next_tbounds,
 
     return redvars,redtime_wts,redtime
 
+def update_time_avg_blocks( redvars, redtime_wts, newvars, newtime_rti, newtime_wts ):
+    """Does the averaging part of update_time_avg, one reduced time at a time rather than one
+    data time at a time.  newtime_rti, newtime_wts are as computed in update_time_avg."""
+    # Group the data times by the reduced time they contribute to.
+    blocks = {}
+    for j in range( newtime_wts.shape[0] ):
+        for k in range( newtime_rti.shape[1] ):
+            i = int( newtime_rti[j][k] )
+            if i<0 or newtime_wts[j,k]<=0: continue
+            if i not in blocks:
+                blocks[i] = ([],[])
+            blocks[i][0].append(j)
+            blocks[i][1].append(newtime_wts[j,k])
+    for i in sorted(blocks.keys()):
+        js, ws = blocks[i]
+        W = sum(ws)
+        for redvar,newvar in zip( redvars, newvars ):
+            if redvar.id=='time_bnds' or redvar.id=='time_weights':
+                continue
+            if redvar.dtype.kind=='i' and newvar.dtype.kind=='i' or\
+                    redvar.dtype.kind=='S' and newvar.dtype.kind=='S' :
+                # integer, any length, or string.  Time average makes no sense.
+                if redvar.shape==newvar.shape:
+                    redvar.assignValue(newvar)
+                else:
+                    redvar[i] = newvar[js[-1]]
+                continue
+            if 'time' not in redvar.getAxisIds():
+                # No time axis, but values may differ from one file to the next, so we still
+                # have to do a time average.
+                if redvar.initialized=='yes' and redtime_wts.initialized=='yes':
+                    rw = redtime_wts[i]
+                    if len(redvar.shape)==0:
+                        redvar.assignValue( ( redvar.subSlice()*rw + newvar*W ) / ( rw + W ) )
+                    else:
+                        redvar[:] = ( redvar[:]*rw + newvar[:]*W ) / ( rw + W )
+                else:
+                    redvar.assignValue(newvar)
+                continue
+            block_time_avg( redvar, newvar, i, js, ws, redtime_wts )
+        if redtime_wts.initialized=='yes':
+            redtime_wts[i] += W
+        else:      # uninitialized is same as value=0
+            redtime_wts[i]  = W
+    for redvar in redvars:
+        redvar.initialized = 'yes'
+    redtime_wts.initialized = 'yes'
+
+def read_ahead( filen, varids, lock=None ):
+    """Reads from the data file filen everything which read_newvars() and the averaging will need
+    for the variables varids: the variables, so far as the file has them; time_weights; and the
+    array weights named by the variables' vwgts attributes.  Returns them as a memory_dataset,
+    which can be used in place of the open file.  The file is opened, read and closed under lock.
+    """
+    if lock is not None:  lock.acquire()
+    try:
+        f = open_datafile(filen)
+        try:
+            ds = memory_dataset( filen, f.attributes )
+            if f.getAxis('time') is not None:
+                ds.add_axis( f.getAxis('time') )
+            wanted = [ varid for varid in varids if varid in f.variables.keys() ]
+            if 'time_weights' in f.variables.keys():
+                wanted.append( 'time_weights' )
+            for varid in wanted:
+                var = f(varid)
+                if not hasattr( var, 'getAxisList' ):
+                    # cdms2 reads a scalar variable as a numpy number
+                    var = cdms2.createVariable( var, id=varid )
+                ds.add_variable( var, varid )
+                vwgts = getattr( var, 'vwgts', None )
+                if vwgts in f.variables.keys() and vwgts not in wanted:
+                    wanted.append( vwgts )
+        finally:
+            f.close()
+    finally:
+        if lock is not None:  lock.release()
+    return ds
+
+def _dataset_nbytes( ds ):
+    return sum([ data.nbytes for data,attributes in ds._vardata.values() ])
+
+def _prefetch_reader( filenames, varids, lock, ready, budget, inflight, maxbytes, stop ):
+    """The reader process of prefetch_datasets()."""
+    for filen in filenames:
+        if stop.is_set():
+            return
+        ds = None
+        if os.path.isfile( filen ):
+            try:
+                ds = read_ahead( filen, varids, lock )
+            except Exception as e:
+                # The consumer will open the file itself, and report the problem.
+                logger.debug("prefetch of %s failed: %s", filen, e)
+        size = 0 if ds is None else _dataset_nbytes(ds)
+        with budget:
+            # Always allow one dataset in the queue, however big it be.
+            while not stop.is_set() and maxbytes is not None and\
+                    inflight.value>0 and inflight.value+size>maxbytes:
+                budget.wait( 0.5 )
+            if stop.is_set():
+                return
+            inflight.value += size
+        ready.put( (filen, ds, size) )
+
+def prefetch_datasets( filenames, varids, depth=2, maxbytes=None, lock=None ):
+    """A generator which yields, for each name in filenames in order, a pair (filename, dataset).
+    Meanwhile a background process reads the variables varids from the files ahead of their
+    turn, see read_ahead(), up to depth files and maxbytes bytes of data ahead (maxbytes=None for
+    no limit), and passes them back through a bounded queue.  So the reads of the next files
+    overlap the averaging of the current one.  The reader is a process rather than a thread,
+    because cdms2 and the NetCDF library are not thread-safe; it reads only under lock.
+    dataset is a memory_dataset which can be used in place of the open file; or None if nothing
+    was read ahead, e.g. if depth<1, or filename is not a real file but a name known to
+    open_datafile(); then the caller should open the file as usual.
+    """
+    if depth<1:
+        for filen in filenames:
+            yield filen, None
+        return
+    ready = multiprocessing.Queue( maxsize=depth )
+    budget = multiprocessing.Condition()
+    inflight = multiprocessing.Value( 'd', 0.0, lock=False )   # protected by budget
+    stop = multiprocessing.Event()
+    reader = multiprocessing.Process( target=_prefetch_reader, name='prefetch_datasets',
+                                      args=( filenames, varids, lock, ready, budget, inflight,
+                                             maxbytes, stop ) )
+    reader.daemon = True
+    try:
+        reader.start()
+    except AssertionError as e:
+        # e.g. daemonic processes are not allowed to have children
+        logger.warning("cannot read files ahead: %s", e)
+        for filen in filenames:
+            yield filen, None
+        return
+    try:
+        for i in range( len(filenames) ):
+            filen, ds, size = ready.get()
+            yield filen, ds
+            with budget:
+                inflight.value -= size
+                budget.notify()
+    finally:
+        stop.set()
+        with budget:
+            budget.notify()
+        # unblock the reader if it is waiting to put a dataset in the queue
+        while reader.is_alive():
+            try:
+                ready.get( timeout=0.1 )
+            except Queue.Empty:
+                pass
+        reader.join()
+
 def update_time_avg_from_files( redvars0, redtime_bnds, redtime_wts, filenames,
                                 fun_next_tbounds=next_tbounds_copyfrom_data,
-                                redfiles=[], dt=None, force_scalar_avg=False, lock=None ):
+                                redfiles=[], dt=None, force_scalar_avg=False, lock=None,
+                                prefetch=0, prefetch_bytes=None ):
     """Updates the time-reduced data for a several variables.  The reduced-time and averaged
     variables are the list redvars.  Its weights (for time averaging) are another variable, redtime_wts.
     (Each variable redvar of redvars has the same time axis, and it normally has an attribute wgts
@@ -693,63 +928,29 @@ def update_time_avg_from_files( redvars0, redtime_bnds, redtime_wts, filenames,
     redfiles is a list of reduced-time files for output.  They should already be open as 'r+'.
     The optional argument dt is used only in that dt=0 means that we are computing climatologies.
     The optional argument force_scalar_avg argument is for testing and is passed on to two_pt_avg.
+    If prefetch>0, the variables of up to that many files (and prefetch_bytes bytes, if
+    specified) will be read ahead by a background process while earlier files are being averaged;
+    see prefetch_datasets().
     """
-    tnewvar = 0
     ttotal = time.time()
     tmin = 1.0e10
     tmax = -1.0e10
-    for filen in filenames:
-        if lock is not None:  lock.acquire()
-        #t1 = time.time()
-        f = cdms2.open(filen)
-        #t2 = time.time()
-        if lock is not None:  lock.release()
-        ftime = f.getAxis('time').clone()  # clone saves it in memory - faster
-        data_tbounds = getClimoBounds(ftime)
+    for filen,f in prefetch_datasets( filenames, [redvar.id for redvar in redvars0],
+                                      prefetch, prefetch_bytes, lock ):
+        if f is None:
+            if lock is not None:  lock.acquire()
+            #t1 = time.time()
+            f = open_datafile(filen)
+            #t2 = time.time()
+            if lock is not None:  lock.release()
+        data_tbounds, new_time_weights, newvard = read_newvars( f, [redvar.id for redvar in redvars0] )
         # Compute tmin, tmax which represent the range of times for the data we computed with.
-        # For regular model output files, these should come from the time bounds.
-        # For a climatology file, they should come from the climatology attribute of time.
         tmin = min( tmin, data_tbounds[0][0] )
         tmax = max( tmax, data_tbounds[-1][-1] )
-        newvard = {}
-        redvard = {}
-        varids = []
-        if 'time_weights' in f.variables:
-            new_time_weights=f('time_weights')
-        else:
-            new_time_weights=None
-        for redvar in redvars0:
-            try:
-                varid = redvar.id
-                if varid not in f.variables.keys(): continue #jfp testing
-                t1=time.time()
-                newvar = f(varid)
-                tnewvar += time.time()-t1
-                # For testing done for Peter Caldwell...
-                #if hasattr(newvar,'dtype') and newvar.dtype=='float32':
-                #    newvar = newvar.astype('float64')
-                if hasattr(newvar,'id'):  # excludes an ordinary number
-                    # Usually newvar is a TransientVariable, hence doesn't have the file as :parent.
-                    # We need the file to get associated variables, so:
-                    newvar.from_file = f
-                testarray = numpy.array([0],newvar.dtype)
-                if isinstance( testarray[0], Number):
-                    varids.append( varid )
-                    if newvar.__class__.__name__.find('Variable')<0:
-                        # newvar should be a TransientVariable.  But cdms2 doesn't work very well
-                        # for scalar variables.  It reads them as numpy numbers.
-                        newvar = cdms2.createVariable(newvar,id=varid)
-                    newvard[varid] = newvar
-                    redvard[varid] = redvar
-                else:
-                    logger.info( "skipping %s",redvar.id )
-            except Exception as e:
-                if varid!='climatology_bnds':  # I know about this one.
-                    logging.exception("skipping %s due to exception", redvar.id)
-                    logging.exception(e)
-                pass
+        varids = [ redvar.id for redvar in redvars0 if redvar.id in newvard ]
         if len(varids)==0:
             continue
+        redvard = { redvar.id:redvar for redvar in redvars0 }
         redvars = [ redvard[varid] for varid in varids ]
         newvars = [ newvard[varid] for varid in varids ]
         if len(redfiles)==0:
@@ -759,20 +960,113 @@ def update_time_avg_from_files( redvars0, redtime_bnds, redtime_wts, filenames,
                              new_time_weights=new_time_weights, force_scalar_avg=force_scalar_avg )
         else:
             for g in redfiles:
-                redtime = g.getAxis('time')
-                redtime_wts = g['time_weights']
-                redtime_bnds = getClimoBounds(redtime)
-                redvars = [ g[varn] for varn in varids ]
-                tbnds = apply( fun_next_tbounds, ( redtime_bnds, data_tbounds ) )
-                update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, tbnds[-1], dt=dt,
-                                 new_time_weights=new_time_weights,
-                                 force_scalar_avg=force_scalar_avg )
+                update_redfile( g, varids, newvars, data_tbounds, new_time_weights,
+                                fun_next_tbounds, dt, force_scalar_avg )
         if lock is not None:  lock.acquire()
         f.close()
         if lock is not None:  lock.release()
     ttotal = time.time() - ttotal
     return tmin, tmax
 
+def read_newvars( f, varids ):
+    """Reads new data from an open data file f, for averaging into reduced-time variables.
+    varids is a list of the names of the variables wanted.  Returns data_tbounds, the time bounds
+    of the data (from the climatology attribute of time if f is a climatology file);
+    new_time_weights, the time_weights variable of f if any, otherwise None; and a dictionary of
+    the variables which could be read and which can be averaged, keyed by variable name.
+    """
+    ftime = f.getAxis('time').clone()  # clone saves it in memory - faster
+    data_tbounds = getClimoBounds(ftime)
+    if 'time_weights' in f.variables:
+        new_time_weights=f('time_weights')
+    else:
+        new_time_weights=None
+    newvard = {}
+    for varid in varids:
+        try:
+            if varid not in f.variables.keys(): continue #jfp testing
+            newvar = f(varid)
+            # For testing done for Peter Caldwell...
+            #if hasattr(newvar,'dtype') and newvar.dtype=='float32':
+            #    newvar = newvar.astype('float64')
+            if hasattr(newvar,'id'):  # excludes an ordinary number
+                # Usually newvar is a TransientVariable, hence doesn't have the file as :parent.
+                # We need the file to get associated variables, so:
+                newvar.from_file = f
+            testarray = numpy.array([0],newvar.dtype)
+            if isinstance( testarray[0], Number):
+                if newvar.__class__.__name__.find('Variable')<0:
+                    # newvar should be a TransientVariable.  But cdms2 doesn't work very well
+                    # for scalar variables.  It reads them as numpy numbers.
+                    newvar = cdms2.createVariable(newvar,id=varid)
+                newvard[varid] = newvar
+            else:
+                logger.info( "skipping %s",varid )
+        except Exception as e:
+            if varid!='climatology_bnds':  # I know about this one.
+                logging.exception("skipping %s due to exception", varid)
+                logging.exception(e)
+            pass
+    return data_tbounds, new_time_weights, newvard
+
+def update_redfile( g, varids, newvars, data_tbounds, new_time_weights,
+                    fun_next_tbounds=next_tbounds_copyfrom_data, dt=None, force_scalar_avg=False ):
+    """Averages the new data newvars, with names varids, into the variables of the same names
+    in the reduced-time file g, which should be open for writing.  The other arguments are as
+    for update_time_avg_from_files and read_newvars."""
+    redtime = g.getAxis('time')
+    redtime_wts = g['time_weights']
+    redtime_bnds = getClimoBounds(redtime)
+    redvars = [ g[varn] for varn in varids ]
+    tbnds = apply( fun_next_tbounds, ( redtime_bnds, data_tbounds ) )
+    update_time_avg( redvars, redtime_bnds, redtime_wts, newvars, tbnds[-1], dt=dt,
+                     new_time_weights=new_time_weights,
+                     force_scalar_avg=force_scalar_avg )
+
+def update_time_avg_from_files_multi( redfiles, filenames, fun_next_tbounds=next_tbounds_copyfrom_data,
+                                      dt=None, force_scalar_avg=False, lock=None,
+                                      prefetch=0, prefetch_bytes=None, file_done=None ):
+    """Like update_time_avg_from_files with several redfiles, except that each reduced-time file
+    may take its data from a different subset of the input files, e.g. one file per season.
+    Each input file is opened and read only once, however many reduced-time files need it.
+    redfiles is a list of tuples (g, varnames, gfilenames) where g is a reduced-time file open
+    for writing, varnames the variables to average into it, and gfilenames a set of the input
+    filenames which belong to it.  filenames is the list of all input files, in time order.
+    Returns a list, corresponding to redfiles, of (tmin,tmax) pairs for the times of the data
+    which went into each reduced-time file.
+    prefetch and prefetch_bytes are as for update_time_avg_from_files.
+    If supplied, file_done is called with each input filename as soon as its data has been
+    averaged in, after which the file is not opened again.
+    """
+    allvarids = []
+    for g,varnames,gfilenames in redfiles:
+        allvarids += [ varn for varn in varnames if varn not in allvarids ]
+    tminmax = [ [1.0e10,-1.0e10] for rf in redfiles ]
+    filenames = [ filen for filen in filenames if any([ filen in rf[2] for rf in redfiles ]) ]
+    for filen,f in prefetch_datasets( filenames, allvarids, prefetch, prefetch_bytes, lock ):
+        users = [ ir for ir,rf in enumerate(redfiles) if filen in rf[2] ]
+        if f is None:
+            if lock is not None:  lock.acquire()
+            f = open_datafile(filen)
+            if lock is not None:  lock.release()
+        data_tbounds, new_time_weights, newvard = read_newvars( f, allvarids )
+        for ir in users:
+            g, varnames, gfilenames = redfiles[ir]
+            tminmax[ir][0] = min( tminmax[ir][0], data_tbounds[0][0] )
+            tminmax[ir][1] = max( tminmax[ir][1], data_tbounds[-1][-1] )
+            varids = [ varn for varn in varnames if varn in newvard ]
+            if len(varids)==0:
+                continue
+            newvars = [ newvard[varid] for varid in varids ]
+            update_redfile( g, varids, newvars, data_tbounds, new_time_weights,
+                            fun_next_tbounds, dt, force_scalar_avg )
+        if lock is not None:  lock.acquire()
+        f.close()
+        if lock is not None:  lock.release()
+        if file_done is not None:
+            file_done( filen )
+    return [ tuple(tm) for tm in tminmax ]
+
 def test_time_avg( redfilename, varnames, datafilenames ):
     #dt = None   # if None, the "reduced" time bounds are exactly the same as in the input data
     dt = 365   # if >0, a fixed time step for partially time-reduced data
@@ -3,6 +3,8 @@
 # This file converts a dictionary file (like amwgmaster.py or lmwgmaster.py) to a series of diags.py commands.
 import sys, getopt, os, subprocess, logging, pdb
 from time import sleep
+import time
+import shlex
 from argparse import ArgumentParser
 from functools import partial
 from collections import OrderedDict
@@ -13,9 +15,14 @@ from metrics.fileio.findfiles import *
 from metrics.frontend.form_filenames import form_filename, form_file_rootname
 from metrics.packages.diagnostic_groups import *
 from output_viewer.index import OutputIndex, OutputPage, OutputGroup, OutputRow, OutputFile, OutputMenu
-import vcs
 import tempfile
 import glob
+import hashlib
+import json
+import numpy
+import re
+from metrics.common.version import version
+from metrics.fileio.filters import basic_filter
 
 
 logger = logging.getLogger(__name__)
@@ -684,11 +691,140 @@ def generatePlots(model_dict, obspath, outpath, pname, xmlflag, data_hash, colls
 
 
 import multiprocessing
+import multiprocessing.queues
+import atexit
 MAX_PROCS = multiprocessing.cpu_count()
 pid_to_cmd = {}
 pid_to_tmpfile = {}
 active_processes = []
 DIAG_TOTAL = 0
+# If not None, a diags_pool which runs the diags command lines, instead of a process for each.
+diagspool = None
+# If not None, the directory of the manifests of diags command lines which have succeeded.  A
+# command line whose manifest is unchanged, and whose outputs are still there, is up to date, and
+# is not run again.
+manifestdir = None
+pending_manifests = {}   # command line: (manifest, time queued), for those not yet finished
+# If not None, a job_scheduler which decides the order in which to run the command lines.
+scheduler = None
+_dataset_stamps = {}     # (path, filter): stamps of its data files, see dataset_stamps()
+
+
+def dataset_stamps(path, filt=None):
+    """Returns a dict, file name: [size, modification time], for the data files under path
+    which pass the filter filt, a string such as "f_startswith('NCEP')".  The files are found
+    as dirtree_datafiles finds them."""
+    key = (path, filt)
+    if key not in _dataset_stamps:
+        if filt is None or filt == "":
+            filt_obj = basic_filter()
+        else:
+            filt_obj = eval(filt)
+        files = []
+        if os.path.isfile(path):
+            files = [path]
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if d[0] != "."]
+                files += [os.path.join(dirpath, f) for f in filenames
+                          if filt_obj(f) and f[0] != "." and os.path.basename(dirpath)[0] != "."]
+        stamps = {}
+        for fn in files:
+            st = os.stat(fn)
+            stamps[fn] = [st.st_size, st.st_mtime]
+        _dataset_stamps[key] = stamps
+    return _dataset_stamps[key]
+
+
+def job_manifest(cmd):
+    """Returns the manifest of the diags command line cmd: a dict of the command line, which
+    determines the variable, season, region, plot set and options; the version of this
+    package; and the size and modification time of every input file of the datasets which
+    cmd names with --model or --obs."""
+    inputs = {}
+    for spec in re.findall(r'--(?:model|obs) (\S+)', cmd):
+        path = re.search(r'path=([^,]+)', spec)
+        filt = re.search(r'filter="([^"]*)"', spec)
+        if path is not None:
+            inputs.update(dataset_stamps(path.group(1), filt.group(1) if filt else None))
+    return {'command': cmd, 'version': version, 'inputs': inputs}
+
+
+def manifest_file(cmd):
+    return os.path.join(manifestdir, hashlib.md5(cmd).hexdigest()+'.json')
+
+
+def job_outputs(cmd, since):
+    """Returns a dict, file name: modification time, of the files (plots, NetCDF, JSON and so
+    on) which the diags command line cmd wrote: those in its --outputdir, modified since the
+    time since, whose names contain its variable and season.  Files written at the same time by
+    other jobs for the same variable and season are included too, which only makes
+    up_to_date() stricter."""
+    argv = shlex.split(cmd)
+    outdir = cmd_args(argv, '--outputdir')
+    if len(outdir) == 0 or not os.path.isdir(outdir[0]):
+        return {}
+    words = set()
+    for arg in cmd_args(argv, '--vars') + cmd_args(argv, '--seasons'):
+        words.update(_name_parts.split(arg))
+    outputs = {}
+    for fn in os.listdir(outdir[0]):
+        if not words.issubset(_name_parts.split(fn)):
+            continue
+        path = os.path.join(outdir[0], fn)
+        if not os.path.isfile(path):
+            continue
+        mtime = os.stat(path).st_mtime
+        # Some file systems keep modification times only to the second.
+        if mtime >= int(since):
+            outputs[path] = mtime
+    return outputs
+_name_parts = re.compile(r'[_.-]')
+
+
+def up_to_date(cmd):
+    """Returns True if the diags command line cmd succeeded before, with the same input files
+    as now, and the output files it wrote then are all still there, none older than the newest
+    input file.  Otherwise, returns False, and remembers the manifest to write if cmd succeeds,
+    see job_finished()."""
+    manifest = job_manifest(cmd)
+    try:
+        with open(manifest_file(cmd)) as f:
+            old = json.load(f)
+        outputs = old.pop('outputs', {})
+        if old == manifest and len(outputs) > 0:
+            newest = max([stamp[1] for stamp in manifest['inputs'].values()] or [0])
+            if all([os.path.isfile(fn) and os.stat(fn).st_mtime >= newest for fn in outputs]):
+                return True
+    except (IOError, OSError, ValueError):
+        pass
+    pending_manifests[cmd] = (manifest, time.time())
+    return False
+
+
+def job_finished(cmd, succeeded):
+    """Writes the manifest of the diags command line cmd, with the outputs it wrote, if it
+    succeeded, so that it will not be run again while its inputs are unchanged and its outputs
+    are still there."""
+    if scheduler is not None:
+        scheduler.finished(cmd, succeeded)
+    pending = pending_manifests.pop(cmd, None)
+    if pending is None or not succeeded:
+        return
+    manifest, since = pending
+    manifest['outputs'] = job_outputs(cmd, since)
+    if len(manifest['outputs']) == 0:
+        logger.info("%s wrote no outputs which can be found, so it will be run again", cmd)
+        return
+    fname = manifest_file(cmd)
+    # Write to a temporary file first, so that a reader never sees a partial manifest.
+    tmpname = fname+'.'+str(os.getpid())
+    try:
+        with open(tmpname, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmpname, fname)
+    except (IOError, OSError) as e:
+        logger.warning("Could not write manifest file %s: %s", fname, e)
 
 
 def cmderr(popened):
@@ -767,46 +903,425 @@ def runcmdline(cmdline, outlogdir, dryrun=False):
     else:
         CMDLINES = [cmdline]
 
+    if manifestdir is not None:
+        uptodate = [cmd for cmd in CMDLINES
+                    if cmd[0] == def_executable and up_to_date(" ".join(cmd))]
+        for cmd in uptodate:
+            logger.info("%s is up to date", " ".join(cmd))
+        CMDLINES = [cmd for cmd in CMDLINES if cmd not in uptodate]
+
     if dryrun is not False:
         for cmd in CMDLINES:
             print >>dryrun, " ".join(cmd)+" &"
         return
 
     for cmdline in CMDLINES:
-        while len(active_processes) >= MAX_PROCS:
-            for i, p in enumerate(active_processes):
-                if p.poll() is not None:
-                    active_processes.pop(i)
-                    if p.returncode != 0:
-                        cmderr(p)
-                    else:
-                        logger.info("%s succeeded. pid= %s", pid_to_cmd[p.pid], p.pid)
-                    cmd = pid_to_cmd[p.pid]
-                    tmpfile = pid_to_tmpfile[p.pid]
-                    f = open(tmpfile.name, 'r')
-                    output = f.read()
-                    log_file = cmd.split(" ")[-1]
-                    with open(log_file, "a") as log:
-                        log.write("\n\n\nSTDOUT and STDERR\n\n")
-                        log.write(output)
-                    f.close()
-                    tmpfile.close()
-                    del pid_to_tmpfile[p.pid]
+        if scheduler is not None:
+            scheduler.add(cmdline)
+        else:
+            start_cmdline(cmdline)
+
+
+def reap_processes():
+    """Handles the diags processes which have finished."""
+    for i, p in enumerate(active_processes):
+        if p.poll() is not None:
+            active_processes.pop(i)
+            if p.returncode != 0:
+                cmderr(p)
+            else:
+                logger.info("%s succeeded. pid= %s", pid_to_cmd[p.pid], p.pid)
+            job_finished(pid_to_cmd[p.pid], p.returncode == 0)
+            cmd = pid_to_cmd[p.pid]
+            tmpfile = pid_to_tmpfile[p.pid]
+            f = open(tmpfile.name, 'r')
+            output = f.read()
+            log_file = cmd.split(" ")[-1]
+            with open(log_file, "a") as log:
+                log.write("\n\n\nSTDOUT and STDERR\n\n")
+                log.write(output)
+            f.close()
+            tmpfile.close()
+            del pid_to_tmpfile[p.pid]
+
+
+def start_cmdline(cmdline, wait=True):
+    """Starts the command line cmdline, in the diags_pool if there is one and it is a diags
+    command, otherwise in a new process.  If wait is True, first waits until fewer than
+    MAX_PROCS processes are running."""
+    global DIAG_TOTAL
+    if diagspool is not None and cmdline[0] == def_executable:
+        diagspool.submit(" ".join(cmdline))
+        DIAG_TOTAL += 1
+        return
+    while wait and len(active_processes) >= MAX_PROCS:
+        reap_processes()
+    cmd = " ".join(cmdline)
+    tmpfile = tempfile.NamedTemporaryFile()
+    if True:   # For some testing purposes, set to False to turn off all plotting.
+        while True:
+            try:
+                active_processes.append(subprocess.Popen(cmd, stdout=tmpfile, stderr=tmpfile, shell=True))
+                break
+            except:
+                sleep(1)
+        DIAG_TOTAL += 1
+        PID = active_processes[-1].pid
+        pid_to_tmpfile[PID] = tmpfile
+        pid_to_cmd[PID] = cmd
+
+        logger.info("%s begun pid= %s diag_total= %s", cmd, PID, DIAG_TOTAL)
+
+
+def run_diags_cmd(cmd):
+    """Runs the diags command line cmd in this process, as the diags script would.  If cmd has a
+    --log_file argument, its logging, standard output and standard error go to that file.
+    Returns 0 if it succeeded, otherwise 1."""
+    from metrics.frontend.diags import run_diags
+    argv = shlex.split(cmd)
+    log_file = None
+    if '--log_file' in argv:
+        log_file = argv[argv.index('--log_file')+1]
+    # Options.parseCmdLine() sets up logging with logging.basicConfig(), which does nothing if
+    # the root logger already has handlers, e.g. those of the previous command.
+    root = logging.getLogger()
+    for h in root.handlers[:]:
+        root.removeHandler(h)
+        h.close()
+    saved_fds = None
+    if log_file is not None:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = (os.dup(1), os.dup(2))
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+        os.dup2(fd, 1)
+        os.dup2(fd, 2)
+        os.close(fd)
+    try:
+        if '--runby' in argv:
+            o = Options(runby=argv[argv.index('--runby')+1])
+        else:
+            o = Options()
+        o.parseCmdLine(argv)
+        o.verifyOptions()
+        run_diags(o)
+        status = 0
+    except SystemExit as e:
+        # diags calls quit() for some errors.
+        status = 0 if e.code is None else (e.code if isinstance(e.code, int) else 1)
+    except Exception:
+        logger.exception("%s failed", cmd)
+        status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for h in root.handlers[:]:
+            root.removeHandler(h)
+            h.close()
+        if saved_fds is not None:
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+    return status
+
+
+def diags_worker(jobs, results, recycle=0):
+    """The main function of a diags_pool worker process.  Runs the diags command lines from the
+    queue jobs until it gets None, or until it has run recycle of them (if recycle>0).  Reports
+    to the queue results as it starts and finishes each command, and when it retires."""
+    import metrics.fileio.findfiles
+    import metrics.frontend.diags   # import it, and so cdms2, just once; vcs with the first plot
+    metrics.fileio.findfiles.keep_filetables = True
+    pid = os.getpid()
+    njobs = 0
+    for cmd in iter(jobs.get, None):
+        results.put(('start', pid, cmd))
+        status = run_diags_cmd(cmd)
+        results.put(('done', pid, cmd, status))
+        njobs += 1
+        if recycle > 0 and njobs >= recycle:
+            break
+    results.put(('retire', pid))
+
+
+class diags_pool:
+    """Long-lived worker processes which run diags command lines in-process, rather than a new
+    diags process for each diagnostic.  Each worker imports cdms2 and vcs once, and keeps its
+    filetables, with their reduced variable caches, from one diagnostic to the next.
+    A worker's in-memory caches last as long as the worker: the filetables
+    (findfiles._filetables, one per dataset), the pressures on hybrid levels
+    (massweighting._pressure_cache, up to pressure_cache_bytes), the climatology weights
+    (reductions.climatology_weights, up to climatology_weights_size time axes), and what VCS
+    leaks.  So if recycle>0 each worker is replaced by a fresh one, with empty caches, after it
+    has run recycle diagnostics; that bounds the memory of a worker which sees many datasets.
+    The workers are not daemonic, so that a diagnostic can start processes of its own, e.g. with
+    --rvworkers.  Any still running when this process exits are terminated."""
+    def __init__(self, nworkers, recycle=0):
+        self.recycle = recycle
+        self.jobs = multiprocessing.Queue()
+        # Unlike a Queue, a SimpleQueue sends each message before put() returns, so no message
+        # is lost if the worker then crashes.
+        self.results = multiprocessing.queues.SimpleQueue()
+        self.workers = {}    # pid: worker Process
+        self.running = {}    # pid: the command line it is running
+        self.pending = 0     # number of command lines submitted and not yet finished
+        for i in range(nworkers):
+            self._start_worker()
+        # multiprocessing waits at exit for processes which aren't daemonic, which would be
+        # forever for idle workers if an error keeps close() from being called.
+        atexit.register(self.terminate)
+
+    def _start_worker(self):
+        p = multiprocessing.Process(target=diags_worker,
+                                    args=(self.jobs, self.results, self.recycle))
+        # A daemonic process can't start children, as plot_plan() does for --rvworkers>1.
+        p.daemon = False
+        p.start()
+        self.workers[p.pid] = p
+
+    def submit(self, cmd):
+        """Queues the diags command line cmd, to be run by the next free worker."""
+        self.jobs.put(cmd)
+        self.pending += 1
+        self.collect(block=False)
+
+    def _handle(self, msg):
+        if msg[0] == 'start':
+            pid, cmd = msg[1:]
+            self.running[pid] = cmd
+            logger.info("%s begun by worker pid= %s", cmd, pid)
+        elif msg[0] == 'done':
+            pid, cmd, status = msg[1:]
+            self.running.pop(pid, None)
+            self.pending -= 1
+            if status != 0:
+                logger.error("Command \n%s\n failed with code of %d.", cmd, status)
+            else:
+                logger.info("%s succeeded. pid= %s", cmd, pid)
+            job_finished(cmd, status == 0)
+        elif msg[0] == 'retire':
+            p = self.workers.pop(msg[1], None)
+            if p is not None:
+                p.join()
+                self._start_worker()
+
+    def _check_workers(self):
+        """Replaces workers which have died, e.g. by a crash in VCS."""
+        # A dead worker sent all its messages before it died, so these are handled first.
+        dead = [pid for pid, p in self.workers.items() if not p.is_alive()]
+        self._drain()
+        for pid in dead:
+            p = self.workers.pop(pid, None)
+            if p is None:
+                continue   # it retired
+            p.join()
+            if pid in self.running:
+                cmd = self.running.pop(pid)
+                logger.error("Command \n%s\n failed: its worker died with code %s.",
+                             cmd, p.exitcode)
+                job_finished(cmd, False)
+                self.pending -= 1
+            self._start_worker()
+
+    def _drain(self):
+        while not self.results.empty():
+            self._handle(self.results.get())
+
+    def collect(self, block=True):
+        """Handles what the workers have reported.  If block is True, waits until every
+        submitted command line has been run."""
+        self._drain()
+        self._check_workers()
+        while block and self.pending > 0:
+            if self.results.empty():
+                sleep(0.5)
+                self._check_workers()
+            else:
+                self._handle(self.results.get())
+
+    def close(self):
+        """Waits for all the submitted command lines, then stops the workers."""
+        self.collect(block=True)
+        for p in self.workers.values():
+            self.jobs.put(None)
+        for p in self.workers.values():
+            p.join()
+        self.workers = {}
+
+    def terminate(self):
+        """Stops the workers at once, without waiting for the command lines they are running."""
+        for p in self.workers.values():
+            p.terminate()
+        for p in self.workers.values():
+            p.join()
+        self.workers = {}
+# For estimating the memory a diags job needs: what every job needs, and the multiple of the size
+# of its input data.
+JOB_MEMORY_OVERHEAD = 500.e6   # bytes
+JOB_MEMORY_FACTOR = 4
+# For estimating the time of a job without recorded timings.
+DEFAULT_JOB_SECONDS = 10.
+DEFAULT_SECONDS_PER_BYTE = 1.e-7
+# The size of a field of unknown shape, for a file scanned before filetables recorded shapes.
+DEFAULT_FIELD_BYTES = 4*192*288
+
+
+def cmd_args(argv, flag):
+    """Returns the arguments which follow flag in the command line argv, a list."""
+    if flag not in argv:
+        return []
+    args = []
+    for arg in argv[argv.index(flag)+1:]:
+        if arg.startswith('--'):
+            break
+        args.append(arg)
+    return args
+
+
+class job_scheduler:
+    """Runs the diags command lines given to add(), when run() is called.  It estimates each
+    job's run time and memory from the size of its data, as found in the model filetables, and
+    from the times recorded by earlier runs in the file timingsfile.  The longest jobs are
+    started first, so that they don't serialize the end of the run; at most maxjobs jobs run at
+    once, and their estimated memory is kept within membudget bytes (None for no limit).  A job
+    which would exceed the budget waits for running jobs to finish; meanwhile, shorter jobs
+    which fit are started if they are expected to finish by then."""
+    def __init__(self, filetables, maxjobs, membudget=None, timingsfile=None):
+        self.filetables = filetables
+        self.maxjobs = maxjobs
+        self.membudget = membudget if membudget is not None else float('inf')
+        self.timingsfile = timingsfile
+        self.timings = {'jobs': {}, 'sets': {}}
+        if timingsfile is not None and os.path.isfile(timingsfile):
+            try:
+                with open(timingsfile) as f:
+                    self.timings = json.load(f)
+            except (IOError, ValueError) as e:
+                logger.warning("Could not read job timings file %s: %s", timingsfile, e)
+        self.jobs = []       # (estimated seconds, estimated memory, data bytes, cmdline)
+        self.running = {}    # command: (start time, estimated end time, estimated memory, data bytes)
+        # Filetables are identified by their index in filetables.  (id() can't be used here, as
+        # the star imports bring in the module metrics.common.id under that name.)
+        self._variables = {}  # filetable index: set of its variables
+        self._typical = {}    # (filetable index, season): typical bytes of a variable
+
+    def _row_bytes(self, row):
+        shape = getattr(row, 'varshape', None)
+        if shape is not None:
+            return 4*int(numpy.prod(shape))
+        return DEFAULT_FIELD_BYTES*(30 if row.levname is not None else 1)
+
+    def _variable_bytes(self, i, var, season):
+        ft = self.filetables[i]
+        if i not in self._variables:
+            self._variables[i] = set(ft.list_variables())
+        if var in self._variables[i]:
+            return sum(self._row_bytes(row) for row in ft.find_files(var, seasonid=season) or [])
+        # Probably a derived variable, computed from a few variables.
+        if (i, season) not in self._typical:
+            sizes = sorted(sum(self._row_bytes(row) for row in ft.find_files(v, seasonid=season) or [])
+                           for v in list(self._variables[i])[:50])
+            self._typical[(i, season)] = sizes[len(sizes)//2] if len(sizes) > 0 else 0
+        return 2*self._typical[(i, season)]
+
+    def data_bytes(self, cmd):
+        """Estimates the bytes of model data which the command line cmd will read."""
+        argv = shlex.split(cmd)
+        seasons = cmd_args(argv, '--seasons') or ['ANN']
+        total = 0
+        for i in range(len(self.filetables)):
+            for var in cmd_args(argv, '--vars'):
+                for season in seasons:
+                    total += self._variable_bytes(i, var, season)
+        return total
+
+    def estimate_time(self, cmd, nbytes):
+        """Estimates the run time, in seconds, of the command line cmd, which reads nbytes of
+        data: as recorded for it before, or else from the recorded times of its plot set."""
+        key = hashlib.md5(cmd).hexdigest()
+        if key in self.timings['jobs']:
+            return self.timings['jobs'][key]
+        plotset = ' '.join(cmd_args(shlex.split(cmd), '--set'))
+        if plotset in self.timings['sets']:
+            seconds, sbytes, count = self.timings['sets'][plotset]
+            if sbytes > 0 and nbytes > 0:
+                return seconds/sbytes*nbytes
+            return seconds/count
+        return DEFAULT_JOB_SECONDS + DEFAULT_SECONDS_PER_BYTE*nbytes
+
+    def add(self, cmdline):
         cmd = " ".join(cmdline)
-        tmpfile = tempfile.NamedTemporaryFile()
-        if True:   # For some testing purposes, set to False to turn off all plotting.
-            while True:
-                try:
-                    active_processes.append(subprocess.Popen(cmd, stdout=tmpfile, stderr=tmpfile, shell=True))
-                    break
-                except:
-                    sleep(1)
-            DIAG_TOTAL += 1
-            PID = active_processes[-1].pid
-            pid_to_tmpfile[PID] = tmpfile
-            pid_to_cmd[PID] = cmd
-
-            logger.info("%s begun pid= %s diag_total= %s", cmd, PID, DIAG_TOTAL)
+        nbytes = self.data_bytes(cmd)
+        memory = JOB_MEMORY_OVERHEAD + JOB_MEMORY_FACTOR*nbytes
+        self.jobs.append((self.estimate_time(cmd, nbytes), memory, nbytes, cmdline))
+
+    def finished(self, cmd, succeeded):
+        """Records that the command line cmd has finished, and its time if it succeeded."""
+        job = self.running.pop(cmd, None)
+        if job is None or not succeeded:
+            return
+        seconds = time.time() - job[0]
+        self.timings['jobs'][hashlib.md5(cmd).hexdigest()] = seconds
+        plotset = ' '.join(cmd_args(shlex.split(cmd), '--set'))
+        total = self.timings['sets'].setdefault(plotset, [0., 0, 0])
+        total[0] += seconds
+        total[1] += job[3]
+        total[2] += 1
+
+    def _start_next(self):
+        """Starts the next job, if one can be started now.  Returns True if it did."""
+        if len(self.jobs) == 0 or len(self.running) >= self.maxjobs:
+            return False
+        now = time.time()
+        inuse = sum(job[2] for job in self.running.values())
+        if len(self.running) == 0 or inuse+self.jobs[0][1] <= self.membudget:
+            self._start(0, now)
+            return True
+        # The longest job must wait for memory.  Find when enough should be free: the shadow time.
+        needed = self.jobs[0][1]
+        free = self.membudget - inuse
+        shadow = now
+        for start, end, memory, nbytes in sorted(self.running.values(), key=lambda job: job[1]):
+            free += memory
+            shadow = max(end, now)
+            if free >= needed:
+                break
+        for i in range(1, len(self.jobs)):
+            seconds, memory = self.jobs[i][0:2]
+            if inuse+memory <= self.membudget and now+seconds <= shadow:
+                self._start(i, now)
+                return True
+        return False
+
+    def _start(self, i, now):
+        seconds, memory, nbytes, cmdline = self.jobs.pop(i)
+        self.running[" ".join(cmdline)] = (now, now+seconds, memory, nbytes)
+        logger.debug("starting job estimated at %.0f seconds and %.0f MB", seconds, memory/1.e6)
+        start_cmdline(cmdline, wait=False)
+
+    def run(self):
+        """Runs all the jobs which have been added, and waits for them to finish."""
+        self.jobs.sort(key=lambda job: job[0], reverse=True)
+        logger.info("scheduling %d jobs, estimated at %.0f seconds in all", len(self.jobs),
+                    sum(job[0] for job in self.jobs))
+        while len(self.jobs) > 0 or len(self.running) > 0:
+            if self._start_next():
+                continue
+            if diagspool is not None:
+                diagspool.collect(block=False)
+            reap_processes()
+            sleep(0.2)
+        if self.timingsfile is not None:
+            tmpname = self.timingsfile+'.'+str(os.getpid())
+            try:
+                with open(tmpname, 'w') as f:
+                    json.dump(self.timings, f)
+                os.rename(tmpname, self.timingsfile)
+            except (IOError, OSError) as e:
+                logger.warning("Could not write job timings file %s: %s", self.timingsfile, e)
+
+
 # These 3 functions are used to add the variables to the database for speeding up
 # classic view
 def setnum( setname ):
@@ -933,6 +1448,16 @@ if __name__ == '__main__':
         tmpDict = diags_collection[K].get("options", {})
         cmaps = opts._opts["colormaps"]
         tmpDict["colormaps"] = " ".join(["%s=%s" % (k, cmaps[k]) for k in cmaps])
+        # All diags runs share one cache of reduced variables, so that a reduced variable needed
+        # by several plot sets is computed only once; see fileio/rvcache.py.  This is on unless
+        # --rvcache no was given; and a collection may have cache options of its own.
+        tmpDict.setdefault( "cachepath", opts["cachepath"] )
+        tmpDict.setdefault( "rvcache", "no" if opts["rvcache"] is False else "yes" )
+        tmpDict.setdefault( "rvcachesize", opts["rvcachesize"] )
+        tmpDict.setdefault( "mwcache", "yes" if opts["mwcache"] else "no" )
+        tmpDict.setdefault( "mwcachesize", opts["mwcachesize"] )
+        # They all compute climatologies from time series the same way.
+        tmpDict.setdefault( "climatology-engine", opts["climatology_engine"] )
         diags_collection[K]["options"] = tmpDict
     if opts["dryrun"]:
         fnm = os.path.join(outpath, "metadiags_commands.sh")
@@ -953,6 +1478,21 @@ module load uvcdat/batch
 """ % (opts["sbatch"])
     else:
         dryrun = False
+        if opts["diagsworkers"] > 0:
+            diagspool = diags_pool(opts["diagsworkers"], opts["diagsrecycle"])
+        # Jobs are collected while the plots are set up, then run longest first.
+        if opts["diagsmemory"] > 0:
+            membudget = opts["diagsmemory"]*1.e6
+        else:
+            try:
+                membudget = 0.8*os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+            except (ValueError, OSError, AttributeError):
+                membudget = None
+        timingsdir = os.path.join(outpath, package.lower(), "DIAGS_OUTPUT")
+        if not os.path.isdir(timingsdir):
+            os.makedirs(timingsdir)
+        scheduler = job_scheduler(fts, len(diagspool.workers) if diagspool is not None else MAX_PROCS,
+                                  membudget, os.path.join(timingsdir, "timings.json"))
 
     xmlflag = opts["output"]["xml"]
 
@@ -966,7 +1506,16 @@ module load uvcdat/batch
     data_path_hmac.update(obspath)
     data_hash = data_path_hmac.hexdigest()
 
+    # With --incremental, diagnostics are run only if they did not succeed before with the same
+    # inputs, or their outputs have gone or are older than the inputs.  The manifests aren't
+    # updated in a dry run, whose commands might never be run.
+    if opts["incremental"]:
+        manifestdir = os.path.join(outpath, package.lower(), "DIAGS_OUTPUT", data_hash, "manifests")
+        if not os.path.isdir(manifestdir):
+            os.makedirs(manifestdir)
     menus, pages = generatePlots(model_dict, obspath, outpath, package, xmlflag, data_hash, colls=colls,dryrun=dryrun)
+    if scheduler is not None:
+        scheduler.run()
 
     for page in pages:
         # Grab file metadata for every image that exists.
@@ -977,6 +1526,7 @@ module load uvcdat/batch
                         path = os.path.join(outpath, package.lower(), col.path)
                         if os.path.exists(path):
                             if os.path.splitext(col.path)[1] == ".png":
+                                import vcs
                                 col.meta = vcs.png_read_metadata(path)
 
         index.addPage(page)
@@ -984,12 +1534,15 @@ module load uvcdat/batch
     index.menu = menus
     index.toJSON(os.path.join(outpath, package.lower(), "index.json"))
 
+    if diagspool is not None:
+        diagspool.close()
     for proc in active_processes:
         result = proc.wait()
         if result != 0:
             cmderr(proc)
         else:
             logger.info("%s succeeded.",pid_to_cmd[proc.pid])
+        job_finished(pid_to_cmd[proc.pid], result == 0)
 
     if opts["dryrun"]:
         if opts["sbatch"] > 0:
@@ -997,7 +1550,6 @@ module load uvcdat/batch
         dryrun.close()
 
     if opts["sbatch"] > 0:
-        import shlex
         cmd = "sbatch %s" % fnm
         logger.info("Commmand: sbatch %s", fnm)
         subprocess.call(shlex.split(cmd))
@@ -38,9 +38,21 @@ help_url="https://acme-climate.atlassian.net/wiki/pages/viewpage.action?pageId=1
 ###  sets - which sets to plot
 ###  translate - optional list of {set 1} to {set N} variable name mapping translations, e.g. TSA->TREFHT
 ###  cachepath - path for cached data (*.cache), and cdscan output (*.xml).
+###  scanworkers - number of processes for reading file headers when building a filetable
+###  rvcache - save reduced variables under cachepath and reuse them in later runs (True/False; None if not given, which metadiags takes as True)
+###  rvcachesize - size limit of the reduced variable cache, in megabytes
+###  mwcache - also save mass weights under cachepath and reuse them in later runs (True/False)
+###  mwcachesize - size limit of the mass weight cache, in megabytes, in memory and on disk
+###  rvworkers - number of processes for computing the reduced variables of a plot concurrently
+###  climatology_engine - what computes seasonal climatologies from time series, 'cdutil' or 'numpy'
 ###  vars - list of variables or ALL
 ###  varopts - list of variable options
 ###  regions -  list of regions
+###  jobs - for diags, a JSON file of jobs (sets, variables, seasons, regions, varopts) to run in one process
+###  diagsworkers - for metadiags, number of worker processes which run the diagnostics (0 for a process per diagnostic)
+###  diagsrecycle - for metadiags, number of diagnostics a worker runs before it is replaced (0 for never)
+###  diagsmemory - for metadiags, megabytes of memory the diagnostics running at once may use (0 for 80% of physical memory)
+###  incremental - for metadiags, skip diagnostics which succeeded before with the same inputs, and whose outputs are still there (True/False)
 
 ### Datasets can be defined as follows.
 # 1) Explicitly pass in all arguments:
@@ -83,11 +95,19 @@ class Options():
             self._opts['varopts' ] = None
             self._opts['sets'] = None
             self._opts['regions'] = []
+            self._opts['jobs'] = None
             self._opts['logging'] = {}
             self._opts['uservars'] = []
 
             self._opts['reltime'] = None
             self._opts['cachepath'] = '/tmp/'+getpass.getuser()+'/uvcmetrics'
+            self._opts['scanworkers'] = 1
+            self._opts['rvcache'] = None    # not given: no for diags, yes for metadiags
+            self._opts['rvcachesize'] = 2000
+            self._opts['mwcache'] = False
+            self._opts['mwcachesize'] = 500
+            self._opts['rvworkers'] = 1
+            self._opts['climatology_engine'] = 'cdutil'
             self._opts['translate'] = True
             self._opts['translations'] = {}
             self._opts['levels'] = None
@@ -115,6 +135,10 @@ class Options():
             self._opts['dbhost'] = "https://diags-viewer.llnl.gov"
             self._opts['dsname'] = None
             self._opts['do_upload'] = False
+            self._opts['diagsworkers'] = 0
+            self._opts['diagsrecycle'] = 0
+            self._opts['diagsmemory'] = 0
+            self._opts['incremental'] = False
 
         for key,value in kwargs.iteritems():
             self._opts[key] = value
@@ -569,6 +593,33 @@ class Options():
             filetable = ft.basic_filetable(dtree, self)
 
 
+        self.setDefaultLevels()
+
+#######
+####### This should be modified to look in the master dictionary files...
+#######
+#         pclass = dm[package.upper()]()
+#
+#         avail_sets = []
+#         slist = pclass.list_diagnostic_sets()
+#         keys = slist.keys()
+#         keys.sort()
+#         for k in keys:
+#            fields = k.split()
+#            avail_sets.append(fields[0])
+#            for user in args.sets:
+#               if user == fields[0]:
+#                  sets.append(user)
+#         sets = self._opts['sets']
+#         intersect = list(set(sets)-set(avail_sets))
+#         if intersect != []:
+#            logging.critical('Collection(s) requested %s', sets)
+#            logging.critical('Collection(s) available: %s', avail_sets)
+#            quit()
+
+    def setDefaultLevels(self):
+        """Sets the levels, difflevels and displayunits options which were not specified, from the
+        defaults for the first variable and variable option."""
         from metrics.graphics.default_levels import default_levels
         import amwgmaster, pdb
 
@@ -583,8 +634,7 @@ class Options():
                     vrlst = amwgmaster.diags_varlist[vr]
                     self._opts["levels"]=default_levels.get(vrlst.get("filekey","OH CRAP"),{}).get("OBS",{}).get("contours",None)
             if self._opts["levels"] is not None:
-                self._opts["levels"].insert(0,-1.e20)
-                self._opts["levels"].append(1.e20)
+                self._opts["levels"] = [-1.e20] + list(self._opts["levels"]) + [1.e20]
 
         if self._opts["difflevels"] is None:  # User did not specified options, let's auto this
             vr = self._opts["vars"][0]
@@ -597,8 +647,7 @@ class Options():
                     vrlst = amwgmaster.diags_varlist[vr]
                     self._opts["difflevels"]=default_levels.get(vrlst.get("filekey","OH CRAP"),{}).get("OBS",{}).get("difference",None)
             if self._opts["difflevels"] is not None:
-                self._opts["difflevels"].insert(0,-1.e20)
-                self._opts["difflevels"].append(1.e20)
+                self._opts["difflevels"] = [-1.e20] + list(self._opts["difflevels"]) + [1.e20]
 
         if self._opts["displayunits"] is None:  # User did not specified options, let's auto this
             vr = self._opts["vars"][0]
@@ -607,28 +656,6 @@ class Options():
             if vr in default_levels:
                 self._opts["displayunits"] = default_levels[vr].get("displayunits", None)
 
-#######
-####### This should be modified to look in the master dictionary files...
-#######
-#         pclass = dm[package.upper()]()
-#
-#         avail_sets = []
-#         slist = pclass.list_diagnostic_sets()
-#         keys = slist.keys()
-#         keys.sort()
-#         for k in keys:
-#            fields = k.split()
-#            avail_sets.append(fields[0])
-#            for user in args.sets:
-#               if user == fields[0]:
-#                  sets.append(user)
-#         sets = self._opts['sets']
-#         intersect = list(set(sets)-set(avail_sets))
-#         if intersect != []:
-#            logging.critical('Collection(s) requested %s', sets)
-#            logging.critical('Collection(s) available: %s', avail_sets)
-#            quit()
-
    ### Less-verbose help for metadiags.
     def metadiags_help(self):
         print
@@ -761,6 +788,20 @@ class Options():
         otheropts = parser.add_argument_group('Other')
         otheropts.add_argument('--cachepath', nargs=1,
                                help="Path for cached files. Defaults to /tmp/<username>/uvcmetrics/")
+        otheropts.add_argument('--scanworkers', type=int,
+                               help="Number of processes used to read file headers when building a filetable. Defaults to 1 (serial).")
+        otheropts.add_argument('--rvcache', choices=['no', 'yes'],
+                               help="Save reduced variables in the cache path, and reuse them in later runs if the data files haven't changed. Defaults to no, except in metadiags, whose diags runs share the cache by default.")
+        otheropts.add_argument('--rvcachesize', type=float,
+                               help="Maximum size of the reduced variable cache, in megabytes. Defaults to 2000.")
+        otheropts.add_argument('--mwcache', choices=['no', 'yes'],
+                               help="Save mass weights in the cache path, and reuse them in later runs if the data files haven't changed. Defaults to no.")
+        otheropts.add_argument('--mwcachesize', type=float,
+                               help="Maximum size of the mass weight cache, in megabytes, both in memory and in the cache path. Defaults to 500.")
+        otheropts.add_argument('--rvworkers', type=int,
+                               help="Number of processes used to compute the reduced variables of a plot concurrently. Requires the reduced variable cache. Defaults to 1 (serial).")
+        otheropts.add_argument('--climatology-engine', choices=['cdutil', 'numpy'],
+                               help="What computes seasonal climatologies from time series data (not climatology files). cdutil averages the yearly means of each season, dropping incomplete seasons such as a DJF without its December. numpy is much faster, and can read big variables a time chunk at a time; but it averages all the time steps in the season, weighted by their lengths, so incomplete seasons at the ends of the run count too. The two agree for whole seasons without missing values. Defaults to cdutil.")
         otheropts.add_argument('--obspath', nargs=1,
                                help="Path for obs files.")
         otheropts.add_argument('--modelpath', nargs=1,
@@ -816,6 +857,8 @@ class Options():
                                      help="Specify variables of interest to process. The default is all variables which can also be specified with the keyword ALL")
                 runopts.add_argument('--regions', '--region', nargs='+', choices=all_regions.keys(),
                                      help="Specify a geographical region of interest. Note: Multi-word regions need quoted, e.g. 'Central Canada'")
+                runopts.add_argument('--jobs',
+                                     help="A JSON file listing jobs to run in this one diags process, sharing its filetables, caches and canvases.  Each job is an object with any of the keys sets, vars, seasons, regions and varopts, which replace the corresponding command-line options.")
             else:
                 runopts.add_argument('--custom_specs', default=None,
                                      help="points to a file that will contain a custom dictionary updation the diags specs, see amwgmaster.py")
@@ -880,16 +923,28 @@ class Options():
                                   help="Specify the hostname of the machine hosting the Diagnostics Viewer. Requires you to have initialized your Diagnostics Viewer credentials by doing `login_viewer [server_name] --user $USERNAME.`")
             metaopts.add_argument('--dsname',
                                   help="A unique identifier for the dataset(s). Used by classic viewer to display the data.")
+            metaopts.add_argument('--diagsworkers', type=int,
+                                  help="Run the diagnostics in this many long-lived worker processes, rather than starting a diags process for each one. The default, 0, starts a process for each.")
+            metaopts.add_argument('--incremental', choices=['no', 'yes'],
+                                  help="Run only the diagnostics whose input files, options or package version have changed since they last succeeded, or whose outputs are missing or older than their inputs. The default, 'no', runs them all.")
+            metaopts.add_argument('--diagsmemory', type=float,
+                                  help="Memory, in megabytes, which the diagnostics running at once may use, as estimated from the sizes of their data. The default, 0, is 80%% of the physical memory.")
+            metaopts.add_argument('--diagsrecycle', type=int,
+                                  help="With --diagsworkers, replace each worker process after it has run this many diagnostics, to limit the memory which VCS leaks and which the worker's caches (of filetables, pressures and climatology weights) hold. The default, 0, never replaces them.")
 
         if 'mpidiags' in progname or 'mpidiags.py' in progname:
             paropts = parser.add_argument_group('Parallel-specific')
             paropts.add_argument('--taskspernode',
                                  help="Specify the maximum number of tasks usable on a given node. Typically this would be set to numcores/node unless memory is an issue")
-    def parseCmdLine(self):
+    def parseCmdLine(self, argv=None):
+        """Parses the command line argv, a list beginning with the program name; by default,
+        sys.argv."""
         ### Do the work
         #args = parser.parse_args()
         import sys, pdb
-        progname = sys.argv[0]
+        if argv is None:
+            argv = sys.argv
+        progname = argv[0]
         progname = progname.split('/')[-1]
         parser = argparse.ArgumentParser( add_help=False,
                                           description="""UV-CDAT Climate Modeling Diagnostics For additional instructions, see also %s""" % help_url,
@@ -904,7 +959,7 @@ class Options():
               --model/--obs or --path can be specified multiple times.
               '''))
         self.processCmdLine(progname, parser)
-        args, extras = parser.parse_known_args()
+        args, extras = parser.parse_known_args(argv[1:])
         #pdb.set_trace()
         if(args.version == 1):
             import metrics.common.utilities
@@ -990,6 +1045,20 @@ class Options():
             #jfpif not os.path.isdir(self._opts['cachepath']):
             if not os.path.isdir(cachepath):
                 raise e
+        if args.scanworkers != None:
+            self._opts['scanworkers'] = args.scanworkers
+        if args.rvcache != None:
+            self._opts['rvcache'] = (args.rvcache == 'yes')
+        if args.rvcachesize != None:
+            self._opts['rvcachesize'] = args.rvcachesize
+        if args.mwcache != None:
+            self._opts['mwcache'] = (args.mwcache == 'yes')
+        if args.mwcachesize != None:
+            self._opts['mwcachesize'] = args.mwcachesize
+        if args.rvworkers != None:
+            self._opts['rvworkers'] = args.rvworkers
+        if args.climatology_engine != None:
+            self._opts['climatology_engine'] = args.climatology_engine
         if args.modelpath != None:
             self['modelpath'] = args.modelpath[0]
         if args.obspath != None:
@@ -1047,6 +1116,14 @@ class Options():
                 self._opts['do_upload'] = True
             if args.dsname != None:
                 self._opts['dsname'] = args.dsname
+            if args.diagsworkers != None:
+                self._opts['diagsworkers'] = args.diagsworkers
+            if args.diagsrecycle != None:
+                self._opts['diagsrecycle'] = args.diagsrecycle
+            if args.diagsmemory != None:
+                self._opts['diagsmemory'] = args.diagsmemory
+            if args.incremental != None:
+                self._opts['incremental'] = (args.incremental == 'yes')
 
         # Disable the UVCDAT logo in plots for users (typically metadiags) that know about this option
         if 'climatology' not in progname and 'climatology.py' not in progname:
@@ -1135,6 +1212,8 @@ class Options():
                 self._opts['vars'] = args.vars
             if(args.regions != None):
                 self._opts['regions'] = args.regions
+            if(args.jobs != None):
+                self._opts['jobs'] = args.jobs
 
             # If --yearly is set, then we will add 'ANN' to the list of climatologies
             if(args.yearly == True):
@@ -1261,10 +1340,18 @@ options_defaults = Options(
     varopts = None,
     sets = None,
     regions = [],
+    jobs = None,
     uservars = [],
 
     reltime = None,
     cachepath = '/tmp/'+getpass.getuser()+'/uvcmetrics',
+    scanworkers = 1,
+    rvcache = None,
+    rvcachesize = 2000,  # megabytes
+    mwcache = False,
+    mwcachesize = 500,  # megabytes
+    rvworkers = 1,
+    climatology_engine = 'cdutil',
     translate = True,
     translations = {},
     levels = None,
@@ -1289,7 +1376,11 @@ options_defaults = Options(
                 'file' : None },
     dbhost = "https://diags-viewer.llnl.gov",
     dsname = None,
-    do_upload = False )
+    do_upload = False,
+    diagsworkers = 0,
+    diagsrecycle = 0,
+    diagsmemory = 0,
+    incremental = False )
 
 ### make_ft_dict - provides an easily parsed dictionary of the climos/raws for a given set of datasets
 def make_ft_dict(models):
@@ -18,12 +18,22 @@ from metrics.frontend.form_filenames import form_filename
 from pprint import pprint
 import cProfile
 import json
-import vcs
 from metrics.common import store_provenance
 
-vcsx=vcs.init()   # This belongs in one of the GUI files, e.g.diagnosticsDockWidget.py
+vcsx=None         # This belongs in one of the GUI files, e.g.diagnosticsDockWidget.py
                   # The GUI probably will have already called vcs.init().
                   # Then, here,  'from foo.bar import vcsx'
+                  # It is made by vcs_canvas() when first needed, as vcs is slow to start.
+
+def vcs_canvas():
+    """Returns vcsx, the canvas used to make graphics methods, first making it if necessary.
+    A process which is not preparing VCS plots sets vcsx to False (as _plotdata_run() does);
+    then this returns False, and no canvas is made."""
+    global vcsx
+    if vcsx is None:
+        from metrics.frontend import setup_vcs
+        vcsx = setup_vcs().init()
+    return vcsx
 # ---------------- code to compute plot in another process, not specific to UV-CDAT:
 
 
@@ -238,6 +248,7 @@ class uvc_simple_plotspec(basic_id):
             presentation = 'Isofill'
             pvars = [zerovar]
         ptype = presentation
+        vcsx = vcs_canvas()
         if vcsx:   # temporary kludge, presently need to know whether preparing VCS plots
             if presentation=="Yxvsx":
                 self.presentation = vcsx.createyxvsx()
@@ -368,6 +379,8 @@ class uvc_simple_plotspec(basic_id):
         simplify further for the plot package.
         The options flip_x and flip_y may be set to True to flip the axis.  That is, in x right
         to left and left to right, and in y top to bottom and bottom to top."""
+        import vcs
+        vcsx = vcs_canvas()
         # old test:
         #if self.presentation.__class__.__name__=="GYx" or\
         #        self.presentation.__class__.__name__=="Gfi":
@@ -986,6 +999,7 @@ def _get_plot_data( plot_set_id, filetable1, filetable2, variable, season ):
     
 def diagnostics_template():
     """creates and returns a VCS template suitable for diagnostics plots"""
+    import vcs
     if 'diagnostic' in vcs.listelements('template'):
         tm = vcs.gettemplate('diagnostic')
     else:
@@ -4,83 +4,192 @@ import argparse
 import subprocess
 import sys
 import shlex
+import collections
 import cdms2
 import multiprocessing
+from metrics.packages.acme_regridder.scripts.acme_regrid import WeightFileRegridder, \
+    make_parser, regrid_file, dataset_from_file, set_netcdf_flags
+from metrics.fileio.multifile import register_dataset, unregister_dataset
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser(description='Given a directory or list of files regrid them using map files and computes climo on them')
+# The regridder of a worker process.  It is made once, by init_worker(), and used for all the
+# files which the worker regrids.
+regdr = None
 
+def init_worker(map_file, weight_cache):
+    global regdr
+    set_netcdf_flags()
+    regdr = WeightFileRegridder(map_file, True, cachedir=weight_cache)
 
-parser.add_argument("-i","--files",help="files to regrid and compute climo on",default="*.nc",nargs="*")
-parser.add_argument("-m","--map-file",help="map file",required=True)
-parser.add_argument("-o","--output",help="output directory",default=None)
-parser.add_argument("-c","--climo",help="name of climo file, leave blank if you do not want to run climo",default=None)
-parser.add_argument("-v","--variables",help="limit operations to these variables",default=None,nargs="*")
-parser.add_argument("-q","--quiet",action="store_true",default=False,help="quiet mode (no output printed to screen)")
-parser.add_argument("-n","--workers",default=int,help="number of workers to use",type=int)
-
-args =parser.parse_args(sys.argv[1:])
-
-if not os.path.exists(args.map_file):
-    raise RuntimeError,"Map file (%s) does not exists" % args.map_file
-
-
-files =args.files
-
-def execute(cmd,time=False):
-    print "Executing:",cmd
-    if time:
-        cmd="time "+cmd
-    p = subprocess.Popen(shlex.split(cmd))
-    p.wait()
-    return
-
-regrid_files = []
-cmds = []
-
-for f in files:
-    f = f.strip()
+def regrid_one(argv):
+    """Regrids and writes one file, as acme_regrid.py would with the arguments argv."""
+    rargs = make_parser().parse_args(argv)
+    if not rargs.quiet:
+        print "Regridding:", " ".join(argv)
     try:
-        fi = cdms2.open(f)
-        fi.close()
-    except:
-        if not args.quiet:
-            logger.error("Could not open file %s -- skipping" % f)
-        continue
-    fout = f
-    if args.output is not None:
-        fout = os.path.join(args.output,os.path.basename(fout))
-    fout = os.path.join(os.path.dirname(fout),"regrid_"+os.path.basename(fout))
-    cmd = "acme_regrid.py -i %s -o %s -w %s" % (f,fout,args.map_file)
-    if args.variables is not None:
-        cmd+=" -v %s" % " ".join(args.variables)
-        if not "time_bnds" in args.variables:
-            cmd+=" time_bnds"
-    if args.quiet:
-        cmd+=" -q"
-    regrid_files.append(fout)
-    cmds.append(cmd)
-pool = multiprocessing.Pool(args.workers)
-pool.map(execute,cmds)
-
-
-print "done regridding"
-if args.climo is None:
-    sys.exit(0)
-
-print "now computing climo over:",regrid_files
-
-cmd = "climatology --outfile %s --infiles %s --seasons DJF MAM JJA SON ANN --multiprocessing" % (args.climo, " ".join(regrid_files))
-print "Executing climo:", cmd
-p = subprocess.Popen(shlex.split(cmd))
-p.wait()
-print "Voila"
-
-
-
-
-
-
+        regrid_file(regdr, rargs)
+    except Exception, err:
+        logger.exception("Regridding %s failed with error: %s", rargs.file, err)
+
+def regrid_to_memory(fin, name, varnames):
+    """Regrids one file and returns the result as a memory_dataset named name."""
+    return dataset_from_file(regdr, fin, varnames, name)
+
+def regridded_datasets(pool, jobs, varnames, window):
+    """A generator which yields the regridded memory_datasets for jobs, a list of (input file,
+    name) pairs, in the same order.  The pool works on at most window files ahead of the one
+    being used, so that no more than that are held in memory."""
+    pending = collections.deque()
+    for fin, name in jobs:
+        pending.append(pool.apply_async(regrid_to_memory, (fin, name, varnames)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+class streamed_dataset(object):
+    """What open_datafile() returns for a name registered by streamed_datasets.  The regridded
+    dataset is fetched when it is first used, and closing this drops the reference to it."""
+    def __init__(self, stream, name):
+        self._stream = stream
+        self._name = name
+        self._dataset = None
+    def _resolve(self):
+        if self._dataset is None:
+            self._dataset = self._stream.get(self._name)
+        return self._dataset
+    def __getattr__(self, att):
+        return getattr(self._resolve(), att)
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+    def __getitem__(self, key):
+        return self._resolve()[key]
+    def close(self):
+        self._dataset = None
+
+class streamed_datasets:
+    """Makes the datasets yielded by the generator datasets available to open_datafile(), under
+    names, which lists their ids in the order they are yielded.  A dataset is taken from the
+    generator only when it (or a later one) is first needed.  The consumer hands each dataset
+    back by calling done() when it has finished with it, e.g. as climos(file_done=...) does;
+    the dataset is then unregistered so that its memory can be freed.  A dataset handed back
+    before it has been taken from the generator is dropped as soon as it is taken."""
+    def __init__(self, names, datasets):
+        self.names = list(names)
+        self.datasets = datasets
+        self.ready = {}
+        self.finished = set()
+        for name in self.names:
+            register_dataset(name, streamed_dataset(self, name))
+    def get(self, name):
+        if name in self.finished:
+            raise RuntimeError("dataset %s was used after it had been handed back" % name)
+        while name not in self.ready:
+            ds = self.datasets.next()
+            if ds.id not in self.finished:
+                self.ready[ds.id] = ds
+        return self.ready[name]
+    def done(self, name):
+        self.finished.add(name)
+        self.ready.pop(name, None)
+        unregister_dataset(name)
+    def unregister_all(self):
+        for name in self.names:
+            unregister_dataset(name)
+        self.ready = {}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Given a directory or list of files regrid them using map files and computes climo on them')
+
+    parser.add_argument("-i","--files",help="files to regrid and compute climo on",default="*.nc",nargs="*")
+    parser.add_argument("-m","--map-file",help="map file",required=True)
+    parser.add_argument("-o","--output",help="output directory",default=None)
+    parser.add_argument("-c","--climo",help="name of climo file, leave blank if you do not want to run climo",default=None)
+    parser.add_argument("-v","--variables",help="limit operations to these variables",default=None,nargs="*")
+    parser.add_argument("-q","--quiet",action="store_true",default=False,help="quiet mode (no output printed to screen)")
+    parser.add_argument("--weight-cache",help="directory for a cache of the map file's weights, shared by the regridding processes",default=None)
+    parser.add_argument("-n","--workers",default=None,help="number of workers to use (default: the number of CPUs)",type=int)
+    parser.add_argument("--keep-regridded",action="store_true",default=False,help="with --climo, write the regridded files and compute the climatology from them, rather than passing the regridded data to the climatology in memory")
+
+    args =parser.parse_args(sys.argv[1:])
+
+    if not os.path.exists(args.map_file):
+        raise RuntimeError,"Map file (%s) does not exists" % args.map_file
+
+    workers = args.workers
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    jobs = []
+    for f in args.files:
+        f = f.strip()
+        try:
+            fi = cdms2.open(f)
+            fi.close()
+        except:
+            if not args.quiet:
+                logger.error("Could not open file %s -- skipping" % f)
+            continue
+        fout = f
+        if args.output is not None:
+            fout = os.path.join(args.output,os.path.basename(fout))
+        fout = os.path.join(os.path.dirname(fout),"regrid_"+os.path.basename(fout))
+        jobs.append((f, fout))
+    # The climatology takes the files in order of name.
+    jobs.sort(key=lambda job: job[1])
+    regrid_files = [fout for f, fout in jobs]
+
+    # Each worker reads the map file once, rather than once per file.
+    pool = multiprocessing.Pool(workers, init_worker, (args.map_file, args.weight_cache))
+
+    if args.climo is None or args.keep_regridded:
+        argvs = []
+        for f, fout in jobs:
+            argv = ["-i", f, "-o", fout, "-w", args.map_file]
+            if args.variables is not None:
+                argv += ["-v"] + args.variables
+                if not "time_bnds" in args.variables:
+                    argv.append("time_bnds")
+            if args.weight_cache is not None:
+                argv += ["--weight-cache", args.weight_cache]
+            if args.quiet:
+                argv.append("-q")
+            argvs.append(argv)
+        pool.map(regrid_one, argvs)
+        pool.close()
+        pool.join()
+
+        print "done regridding"
+        if args.climo is None:
+            sys.exit(0)
+
+        print "now computing climo over:",regrid_files
+
+        cmd = "climatology --outfile %s --infiles %s --seasons DJF MAM JJA SON ANN --multiprocessing" % (args.climo, " ".join(regrid_files))
+        print "Executing climo:", cmd
+        p = subprocess.Popen(shlex.split(cmd))
+        p.wait()
+        print "Voila"
+        sys.exit(0)
+
+    # The regridded data goes straight from the workers into the climatology accumulators,
+    # without being written.  The climatology is computed in a single pass over the files, so
+    # each regridded file is needed only briefly, while the workers regrid the next ones.
+    from metrics.frontend.climatology import climos
+    seasons = ['DJF', 'MAM', 'JJA', 'SON', 'ANN']
+    set_netcdf_flags()
+    print "computing climo while regridding:", regrid_files
+    stream = streamed_datasets(
+        regrid_files,
+        regridded_datasets(pool, jobs, args.variables, 2*workers))
+    try:
+        climos(args.climo, seasons, args.variables or ['ALL'], regrid_files, singlepass=True,
+               file_done=stream.done)
+    finally:
+        stream.unregister_all()
+        pool.terminate()
+        pool.join()
+    print "Voila"
@@ -13,56 +13,195 @@ import metrics.packages.acme_regridder._regrid
 import cdutil
 import datetime
 import time
+import hashlib
+import json
+import shutil
 from metrics.common import store_provenance
 import cdat_info
 
 
+# The arrays which WeightFileRegridder uses from a map file, and which can be cached.
+_cached_arrays = ["S", "row", "col", "mask_b", "lat", "lat_bnds", "lon", "lon_bnds", "area_b"]
+
+
+def read_weights(wFile, toRegularGrid=True):
+    """Reads what WeightFileRegridder needs from the open map file wFile, and returns it as a
+    dict.  S, row and col are converted to the types the C kernels use, and row and col are
+    made 0-based.  mask_b is a boolean array, True where the destination grid is masked; or
+    None if nothing is masked.  If toRegularGrid is True the dict has the sorted, distinct
+    latitudes and longitudes of the destination grid, and their bounds."""
+    weights = {}
+    # In the types the C kernels use, so they aren't converted on every call.
+    weights["S"] = numpy.ascontiguousarray(wFile("S").filled(), dtype=numpy.float64)
+    weights["row"] = numpy.ascontiguousarray(wFile("row").filled()-1, dtype=numpy.int32)
+    weights["col"] = numpy.ascontiguousarray(wFile("col").filled()-1, dtype=numpy.int32)
+    mask_b = wFile("mask_b")
+    weights["nb"] = mask_b.shape[0]
+    if mask_b.min() == 1 and mask_b.max() == 1:
+        weights["mask_b"] = None
+    else:
+        weights["mask_b"] = numpy.logical_not(mask_b.filled())
+    weights["map_method"] = wFile.map_method
+    if toRegularGrid:
+        weights["lat"] = numpy.array(sorted(set(wFile("yc_b").tolist())))
+        weights["lat_bnds"] = numpy.array(sorted(set(wFile("yv_b").ravel().tolist())))
+        weights["lon"] = numpy.array(sorted(set(wFile("xc_b").tolist())))
+        weights["lon_bnds"] = numpy.array(sorted(set(wFile("xv_b").ravel().tolist())))
+        if "area_b" in wFile.variables:
+            weights["area_b"] = wFile("area_b").filled()
+        else:
+            weights["area_b"] = None
+    else:
+        weights["yc_b"] = wFile("yc_b")
+        weights["xc_b"] = wFile("xc_b")
+        weights["yv_b"] = wFile("yv_b")
+        weights["xv_b"] = wFile("xv_b")
+    return weights
+
+
+def map_file_checksum(weightFile, cachedir):
+    """Returns the md5 checksum of the map file.  It is remembered in cachedir, under the
+    file's path, size and modification time, so that the file is read only once."""
+    stat = os.stat(weightFile)
+    stamp = "%s %d %f" % (os.path.abspath(weightFile), stat.st_size, stat.st_mtime)
+    memo = os.path.join(cachedir, hashlib.md5(stamp).hexdigest()+".md5")
+    if os.path.isfile(memo):
+        return open(memo).read().strip()
+    md5 = hashlib.md5()
+    with open(weightFile, "rb") as wf:
+        for block in iter(lambda: wf.read(1 << 22), ""):
+            md5.update(block)
+    checksum = md5.hexdigest()
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        tmpname = memo+".%d" % os.getpid()
+        with open(tmpname, "w") as mf:
+            mf.write(checksum)
+        os.rename(tmpname, memo)
+    except (IOError, OSError) as err:
+        logging.info("cannot remember checksum of %s: %s", weightFile, err)
+    return checksum
+
+
+def load_weight_cache(weightFile, cachedir):
+    """Returns the dict of read_weights(), for a regular destination grid, from the cache in
+    the directory cachedir; or None if it isn't there.  The arrays are memory-mapped
+    read-only, so processes which use the same map file share one copy of them."""
+    try:
+        path = os.path.join(cachedir, map_file_checksum(weightFile, cachedir)+".weights")
+        if not os.path.isdir(path):
+            return None
+        with open(os.path.join(path, "meta.json")) as mf:
+            weights = json.load(mf)
+        weights["map_method"] = str(weights["map_method"])
+        for name in _cached_arrays:
+            fname = os.path.join(path, name+".npy")
+            if os.path.isfile(fname):
+                weights[name] = numpy.load(fname, mmap_mode="r")
+            else:
+                weights[name] = None
+    except (IOError, OSError, ValueError) as err:
+        logging.warning("cannot read regrid weight cache for %s: %s", weightFile, err)
+        return None
+    return weights
+
+
+def save_weight_cache(weightFile, cachedir, weights):
+    """Saves the dict of read_weights(), for a regular destination grid, to the cache in the
+    directory cachedir.  Failure to write the cache is not an error."""
+    tmppath = None
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        path = os.path.join(cachedir, map_file_checksum(weightFile, cachedir)+".weights")
+        if os.path.isdir(path):
+            return
+        # Written in a scratch directory, which is renamed when complete.
+        tmppath = path+".%d" % os.getpid()
+        os.makedirs(tmppath)
+        for name in _cached_arrays:
+            if weights[name] is not None:
+                numpy.save(os.path.join(tmppath, name+".npy"), numpy.asarray(weights[name]))
+        with open(os.path.join(tmppath, "meta.json"), "w") as mf:
+            json.dump({"nb": weights["nb"], "map_method": weights["map_method"]}, mf)
+        os.rename(tmppath, path)
+        tmppath = None
+    except (IOError, OSError) as err:
+        # Another process may have written the cache first.
+        logging.info("cannot write regrid weight cache for %s: %s", weightFile, err)
+    finally:
+        if tmppath is not None and os.path.isdir(tmppath):
+            shutil.rmtree(tmppath, ignore_errors=True)
+
+
 class WeightFileRegridder:
-    def __init__(self, weightFile, toRegularGrid=True, fix_bounds=False):
+    def __init__(self, weightFile, toRegularGrid=True, fix_bounds=False,
+                 renormalize=False, cachedir=None):
+        """If renormalize is True, regrid_many() divides each destination value by the sum
+        of the weights of its non-missing sources, rather than just leaving out the missing
+        sources as regrid() does.
+        If cachedir is a directory name, the weights of the map file weightFile are kept there
+        in a form which can be memory-mapped, keyed on the file's checksum.  Later
+        WeightFileRegridders for the same map file, in any process, load them from there
+        instead of reading the map file."""
+        weights = None
         if isinstance(weightFile, str):
             if not os.path.exists(weightFile):
                 raise Exception("WeightFile %s does not exists" % weightFile)
-            wFile = cdms2.open(weightFile)
-        else:
-            wFile = weightFile
-        self.S = wFile("S").filled()
-        self.row = wFile("row").filled()-1
-        self.col = wFile("col").filled()-1
-        self.mask_b = wFile("mask_b")
-        self.nb = self.mask_b.shape[0]
-        if self.mask_b.min() == 1 and self.mask_b.max() == 1:
+            if cachedir is not None and toRegularGrid:
+                weights = load_weight_cache(weightFile, cachedir)
+        if weights is None:
+            if isinstance(weightFile, str):
+                wFile = cdms2.open(weightFile)
+            else:
+                wFile = weightFile
+            weights = read_weights(wFile, toRegularGrid)
+            if isinstance(weightFile, str):
+                wFile.close()
+                if cachedir is not None and toRegularGrid:
+                    save_weight_cache(weightFile, cachedir, weights)
+        self.S = weights["S"]
+        self.row = weights["row"]
+        self.col = weights["col"]
+        self.nb = weights["nb"]
+        if weights["mask_b"] is None:
             self.mask_b = False
         else:
-            self.mask_b = numpy.logical_not(wFile("mask_b").filled())
+            self.mask_b = weights["mask_b"]
         self.n_s = self.S.shape[0]
-        self.method = wFile.map_method
+        self.method = weights["map_method"]
         self.regular = toRegularGrid
+        self.renormalize = renormalize
+        self._csr = None
+        self._csr_pattern = None
         if toRegularGrid:
-            self.lats = cdms2.createAxis(sorted(set(wFile("yc_b").tolist())))
+            self.area_b = weights["area_b"]
+            self.lats = cdms2.createAxis(numpy.array(weights["lat"]))
             self.lats.designateLatitude()
             self.lats.units = "degrees_north"
-            bnds = numpy.array(sorted(set(wFile("yv_b").ravel().tolist())))
-            self.lats.setBounds(bnds)
+            self.lats.setBounds(numpy.array(weights["lat_bnds"]))
             self.lats.id = "lat"
-            self.lons = cdms2.createAxis(sorted(set(wFile("xc_b").tolist())))
-            bnds = numpy.array(sorted(set(wFile("xv_b").ravel().tolist())))
+            self.lons = cdms2.createAxis(numpy.array(weights["lon"]))
             self.lons.designateLongitude()
             self.lons.units = "degrees_east"
             if fix_bounds:
               self.lons.setBounds(None)
             else:
-              self.lons.setBounds(bnds)
+              self.lons.setBounds(numpy.array(weights["lon_bnds"]))
             self.lons.id = "lon"
         else:
-            self.yc_b = wFile("yc_b")
-            self.xc_b = wFile("xc_b")
-            self.yv_b = wFile("yv_b")
-            self.xv_b = wFile("xv_b")
+            self.yc_b = weights["yc_b"]
+            self.xc_b = weights["xc_b"]
+            self.yv_b = weights["yv_b"]
+            self.xv_b = weights["xv_b"]
 
-        if isinstance(weightFile, str):
-            wFile.close()
-
-    def regrid(self, input):
+    def regrid(self, input, out=None, single=False):
+        """Regrids the variable input, whose last axis is ncol.  float32 and float64 data are
+        used as they are.  If out is supplied, it is a contiguous float32 or float64 array of
+        shape (number of leading-dimension slices, nb), to hold the result, e.g. the same
+        array for every time step.  Otherwise, the result is float32 if single is True, or
+        else float64."""
         axes = input.getAxisList()
         input_id = input.id
         M = input.getMissing()
@@ -76,17 +215,89 @@ class WeightFileRegridder:
         if isMasked:
             dest_field = \
                 metrics.packages.acme_regridder._regrid.apply_weights_masked(
-                    input, self.S, self.row, self.col, self.nb, float(M))
+                    input, self.S, self.row, self.col, self.nb, float(M),
+                    out=out, single=single)
         else:
             dest_field = metrics.packages.acme_regridder._regrid.apply_weights(
-                input, self.S, self.row, self.col, self.nb)
+                input, self.S, self.row, self.col, self.nb, out=out, single=single)
+        return self._wrap(dest_field, sh, axes, input_id, isMasked, M)
+
+    def regridded_axes(self, V):
+        """Returns the axes which regrid(V) would have, without reading or regridding V."""
+        return V.getAxisList()[:-1] + [self.lats, self.lons]
+
+    def sparse_operator(self, n_a):
+        """Returns the weights as a scipy.sparse CSR matrix of shape (nb, n_a), built
+        once and kept; or None if scipy is not available."""
+        if self._csr is None or self._csr.shape[1] != n_a:
+            try:
+                import scipy.sparse
+            except ImportError:
+                return None
+            # Duplicate (row,col) entries are summed, as the C kernels do.
+            self._csr = scipy.sparse.csr_matrix(
+                (self.S, (self.row, self.col)), shape=(self.nb, n_a))
+            self._csr_pattern = self._csr.copy()
+            self._csr_pattern.data[:] = 1.
+        return self._csr
+
+    def regrid_many(self, inputs):
+        """Regrids a list of variables, each with ncol as its last axis, and returns a list of
+        the regridded variables.  Every leading-dimension slice of every variable is stacked
+        into one block, so that the weights are applied in a single sparse matrix product.
+        If scipy is not available, the variables are regridded one by one with regrid()."""
+        if len(inputs) == 0:
+            return []
+        n_a = inputs[0].shape[-1]
+        A = self.sparse_operator(n_a)
+        if A is None:
+            logging.warning("scipy is not available; regridding one variable at a time")
+            return [self.regrid(input) for input in inputs]
+        sizes = [numpy.prod(input.shape[:-1], dtype=int) for input in inputs]
+        isMasked = [input.mask is not numpy.ma.nomask and input.mask.any()
+                    for input in inputs]
+        X = numpy.concatenate([numpy.ma.filled(input, 0).reshape(n, n_a)
+                               for input, n in zip(inputs, sizes)])
+        # A.dot needs the source points along the first axis; the result is transposed back.
+        out = A.dot(X.T).T
+        del X
+        if any(isMasked):
+            valid = numpy.concatenate(
+                [numpy.logical_not(numpy.ma.getmaskarray(input)).reshape(n, n_a)
+                 for input, n in zip(inputs, sizes)]).astype(numpy.float64)
+            nvalid = self._csr_pattern.dot(valid.T).T
+            missing = nvalid == 0
+            if self.renormalize:
+                wvalid = A.dot(valid.T).T
+                del valid
+                numpy.divide(out, wvalid, out=out, where=wvalid != 0)
+                del wvalid
+            else:
+                del valid
+        else:
+            missing = None
+        results = []
+        start = 0
+        for input, n, masked in zip(inputs, sizes, isMasked):
+            dest_field = numpy.ascontiguousarray(out[start:start+n])
+            M = input.getMissing()
+            if masked:
+                dest_field[missing[start:start+n]] = float(M)
+            start += n
+            results.append(self._wrap(dest_field, input.shape, input.getAxisList(),
+                                      input.id, masked, M))
+        return results
+
+    def _wrap(self, dest_field, sh, axes, input_id, isMasked, M):
+        """Gives the (nindep, nb) array of regridded values dest_field the shape, axes and
+        missing value of the variable of shape sh which it came from."""
         if self.mask_b is not False:
             dest_field = numpy.ma.masked_where(self.mask_b, dest_field)
         if self.regular:
             sh2 = list(sh[:-1])
             sh2.append(len(self.lats))
             sh2.append(len(self.lons))
-            dest_field.shape = sh2
+            dest_field = dest_field.reshape(sh2)  # a view; out keeps its shape
             dest_field = MV2.array(dest_field, id=input_id)
             dest_field.setAxis(-1, self.lons)
             dest_field.setAxis(-2, self.lats)
@@ -97,6 +308,91 @@ class WeightFileRegridder:
         return dest_field
 
 
+def regrid_time_chunks(regdr, V, chunk):
+    """Regrids the file variable V, reading chunk time steps at a time.  Yields pairs
+    (time slice, regridded data) in time order, so that only one chunk need be in memory.
+    The results are the same as regdr.regrid(V()) would give.  If time is not V's first
+    axis, V is regridded whole."""
+    axes = V.getAxisList()
+    if chunk <= 0 or not axes[0].isTime():
+        yield slice(None), regdr.regrid(V())
+        return
+    nt = len(axes[0])
+    # Each chunk's result is written into the same buffer.
+    nindep = chunk*int(numpy.prod(V.shape[1:-1], dtype=int))
+    out = numpy.empty((nindep, regdr.nb), dtype=numpy.float64)
+    for t0 in range(0, nt, chunk):
+        t1 = min(t0+chunk, nt)
+        data = V[t0:t1]
+        rows = data.size // data.shape[-1]
+        yield slice(t0, t1), regdr.regrid(data, out=out[:rows])
+
+
+def grid_weights(regdr, dat2, quiet=False):
+    """Returns the latitude weights gw and the cell areas, for the destination grid of regdr.
+    dat2 is a regridded variable."""
+    if not quiet: print "trying to get weights"
+    wgts = [numpy.sin(x[1]*numpy.pi/180.) -
+            numpy.sin(x[0]*numpy.pi/180.)
+            for x in dat2.getLatitude().getBounds()]
+    if dat2.ndim > 3:
+        dat2 = dat2[0, 0]
+    else:
+        dat2 = dat2[0]
+    if not quiet: print "Computing area weights"
+    area = regdr.area_b
+    if area is None or numpy.allclose(area,0.):
+      if not quiet: print "area is all zeroes computing it for you"
+      area = cdutil.area_weights(dat2)*numpy.pi*4.
+    area = MV2.reshape(area, dat2.shape[-2:])
+    return wgts, area
+
+
+# Attributes of the area variable written with regridded data.
+area_attributes = {"units": "steradian",
+                   "long_name": "solid angle subtended by grid cell",
+                   "standard_name": "cell_area",
+                   "cell_methods": "lat, lon: sum"}
+
+
+def dataset_from_file(regdr, filename, varnames=None, name=None):
+    """Regrids the data file filename with the WeightFileRegridder regdr, as regrid_file() does,
+    but returns the result as a memory_dataset named name (by default filename) instead of
+    writing it.  If varnames is supplied, only those variables (and time_bnds) are included."""
+    from metrics.fileio.memdataset import memory_dataset
+    f = cdms2.open(filename)
+    ds = memory_dataset(filename if name is None else name, f.attributes)
+    if varnames is None:
+        varnames = f.variables.keys()
+    elif "time_bnds" not in varnames:
+        varnames = list(varnames) + ["time_bnds"]
+    dat2 = None
+    for v in varnames:
+        V = f[v]
+        if V is None or V.id in ["lat", "lon", "area"]:
+            continue
+        try:
+            if "ncol" in V.getAxisIds():
+                dat2 = cdms2.MV2.array(regdr.regrid(V()))
+                ds.add_variable(cdms2.createVariable(dat2.astype(V.typecode()), id=V.id,
+                                                     axes=dat2.getAxisList(),
+                                                     attributes=dict(V.attributes)))
+            elif V.rank() == 0:
+                ds.add_variable(cdms2.createVariable(V.getValue(), id=V.id,
+                                                     attributes=dict(V.attributes)))
+            else:
+                ds.add_variable(V(), V.id)
+        except Exception, err:
+            logging.exception("Variable %s failed with error: %s", v, err)
+    if dat2 is not None:
+        wgts, area = grid_weights(regdr, dat2, quiet=True)
+        ds.add_variable(cdms2.createVariable(numpy.array(wgts), axes=[regdr.lats], id="gw"))
+        ds.add_variable(cdms2.createVariable(numpy.array(area), axes=[regdr.lats, regdr.lons],
+                                             id="area", attributes=dict(area_attributes)))
+    f.close()
+    return ds
+
+
 def addAxes(f, axisList, store_bounds = False):
     axes = []
     for ax in axisList:
@@ -121,7 +417,8 @@ def addVariable(f, id, typecode, axes, attributes, store_bounds=False):
     for att in attributes:
         setattr(V, att, attributes[att])
 
-if __name__ == "__main__":
+def set_netcdf_flags():
+    """NetCDF library settings for writing the regridded files."""
     cdms2.setNetcdfClassicFlag(0)
     cdms2.setNetcdf4Flag(1)
     cdms2.setNetcdfUseNCSwitchModeFlag(0)
@@ -129,6 +426,9 @@ if __name__ == "__main__":
     cdms2.setNetcdfDeflateFlag(0)
     cdms2.setNetcdfDeflateLevelFlag(0)
 
+
+def make_parser():
+    """Returns the parser for the command-line arguments of acme_regrid."""
     # Create the parser for user input
     parser = argparse.ArgumentParser(
         description='Regrid variables in a file using a weight file')
@@ -149,13 +449,18 @@ if __name__ == "__main__":
                             (default is all variable with 'ncol' dimension")
     parser.add_argument("--store-bounds",dest="store_bounds",action="store_true",default=False,help="store lat/lon bounds information")
     parser.add_argument("--fix-esmf-bounds",dest="fix_bounds",action="store_true",default=False,help="fix esmf first and last longitudes being half width")
+    parser.add_argument("--batch-mb",dest="batch_mb",type=float,default=0.,help="regrid variables together, in batches of about this many megabytes, with one sparse matrix product per batch (needs scipy; default 0, one variable at a time)")
+    parser.add_argument("--renormalize",action="store_true",default=False,help="with --batch-mb, divide each regridded value by the total weight of its non-missing source values")
+    parser.add_argument("--time-chunk",dest="time_chunk",type=int,default=0,help="regrid each variable this many time steps at a time, to bound memory use (default 0, whole variables; overrides --batch-mb)")
+    parser.add_argument("--weight-cache",dest="weight_cache",default=None,help="directory for a cache of preprocessed, memory-mappable map file weights, shared by all processes which use it")
     parser.add_argument("-q","--quiet",action="store_true",default=False,help="quiet mode (no output printed to screen)")
+    return parser
 
-    args = parser.parse_args(sys.argv[1:])
-
-    # Read the weights file
-    regdr = WeightFileRegridder(args.weights,True,fix_bounds=args.fix_bounds)
 
+def regrid_file(regdr, args):
+    """Regrids the input file args.file with the WeightFileRegridder regdr, and writes the
+    output file.  args holds the arguments of acme_regrid, as returned by
+    make_parser().parse_args()."""
     f = cdms2.open(args.file)
 
     if args.out is None:
@@ -203,6 +508,7 @@ if __name__ == "__main__":
     area = None
     NVARS = len(vars)
     tim_bnds = None
+    last_ncol = None
     for i, v in enumerate(vars):
         V = f[v]
         if V is None:
@@ -211,31 +517,26 @@ if __name__ == "__main__":
             if not args.quiet: print i, NVARS, "Will skip", V.id, "no longer needed or recomputed"
         elif "ncol" in V.getAxisIds():
             if not args.quiet: print i, NVARS, "Will process:", V.id
+            last_ncol = i
             if V.rank() == 2:
                 if axes3d == []:
-                    dat2 = cdms2.MV2.array(regdr.regrid(V()))
-                    axes3d = dat2.getAxisList()
+                    axes3d = regdr.regridded_axes(V)
                 addVariable(fo, V.id, V.typecode(), axes3d, V.attributes, store_bounds=args.store_bounds)
             elif V.rank() == 3:
                 if "ilev" in V.getAxisIds(): # New CLUBB things
                     if axes4d_ilev == []:
-                        dat2 = cdms2.MV2.array(regdr.regrid(V()))
-                        axes4d_ilev = dat2.getAxisList()
+                        axes4d_ilev = regdr.regridded_axes(V)
                     addVariable(fo, V.id, V.typecode(), axes4d_ilev, V.attributes, store_bounds=args.store_bounds)
                 else:
                     if axes4d == []:
-                        dat2 = cdms2.MV2.array(regdr.regrid(V()))
-                        axes4d = dat2.getAxisList()
+                        axes4d = regdr.regridded_axes(V)
                     addVariable(fo, V.id, V.typecode(), axes4d, V.attributes, store_bounds=args.store_bounds)
             if wgt is None:
                 wgt = True
-                addVariable(fo, "gw", "d", [dat2.getLatitude(), ], [])
+                addVariable(fo, "gw", "d", [regdr.lats, ], [])
                 addVariable(fo, "area", "d",
-                            [dat2.getLatitude(), dat2.getLongitude()],
-                            {"units": "steradian",
-                             "long_name": "solid angle subtended by grid cell",
-                             "standard_name": "cell_area",
-                             "cell_methods": "lat, lon: sum"}
+                            [regdr.lats, regdr.lons],
+                            area_attributes
                             )
         else:
             if not args.quiet: print "Will rewrite as is", V.id
@@ -249,6 +550,8 @@ if __name__ == "__main__":
       addVariable(fo, "longitude_bounds", "d", [regdr.lons, tim_bnds], {}, store_bounds=args.store_bounds)
 
     wgts = None
+    pending = []
+    pending_bytes = 0
     for i, v in enumerate(vars):
         V = f[v]
         if V is None:
@@ -257,30 +560,32 @@ if __name__ == "__main__":
             if not args.quiet: print i, NVARS, "Skipping", V.id, "no longer needed or recomputed"
         elif "ncol" in V.getAxisIds():
             if not args.quiet: print i, NVARS, "Processing:", V.id
-            V2 = fo[V.id]
-            dat2 = cdms2.MV2.array(regdr.regrid(V()))
-            V2[:] = dat2[:].astype(V.typecode())
-            if wgts is None:
-                if not args.quiet: print "trying to get weights"
-                wgts = [numpy.sin(x[1]*numpy.pi/180.) -
-                        numpy.sin(x[0]*numpy.pi/180.)
-                        for x in dat2.getLatitude().getBounds()]
-                V2 = fo["gw"]
-                V2[:] = wgts[:]
-                if dat2.ndim > 3:
-                    dat2 = dat2[0, 0]
-                else:
-                    dat2 = dat2[0]
-                if not args.quiet: print "Computing area weights"
-                fw = cdms2.open(args.weights)
-                area = fw("area_b")
-                fw.close()
-                if numpy.allclose(area,0.):
-                  if not args.quiet: print "area is all zeroes computing it for you"
-                  area = cdutil.area_weights(dat2)*numpy.pi*4.
-                area = MV2.reshape(area, dat2.shape[-2:])
-                V2 = fo["area"]
-                V2[:] = area[:]
+            # Variables are regridded in batches of about args.batch_mb megabytes; or, with
+            # --time-chunk, one at a time, args.time_chunk time steps at a time.
+            pending.append(V)
+            pending_bytes += numpy.prod(V.shape)*numpy.dtype(V.typecode()).itemsize
+            if pending_bytes < args.batch_mb*1.e6 and i != last_ncol and args.time_chunk <= 0:
+                continue
+            if args.time_chunk > 0:
+                regridded = ((V, tslice, dat2) for tslice, dat2 in
+                             regrid_time_chunks(regdr, V, args.time_chunk))
+            elif len(pending) > 1:
+                regridded = [(P, slice(None), dat2) for P, dat2 in
+                             zip(pending, regdr.regrid_many([P() for P in pending]))]
+            else:
+                regridded = [(V, slice(None), regdr.regrid(V()))]
+            for V, tslice, dat2 in regridded:
+                V2 = fo[V.id]
+                dat2 = cdms2.MV2.array(dat2)
+                V2[tslice] = dat2[:].astype(V.typecode())
+                if wgts is None:
+                    wgts, area = grid_weights(regdr, dat2, args.quiet)
+                    V2 = fo["gw"]
+                    V2[:] = wgts[:]
+                    V2 = fo["area"]
+                    V2[:] = area[:]
+            pending = []
+            pending_bytes = 0
         else:
             if not args.quiet: print i, NVARS, "Rewriting as is:", V.id
             try:
@@ -307,3 +612,16 @@ if __name__ == "__main__":
       fo["latitude_bounds"][:]=regdr.lats.getBounds()
       fo["longitude_bounds"][:]=regdr.lons.getBounds()
     fo.close()
+    f.close()
+
+
+if __name__ == "__main__":
+    set_netcdf_flags()
+    args = make_parser().parse_args(sys.argv[1:])
+
+    # Read the weights file
+    regdr = WeightFileRegridder(args.weights,True,fix_bounds=args.fix_bounds,
+                                renormalize=args.renormalize,
+                                cachedir=args.weight_cache)
+
+    regrid_file(regdr, args)
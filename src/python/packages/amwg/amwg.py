@@ -3,7 +3,7 @@
 # Top-leve definition of AMWG Diagnostics.
 # AMWG = Atmospheric Model Working Group
 
-import pdb
+import pdb, importlib
 from metrics.packages.diagnostic_groups import *
 from metrics.computation.reductions import *
 from metrics.computation.plotspec import *
@@ -81,6 +81,7 @@ class AMWG(BasicDiagnosticGroup):
         return vlist
 
     def list_diagnostic_sets( self ):
+        load_plot_sets()
         psets = amwg_plot_plan.__subclasses__()
         plot_sets = psets
         for cl in psets:
@@ -212,20 +213,14 @@ class amwg_plot_plan(plot_plan):
     def _all_variables( model, obs ):
         return amwg_plot_plan.package._all_variables( model, obs, "amwg_plot_plan" )
 
-# plot set classes in other files:
-#import the individual plot modules
-from metrics.packages.amwg.amwg1 import *
-from metrics.packages.amwg.amwg2 import *
-from metrics.packages.amwg.amwg3 import *
-from metrics.packages.amwg.amwg4 import *
-from metrics.packages.amwg.amwg5 import *
-from metrics.packages.amwg.amwg6 import *
-from metrics.packages.amwg.amwg7 import *
-from metrics.packages.amwg.amwg8 import *
-from metrics.packages.amwg.amwg9 import *
-from metrics.packages.amwg.amwg10 import *
-from metrics.packages.amwg.amwg11 import *
-from metrics.packages.amwg.amwg12 import *
-from metrics.packages.amwg.amwg13 import *
-from metrics.packages.amwg.amwg14 import *
-from metrics.packages.amwg.amwg15 import *
+# plot set classes in other files.  They are slow to import, and most runs use only one or two
+# of them, so they are imported by load_plot_sets() when first needed, not with this module.
+# Thus a plot set class must be imported from its own module, e.g.
+# from metrics.packages.amwg.amwg5 import amwg_plot_set5
+plot_set_modules = [ 'metrics.packages.amwg.amwg%d' % i for i in range(1,16) ]
+
+def load_plot_sets():
+    """Imports the modules defining the AMWG plot sets, so that their classes are subclasses of
+    amwg_plot_plan.  Modules already imported are not imported again."""
+    for name in plot_set_modules:
+        importlib.import_module(name)
@@ -215,6 +215,7 @@ class amwg_plot_set13(amwg_plot_plan):
     def customizeTemplates(self, templates, data=None, varIndex=None, graphicMethod=None, var=None,
                            uvcplotspec=None ):
         """This method does what the title says.  It is a hack that will no doubt change as diags changes."""
+        import vcs
         (cnvs1, tm1), (cnvs2, tm2) = templates
         
         tm2.yname.priority  = 1
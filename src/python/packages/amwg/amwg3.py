@@ -70,7 +70,8 @@ class amwg_plot_set3(amwg_plot_plan,basic_id):
         if varnom in filetable1.list_variables():
             zvar = reduced_variable(
                 variableid=varnom,
-                filetable=filetable1, season=self.season, region=self.region,
+                filetable=filetable1, season=self.season, region=self.region, chunked=True,
+                read_region=self.region,
                 reduction_function=(lambda x,vid=None: reduce2lat_seasonal(x,self.season,self.region,vid=vid)) )
             self.reduced_variables[zvar._strid] = zvar
         elif varnom in self.common_derived_variables.keys():
@@ -91,7 +92,8 @@ class amwg_plot_set3(amwg_plot_plan,basic_id):
         if varnom in filetable2.list_variables():
             z2var = reduced_variable(
                 variableid=varnom,
-                filetable=filetable2, season=self.season, region=self.region,
+                filetable=filetable2, season=self.season, region=self.region, chunked=True,
+                read_region=self.region,
                 reduction_function=(lambda x,vid=None: reduce2lat_seasonal(x,self.season,self.region,vid=vid)) )
             self.reduced_variables[z2var._strid] = z2var
         elif varnom in self.common_derived_variables.keys():
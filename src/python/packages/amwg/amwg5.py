@@ -198,7 +198,8 @@ class amwg_plot_set5(amwg_plot_plan):
     def vars_normal_contours( self, filetable, varnom, seasonid, aux=None ):
         reduced_varlis = [
             reduced_variable(
-                variableid=varnom, filetable=filetable, season=self.season,
+                variableid=varnom, filetable=filetable, season=self.season, chunked=True,
+                read_region=self.region,
                 reduction_function=(lambda x,vid: reduce2latlon_seasonal( x, self.season, self.region, vid) ) ),
             reduced_variable(
                 # variance, for when there are variance climatology files
@@ -333,7 +334,7 @@ class amwg_plot_set5(amwg_plot_plan):
             vidl2 = dv.dict_id( varnom, 'lp', seasonid, filetable2 )
             reduced_varlis += [
                 reduced_variable(  # var=var(time,lev,lat,lon)
-                    variableid=varnom, filetable=filetable2, season=self.season,
+                    variableid=varnom, filetable=filetable2, season=self.season, read_level=pselect,
                     reduction_function=(lambda x,vid: reduce_time_seasonal( x, self.season, self.region, vid ) ) )
                 ]
             self.derived_variables[vidl2] = derived_var(
@@ -512,6 +513,7 @@ class amwg_plot_set5(amwg_plot_plan):
                                 graphicMethod=None, var=None, uvcplotspec=None):
         """This method does what the title says.  It is a hack that will no doubt change as diags changes.
         It is a total hack. I'm embarassed to be part of it. Please find a better way!!!"""
+        import vcs
         #(cnvs1, tm1), (cnvs2, tm2) = templates
         if hasattr(var, 'model') and hasattr(var, 'obs'): #these come from aminusb_2ax
             from metrics.graphics.default_levels import default_levels
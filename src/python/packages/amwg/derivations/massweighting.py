@@ -14,13 +14,89 @@
 
 import numpy
 import cdms2
-import logging, pdb
+import logging, pdb, collections, hashlib
 from atmconst import AtmConst
 from unidata import udunits
+from metrics.fileio.multifile import open_datafile
 
 
 logger = logging.getLogger(__name__)
 
+# Pressures on hybrid levels are needed for mass weights (at the level interfaces) and by
+# verticalize() (at the level midpoints), often many times for the same surface pressure.  So they
+# are cached in one cache, keyed by the values of everything they are computed from; see
+# pressure_key().  The cache holds up to pressure_cache_bytes of pressures (None to not cache),
+# least recently used first out.
+pressure_cache_bytes = 2**28
+_pressure_cache = collections.OrderedDict()
+_pressure_cache_nbytes = 0
+
+def hybrid_pressure( PS, hya, hyb, P0, levax=None ):
+    """Returns the pressure hya*P0+hyb*PS on hybrid levels: at the level interfaces if hya,hyb are
+    hyai,hybi, or at the midpoints if they are hyam,hybm.  PS, the surface pressure, is shaped
+    (lat,lon) or (time,lat,lon); all its times are done at once.  The pressure has the axes of PS
+    with a level axis inserted before lat,lon: levax, or if that's None, the level axis of hyb.
+    It has the units of PS, and P0 must be in the same units."""
+    if levax is None:
+        levax = hyb.getLevel()
+    P0 = float( numpy.asarray(P0).ravel()[0] )
+    a = numpy.asarray( hya, dtype=numpy.float64 ).ravel()[:,None,None]
+    b = numpy.asarray( hyb, dtype=numpy.float64 ).ravel()[:,None,None]
+    ps = numpy.ma.asarray( PS )
+    pdat = a*P0 + b*ps[...,None,:,:]   # shape is PS.shape[:-2]+(nlev,)+PS.shape[-2:]
+    psaxes = PS.getAxisList()
+    p = cdms2.createVariable( pdat, axes=psaxes[:-2]+[levax]+psaxes[-2:], id='pressure' )
+    if hasattr( PS, 'units' ):
+        p.units = PS.units
+    return p
+
+def pressure_key( PS, hya, hyb, P0, levax=None ):
+    """Returns a key for the pressure which hybrid_pressure() computes from the same arguments: a
+    hash of the values and units of PS, its axes, hya, hyb, P0 and the level axis.  As it depends
+    only on the values, the seasonal means of PS from one file have different keys; and the same
+    pressure is found whether mass_weights() or verticalize() computed it."""
+    from metrics.fileio.weightcache import axis_fingerprint
+    if levax is None:
+        levax = hyb.getLevel()
+    ps = numpy.ma.asarray( PS )
+    key = hashlib.sha1( numpy.ascontiguousarray( ps.filled(0), dtype=numpy.float64 ) )
+    key.update( numpy.ascontiguousarray( numpy.ma.getmaskarray(ps) ) )
+    key.update( "%s %s" % (ps.shape, getattr(PS,'units','')) )
+    for ax in PS.getAxisList()+[levax]:
+        key.update( str(axis_fingerprint(ax)) )
+    for coeffs in [ hya, hyb ]:
+        key.update( numpy.ascontiguousarray( coeffs, dtype=numpy.float64 ) )
+    # P0 may come from a unit conversion, as in verticalize(), so is rounded a little.
+    key.update( '%.10g' % float( numpy.asarray(P0).ravel()[0] ) )
+    return key.hexdigest()
+
+def cached_pressure( key, compute ):
+    """Returns the pressure cached under key.  If there is none, or key is None, the pressure is
+    computed by calling compute() and cached.  The caller must not change it."""
+    global _pressure_cache_nbytes
+    if key is not None and key in _pressure_cache:
+        p = _pressure_cache.pop( key )
+        _pressure_cache[key] = p
+        return p
+    p = compute()
+    if key is None or pressure_cache_bytes is None:
+        return p
+    _pressure_cache[key] = p
+    _pressure_cache_nbytes += p.nbytes
+    while _pressure_cache_nbytes>pressure_cache_bytes and len(_pressure_cache)>1:
+        oldkey, oldp = _pressure_cache.popitem( last=False )
+        _pressure_cache_nbytes -= oldp.nbytes
+    return p
+
+def first_time_ps( f ):
+    """Reads the surface pressure PS from the open file (or multifile_dataset) f, but only its first
+    time."""
+    from metrics.computation.reductions import file_variable_axes, read_first_time
+    taxes = [ ax for ax in file_variable_axes( f, 'PS' ) if ax is not None and ax.isTime() ]
+    if len(taxes)==0:
+        return f('PS')
+    return read_first_time( f, 'PS', taxes[0] )
+
 def rhodz_from_hybridlev( PS, P0, hyai, hybi, mv, f ):
     """returns a variable rhodz which represents the air mass column density in each cell, assumes
     kg,m,sec,mbar units and 3-D grid lon,lat,level.  The input variables are from CAM, except for mv
@@ -37,15 +113,16 @@ def rhodz_from_hybridlev( PS, P0, hyai, hybi, mv, f ):
     g = AtmConst.g     # 9.80665 m/s2.
     latm1,latm2 = axis_minmax( mv.getLatitude(), f )
     lonm1,lonm2 = axis_minmax( mv.getLongitude(), f )
-    PSlim = PS( latitude=(latm1,latm2), longitude=(lonm1,lonm2) )
-    levax = hybi.getLevel()
-    latax = PSlim.getLatitude()
-    lonax = PSlim.getLongitude()
-    pintdat = numpy.zeros( ( hybi.shape[0], PSlim.shape[1], PSlim.shape[2] ) )
-    pint = cdms2.createVariable( pintdat, axes=[levax,latax,lonax] )
-    for k in range(hybi.shape[0]):
-	pint[k,:,:] = hyai[k]*P0 + PSlim[0,:,:]*hybi[k]
-    # ... I don't know how to do this without a loop.
+    if PS.getTime() is None:
+        PSlim = PS( latitude=(latm1,latm2), longitude=(lonm1,lonm2) )
+    else:
+        # Only the first time is used.  Without a time axis, the pressure is the same as for a
+        # seasonal mean of PS with the same values, so it can share the cache entry.
+        PSlim = PS( latitude=(latm1,latm2), longitude=(lonm1,lonm2), time=slice(0,1) )[0]
+        if hasattr( PS, 'units' ):
+            PSlim.units = PS.units
+    pint = cached_pressure( pressure_key( PSlim, hyai, hybi, P0 ),
+                            lambda: hybrid_pressure( PSlim, hyai, hybi, P0 ) )
     dp = pint[1:,0:,0:] - pint[0:-1,0:,0:]
     rhodz = dp/g
 
@@ -134,7 +211,7 @@ def rhodz_from_plev( lev, nlev_want, mv ):
         # We'll try to use other variables to do better than extrapolating.
         # This only works in CAM, CESM, ACME, etc.
         # For simplicity, if data is available at multiple times we will use just the first time.
-        f = cdms2.open(lev.filename)
+        f = open_datafile(lev.filename)
         fvars = f.variables.keys()
         if 'PS' in fvars:
             latm1,latm2 = axis_minmax( lat, f )
@@ -232,10 +309,10 @@ def rhodz_from_mv( mv ):
     Its shape is lev,lat,lon.  The input is a cdms variable.  """
     lev = mv.getLevel()
     if lev.units=='level':  # hybrid level
-        cfile = cdms2.open( mv.filename )
+        cfile = open_datafile( mv.filename )
         check_compatible_levels( mv, cfile('hybi'), True )
-        rhodz = rhodz_from_hybridlev( cfile('PS'), cfile('P0'), cfile('hyai'), cfile('hybi'),
-                                      mv, cfile )
+        rhodz = rhodz_from_hybridlev( first_time_ps(cfile), cfile('P0'), cfile('hyai'),
+                                      cfile('hybi'), mv, cfile )
         cfile.close()
     elif lev.units in  ['millibars','mbar','mb','Pa','hPa']:  # pressure level
         # Note that lev is the level axis of mv, thus each value of mv is centered _at_ a level.
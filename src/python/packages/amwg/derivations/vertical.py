@@ -50,7 +50,11 @@ def verticalize( T, hyam, hybm, ps, level_src=plvlO ):
     s,i = tmp.how(ps.units)
     p0 = s*p0 + i
     #psmb = cdms2.createVariable( pressures_in_mb( ps ), copy=True, units='mbar', id=ps.id )
-    levels_orig = cdutil.vertical.reconstructPressureFromHybrid( ps, hyam, hybm, p0 )
+    # The pressures are shared with the mass weights, through their cache.
+    from metrics.packages.amwg.derivations.massweighting import hybrid_pressure, pressure_key,\
+        cached_pressure
+    levels_orig = cached_pressure( pressure_key( ps, hyam, hybm, p0, levAxis(T) ),
+                                   lambda: hybrid_pressure( ps, hyam, hybm, p0, levAxis(T) ) )
     # At this point levels_orig has the same units as ps.  Convert to to mbar
     tmp = udunits(1.0,ps.units)
     s,i = tmp.how('mbar')
@@ -1,5 +1,3 @@
-import vcs
-
 def src2modobs( src ):
     """guesses whether the source string is for model or obs, prefer model"""
     if src.find('obs')>=0:
@@ -25,6 +23,7 @@ def get_model_case(filetable):
         case = 'not available'
     return case
 def get_textobject(t,att,text):
+    import vcs
     obj = vcs.createtext(Tt_source=getattr(t,att).texttable,To_source=getattr(t,att).textorientation)
     obj.string = [text]
     obj.x = [getattr(t,att).x]
@@ -2,12 +2,37 @@
 
 # Features common to standard diagnostics from all groups, e.g. AMWG, LMWG.
 
+import importlib
 from metrics.fileio.filetable import basic_filetable
 
+# The diagnostic groups, and the modules which define them.  A group's module (which defines all
+# its plot sets) is slow to import, so it is imported only when the group is first looked up.
+diagnostic_group_modules = { "AMWG":"metrics.packages.amwg.amwg", "LMWG":"metrics.packages.lmwg.lmwg" }
+
+class diagnostics_menu_dict(dict):
+    """The dict returned by diagnostics_menu(), group name:group class.  The names are known
+    from the start, but each class is imported only when it is first looked up."""
+    def __getitem__( self, key ):
+        value = dict.__getitem__( self, key )
+        if isinstance( value, basestring ):
+            value = getattr( importlib.import_module(value), key )
+            self[key] = value
+        return value
+    def get( self, key, default=None ):
+        if key in self:
+            return self[key]
+        return default
+    def values( self ):
+        return [ self[key] for key in self.keys() ]
+    def items( self ):
+        return [ (key, self[key]) for key in self.keys() ]
+    def itervalues( self ):
+        return iter( self.values() )
+    def iteritems( self ):
+        return iter( self.items() )
+
 def diagnostics_menu():
-    from metrics.packages.amwg.amwg import AMWG
-    from metrics.packages.lmwg.lmwg import LMWG
-    return { "AMWG":AMWG, "LMWG":LMWG }
+    return diagnostics_menu_dict( diagnostic_group_modules )
 
 class BasicDiagnosticGroup():
     # This class will probably not get instantiated.
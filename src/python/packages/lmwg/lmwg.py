@@ -90,13 +90,13 @@ class evapfrac_redvar ( reduced_variable ):
          if flag == 'MONTHLY':
             reduced_variable.__init__(
                self, variableid='EVAPFRAC_A'+suffix, 
-               filetable=filetable, 
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceMonthlyTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={'EVAPFRAC_A'+suffix:duv})
          else:
             reduced_variable.__init__(
                self, variableid='EVAPFRAC_A'+suffix, 
-               filetable=filetable, 
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceAnnTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={'EVAPFRAC_A'+suffix:duv})
       if fn == None:
@@ -121,19 +121,19 @@ class rnet_redvar( reduced_variable ):
          if flag == 'MONTHLY':
             reduced_variable.__init__(
                self, variableid='RNET_A'+suffix,
-               filetable=filetable,
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceMonthlyTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={'RNET_A'+suffix:duv})
          else:
             reduced_variable.__init__(
                self, variableid='RNET_A'+suffix,
-               filetable=filetable,
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceAnnTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={'RNET_A'+suffix:duv})
       if fn == 'SINGLE':
          reduced_variable.__init__(
             self, variableid='RNET_A'+suffix,
-            filetable=filetable,
+            filetable=filetable, read_region=region,
             reduction_function=(lambda x, vid=None: reduceAnnTrendRegion(x, region, weights=weights, single=True, vid=vid)),
             duvs={'RNET_A'+suffix:duv})
       if fn == None:
@@ -164,19 +164,19 @@ class albedos_redvar( reduced_variable ):
          if flag == 'MONTHLY':
             reduced_variable.__init__(
                self, variableid=vname,
-               filetable=filetable,
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceMonthlyTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={vname: duv})
          else:
             reduced_variable.__init__(
                self, variableid=vname,
-               filetable=filetable,
+               filetable=filetable, read_region=region,
                reduction_function=(lambda x, vid=None: reduceAnnTrendRegion(x, region, weights=weights, vid=vid)),
                duvs={vname: duv})
       elif fn == 'SINGLE':
          reduced_variable.__init__(
             self, variableid=vname,
-            filetable=filetable,
+            filetable=filetable, read_region=region,
             reduction_function=(lambda x, vid: reduceAnnTrendRegion(x, region, weights=weights, single=True, vid=vid)),
             duvs={vname:duv})
       elif fn == 'BIAS':
@@ -1519,11 +1519,11 @@ class lmwg_plot_set3(lmwg_plot_plan):
 #            ft = raw0 #(climo0 if climo0 is not None else raw0)
 #            ft2 = raw1 # (climo1 if climo1 is not None else raw1)
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             if num_models == 2: 
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
 
          self.derived_variables['ET_ft1'] = derived_var(
@@ -1584,14 +1584,14 @@ class lmwg_plot_set3(lmwg_plot_plan):
             ft = (climo0 if climo0 is not None else raw0)
             ft2 = (climo1 if climo1 is not None else raw1)
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             self.single_plotspecs[v] = plotspec(vid=v+'_ft1', 
                zvars = [v+'_ft1'], zfunc=(lambda z:z),
                plottype = self.plottype, title=varinfo[v]['desc'])
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
                self.single_plotspecs[v].z2vars = [v+'_ft2']
                self.single_plotspecs[v].z2func = (lambda z:z)
@@ -1632,11 +1632,11 @@ class lmwg_plot_set3(lmwg_plot_plan):
          red_varlist = ['FSH', 'FCTR', 'FCEV', 'FGEV', 'FGR', 'BTRAN', 'TLAI']
          for v in red_varlist:
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
             self.single_plotspecs[v] = plotspec(vid=v+'_ft1', 
                zvars = [v+'_ft1'], zfunc=(lambda z:z),
@@ -1650,11 +1650,11 @@ class lmwg_plot_set3(lmwg_plot_plan):
          sub_varlist = ['FCTR', 'FGEV', 'FCEV']
          for v in sub_varlist:
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
          ### Can we do these with reduceMonthlyTrendRegion? Needs investigation
          self.derived_variables['LHEAT_ft1'] = derived_var(
@@ -1709,11 +1709,11 @@ class lmwg_plot_set3(lmwg_plot_plan):
 
          for v in red_varlist:
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
 
          # These are all linaer, so we can take reduced vars and add them together. I think that is the VAR_ft1 variables
@@ -1748,22 +1748,22 @@ class lmwg_plot_set3(lmwg_plot_plan):
             if 'PREC' in obs[i].list_variables():
                num_prec = num_prec+1
                self.reduced_variables['PREC_obs'+num_prec] = reduced_variable(
-                  variableid = 'PREC', filetable=obs[i], reduced_var_id='PREC_obs'+num_prec,
+                  variableid = 'PREC', filetable=obs[i], reduced_var_id='PREC_obs'+num_prec, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'PRECIP_LAND' in obs[i].list_variables():
                num_prec = num_prec+1
                self.reduced_variables['PREC_obs'+num_prec] = reduced_variable(
-                  variableid = 'PRECIP_LAND', filetable=obs[i], reduced_var_id='PREC_obs'+num_prec,
+                  variableid = 'PRECIP_LAND', filetable=obs[i], reduced_var_id='PREC_obs'+num_prec, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'RUNOFF' in obs[i].list_variables():
                num_run = num_run+1
                self.reduced_variables['TOTRUNOFF_obs'+num_run] = reduced_variable(
-                  variableid = 'RUNOFF', filetable=obs[i], reduced_var_id='TOTRUNOFF_obs'+num_run,
+                  variableid = 'RUNOFF', filetable=obs[i], reduced_var_id='TOTRUNOFF_obs'+num_run, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'SNOWDP' in obs[i].list_variables():
                num_snowd = num_snowd+1
                self.reduced_variables['SNOWDP_obs'+num_snowd] = reduced_variable(
-                  variableid = 'SNOWDP', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd,
+                  variableid = 'SNOWDP', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
 #            if 'SCF' in obs[i].list_variables():
 #               print '***** IS SCF SNOWDP????? ******'
@@ -1774,17 +1774,17 @@ class lmwg_plot_set3(lmwg_plot_plan):
             if 'SNOWD' in obs[i].list_variables():
                num_snowd = num_snowd+1
                self.reduced_variables['SNOWDP_obs'+num_snowd] = reduced_variable(
-                  variableid = 'SNOWD', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd,
+                  variableid = 'SNOWD', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'TSA' in obs[i].list_variables():
                num_temp = num_temp+1
                self.reduced_variables['TSA_obs'+num_temp] = reduced_variable(
-                  variableid = 'TSA', filetable=obs[i], reduced_var_id='TSA_obs'+num_temp,
+                  variableid = 'TSA', filetable=obs[i], reduced_var_id='TSA_obs'+num_temp, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'TREFHT' in obs[i].list_variables():
                num_temp = num_temp+1
                self.reduced_variables['TSA_obs'+num_temp] = reduced_variable(
-                  variableid = 'TREFHT', filetable=obs[i], reduced_var_id='TSA_obs'+num_temp,
+                  variableid = 'TREFHT', filetable=obs[i], reduced_var_id='TSA_obs'+num_temp, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'SWE' in obs[i].list_variables():
                # snow water equivalent. what is this? units in mm so not a rate, so prec maybe?
@@ -1904,14 +1904,14 @@ class lmwg_plot_set3(lmwg_plot_plan):
          self.composite_plotspecs[pspec_name] = []
          for v in red_varlist:
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             self.single_plotspecs[v] = plotspec(vid=v+'_ft1', 
                zvars = [v+'_ft1'], zfunc=(lambda z:z),
                plottype = self.plottype, title=varinfo[v]['desc'])
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
                self.single_plotspecs[v].z2vars = [v+'_ft2']
                self.single_plotspecs[v].z2func = (lambda z:z)
@@ -1927,22 +1927,22 @@ class lmwg_plot_set3(lmwg_plot_plan):
             if 'SNOWDP' in obs[i].list_variables():
                num_snowd = num_snowd+1
                self.reduced_variables['SNOWDP_obs'+num_run] = reduced_variable(
-                  variableid = 'SNOWDP', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd,
+                  variableid = 'SNOWDP', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'SCF' in obs[i].list_variables():
                num_fsno = num_fsno+1
                self.reduced_variables['FSNO_obs'+num_run] = reduced_variable(
-                  variableid = 'SCF', filetable=obs[i], reduced_var_id='FSNO_obs'+num_fsno,
+                  variableid = 'SCF', filetable=obs[i], reduced_var_id='FSNO_obs'+num_fsno, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'SNOWD' in obs[i].list_variables():
                num_snowd = num_snowd+1
                self.reduced_variables['SNOWDP_obs'+num_run] = reduced_variable(
-                  variableid = 'SNOWD', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd,
+                  variableid = 'SNOWD', filetable=obs[i], reduced_var_id='SNOWDP_obs'+num_snowd, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
             if 'SWE' in obs[i].list_variables():
                num_swe = num_swe+1
                self.reduced_variables['H2OSNO'+num_swe] = reduced_variable(
-                  variableid = 'H2OSNO', filetable=obs[i], reduced_var_id='H2OSNO_obs'+num_swe,
+                  variableid = 'H2OSNO', filetable=obs[i], reduced_var_id='H2OSNO_obs'+num_swe, read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region=region, weights=weights[i], vid=vid)))
          if num_obs != 0:
             if num_models == 2:
@@ -2021,11 +2021,11 @@ class lmwg_plot_set3(lmwg_plot_plan):
 
          for v in red_varlist:
             self.reduced_variables[v+'_ft1'] = reduced_variable(
-               variableid = v, filetable=ft, reduced_var_id=v+'_ft1',
+               variableid = v, filetable=ft, reduced_var_id=v+'_ft1', read_region=region,
                reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw0, vid=vid)))
             if num_models == 2:
                self.reduced_variables[v+'_ft2'] = reduced_variable(
-                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2',
+                  variableid = v, filetable=ft2, reduced_var_id=v+'_ft2', read_region=region,
                   reduction_function=(lambda x, vid: reduceMonthlyTrendRegion(x, region, weights=lw1, vid=vid)))
             self.single_plotspecs[v] = plotspec(vid=v+'_ft1', 
                zvars = [v+'_ft1'], zfunc=(lambda z:z),
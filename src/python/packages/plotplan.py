@@ -1,4 +1,4 @@
-import logging, pdb
+import logging, pdb, multiprocessing
 from numbers import Number
 from pprint import pprint
 import cdms2
@@ -10,6 +10,21 @@ from metrics.frontend.uvcdat import uvc_simple_plotspec
 
 logger = logging.getLogger(__name__)
 
+# The plot_plan whose reduced variables are being computed by a pool of worker processes.
+# The workers inherit it when the pool is forked, so it never has to be pickled.
+_pool_plan = None
+
+def _precompute_reduced_variable( i ):
+    """Run in a worker process: computes the i-th of _pool_plan._pool_keys, so that the result
+    will be saved in the on-disk cache of reduced variables.  Only a success flag is returned."""
+    v = _pool_plan._pool_keys[i]
+    try:
+        value = _pool_plan.reduced_variables[v].reduce( vid=None, gw=_pool_plan._gw_value(v) )
+        return value is not None
+    except Exception as e:
+        logger.debug("worker could not compute %s: %s", v, e)
+        return False
+
 
 class plot_plan(object):
     # ...I made this a new-style class so we can call __subclasses__ .
@@ -17,6 +32,8 @@ class plot_plan(object):
     name = "dummy plot_plan class"  # anything which will get instantiated should have a real plot set name.
     number = '0'    # anything which will get instantiated should have the plot set 'number' which appears in its name
     #                 The number is actually a short string, not a number - e.g. '3' or '4b'.
+    rvworkers = 1   # number of processes for computing reduced variables concurrently
+    free_intermediates = True  # forget values of variables which were needed only for derived variables
     def __repr__( self ):
         if hasattr( self, 'plotall_id' ):
             return self.__class__.__name__+'('+self.plotall_id+')'
@@ -134,70 +151,7 @@ class plot_plan(object):
         In the future regrid>0 will mean regrid everything to the finest grid and regrid<0
         will mean regrid everything to the coarsest grid."""
 
-        # Get gw (latitude Gaussian weights) variables first, if available - everything else may
-        # possibly need it.
-        # Note that the reduced_variables dict could have several gw variables.  Most will be
-        # wrong for this plot - the wrong filetable, or the wrong season, etc.
-        for v in self.reduced_variables.keys():
-            # v is normally a reduced_variable_ID (a named tuple) but for backwards compatibility
-            # we also have to support type(v)==str.
-            if v!='gw' and getattr(v,'var',None)!='gw':  
-                continue
-            #print v
-            value = self.reduced_variables[v].reduce(None)
-            try:
-                if  len(value.data)<=0:
-                    logger.error("No data for %s",v)
-            except: # value.data may not exist, or may not accept len()
-                try:
-                    if value.size<=0:
-                        logger.error("No data for %s",v)
-                except: # value.size may not exist
-                    pass
-            self.variable_values[v] = value  # could be None
-        for v in self.reduced_variables.keys():
-            # v is normally a reduced_variable_ID (a named tuple) but for backwards compatibility
-            # we also have to support type(v)==str.
-            if v=='gw' or getattr(v,'var',None)=='gw':  
-                continue
-            #print v
-            if type(v) is str:
-                gwid = 'gw'
-            else:
-                gwid = v._replace(var='gw')
-            gw = self.variable_values.get(gwid,None)
-            value = self.reduced_variables[v].reduce(vid=None,gw=gw)
-            try:
-                if  len(value.data)<=0:
-                    logger.error("No data for %s",v)
-            except: # value.data may not exist, or may not accept len()
-                try:
-                    if value.size<=0:
-                        logger.error("No data for %s",v)
-                except: # value.size may not exist
-                    pass
-            self.variable_values[v] = value  # could be None
-            #print value.id, value.shape
-        postponed = []   # derived variables we won't do right away
-
-        #print 'derived var'
-        for v in self.derived_variables.keys():
-            #print v
-            value = self.derived_variables[v].derive(self.variable_values)
-            #print value.id, value.shape
-            if value is None:
-                # couldn't compute v - probably it depends on another derived variables which
-                # hasn't been computed yet
-                postponed.append(v)
-            else:
-                self.variable_values[v] = value
-
-        #print 'postponed', postponed
-        for v in postponed:   # Finish up with derived variables
-            #print v
-            value = self.derived_variables[v].derive(self.variable_values)
-            #print value.id, value.shape
-            self.variable_values[v] = value  # could be None
+        self._compute_variables()
         varvals = self.variable_values
 
         for p, ps in self.single_plotspecs.iteritems():
@@ -383,6 +337,166 @@ class plot_plan(object):
         # pprint( self.plotspec_values.keys() )
         return self
 
+    def _is_gw( self, v ):
+        # v is normally a reduced_variable_ID (a named tuple) but for backwards compatibility
+        # we also have to support type(v)==str.
+        return v=='gw' or getattr(v,'var',None)=='gw'
+    def _gw_id( self, v ):
+        """returns the key of the gw (latitude Gaussian weights) variable for the reduced variable v"""
+        if type(v) is str:
+            return 'gw'
+        else:
+            return v._replace(var='gw')
+    def _gw_value( self, v ):
+        return self.variable_values.get( self._gw_id(v), None )
+
+    def _dependency_graph( self ):
+        """Returns a dict whose keys are the keys of all reduced and derived variables, and whose
+        values are lists of the keys of the variables which it is computed from.  Every reduced
+        variable depends on its gw variable, if any.  A derived variable depends on its inputs."""
+        nodes = set( self.reduced_variables.keys() ) | set( self.derived_variables.keys() )
+        inputs = {}
+        for v in self.reduced_variables.keys():
+            inputs[v] = []
+            if not self._is_gw(v) and self._gw_id(v) in self.reduced_variables:
+                inputs[v].append( self._gw_id(v) )
+        for v,dv in self.derived_variables.items():
+            inputs[v] = []
+            for i in dv.inputs():
+                try:
+                    if i in nodes and i!=v and i not in inputs[v]:
+                        inputs[v].append(i)
+                except TypeError:   # unhashable, can't be a variable key
+                    pass
+        return inputs
+
+    def _plotted_keys( self ):
+        """returns the set of keys of variables which plots are made from"""
+        keys = set()
+        for ps in self.single_plotspecs.values():
+            for att in ['zvars','z2vars','z3vars','z4vars']:
+                for k in ( getattr(ps,att,None) or [] ):
+                    # k is normally a key, but may be a variable object, whose ids are keys
+                    for kk in [ k, getattr(k,'_strid',None), getattr(k,'_id',None) ]:
+                        try:
+                            keys.add(kk)
+                        except TypeError:
+                            pass
+        return keys
+
+    def _compute_order( self, inputs ):
+        """Returns the keys of inputs (see _dependency_graph) in an order in which every variable
+        comes after the variables it depends on.  That's gw variables first, then the other reduced
+        variables, then derived variables as soon as their inputs are available.
+        If there is a cycle, the variables in it are put at the end, in no particular order."""
+        rvkeys = [ v for v in self.reduced_variables.keys() if self._is_gw(v) ] +\
+            [ v for v in self.reduced_variables.keys() if not self._is_gw(v) ]
+        dvkeys = [ v for v in self.derived_variables.keys() if v not in self.reduced_variables ]
+        waiting = { v:len(inputs[v]) for v in inputs }
+        consumers = { v:[] for v in inputs }
+        for v in inputs:
+            for i in inputs[v]:
+                consumers[i].append(v)
+        order = []
+        done = set()
+        ready = [ v for v in rvkeys+dvkeys if waiting[v]==0 ]
+        while len(ready)>0:
+            v = ready.pop(0)
+            order.append(v)
+            done.add(v)
+            for c in consumers[v]:
+                waiting[c] -= 1
+                if waiting[c]==0:
+                    ready.append(c)
+        cycle = [ v for v in rvkeys+dvkeys if v not in done ]
+        if len(cycle)>0:
+            logger.warning("circular dependencies among variables %s", cycle)
+        return order+cycle
+
+    def _precompute_reduced_variables( self, keys ):
+        """Computes the reduced variables named by keys in self.rvworkers processes.  The results
+        are left in the on-disk cache of reduced variables (see metrics.fileio.rvcache), where
+        reduce() will then find them.  Variables which won't be cached, e.g. because their
+        filetable doesn't have such a cache, are not done here, as they would be computed again.
+        The gw variables should have been computed already."""
+        global _pool_plan
+        nocache = [ v for v in keys
+                    if getattr( self.reduced_variables[v].filetable, 'rvcache', None ) is None ]
+        if len(nocache)>0:
+            logger.warning("--rvworkers needs --rvcache yes; %d reduced variables will be computed"
+                           " serially", len(nocache))
+        keys = [ v for v in keys if v not in nocache and
+                 self.reduced_variables[v].cacheable_key( None, self._gw_value(v) ) is not None ]
+        nworkers = min( self.rvworkers, len(keys) )
+        if nworkers<=1:
+            return
+        self._pool_keys = keys
+        _pool_plan = self
+        pool = multiprocessing.Pool( nworkers )
+        try:
+            for v,ok in zip( keys, pool.imap( _precompute_reduced_variable, range(len(keys)) ) ):
+                if not ok:
+                    logger.debug("reduced variable %s was not precomputed", v)
+        finally:
+            pool.close()
+            pool.join()
+            _pool_plan = None
+            del self._pool_keys
+
+    def _compute_variables( self ):
+        """Computes the values of all reduced and derived variables and puts them in
+        self.variable_values.  Each is computed after the variables it depends on.  If
+        self.free_intermediates is True, a variable is forgotten as soon as every derived variable
+        using it has been computed, unless it's to be plotted or is a gw variable."""
+        inputs = self._dependency_graph()
+        order = self._compute_order( inputs )
+        plotted = self._plotted_keys()
+        nconsumers = { v:0 for v in inputs }
+        for v in inputs:
+            for i in inputs[v]:
+                nconsumers[i] += 1
+
+        computed = set()
+        if self.rvworkers>1:
+            for v in order:
+                if v in self.reduced_variables and self._is_gw(v):
+                    self._compute_variable(v)
+                    computed.add(v)
+            self._precompute_reduced_variables(
+                [ v for v in order if v in self.reduced_variables and not self._is_gw(v) ] )
+
+        for v in order:
+            if v not in computed:
+                self._compute_variable(v)
+            if not self.free_intermediates:
+                continue
+            for i in inputs[v]:
+                nconsumers[i] -= 1
+                if nconsumers[i]==0 and i not in plotted and not self._is_gw(i) and\
+                        i in self.variable_values:
+                    del self.variable_values[i]
+
+    def _compute_variable( self, v ):
+        """Computes the value of the reduced or derived variable v and puts it in
+        self.variable_values.  The value may be None."""
+        if v in self.reduced_variables:
+            if self._is_gw(v):
+                value = self.reduced_variables[v].reduce(None)
+            else:
+                value = self.reduced_variables[v].reduce( vid=None, gw=self._gw_value(v) )
+            try:
+                if  len(value.data)<=0:
+                    logger.error("No data for %s",v)
+            except: # value.data may not exist, or may not accept len()
+                try:
+                    if value.size<=0:
+                        logger.error("No data for %s",v)
+                except: # value.size may not exist
+                    pass
+        else:
+            value = self.derived_variables[v].derive(self.variable_values)
+        self.variable_values[v] = value  # could be None
+
     def compute_plot_var_value( self, ps, zvars, zfunc ):
         """Inputs: a plotspec object, a list zvars of precursor variables, and a function zfunc.
         This method computes the variable z to be plotted as zfunc(zvars), and returns it.
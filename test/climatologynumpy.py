@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Checks the numpy engine of calculate_seasonal_climatology() against cdutil's climatology(), on
+# complete seasons of data without missing values, where the two should agree; that for DJF in
+# calendar years, which begin and end with incomplete DJFs, the numpy engine gives the mean of all
+# the DJF months and so differs from cdutil; and that cdutil is still used unless
+# reductions.numpy_climatology is set.  Uses synthetic data, so needs no arguments.
+
+import sys, os
+import numpy
+from perfcheck import *
+import metrics, cdms2, cdutil
+import metrics.computation.reductions as reductions
+from metrics.computation.reductions import calculate_seasonal_climatology
+
+args = parse_args( "Compare seasonal climatologies computed with numpy and with cdutil" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+def read_variables( first ):
+    """TS and T for three years of monthly data from first, a (year,month) pair, in one file."""
+    fname = write_monthly_files( datadir, first=first, nmonths=36, months_per_file=36 )[0]
+    f = cdms2.open( fname )
+    variables = [ f('TS'), f('T') ]
+    f.close()
+    return variables
+# Three calendar years.  Their DJFs are incomplete at both ends, so DJF is checked separately.
+variables = read_variables( (1,1) )
+seasons = [ 'MAM', 'JJA', 'SON', 'ANN' ]
+
+check( reductions.numpy_climatology is False, "cdutil should compute climatologies by default" )
+reductions.climatology_weights.clear()
+bycdutil = {}
+for V in variables:
+    for season in seasons:
+        bycdutil[V.id,season] = calculate_seasonal_climatology( V, season )
+check( len(reductions.climatology_weights)==0,
+       "seasonal weights were computed although numpy_climatology is False" )
+
+reductions.numpy_climatology = True
+try:
+    for V in variables:
+        for season in seasons:
+            what = "%s, %s" % (V.id,season)
+            bynumpy = calculate_seasonal_climatology( V, season )
+            check( same_values( bynumpy, bycdutil[V.id,season], rtol=1.e-5 ) and
+                   same_axes( bynumpy, bycdutil[V.id,season] ),
+                   "%s: the numpy climatology differs from cdutil's" % what )
+            # cdutil's result, for comparison with the direct call.
+            cseason = cdutil.times.Seasons( 'JFMAMJJASOND' if season=='ANN' else season )
+            direct = cseason.climatology( V )
+            check( same_values( bynumpy, direct[0], rtol=1.e-5 ),
+                   "%s: the numpy climatology differs from cdutil's climatology()" % what )
+    check( len(reductions.climatology_weights)==1,
+           "the weights of the time axis should have been computed once, not %d times" %
+           len(reductions.climatology_weights) )
+
+    # DJF in the calendar years: cdutil averages the means of whole DJFs, Dec-Jan-Feb, while
+    # numpy averages all the 9 DJF months, including Jan and Feb of the first year and Dec of the
+    # last, each weighted by its length in days.
+    lengths = { 0:31., 1:28., 11:31. }    # Jan, Feb, Dec in the noleap calendar
+    months = [ m for m in range(36) if m%12 in lengths ]
+    for V in variables:
+        what = "%s, DJF of calendar years" % V.id
+        bynumpy = calculate_seasonal_climatology( V, 'DJF' )
+        expected = numpy.ma.average( numpy.ma.asarray(V)[months], axis=0,
+                                     weights=[ lengths[m%12] for m in months ] )
+        check( numpy.allclose( numpy.ma.asarray(bynumpy), expected, rtol=1.e-5 ),
+               "%s: the numpy climatology is not the mean of all the DJF months" % what )
+        reductions.numpy_climatology = False
+        bycdutil = calculate_seasonal_climatology( V, 'DJF' )
+        reductions.numpy_climatology = True
+        check( not same_values( bynumpy, bycdutil, rtol=1.e-5 ),
+               "%s: the numpy climatology should differ from cdutil's" % what )
+
+    # DJF in years from December, which are all whole DJFs: the engines agree.
+    for V in read_variables( (1,12) ):
+        what = "%s, DJF of years from December" % V.id
+        bynumpy = calculate_seasonal_climatology( V, 'DJF' )
+        reductions.numpy_climatology = False
+        bycdutil = calculate_seasonal_climatology( V, 'DJF' )
+        reductions.numpy_climatology = True
+        check( same_values( bynumpy, bycdutil, rtol=1.e-5 ) and same_axes( bynumpy, bycdutil ),
+               "%s: the numpy climatology differs from cdutil's" % what )
+finally:
+    reductions.numpy_climatology = False
+
+cleanup( args )
+finish()
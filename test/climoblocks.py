@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# Checks that averaging all of an input file's times for a season at once (block_time_avg) gives
+# the same climatologies as the original averaging of one time at a time (two_pt_avg).  The input
+# files have several months each, and a variable whose mask changes from month to month.  Uses
+# synthetic data, so needs no arguments.
+
+import sys, os
+from perfcheck import *
+import metrics
+import metrics.frontend.inc_reduce as inc_reduce
+from metrics.frontend.climatology import climos
+
+args = parse_args( "Compare block and per-time averaging of climatologies" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+update_time_avg = inc_reduce.update_time_avg
+def per_time_update( *args, **kwargs ):
+    """update_time_avg, but averaging in one time at a time, as originally"""
+    kwargs['blockwise'] = False
+    return update_time_avg( *args, **kwargs )
+
+seasons = [ 'ANN', 'DJF', 'JAN' ]
+varnames = [ 'TS', 'PS', 'T', 'MISSV' ]
+for months_per_file in [ 1, 3, 12 ]:
+    datadir = tempdir()
+    outdir = tempdir()
+    files = write_monthly_files( datadir, first=(1,1), nmonths=24, months_per_file=months_per_file )
+    templates = {}
+    for blockwise in [ True, False ]:
+        templates[blockwise] = os.path.join( outdir, 'synth_%s_XXX_climo.nc' % blockwise )
+        inc_reduce.update_time_avg = update_time_avg if blockwise else per_time_update
+        try:
+            climos( templates[blockwise], seasons, varnames, files )
+        finally:
+            inc_reduce.update_time_avg = update_time_avg
+    for season in seasons:
+        check( same_files( templates[True].replace('XXX',season),
+                           templates[False].replace('XXX',season) ),
+               "season %s, %d months per file: block average differs" % (season,months_per_file) )
+
+cleanup( args )
+finish()
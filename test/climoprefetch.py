@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Checks that reading input files ahead in a background process (climatology.py --prefetch) gives
+# the same climatologies as reading them in turn; that prefetch_datasets() yields every file, in
+# order, whatever its limits, with the same data as the file; that its reader reads only under
+# the lock; and that the reader stops with the generator.  Uses synthetic data, so needs no
+# arguments.
+
+import sys, os, time, threading, multiprocessing
+from perfcheck import *
+import metrics, cdms2
+import metrics.frontend.climatology as climatology
+from metrics.frontend.inc_reduce import prefetch_datasets
+
+args = parse_args( "Compare climatologies computed with and without prefetching" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+outdir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=14 )
+varids = [ 'TS', 'T', 'MISSV', 'NOSUCHVAR' ]
+f = cdms2.open( files[0] )
+nbytes = f('TS').nbytes + f('T').nbytes + f('MISSV').nbytes
+f.close()
+
+for depth,maxbytes in [ (0,None), (1,None), (3,None), (4,nbytes//2), (20,3*nbytes) ]:
+    what = "prefetch_datasets(depth=%d,maxbytes=%s)" % (depth,maxbytes)
+    yielded = []
+    for filen,ds in prefetch_datasets( files, varids, depth, maxbytes ):
+        yielded.append( filen )
+        if depth<1:
+            check( ds is None, "%s: read ahead" % what )
+            continue
+        if not check( ds is not None, "%s: nothing was read ahead of %s" % (what,filen) ):
+            continue
+        f = cdms2.open( filen )
+        check( sorted(ds.variables.keys())==[ 'MISSV', 'T', 'TS' ],
+               "%s: read %s" % (what,sorted(ds.variables.keys())) )
+        for varid in ds.variables.keys():
+            check( same_values( ds(varid), f(varid) ) and same_axes( ds(varid), f(varid) ),
+                   "%s: %s differs from %s in the file" % (what,varid,filen) )
+        check( same_values( ds.getAxis('time').getBounds(), f.getAxis('time').getBounds() ),
+               "%s: the time bounds differ" % what )
+        f.close()
+    check( yielded==files, "%s did not yield the files in order" % what )
+withbad = files[0:3] + [ os.path.join(datadir,'nosuchfile.nc') ] + files[3:5]
+yielded = list( prefetch_datasets( withbad, varids, 2 ) )
+check( [ filen for filen,ds in yielded ]==withbad and yielded[3][1] is None,
+       "a missing file should be yielded like the others, with nothing read" )
+
+# The reader waits for the lock.
+lock = multiprocessing.Lock()
+lock.acquire()
+threading.Timer( 1.0, lock.release ).start()
+t0 = time.time()
+for filen,ds in prefetch_datasets( files, varids, 2, None, lock ):
+    check( time.time()-t0>=0.9, "the reader read without the lock" )
+    break
+# Stopping early must stop the reader process.
+check( len(multiprocessing.active_children())==0, "the reader process outlived its generator" )
+
+seasons = [ 'ANN', 'DJF', 'JJA' ]
+varnames = [ 'TS', 'PS', 'T', 'MISSV' ]
+for singlepass in [ False, True ]:
+    templates = {}
+    for prefetch,prefetch_bytes in [ (0,None), (2,None), (3,2*nbytes) ]:
+        climatology.prefetch, climatology.prefetch_bytes = prefetch, prefetch_bytes
+        templates[prefetch] = os.path.join( outdir, 'synth_%s_%d_XXX_climo.nc' % (singlepass,prefetch) )
+        climatology.climos( templates[prefetch], seasons, varnames, files, [], singlepass )
+    climatology.prefetch, climatology.prefetch_bytes = 0, None
+    for prefetch in [ 2, 3 ]:
+        for season in seasons:
+            check( same_files( templates[0].replace('XXX',season),
+                               templates[prefetch].replace('XXX',season) ),
+                   "season %s, singlepass=%s: climatology differs with prefetch=%d" %
+                   (season,singlepass,prefetch) )
+
+cleanup( args )
+finish()
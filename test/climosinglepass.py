@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Checks that climos() with singlepass=True, which reads each input file once for all seasons,
+# writes the same climatology files as the original computation, one season at a time.  Uses
+# synthetic data, so needs no arguments.
+
+import sys, os
+from perfcheck import *
+import metrics
+from metrics.frontend.climatology import climos
+
+args = parse_args( "Compare single-pass and per-season climatologies" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+outdir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=26 )
+seasons = [ 'ANN', 'DJF', 'MAM', 'JJA', 'SON', 'JAN', 'JUL', 'DEC' ]
+varnames = [ 'TS', 'PS', 'T', 'MISSV', 'hyam', 'hybm', 'gw', 'P0' ]
+omit = [ [ 'DJF', files[0], files[1] ] ]   # an incomplete DJF at the start
+
+for omitBySeason in [ [], omit ]:
+    templates = {}
+    for singlepass in [ False, True ]:
+        templates[singlepass] = os.path.join( outdir, 'synth_%s_%d_XXX_climo.nc' %
+                                              (singlepass,len(omitBySeason)) )
+        climos( templates[singlepass], seasons, varnames, files, omitBySeason, singlepass )
+    for season in seasons:
+        check( same_files( templates[False].replace('XXX',season),
+                           templates[True].replace('XXX',season) ),
+               "season %s, omitting %s: single-pass climatology differs" % (season,omitBySeason) )
+
+# Every file is handed back once, after its data has been read.
+done = []
+climos( os.path.join( outdir, 'synth_done_XXX_climo.nc' ), [ 'DJF', 'JJA' ], varnames, files,
+        singlepass=True, file_done=done.append )
+check( sorted(done)==sorted(files) and len(set(done))==len(done),
+       "every file should be handed back once, not %s" % done )
+# The files are monthly from January; those in neither season are never read.
+unused = [ fn for i,fn in enumerate(files) if i%12 not in (11,0,1,5,6,7) ]
+check( sorted(done[:len(unused)])==unused, "unread files should be handed back first" )
+check( done[len(unused):]==sorted(done[len(unused):]),
+       "files should be handed back in order, as their data is read" )
+
+cleanup( args )
+finish()
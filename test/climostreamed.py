@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Checks the way acme_climo_regrid streams in-memory datasets into climos(): the climatologies are
+# the same as those computed from the files; every dataset is handed back by climos() and
+# unregistered, and none is used after that; and datasets which climos() never opens are dropped
+# as soon as they arrive.  The
+# datasets are copies of synthetic files rather than regridded data, so needs no arguments.
+
+import sys, os
+from perfcheck import *
+import metrics, cdms2
+import metrics.fileio.multifile as multifile
+from metrics.fileio.memdataset import memory_dataset
+from metrics.frontend.climatology import climos
+from metrics.packages.acme_regridder.scripts.acme_climo_regrid import streamed_datasets
+
+args = parse_args( "Compare climatologies of streamed datasets and of files" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+outdir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=14 )
+# The datasets have names like the regridded files of acme_climo_regrid, which are not written.
+names = [ os.path.join( outdir, 'regrid_'+os.path.basename(fn) ) for fn in files ]
+
+def in_memory( fn, name ):
+    """A memory_dataset named name, with the contents of the file fn."""
+    f = cdms2.open( fn )
+    ds = memory_dataset( name, f.attributes )
+    for varid in f.variables.keys():
+        V = f[varid]
+        if V.rank()==0:
+            ds.add_variable( cdms2.createVariable( V.getValue(), id=varid,
+                                                   attributes=dict(V.attributes) ) )
+        else:
+            ds.add_variable( V(), varid )
+    f.close()
+    return ds
+
+for seasons in [ [ 'DJF', 'MAM', 'JJA', 'SON', 'ANN' ], [ 'DJF', 'JJA' ] ]:
+    what = "seasons %s" % seasons
+    unused = []
+    if seasons==[ 'DJF', 'JJA' ]:
+        # The files are monthly from January; those in neither season won't be opened.
+        unused = [ name for i,name in enumerate(names) if i%12 not in (11,0,1,5,6,7) ]
+        check( len(unused)>0, "%s: some datasets should not be opened" % what )
+    yielded = []
+    def datasets():
+        for fn, name in zip( files, names ):
+            # By now, the datasets which won't be opened have been dropped.
+            check( not any([ u in stream.ready for u in unused ]),
+                   "%s: a dataset which won't be opened was kept" % what )
+            yielded.append( name )
+            yield in_memory( fn, name )
+    stream = streamed_datasets( names, datasets() )
+    streamed = os.path.join( outdir, 'streamed_%d_XXX_climo.nc' % len(seasons) )
+    try:
+        climos( streamed, seasons, ['ALL'], names, singlepass=True, file_done=stream.done )
+    except RuntimeError as e:   # a dataset was used after it had been handed back
+        check( False, "%s: %s" % (what,e) )
+    finally:
+        finished = set( stream.finished )
+        ready = dict( stream.ready )
+        registered = [ name for name in names if name in multifile._aggregations ]
+        stream.unregister_all()
+    check( yielded==names, "%s: datasets were not all taken, in order" % what )
+    check( finished==set(names), "%s: datasets not handed back: %s" %
+           ( what, sorted( set(names)-finished ) ) )
+    check( ready=={}, "%s: datasets still held: %s" % (what,sorted(ready.keys())) )
+    check( registered==[], "%s: datasets still registered: %s" % (what,registered) )
+
+    fromfiles = os.path.join( outdir, 'files_%d_XXX_climo.nc' % len(seasons) )
+    climos( fromfiles, seasons, ['ALL'], files, singlepass=True )
+    for season in seasons:
+        check( same_files( streamed.replace('XXX',season), fromfiles.replace('XXX',season) ),
+               "%s: streamed climatology for %s differs" % (what,season) )
+
+cleanup( args )
+finish()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Checks diags --jobs: the jobs file is read and checked; each job is run with its options in place
+# of the command line's, and with the options as they would be for a diags run of that job alone;
+# a failing job, or one which quits, is reported without stopping the others; and the report is
+# written.  run_diags() is replaced by a stand-in, so needs no arguments.
+
+import sys, os, json
+from perfcheck import *
+import metrics
+import metrics.frontend.diags as diags
+import metrics.fileio.findfiles as findfiles
+from metrics.frontend.options import Options
+
+args = parse_args( "Check diags --jobs" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+modeldir = tempdir()
+outdir = tempdir()
+
+def write_jobs( jobs, name='jobs.json' ):
+    fname = os.path.join( outdir, name )
+    f = open( fname, 'w' )
+    json.dump( jobs, f )
+    f.close()
+    return fname
+
+def command_options( extra ):
+    o = Options()
+    o.parseCmdLine( [ 'diags', '--model', 'path=%s,climos=no' % modeldir, '--outputdir', outdir,
+                      '--plots', 'no', '--seasons', 'ANN', '--vars', 'TS' ] + extra )
+    return o
+
+# Reading the jobs file.
+jobs = diags.read_jobs( write_jobs(
+        [ { "sets":"5", "vars":["TS","PRECT"], "seasons":["JJA","DJF","ANN"] },
+          { "sets":["4"], "vars":"T", "seasons":"SON", "regions":"Tropics", "varopts":[850] } ] ) )
+check( jobs==[ { 'sets':['5'], 'vars':['TS','PRECT'], 'times':['DJF','JJA','ANN'] },
+               { 'sets':['4'], 'vars':['T'], 'times':['SON'], 'regions':['Tropics'],
+                 'varopts':['850'] } ],
+       "jobs read as %s" % jobs )
+for bad in [ { "sets":"5" }, [ { "sets":"5", "variables":"T" } ], [ "5 T" ] ]:
+    try:
+        diags.read_jobs( write_jobs( bad, 'bad.json' ) )
+        check( False, "jobs file %s should be rejected" % json.dumps(bad) )
+    except ValueError:
+        pass
+
+# Running the jobs.  Jobs for the variable BAD fail, and for QUIT quit as run_diags() sometimes does.
+ran = []
+def fake_run_diags( opts, canvases=None ):
+    ran.append( dict( [ (key,opts[key]) for key in
+                        [ 'sets', 'vars', 'times', 'regions', 'varopts', 'levels', 'difflevels',
+                          'displayunits', 'model' ] ] ) )
+    check( canvases==(None,None), "the canvases should be passed on" )
+    check( findfiles.keep_filetables, "filetables should be kept for the following jobs" )
+    if 'BAD' in opts['vars']:
+        raise ValueError( "no variable BAD" )
+    if 'QUIT' in opts['vars']:
+        quit()
+diags.run_diags = fake_run_diags
+
+joblist = [ { "sets":"5", "vars":"PRECT", "seasons":["JJA","DJF"] },
+            { "sets":"5", "vars":"BAD" },
+            { "vars":"QUIT", "seasons":"MAM" },
+            { "sets":"6", "vars":["SWCF","TS"], "regions":"Tropics" } ]
+opts = command_options( [ '--set', '4', '--jobs', write_jobs(joblist) ] )
+results = diags.run_diags_batch( opts )
+
+check( len(ran)==len(joblist), "%d jobs were run, not %d" % (len(ran),len(joblist)) )
+check( [ result['status'] for result in results ]==[ 'ok', 'failed', 'failed', 'ok' ],
+       "job status %s" % [ result['status'] for result in results ] )
+check( results[1]['error']=='ValueError: no variable BAD' and
+       results[2]['error'].startswith('SystemExit') and
+       results[0]['error'] is None and results[3]['error'] is None,
+       "job errors %s" % [ result['error'] for result in results ] )
+check( all([ result['seconds']>=0 for result in results ]), "every job should be timed" )
+reportfile = os.path.join( outdir, 'diags_jobs_report.json' )
+if check( os.path.isfile(reportfile), "no report was written" ):
+    report = json.load( open(reportfile) )
+    check( [ (r['job'],r['status'],r['error']) for r in report ]==
+           [ (r['job'],r['status'],r['error']) for r in results ],
+           "the report differs from the results" )
+
+# Each job's options are the command line's, but for those in the job; and they are what diags
+# would use to run that job by itself.
+for job, used in zip( joblist, ran ):
+    extra = [ '--set', job.get('sets','4') ]
+    for key, option in [ ('vars','--vars'), ('seasons','--seasons'), ('regions','--regions') ]:
+        if key in job:
+            value = job[key]
+            extra += [ option ] + ( value if type(value) is list else [value] )
+    alone = command_options( extra )
+    alone.verifyOptions()
+    for key, value in used.items():
+        check( value==alone[key], "job %s: option %s is %s, not %s" % (job,key,value,alone[key]) )
+check( ran[0]['levels']!=ran[3]['levels'],
+       "levels chosen for one job's variable should not be used for another's" )
+
+cleanup( args )
+finish()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Checks metadiags' diags_pool: every submitted command line is run and reported once, with its
+# status; a diagnostic can start processes of its own (as plot_plan() does with --rvworkers>1),
+# which a daemonic worker could not; workers are replaced after --diagsrecycle diagnostics, and
+# when they die; and terminate() stops idle workers.  The diags command lines are replaced by
+# stand-ins, so needs no arguments.
+
+import sys, os, time, multiprocessing
+from perfcheck import *
+import metrics
+import metrics.frontend.metadiags as metadiags
+
+args = parse_args( "Check the metadiags worker pool" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+outdir = tempdir()
+
+def square( x ):
+    return x*x
+
+def run_job( cmd ):
+    """A stand-in for run_diags_cmd(), for command lines "job <n> <ok|fail|crash>".  An ok job
+    computes with a pool of processes, and writes its worker's pid and the result to a file."""
+    words = cmd.split()
+    n, mode = int(words[1]), words[2]
+    if mode=='crash':
+        os._exit(3)
+    if mode=='fail':
+        return 1
+    pool = multiprocessing.Pool( 2 )
+    total = sum( pool.map( square, range(n) ) )
+    pool.close()
+    pool.join()
+    with open( os.path.join(outdir,'job%d' % n), 'w' ) as f:
+        f.write( '%d %d' % (os.getpid(), total) )
+    return 0
+metadiags.run_diags_cmd = run_job
+
+finished = []
+metadiags.job_finished = lambda cmd, succeeded: finished.append( (cmd,succeeded) )
+
+recycle = 2
+pool = metadiags.diags_pool( 3, recycle )
+check( all([ not p.daemon for p in pool.workers.values() ]), "workers should not be daemonic" )
+expected = {}
+for n in range(1,9):
+    cmd = 'job %d ok' % n
+    pool.submit( cmd )
+    expected[cmd] = True
+for cmd in [ 'job 20 fail', 'job 21 crash' ]:
+    pool.submit( cmd )
+    expected[cmd] = False
+pool.close()
+check( sorted(finished)==sorted(expected.items()),
+       "jobs finished %s, not %s" % (sorted(finished),sorted(expected.items())) )
+check( pool.workers=={} and pool.pending==0, "the pool should be empty after close()" )
+
+pids = {}
+for n in range(1,9):
+    fname = os.path.join( outdir, 'job%d' % n )
+    if not check( os.path.isfile(fname), "job %d wrote nothing" % n ):
+        continue
+    pid, total = [ int(w) for w in open(fname).read().split() ]
+    check( total==sum([ i*i for i in range(n) ]), "job %d computed %d" % (n,total) )
+    pids[pid] = pids.get( pid, 0 ) + 1
+check( max(pids.values())<=recycle,
+       "a worker ran %d jobs, more than --diagsrecycle %d" % (max(pids.values()),recycle) )
+check( len(pids)>=4, "the workers were not replaced: only %d ran jobs" % len(pids) )
+
+# Idle workers are stopped by terminate(), as they are when metadiags exits without close().
+pool = metadiags.diags_pool( 2 )
+workers = pool.workers.values()
+pool.terminate()
+check( all([ not p.is_alive() for p in workers ]) and pool.workers=={},
+       "terminate() should stop the workers" )
+
+cleanup( args )
+finish()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Startup time of diags.  metadiags runs diags once for every diagnostic, so the time diags takes
+# to start (mostly importing modules) is paid thousands of times.  This times, in fresh
+# processes:
+#   import: importing metrics.frontend.diags
+#   list:   diags --list sets --package AMWG
+#   plot:   one single-plot run of diags, on the test data
+# and checks that importing diags does not import the modules which are meant to be imported
+# only when first needed (vcs, the plotting modules, and the plot sets).
+# Arguments:
+#   --datadir=<data location> - with subdirectories cam_output and obs_atmos, for the plot run.
+#       If omitted, the plot run is skipped.
+#   --repeat=<n> - time each command n times, and report the fastest and the median.
+#   --record=<file> - append the timings, as a line of JSON, to this file, to track them over time.
+#   --max-list=<seconds>, --max-plot=<seconds> - fail if the fastest time exceeds this.
+
+import sys, os, shutil, tempfile, subprocess, time, json, argparse
+import metrics
+
+# Modules which importing diags should not import.
+lazy_modules = [ 'vcs', 'metrics.frontend.it', 'metrics.frontend.amwg_plotting',
+                 'metrics.packages.lmwg.lmwg' ] +\
+               [ 'metrics.packages.amwg.amwg%d' % i for i in range(1,16) ]
+
+def time_command( cmd, repeat ):
+    """Runs the command cmd (a list) repeat times, and returns the times in seconds, sorted."""
+    times = []
+    devnull = open( os.devnull, 'w' )
+    for i in range(repeat):
+        t0 = time.time()
+        status = subprocess.call( cmd, stdout=devnull, stderr=subprocess.STDOUT )
+        times.append( time.time() - t0 )
+        if status != 0:
+            print "FAIL:", ' '.join(cmd), "exited with status", status
+            sys.exit(1)
+    devnull.close()
+    times.sort()
+    return times
+
+def eagerly_imported():
+    """Returns the members of lazy_modules which are imported by importing diags."""
+    script = "import sys, metrics.frontend.diags\n" +\
+        "print ' '.join([m for m in %r if m in sys.modules])" % lazy_modules
+    return subprocess.check_output( [sys.executable, '-c', script] ).split()
+
+p = argparse.ArgumentParser(description="Time the startup of diags")
+p.add_argument("--datadir", dest="datadir", help="root directory for model and obs data")
+p.add_argument("--repeat", dest="repeat", type=int, default=3, help="times to run each command")
+p.add_argument("--record", dest="record", help="file to append the timings to")
+p.add_argument("--max-list", dest="max_list", type=float, help="maximum seconds for diags --list sets")
+p.add_argument("--max-plot", dest="max_plot", type=float, help="maximum seconds for one plot")
+args = p.parse_args(sys.argv[1:])
+
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+eager = eagerly_imported()
+if len(eager) > 0:
+    print "FAIL: importing diags imports", ' '.join(eager)
+    sys.exit(1)
+
+commands = {
+    'import': [ sys.executable, '-c', 'import metrics.frontend.diags' ],
+    'list': [ 'diags', '--list', 'sets', '--package', 'AMWG' ] }
+outpath = None
+if args.datadir is not None:
+    outpath = tempfile.mkdtemp()
+    commands['plot'] = [ 'diags', '--no-antialiasing', '--outputdir', outpath,
+                         '--model', 'path=%s,climos=no' % os.path.join(args.datadir,'cam_output'),
+                         '--obs', "path=%s,filter=f_contains('NCEP'),climos=yes" %\
+                             os.path.join(args.datadir,'obs_atmos'),
+                         '--package', 'AMWG', '--set', '3', '--var', 'T', '--seasons', 'JJA' ]
+
+timings = { 'version':metrics.git.commit, 'date':time.strftime('%Y-%m-%d %H:%M:%S') }
+try:
+    for name in ['import', 'list', 'plot']:
+        if name not in commands:
+            continue
+        times = time_command( commands[name], args.repeat )
+        timings[name] = { 'min':times[0], 'median':times[len(times)/2] }
+        print "%-6s fastest %.2f s, median %.2f s" % (name, times[0], times[len(times)/2])
+finally:
+    if outpath is not None:
+        shutil.rmtree( outpath, ignore_errors=True )
+
+if args.record is not None:
+    f = open( args.record, 'a' )
+    f.write( json.dumps(timings, sort_keys=True) + '\n' )
+    f.close()
+
+failed = False
+for name, limit in [('list', args.max_list), ('plot', args.max_plot)]:
+    if limit is not None and name in timings and timings[name]['min'] > limit:
+        print "FAIL: %s took %.2f s, more than %.2f s" % (name, timings[name]['min'], limit)
+        failed = True
+if failed:
+    sys.exit(1)
+print "PASS"
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 """" In this file the inputs for the test are defined and passed to diags_test.execute"""
 import diags_test
-from metrics.packages.amwg.amwg import amwg_plot_set8
+from metrics.packages.amwg.amwg8 import amwg_plot_set8
 
 print amwg_plot_set8.name
 
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 """" In this file the inputs for the test are defined and passed to diags_test.execute"""
 import diags_test
-from metrics.packages.amwg.amwg import amwg_plot_set9
+from metrics.packages.amwg.amwg9 import amwg_plot_set9
 
 print amwg_plot_set9.name
 
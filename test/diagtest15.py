@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 """" In this file the inputs for the test are defined and passed to diags_test.execute"""
 import diags_test
-from metrics.packages.amwg.amwg import amwg_plot_set15
+from metrics.packages.amwg.amwg15 import amwg_plot_set15
 
 print amwg_plot_set15.name
 
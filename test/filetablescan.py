@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Checks that a filetable built by scanning the file headers in several processes
+# (--scanworkers) is the same as one built by scanning them serially, and gives the same bad-file
+# warnings, within one budget of warnings for the whole scan.
+# Arguments:
+#   --datadir=<data location> - with subdirectories cam_output and obs_atmos.
+
+import sys, os, logging
+from perfcheck import *
+import metrics
+from metrics.fileio.filetable import basic_filetable, report_file_problems
+
+args = parse_args( "Compare serial and parallel filetable scans" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+class recorder(logging.Handler):
+    """Records the messages of warnings."""
+    def __init__( self ):
+        logging.Handler.__init__( self, logging.WARNING )
+        self.messages = []
+    def emit( self, record ):
+        self.messages.append( record.getMessage() )
+warnings = recorder()
+logging.getLogger('metrics.fileio.filetable').addHandler( warnings )
+
+def data_files( path ):
+    """Returns the files in the directory tree under path, sorted."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk( path ):
+        files += [ os.path.join(dirpath,f) for f in filenames if f[0]!='.' ]
+    return sorted( files )
+
+# Problems of several files are reported until the budget is spent, checking it after each axis.
+problems = [ [ [(False,['a1'])], [(True,['a2','a2 again'])] ], [ [(False,['b1']),(False,['b2'])] ] ]
+maxwarn = 2
+for fileproblems in problems:
+    bad, maxwarn = report_file_problems( fileproblems, maxwarn )
+check( warnings.messages[0:3]==['a1','a2','a2 again'] and len(warnings.messages)==4 and
+       maxwarn==0, "warnings beyond the budget: %s" % warnings.messages )
+
+for subdir in [ 'cam_output', 'obs_atmos' ]:
+    files = data_files( os.path.join( args.datadir, subdir ) )
+    check( len(files)>1, "no test data in %s" % subdir )
+    tables = {}
+    messages = {}
+    for nworkers in [ 1, 3 ]:
+        opts = make_options( tempdir(), scanworkers=nworkers )
+        del warnings.messages[:]
+        ft = basic_filetable( make_datafiles(files,opts), opts, subdir )
+        tables[nworkers] = ft
+        messages[nworkers] = list( warnings.messages )
+    serial, parallel = tables[1], tables[3]
+    check( messages[1]==messages[3] and serial.maxfilewarn==parallel.maxfilewarn,
+           "%s: bad-file warnings differ between serial and parallel scans" % subdir )
+    check( filetable_rows(serial)==filetable_rows(parallel),
+           "%s: rows differ between serial and parallel scans" % subdir )
+    check( serial.filefmt==parallel.filefmt, "%s: file formats differ" % subdir )
+    for axes in [ 'lataxes', 'lonaxes', 'levaxes' ]:
+        check( getattr(serial,axes)==getattr(parallel,axes), "%s: %s differ" % (subdir,axes) )
+    check( sorted(serial._varindex.keys())==sorted(parallel._varindex.keys()),
+           "%s: variable indices differ" % subdir )
+    for var in serial.list_variables()[0:5]:
+        check( [r.fileid for r in serial.find_files(var)]==
+               [r.fileid for r in parallel.find_files(var)],
+               "%s: find_files(%s) differs" % (subdir,var) )
+
+cleanup( args )
+finish()
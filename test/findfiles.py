@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Checks that basic_filetable.find_files(), which uses season and time indices and memoizes its
+# results, finds the same rows as the original linear search through all the rows of a variable.
+# Also checks that memoized results aren't shared by filters which do different things.
+# Uses a synthetic filetable, so needs no arguments.
+
+import sys, itertools
+import numpy
+from perfcheck import *
+import metrics
+from metrics.fileio.filetable import basic_filetable, ftrow, drange
+from metrics.fileio.filters import basic_filter, f_contains, f_endswith, f_and, f_not, filter_key
+
+args = parse_args( "Compare indexed and linear searches of a filetable" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+def linear_find_files( ft, variable, time_range=None, lat_range=drange(), lon_range=drange(),
+                       level_range=drange(), seasonid=None, filefilter=None ):
+    """find_files() as it was before the indices: a search through all rows of the variable."""
+    def matches( row ):
+        return lat_range.overlaps_with( row.latrange ) and\
+            lon_range.overlaps_with( row.lonrange ) and\
+            level_range.overlaps_with( row.levelrange ) and\
+            ( filefilter is None or filefilter(row.fileid) )
+    candidates = ft._varindex[variable]
+    if seasonid is not None:
+        if seasonid=='JFMAMJJASOND':
+            seasonid = 'ANN'
+        found = [ r for r in candidates if seasonid==r.timerange and matches(r) ]
+        if found==[]:
+            found = [ r for r in candidates if matches(r) ]
+        return found
+    if time_range is None:
+        return [ r for r in candidates if matches(r) ]
+    return [ r for r in candidates if time_range.overlaps_with(r.timerange) and matches(r) ]
+
+# The synthetic filetable.  Variable TS is in monthly files, in two time units, with some
+# overlapping files and some with an unlimited time range.  Variable CLIMO is in climatology
+# files.  Variable MIXED is in both.
+rows = []
+lats = [ drange(-90.,90.,'degrees_north'), drange(-90.,0.,'degrees_north'),
+         drange(0.,90.,'degrees_north') ]
+lons = [ drange(0.,360.,'degrees_east'), drange(-180.,180.,'degrees_east') ]
+levs = [ None, drange(1.,1000.,'mbar') ]
+def space( i ):
+    return dict( latrange=lats[i%3], lonrange=lons[i%2], levelrange=levs[i%2] )
+for i in range(60):
+    units = 'days since 0001-01-01' if i%5 else 'days since 1850-01-01'
+    lo = 30.*(i%24) + (15. if i%7==0 else 0.)   # some overlaps
+    rows.append( ftrow( 'run%d/cam.h0.%03d.nc' % (i%3,i), 'TS', drange(lo,lo+30.,units), **space(i) ) )
+rows.append( ftrow( 'run0/cam.fixed.nc', 'TS', drange(), **space(1) ) )
+rows.append( ftrow( 'run1/cam.nounits.nc', 'TS', drange(100.,200.), **space(2) ) )
+rows.append( ftrow( 'run2/cam.openend.nc', 'TS', drange(300.,None,'days since 0001-01-01'),
+                    **space(0) ) )
+seasons = [ 'ANN', 'DJF', 'MAM', 'JJA', 'SON', 'JAN' ]
+for i,season in enumerate(seasons*2):
+    rows.append( ftrow( 'run%d/cam_%s_climo.nc' % (i%2,season), 'CLIMO', season, **space(i) ) )
+    if season!='MAM':
+        rows.append( ftrow( 'run%d/cam_%s_climo.nc' % (i%2,season), 'MIXED', season, **space(i) ) )
+for i in range(10):
+    rows.append( ftrow( 'run%d/cam.h0.%03d.nc' % (i%2,i), 'MIXED',
+                        drange(30.*i,30.*(i+1),'days since 0001-01-01'), **space(i) ) )
+
+ft = basic_filetable( None, make_options(tempdir()), 'synth' )
+ft.filefmt = None
+for i in range(0,len(rows),7):
+    ft._addrows( rows[i:i+7], 'synthetic' )   # several additions, as when scanning files
+
+class f_run0(basic_filter):
+    """a filter without its own __repr__ or attributes"""
+    def __call__( self, filen ):
+        return filen.startswith('run0/')
+filters = [ None, f_contains('run1'), f_contains('run2'), f_endswith('climo.nc'),
+            f_and( f_contains('run0'), f_not(f_endswith('5.nc')) ), f_run0() ]
+time_ranges = [ None, drange(), drange(0.,30.,'days since 0001-01-01'),
+                drange(45.,400.,'days since 0001-01-01'), drange(100.,150.),
+                drange(0.,60.,'days since 1850-01-01'), drange(700.,None,'days since 0001-01-01'),
+                drange(-100.,0.,'days since 0001-01-01'), drange(0.,30.,'hours since 1-1-1') ]
+space_ranges = [ (drange(),drange(),drange()),
+                 (drange(-30.,30.,'degrees_north'),drange(),drange()),
+                 (drange(10.,20.,'degrees_north'),drange(0.,90.,'degrees_east'),
+                  drange(500.,600.,'mbar')) ]
+
+def rowids( found ):
+    return None if found is None else [ id(r) for r in found ]
+
+# Each query twice, to check both the computed and memoized results.
+for repeat in range(2):
+    for filt, (lat,lon,lev) in itertools.product( filters, space_ranges ):
+        for tr in time_ranges:
+            check( rowids(ft.find_files('TS',tr,lat,lon,lev,None,filt))==
+                   rowids(linear_find_files(ft,'TS',tr,lat,lon,lev,None,filt)),
+                   "TS, time %s, space %s, filter %s" % (tr,(lat,lon,lev),filt) )
+        for var in [ 'TS', 'CLIMO', 'MIXED' ]:
+            for season in seasons+['JFMAMJJASOND','SON2']:
+                check( rowids(ft.find_files(var,None,lat,lon,lev,season,filt))==
+                       rowids(linear_find_files(ft,var,None,lat,lon,lev,season,filt)),
+                       "%s, season %s, space %s, filter %s" % (var,season,(lat,lon,lev),filt) )
+check( ft.find_files('NOSUCHVAR')==None, "an unknown variable should have no rows" )
+
+# Filters of the same class but different parameters must not share memoized results.
+check( filter_key(f_contains('run1'))!=filter_key(f_contains('run2')),
+       "filters with different parameters have the same key" )
+check( filter_key(f_contains('run1'))==filter_key(f_contains('run1')),
+       "equal filters should have the same key" )
+check( filter_key(f_and(f_contains('a'),f_contains('b')))!=
+       filter_key(f_and(f_contains('a'),f_contains('c'))), "compound filters have the same key" )
+check( filter_key(f_run0())!=filter_key(basic_filter()), "filter classes have the same key" )
+class f_callable(basic_filter):
+    """a filter whose behavior is set by a function, which can't be identified"""
+    def __init__( self, fun ):
+        self.fun = fun
+    def __call__( self, filen ):
+        return self.fun(filen)
+check( filter_key(f_callable(len)) is None, "a filter with a function attribute should have no key" )
+first = f_callable( lambda fn: 'run1' in fn )
+second = f_callable( lambda fn: 'run2' in fn )
+check( rowids(ft.find_files('TS',filefilter=first))==rowids(linear_find_files(ft,'TS',filefilter=first))
+       and rowids(ft.find_files('TS',filefilter=second))==
+       rowids(linear_find_files(ft,'TS',filefilter=second)),
+       "filters which can't be identified shouldn't be memoized" )
+
+# Adding rows must discard the memoized results.
+before = ft.find_files( 'TS', drange(0.,30.,'days since 0001-01-01') )
+ft._addrows( [ ftrow( 'run0/cam.h0.new.nc', 'TS', drange(10.,20.,'days since 0001-01-01'),
+                      **space(0) ) ], 'synthetic' )
+after = ft.find_files( 'TS', drange(0.,30.,'days since 0001-01-01') )
+check( len(after)==len(before)+1 and after[-1].fileid=='run0/cam.h0.new.nc',
+       "a row added after a search was not found" )
+
+cleanup( args )
+finish()
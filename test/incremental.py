@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Checks how metadiags --incremental decides that a diagnostic is up to date: it must have
+# succeeded before with the same inputs, and the output files it wrote then must still be there,
+# no older than its newest input.  The diagnostics are not run; their outputs are made up, so
+# needs no arguments.
+
+import sys, os, time, json
+from perfcheck import *
+import metrics
+import metrics.frontend.metadiags as metadiags
+from metrics.frontend.options import Options
+
+args = parse_args( "Check which diagnostics metadiags --incremental runs" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+outdir = tempdir()
+metadiags.manifestdir = tempdir()
+inputs = [ os.path.join( datadir, 'model_%02d_climo.nc' % i ) for i in range(3) ]
+for fn in inputs:
+    open( fn, 'w' ).write( fn )
+old = time.time() - 1000.
+for fn in inputs:
+    os.utime( fn, (old,old) )
+
+def command( var, season ):
+    return "diags --model path=%s,climos=yes,type=model --package AMWG --set 5 --seasons %s "\
+        "--vars %s --outputdir %s --log_file %s" %\
+        ( datadir, season, var, outdir, os.path.join(datadir,'%s_%s.log' % (var,season)) )
+
+def write_outputs( names, mtime=None ):
+    """Makes output files, as a diagnostic would, and returns their paths."""
+    paths = [ os.path.join( outdir, name ) for name in names ]
+    for path in paths:
+        open( path, 'w' ).write( 'output' )
+        if mtime is not None:
+            os.utime( path, (mtime,mtime) )
+    return paths
+
+def run( cmd, names, succeeded=True ):
+    """What metadiags does for a diagnostic which isn't up to date: runs it, then reports it."""
+    paths = write_outputs( names )
+    metadiags.job_finished( cmd, succeeded )
+    return paths
+
+def recorded( cmd ):
+    return sorted( json.load( open(metadiags.manifest_file(cmd)) )['outputs'].keys() )
+
+check( Options()._opts['incremental'] is False, "--incremental should default to no" )
+
+cmd = command( 'T', 'JJA' )
+stale = write_outputs( [ 'set5_JJA_T_NCEP-old.png' ], mtime=old )
+check( not metadiags.up_to_date(cmd), "a diagnostic without a manifest should be run" )
+write_outputs( [ 'set5_JJA_TS_NCEP-model.png', 'set5_DJF_T_NCEP-model.png' ] )   # other jobs'
+outputs = run( cmd, [ 'set5_JJA_T_NCEP-model.png', 'set5_JJA_T_NCEP-model.nc',
+                      'set5_JJA_T_NCEP.json' ] )
+check( recorded(cmd)==sorted(outputs), "outputs recorded %s, not %s" % (recorded(cmd),outputs) )
+check( metadiags.up_to_date(cmd), "a diagnostic whose inputs and outputs are unchanged is up to date" )
+
+# A missing output.
+os.remove( outputs[1] )
+check( not metadiags.up_to_date(cmd), "a diagnostic with a missing output should be run" )
+outputs = run( cmd, [ 'set5_JJA_T_NCEP-model.png', 'set5_JJA_T_NCEP-model.nc',
+                      'set5_JJA_T_NCEP.json' ] )
+check( metadiags.up_to_date(cmd), "a diagnostic run again should be up to date" )
+
+# An output older than the newest input, although the inputs are the same as when it succeeded.
+os.utime( outputs[0], (old-10.,old-10.) )
+check( not metadiags.up_to_date(cmd), "a diagnostic with an output older than its inputs should be run" )
+outputs = run( cmd, [ 'set5_JJA_T_NCEP-model.png', 'set5_JJA_T_NCEP-model.nc' ] )
+check( metadiags.up_to_date(cmd), "a diagnostic run again should be up to date" )
+
+# A changed input.  (Outputs are recognized by their modification times, which some file systems
+# keep only to the second.)
+time.sleep( 1.1 )
+now = time.time()
+os.utime( inputs[1], (now,now) )
+metadiags._dataset_stamps.clear()   # as for a new run of metadiags
+check( not metadiags.up_to_date(cmd), "a diagnostic with a changed input should be run" )
+run( cmd, [ 'set5_JJA_T_NCEP-model.png' ] )
+check( metadiags.up_to_date(cmd), "a diagnostic run again should be up to date" )
+
+# A failed diagnostic, and one which wrote nothing, are run again.
+for var, names, succeeded in [ ('U', ['set5_JJA_U_NCEP-model.png'], False), ('V', [], True) ]:
+    other = command( var, 'JJA' )
+    check( not metadiags.up_to_date(other), "%s: a new diagnostic should be run" % var )
+    run( other, names, succeeded )
+    check( not metadiags.up_to_date(other), "%s: the diagnostic should be run again" % var )
+
+# Variables whose names contain underscores.
+cmd = command( 'SWCF_LWCF', 'ANN' )
+metadiags.up_to_date( cmd )
+outputs = run( cmd, [ 'set11_ANN_SWCF_LWCF_CERES.png' ] )
+check( recorded(cmd)==outputs, "outputs recorded %s, not %s" % (recorded(cmd),outputs) )
+
+cleanup( args )
+finish()
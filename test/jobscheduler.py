@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Checks metadiags' job_scheduler: its estimates of the data a job reads, from the filetables; that
+# it starts the longest jobs first; that the jobs running at once stay within maxjobs and the memory
+# budget; and that it learns from the times it records.  The jobs are stand-ins which take as long as estimated, so needs no arguments.
+
+import sys, os, time
+from perfcheck import *
+import metrics
+import metrics.frontend.metadiags as metadiags
+
+args = parse_args( "Check the metadiags job scheduler" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+class fake_row:
+    def __init__( self, shape ):
+        self.varshape = shape
+        self.levname = 'lev' if len(shape)>2 else None
+
+class fake_filetable:
+    """variables: a dict, variable name: (shape, files per month)"""
+    def __init__( self, variables ):
+        self.variables = variables
+    def list_variables( self ):
+        return sorted( self.variables.keys() )
+    def find_files( self, var, seasonid=None ):
+        if var not in self.variables:
+            return None
+        shape, nfiles = self.variables[var]
+        months = 12 if seasonid in (None,'ANN') else 3
+        return [ fake_row(shape) ]*( months*nfiles )
+
+ft = fake_filetable( { 'BIG':((30,400,400),1), 'MID':((400,400),1), 'SMALL':((40,40),1),
+                       'TWO':((400,400),2) } )
+def command( plotset, var, season ):
+    return [ 'diags', '--model path=/data,climos=no', '--set %s' % plotset,
+             '--seasons %s' % season, '--vars %s' % var, '--outputdir /out' ]
+
+sched = metadiags.job_scheduler( [ft], 4 )
+check( sched.data_bytes( ' '.join(command(4,'BIG','JJA')) )==3*4*30*400*400,
+       "BIG, JJA: wrong data size" )
+check( sched.data_bytes( ' '.join(command(4,'BIG','ANN')) )==12*4*30*400*400,
+       "BIG, ANN: wrong data size" )
+check( sched.data_bytes( ' '.join(command(4,'TWO','ANN')) )==2*12*4*400*400,
+       "TWO, ANN: wrong data size" )
+check( sched.data_bytes( ' '.join(command(4,'DERIVED','ANN')) )>0,
+       "a derived variable should be estimated from the others" )
+
+# Stand-ins for running the jobs.  Each takes as long as the scheduler estimated.
+metadiags.DEFAULT_JOB_SECONDS = 0.05
+metadiags.DEFAULT_SECONDS_PER_BYTE = 1.e-9
+metadiags.JOB_MEMORY_OVERHEAD = 1.e6
+ends = {}       # command: when it will finish
+started = []    # commands, in the order started
+most = [0]      # the most jobs running at once
+def fake_start( cmdline, wait=True ):
+    cmd = ' '.join( cmdline )
+    started.append( cmd )
+    seconds, memory = estimates[cmd]
+    ends[cmd] = time.time() + seconds
+    running = metadiags.scheduler.running
+    most[0] = max( most[0], len(running) )
+    check( len(running)<=maxjobs, "%d jobs running, more than %d" % (len(running),maxjobs) )
+    inuse = sum([ job[2] for job in running.values() ])
+    check( len(running)==1 or inuse<=membudget,
+           "%.0f bytes in use, more than the budget of %.0f" % (inuse,membudget) )
+def fake_reap():
+    now = time.time()
+    for cmd, end in ends.items():
+        if now>=end:
+            del ends[cmd]
+            metadiags.job_finished( cmd, True )
+metadiags.start_cmdline = fake_start
+metadiags.reap_processes = fake_reap
+
+jobs = [ command(4,var,season) for var in [ 'BIG', 'MID', 'SMALL', 'TWO' ]
+         for season in [ 'ANN', 'DJF', 'JJA' ] ] + [ command(5,'SMALL','MAM') ]
+timingsfile = os.path.join( tempdir(), 'timings.json' )
+
+def schedule( nmax, budget ):
+    global maxjobs, membudget, estimates
+    maxjobs, membudget = nmax, float('inf') if budget is None else budget
+    metadiags.scheduler = metadiags.job_scheduler( [ft], nmax, budget, timingsfile )
+    for cmdline in jobs:
+        metadiags.scheduler.add( cmdline )
+    estimates = dict([ (' '.join(cmdline),(seconds,memory))
+                       for seconds,memory,nbytes,cmdline in metadiags.scheduler.jobs ])
+    del started[:]
+    most[0] = 0
+    t0 = time.time()
+    metadiags.scheduler.run()
+    check( sorted(started)==sorted([ ' '.join(cmdline) for cmdline in jobs ]),
+           "every job should be run once" )
+    check( metadiags.scheduler.running=={}, "no job should be left running" )
+    return time.time()-t0
+
+# One at a time, the longest first.
+schedule( 1, None )
+times = [ estimates[cmd][0] for cmd in started ]
+check( times==sorted(times,reverse=True), "jobs should be started longest first" )
+
+# Within a memory budget which fits the biggest job alone.
+biggest = max([ memory for seconds,memory in estimates.values() ])
+elapsed = schedule( 4, 1.2*biggest )
+big = ' '.join( command(4,'BIG','ANN') )
+check( started[0]==big, "the longest job should be started first" )
+check( most[0]>1 and elapsed<sum([ seconds for seconds,memory in estimates.values() ]),
+       "jobs should run at the same time" )
+
+# Recorded times are used for the next run.
+metadiags.scheduler = None
+later = metadiags.job_scheduler( [ft], 4, None, timingsfile )
+check( os.path.isfile(timingsfile), "timings should be recorded" )
+nbytes = later.data_bytes( big )
+check( abs( later.estimate_time(big,nbytes) - estimates[big][0] ) < 0.5,
+       "the recorded time of a job should be its estimate" )
+newjob = ' '.join( command(4,'BIG','SON') )
+seconds, sbytes, count = later.timings['sets']['4']
+check( count==2*len(jobs)-2 and
+       abs( later.estimate_time(newjob,later.data_bytes(newjob)) -
+            seconds/sbytes*later.data_bytes(newjob) ) < 1.e-9,
+       "a new job should be estimated from the recorded times of its plot set" )
+
+cleanup( args )
+finish()
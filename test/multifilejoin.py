@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Checks that reading from a multifile_dataset, which joins monthly files along their time axis
+# without cdscan, gives the same results as reading each file and joining the data, then making
+# the same selection from the joined data.  Also checks that a selection by time index reads only
+# the files which it covers, and that mf[varid] reads nothing until it is indexed, and then only
+# the files which the index covers.  Uses synthetic data, so needs no arguments.
+
+import sys, os
+import numpy
+from perfcheck import *
+import metrics, cdms2
+from metrics.fileio.multifile import aggregate_files, open_datafile, multifile_dataset
+
+args = parse_args( "Compare reads of joined files with reads of each file" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=12 )
+files += write_monthly_files( datadir, first=(2,1), nmonths=2 )
+opts = make_options( tempdir() )
+ft = make_datafiles( files, opts ).setup_filetable( 'synth' )
+
+def joined( varid, fnames ):
+    """The original way: read the whole variable from each file and join them."""
+    parts = []
+    for fn in fnames:
+        f = cdms2.open( fn )
+        parts.append( f(varid) )
+        f.close()
+    return cdms2.MV2.concatenate( parts, axis=0 )
+
+# Count the files opened by the multifile_dataset.
+opened = []
+cdms2_open = cdms2.open
+def counting_open( fn, *args, **kwargs ):
+    opened.append( fn )
+    return cdms2_open( fn, *args, **kwargs )
+
+def same( a, b, what ):
+    if isinstance( a, (int,long,float,numpy.number) ) or numpy.ndim(a)==0:
+        return check( numpy.allclose( a, b ), "%s: values differ" % what )
+    return check( same_values(a,b) and same_axes(a,b), "%s: data or axes differ" % what )
+
+times = joined( 'TS', files ).getTime()[:]
+selections = [ ( (), {} ),
+               ( (slice(0,1),), {} ),
+               ( (0,), {} ),
+               ( (-1,), {} ),
+               ( (5,), {} ),
+               ( (slice(2,7),), {} ),
+               ( (slice(1,13,3),), {} ),
+               ( (slice(-3,None),), {} ),
+               ( (slice(None,None,-2),), {} ),
+               ( (), {'time':slice(3,9)} ),
+               ( (), {'time':(times[2],times[5])} ),
+               ( (), {'time':(times[2]-10.,times[2]+10.,'co')} ),
+               ( (), {'time':times[4]} ),
+               ( (slice(0,2),), {'lat':(-30.,30.)} ),
+               ( (slice(4,6),), {'squeeze':1} ),
+               ( (Ellipsis,0), {} ) ]
+
+for seasonid,seasonfiles in [ (None,files),
+                              ('DJF',[ fn for fn in files if fn[-5:-3] in ('12','01','02') ]),
+                              ('JJA',[ fn for fn in files if fn[-5:-3] in ('06','07','08') ]) ]:
+    for varid in [ 'TS', 'T', 'MISSV' ]:
+        rows = ft.find_files( varid )
+        name = aggregate_files( os.path.join(datadir,'synth'), rows, seasonid )
+        check( name is not None, "files for %s could not be joined" % varid )
+        mf = open_datafile( name )
+        ref = joined( varid, seasonfiles )
+        cdms2.open = counting_open
+        try:
+            for sargs,skwargs in selections:
+                if seasonid is not None and 'time' in skwargs and type(skwargs['time']) is not slice:
+                    continue   # time values select from all files, not only the season's
+                if len(sargs)>0 and type(sargs[0]) is int and sargs[0]>=len(seasonfiles):
+                    continue
+                what = "%s %s %s %s" % (seasonid,varid,sargs,skwargs)
+                del opened[:]
+                try:
+                    data = mf( varid, *sargs, **dict(skwargs) )
+                except Exception as e:
+                    check( False, "%s: %s" % (what,e) )
+                    continue
+                same( data, ref(*sargs,**skwargs), what )
+                if len(sargs)>0 and isinstance( sargs[0], (int,slice) ) and\
+                        (not isinstance(sargs[0],slice) or sargs[0].step in (None,1,3)):
+                    start, stop, step = ( sargs[0] if isinstance(sargs[0],slice) else
+                                          slice(sargs[0],sargs[0]+1 if sargs[0]!=-1 else None)
+                                          ).indices(len(seasonfiles))
+                    needed = set( seasonfiles[start:stop:step] )
+                    check( set(opened)==needed,
+                           "%s: read %d files, but only %d are needed" % (what,len(opened),len(needed)) )
+        finally:
+            cdms2.open = cdms2_open
+
+# mf[varid] is a proxy, which knows its shape and axes without reading data, and reads only the
+# files needed for an index selection.
+name = aggregate_files( os.path.join(datadir,'synth'), ft.find_files('T') )
+mf = open_datafile( name )
+ref = joined( 'T', files )
+cdms2.open = counting_open
+try:
+    del opened[:]
+    var = mf['T']
+    check( len(opened)==0, "mf['T'] read %d files" % len(opened) )
+    check( var.shape==ref.shape and len(var)==len(ref) and var.dtype==ref.dtype,
+           "mf['T'] has shape %s, not %s" % (var.shape,ref.shape) )
+    check( [ax.id for ax in var.getAxisList()]==[ax.id for ax in ref.getAxisList()] and
+           numpy.allclose( var.getTime()[:], times ), "mf['T'] has the wrong axes" )
+    check( var.units==ref.units, "mf['T'] lacks the variable's attributes" )
+    for key in [ 0, -1, 5, slice(2,4), (slice(1,13,3),0), (3,slice(None),slice(1,3)),
+                 (slice(None),1,2,3), (Ellipsis,0) ]:
+        del opened[:]
+        data, refdata = var[key], ref[key]
+        same( data, refdata, "mf['T'][%s]" % (key,) )
+        tkey = key[0] if type(key) is tuple else key
+        if tkey is not Ellipsis:
+            needed = set( files[tkey] if isinstance(tkey,slice) else [files[tkey]] )
+            check( set(opened)==needed, "mf['T'][%s] read %d files, but only %d are needed" %
+                   (key,len(opened),len(needed)) )
+finally:
+    cdms2.open = cdms2_open
+
+# Without the time lengths from the filetable, they are read from the files.
+timeranges = dict([ (r.fileid,r.timerange) for r in ft.find_files('TS') ])
+mf = multifile_dataset( 'nolengths', files, [ timeranges[fn] for fn in files ] )
+same( mf('TS',slice(3,5)), joined('TS',files)(slice(3,5)), "time lengths read from files" )
+
+# Variables without a time axis come from the first file.
+mf = open_datafile( aggregate_files( os.path.join(datadir,'synth'), ft.find_files('TS') ) )
+f = cdms2.open( files[0] )
+same( mf('gw'), f('gw'), "gw" )
+same( mf('hyam'), f('hyam'), "hyam" )
+f.close()
+check( numpy.allclose( mf.getAxis('time')[:], times ), "joined time axis differs" )
+
+cleanup( args )
+finish()
@@ -0,0 +1,308 @@
+# Helpers for the tests which check that the faster ways of computing things give the same results
+# as the original ways.  Each such test is a script which prints PASS, or else a FAIL line for each
+# failed check, and exits with status 1.
+# Some tests run on the standard test data (--datadir, with subdirectories cam_output and
+# obs_atmos); others write small synthetic CAM-like files with write_monthly_files().
+
+import sys, os, argparse, tempfile, shutil
+import numpy
+
+failures = []
+
+def check( ok, message ):
+    """Records a failure, with the message, unless ok is true.  Returns ok."""
+    if not ok:
+        print "FAIL:", message
+        failures.append( message )
+    return ok
+
+def finish():
+    """Reports the result of all the checks and exits."""
+    if len(failures)>0:
+        print "FAIL: %d checks failed" % len(failures)
+        sys.exit(1)
+    print "PASS"
+    sys.exit(0)
+
+def parse_args( description ):
+    """Parses the usual test arguments: --datadir and --keep."""
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument("--datadir", dest="datadir", help="root directory for model and obs data")
+    p.add_argument("--keep", dest="keep", help="If True, will keep the files written")
+    return p.parse_args(sys.argv[1:])
+
+def tempdir():
+    """Returns a new temporary directory, which cleanup() will delete unless --keep was given."""
+    d = tempfile.mkdtemp()
+    _tempdirs.append( d )
+    return d
+_tempdirs = []
+
+def cleanup( args=None ):
+    if args is not None and getattr( args, 'keep', None ):
+        print "keeping", ' '.join(_tempdirs)
+        return
+    for d in _tempdirs:
+        shutil.rmtree( d, ignore_errors=True )
+
+def same_values( a, b, rtol=1.e-6, atol=1.e-12 ):
+    """Returns True if a and b, numpy or cdms2 arrays, have the same shape, the same mask, and
+    close values where they aren't masked."""
+    a = numpy.ma.asarray( a )
+    b = numpy.ma.asarray( b )
+    if a.shape!=b.shape:
+        print "shapes differ:", a.shape, b.shape
+        return False
+    if (numpy.ma.getmaskarray(a)!=numpy.ma.getmaskarray(b)).any():
+        print "masks differ in %d places" %\
+            (numpy.ma.getmaskarray(a)!=numpy.ma.getmaskarray(b)).sum()
+        return False
+    fa = numpy.ma.filled( a, 0. ).astype(numpy.float64)
+    fb = numpy.ma.filled( b, 0. ).astype(numpy.float64)
+    if not numpy.allclose( fa, fb, rtol=rtol, atol=atol ):
+        print "largest difference", abs(fa-fb).max()
+        return False
+    return True
+
+def same_axes( a, b ):
+    """Returns True if the cdms2 variables a and b have axes with the same values."""
+    aaxes = a.getAxisList()
+    baxes = b.getAxisList()
+    if len(aaxes)!=len(baxes):
+        return False
+    return all([ numpy.allclose( ax[:], bx[:] ) for ax,bx in zip(aaxes,baxes) ])
+
+def make_options( cachepath, **opts ):
+    """Returns an Options object with the default options, but the supplied cache path and
+    other options."""
+    from metrics.frontend.options import Options
+    o = Options()
+    o._opts['cachepath'] = cachepath
+    for k,v in opts.items():
+        o._opts[k] = v
+    return o
+
+def make_datafiles( files, opts ):
+    """Returns a datafiles object for the supplied list of files."""
+    from metrics.fileio.findfiles import basic_datafiles
+    datafiles = basic_datafiles( opts )
+    datafiles.files = sorted( files )
+    return datafiles
+
+def filetable_rows( ft ):
+    """Returns the rows of a filetable as comparable tuples."""
+    def rng( r ):
+        if type(r) is str:
+            return r
+        return ( r.lo, r.hi, r.units )
+    return [ ( r.fileid, r.variableid, rng(r.timerange), rng(r.latrange), rng(r.lonrange),
+               rng(r.levelrange), tuple(r.varaxisnames), r.varshape )
+             for r in ft._table ]
+
+# Synthetic data.  Files are like CAM monthly history files: one time per file, at the end of the
+# month, with time bounds; hybrid levels; and a few variables.
+nlat, nlon, nlev = 6, 8, 4
+
+def _axes( ):
+    import cdms2
+    lat = cdms2.createAxis( numpy.linspace(-75.,75.,nlat), id='lat' )
+    lat.designateLatitude()
+    lat.units = 'degrees_north'
+    lat.setBounds( lat.genGenericBounds() )
+    lon = cdms2.createAxis( numpy.arange(nlon)*(360./nlon), id='lon' )
+    lon.designateLongitude()
+    lon.units = 'degrees_east'
+    lon.setBounds( lon.genGenericBounds() )
+    hyai = numpy.linspace( 0.01, 0., nlev+1 )
+    hybi = numpy.linspace( 0., 1., nlev+1 )
+    hyam = 0.5*(hyai[1:]+hyai[:-1])
+    hybm = 0.5*(hybi[1:]+hybi[:-1])
+    lev = cdms2.createAxis( 1000.*(hyam+hybm), id='lev' )
+    lev.designateLevel()
+    lev.units = 'level'
+    lev.positive = 'down'
+    ilev = cdms2.createAxis( 1000.*(hyai+hybi), id='ilev' )
+    ilev.designateLevel()
+    ilev.units = 'level'
+    ilev.positive = 'down'
+    return lat, lon, lev, ilev, hyai, hybi, hyam, hybm
+
+def month_bounds( year, month, units ):
+    """Returns the (start,end) of a month as times in units, in the noleap calendar."""
+    import cdtime
+    c0 = cdtime.comptime( year, month, 1 )
+    c1 = c0.add( 1, cdtime.Month )
+    return c0.torel(units,cdtime.NoLeapCalendar).value, c1.torel(units,cdtime.NoLeapCalendar).value
+
+def write_monthly_files( path, first=(1,1), nmonths=12, missing=True, months_per_file=1 ):
+    """Writes nmonths months of data in the directory path, starting with first, a (year,month)
+    pair, in the noleap calendar.  Each file has months_per_file months, and is named for its
+    first month.  Returns the list of file names.  The variables are TS, PS, T (on hybrid
+    levels), and, if missing is True, MISSV, which has missing values."""
+    import cdms2, cdtime
+    cdms2.setNetcdfShuffleFlag(0)
+    cdms2.setNetcdfDeflateFlag(0)
+    cdms2.setNetcdfDeflateLevelFlag(0)
+    units = 'days since 0001-01-01 00:00:00'
+    lat, lon, lev, ilev, hyai, hybi, hyam, hybm = _axes()
+    months = []
+    year, month = first
+    for n in range(nmonths):
+        months.append( (year,month) )
+        month += 1
+        if month>12:
+            year, month = year+1, 1
+    files = []
+    for m0 in range( 0, nmonths, months_per_file ):
+        fmonths = months[m0:m0+months_per_file]
+        bounds = numpy.array([ month_bounds( year, month, units ) for year,month in fmonths ])
+        time = cdms2.createAxis( bounds[:,1], bounds=bounds, id='time' )
+        time.designateTime( calendar=cdtime.NoLeapCalendar )
+        time.units = units
+        time.calendar = 'noleap'
+        data = {}
+        for year,month in fmonths:
+            rs = numpy.random.RandomState( 1000*year+month )
+            for varid,shape in [ ('TS',(nlat,nlon)), ('PS',(nlat,nlon)), ('T',(nlev,nlat,nlon)),
+                                 ('MISSV',(nlat,nlon)) ]:
+                data.setdefault( varid, [] ).append( rs.random_sample(shape) )
+        fname = os.path.join( path, 'synth.cam.h0.%04d-%02d.nc' % fmonths[0] )
+        f = cdms2.open( fname, 'w' )
+        f.source = 'CAM'
+        f.Conventions = 'CF-1.0'
+        ts = cdms2.createVariable( 250.+50.*numpy.array(data['TS']), axes=[time,lat,lon], id='TS' )
+        ts.units = 'K'
+        ts.long_name = 'Surface temperature'
+        f.write( ts )
+        ps = cdms2.createVariable( 1.e5+2000.*(numpy.array(data['PS'])-0.5),
+                                   axes=[time,lat,lon], id='PS' )
+        ps.units = 'Pa'
+        ps.long_name = 'Surface pressure'
+        f.write( ps )
+        t = cdms2.createVariable( 200.+100.*numpy.array(data['T']), axes=[time,lev,lat,lon], id='T' )
+        t.units = 'K'
+        t.long_name = 'Temperature'
+        f.write( t )
+        if missing:
+            mv = numpy.ma.masked_greater( numpy.array(data['MISSV']), 0.8 )
+            mvar = cdms2.createVariable( mv, axes=[time,lat,lon], id='MISSV',
+                                         fill_value=1.e20 )
+            mvar.units = 'kg/kg'
+            f.write( mvar )
+        for name,vals,ax in [ ('hyai',hyai,ilev), ('hybi',hybi,ilev),
+                              ('hyam',hyam,lev), ('hybm',hybm,lev) ]:
+            f.write( cdms2.createVariable( vals, axes=[ax], id=name ) )
+        gw = cdms2.createVariable( numpy.cos(numpy.radians(lat[:])), axes=[lat], id='gw' )
+        f.write( gw )
+        p0 = f.createVariable( 'P0', 'd', () )
+        p0.assignValue( 1.e5 )
+        p0.units = 'Pa'
+        f.close()
+        files.append( fname )
+    return files
+
+def same_files( fname1, fname2 ):
+    """Returns True if the NetCDF files fname1 and fname2 have the same variables, with the same
+    values and axes.  Global attributes are not compared, as they include provenance."""
+    import cdms2
+    f1 = cdms2.open( fname1 )
+    f2 = cdms2.open( fname2 )
+    try:
+        if sorted(f1.variables.keys())!=sorted(f2.variables.keys()):
+            print "variables differ:", sorted(f1.variables.keys()), sorted(f2.variables.keys())
+            return False
+        ok = True
+        for varid in sorted( f1.variables.keys() ):
+            v1, v2 = f1(varid), f2(varid)
+            if numpy.ndim(v1)==0:
+                same = numpy.allclose( v1, v2 )
+            else:
+                same = same_values( v1, v2 ) and same_axes( v1, v2 )
+            if not same:
+                print "%s differs between %s and %s" % (varid, fname1, fname2)
+                ok = False
+        return ok
+    finally:
+        f1.close()
+        f2.close()
+
+# Synthetic regridding data: a map file like those of ESMF_RegridWeightGen, from n_a unstructured
+# source points to a regular nlat x nlon grid, and CAM-SE-like files on the ncol axis.
+def write_map_file( fname, n_a=30, seed=0, masked=False ):
+    """Writes the map file fname, to a 4x6 grid.  Each destination point gets weights from a few random source
+    points, some of them repeated, as the kernels must sum duplicate weights.  If masked is True,
+    some destination points have no source points, and are masked (mask_b=0)."""
+    import cdms2
+    rs = numpy.random.RandomState( seed )
+    nlat, nlon = 4, 6
+    n_b = nlat*nlon
+    lat = numpy.linspace( -60., 60., nlat )
+    lon = numpy.arange( nlon )*(360./nlon)
+    dlat, dlon = lat[1]-lat[0], 360./nlon
+    S, row, col = [], [], []
+    mask_b = numpy.ones( n_b, dtype=numpy.int32 )
+    for b in range( n_b ):
+        if masked and b%5==2:
+            mask_b[b] = 0
+            continue
+        srcs = list( rs.randint( 0, n_a, size=3 ) )
+        srcs.append( srcs[0] )
+        w = rs.random_sample( len(srcs) )
+        S += list( w/w.sum() )
+        row += [ b+1 ]*len(srcs)   # 1-based, as in the files
+        col += [ s+1 for s in srcs ]
+    yc_b = numpy.repeat( lat, nlon )
+    xc_b = numpy.tile( lon, nlat )
+    yv_b = numpy.array([ [y-dlat/2,y-dlat/2,y+dlat/2,y+dlat/2] for y in yc_b ])
+    xv_b = numpy.array([ [x-dlon/2,x+dlon/2,x+dlon/2,x-dlon/2] for x in xc_b ])
+    n_s = cdms2.createAxis( numpy.arange(len(S)), id='n_s' )
+    n_b_ax = cdms2.createAxis( numpy.arange(n_b), id='n_b' )
+    nv_b = cdms2.createAxis( numpy.arange(4), id='nv_b' )
+    f = cdms2.open( fname, 'w' )
+    f.map_method = 'Bilinear remapping'
+    f.write( cdms2.createVariable( numpy.array(S), axes=[n_s], id='S' ) )
+    f.write( cdms2.createVariable( numpy.array(row,dtype=numpy.int32), axes=[n_s], id='row' ) )
+    f.write( cdms2.createVariable( numpy.array(col,dtype=numpy.int32), axes=[n_s], id='col' ) )
+    f.write( cdms2.createVariable( mask_b, axes=[n_b_ax], id='mask_b' ) )
+    f.write( cdms2.createVariable( yc_b, axes=[n_b_ax], id='yc_b' ) )
+    f.write( cdms2.createVariable( xc_b, axes=[n_b_ax], id='xc_b' ) )
+    f.write( cdms2.createVariable( yv_b, axes=[n_b_ax,nv_b], id='yv_b' ) )
+    f.write( cdms2.createVariable( xv_b, axes=[n_b_ax,nv_b], id='xv_b' ) )
+    area = numpy.radians(dlon)*( numpy.sin(numpy.radians(yc_b+dlat/2)) -
+                                 numpy.sin(numpy.radians(yc_b-dlat/2)) )
+    f.write( cdms2.createVariable( area, axes=[n_b_ax], id='area_b' ) )
+    f.close()
+    return fname
+
+def write_ncol_file( fname, n_a=30, ntimes=5 ):
+    """Writes the file fname, of ntimes time steps of data on n_a unstructured source points.
+    The variables are TS (time,ncol), T (time,lev,ncol), Q (time,ilev,ncol) in float32, MISSV
+    (time,ncol) with missing values, and lev, hyam and P0, which are copied as they are."""
+    import cdms2
+    rs = numpy.random.RandomState( 0 )
+    lat, lon, lev, ilev, hyai, hybi, hyam, hybm = _axes()
+    time = cdms2.createAxis( 31.*numpy.arange(1,ntimes+1), id='time' )
+    time.designateTime()
+    time.units = 'days since 0001-01-01 00:00:00'
+    time.calendar = 'noleap'
+    ncol = cdms2.createAxis( numpy.arange(n_a), id='ncol' )
+    f = cdms2.open( fname, 'w' )
+    f.source = 'CAM'
+    ts = cdms2.createVariable( 250.+50.*rs.random_sample((ntimes,n_a)), axes=[time,ncol], id='TS' )
+    ts.units = 'K'
+    f.write( ts )
+    t = cdms2.createVariable( 200.+100.*rs.random_sample((ntimes,nlev,n_a)),
+                              axes=[time,lev,ncol], id='T' )
+    t.units = 'K'
+    f.write( t )
+    q = cdms2.createVariable( rs.random_sample((ntimes,nlev+1,n_a)).astype(numpy.float32),
+                              axes=[time,ilev,ncol], id='Q' )
+    q.units = 'kg/kg'
+    f.write( q )
+    mv = numpy.ma.masked_greater( rs.random_sample((ntimes,n_a)), 0.7 )
+    f.write( cdms2.createVariable( mv, axes=[time,ncol], id='MISSV', fill_value=1.e20 ) )
+    f.write( cdms2.createVariable( hyam, axes=[lev], id='hyam' ) )
+    p0 = f.createVariable( 'P0', 'd', () )
+    p0.assignValue( 1.e5 )
+    f.close()
+    return fname
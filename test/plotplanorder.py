@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Checks that plot_plan computes its reduced and derived variables in dependency order, getting
+# the same values as the original order (reduced variables, then derived variables with one retry
+# of those which couldn't be computed yet), and also values for chains of derived variables too
+# deep for that.  And that with --rvworkers, only reduced variables which will be cached are
+# computed by the pool of workers, with a warning if there's no cache.  Uses made-up variables,
+# so needs no arguments.
+
+import sys, logging
+import numpy
+from perfcheck import *
+import metrics
+import metrics.packages.plotplan as plotplan
+from metrics.packages.plotplan import plot_plan
+from metrics.computation.plotspec import derived_var
+
+args = parse_args( "Check the order in which plot_plan computes variables" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+computed = []   # the order in which variables are computed
+
+class made_up_rv:
+    """has the interface of a reduced_variable, reduce(); its value is made up"""
+    def __init__( self, name, value ):
+        self.name = name
+        self.value = value
+    def reduce( self, vid=None, gw=None ):
+        computed.append( self.name )
+        if gw is None:
+            return numpy.ma.array(self.value)
+        return numpy.ma.array(self.value)*gw.sum()
+
+class made_up_ps:
+    """has the attributes of a plotspec which _plotted_keys() uses"""
+    def __init__( self, zvars ):
+        self.zvars = zvars
+
+def dv( name, inputs, func ):
+    def logged( *args ):
+        computed.append( name )
+        return func( *args )
+    return derived_var( vid=name, inputs=inputs, func=logged )
+
+def make_plan( free_intermediates=True ):
+    pp = plot_plan( 'JJA' )
+    pp.free_intermediates = free_intermediates
+    pp.reduced_variables = { 'gw':made_up_rv('gw',[0.25,0.25]), 'A':made_up_rv('A',[1.,2.]),
+                             'B':made_up_rv('B',[3.,5.]) }
+    # F and G need three rounds of derivation; H depends on a variable which doesn't exist.
+    pp.derived_variables = { 'C':dv('C',['A','B'],lambda a,b: a+b),
+                             'D':dv('D',['C'],lambda c: 2*c),
+                             'E':dv('E',['D','A'],lambda d,a: d-a),
+                             'F':dv('F',['E','C'],lambda e,c: e*c),
+                             'G':dv('G',['F'],lambda f: f+1.),
+                             'H':dv('H',['NOSUCH'],lambda x: x) }
+    pp.single_plotspecs = { 'p1':made_up_ps(['G','B']), 'p2':made_up_ps(['D']) }
+    return pp
+
+def original_order( pp ):
+    """The original computation in plot_plan._results()"""
+    vals = pp.variable_values
+    for v in pp.reduced_variables.keys():
+        if v=='gw':
+            vals[v] = pp.reduced_variables[v].reduce(None)
+    for v in pp.reduced_variables.keys():
+        if v!='gw':
+            vals[v] = pp.reduced_variables[v].reduce( vid=None, gw=vals.get('gw',None) )
+    postponed = []
+    for v in pp.derived_variables.keys():
+        value = pp.derived_variables[v].derive( vals )
+        if value is None:
+            postponed.append(v)
+        else:
+            vals[v] = value
+    for v in postponed:
+        vals[v] = pp.derived_variables[v].derive( vals )
+
+old = make_plan()
+original_order( old )
+for free in [ False, True ]:
+    new = make_plan( free )
+    del computed[:]
+    new._compute_variables()
+    for v in computed:
+        deps = new._dependency_graph()[v]
+        check( all([ computed.index(d)<computed.index(v) for d in deps ]),
+               "%s was computed before its inputs %s" % (v,deps) )
+    check( sorted(set(computed))==sorted(computed), "a variable was computed twice" )
+    expected = { 'A':[0.5,1.], 'B':[1.5,2.5] }
+    expected['C'] = numpy.add( expected['A'], expected['B'] )
+    expected['D'] = 2*expected['C']
+    expected['E'] = expected['D']-expected['A']
+    expected['F'] = expected['E']*expected['C']
+    expected['G'] = expected['F']+1.
+    for v in [ 'gw', 'B', 'D', 'G' ] + ( [] if free else [ 'A', 'C', 'E', 'F' ] ):
+        check( new.variable_values.get(v,None) is not None, "no value for %s" % v )
+        if v in expected and new.variable_values.get(v,None) is not None:
+            check( numpy.allclose( new.variable_values[v], expected[v] ), "wrong value for %s" % v )
+        if old.variable_values.get(v,None) is not None and new.variable_values.get(v,None) is not None:
+            check( numpy.allclose( new.variable_values[v], old.variable_values[v] ),
+                   "%s differs from the original computation" % v )
+    check( new.variable_values.get('H',None) is None, "H can't be computed" )
+    if free:
+        check( all([ v not in new.variable_values for v in ['A','C','E','F'] ]),
+               "intermediate variables should have been freed" )
+
+# The pool of workers for --rvworkers gets only the reduced variables which will be cached.
+class made_up_cached_rv(made_up_rv):
+    """a made_up_rv in a filetable which may have a cache of reduced variables"""
+    def __init__( self, name, value, rvcache, key ):
+        made_up_rv.__init__( self, name, value )
+        self.filetable = made_up_ft( rvcache )
+        self.key = key
+    def cacheable_key( self, vid=None, gw=None ):
+        return self.key
+class made_up_ft:
+    def __init__( self, rvcache ):
+        self.rvcache = rvcache
+pooled = []
+class made_up_pool:
+    """has the interface of a multiprocessing.Pool, but runs the work in this process"""
+    def __init__( self, nworkers ):
+        pass
+    def imap( self, fn, items ):
+        pooled.extend([ plotplan._pool_plan._pool_keys[i] for i in items ])
+        return [ fn(i) for i in items ]
+    def close( self ):
+        pass
+    def join( self ):
+        pass
+class recorder(logging.Handler):
+    def __init__( self ):
+        logging.Handler.__init__( self, logging.WARNING )
+        self.messages = []
+    def emit( self, record ):
+        self.messages.append( record.getMessage() )
+warnings = recorder()
+logging.getLogger('metrics.packages.plotplan').addHandler( warnings )
+pool = plotplan.multiprocessing.Pool
+plotplan.multiprocessing.Pool = made_up_pool
+try:
+    for rvcache, keys, expected in [ (None, ['a','b'], []),
+                                     ('cache', ['a',None], []),
+                                     ('cache', ['a','b'], ['A','B']) ]:
+        pp = make_plan()
+        pp.rvworkers = 2
+        pp.reduced_variables['A'] = made_up_cached_rv( 'A', [1.,2.], rvcache, keys[0] )
+        pp.reduced_variables['B'] = made_up_cached_rv( 'B', [3.,5.], rvcache, keys[1] )
+        del pooled[:], warnings.messages[:]
+        pp._compute_variables()
+        check( sorted(pooled)==expected, "rvcache %s, keys %s: the pool computed %s" %
+               (rvcache,keys,pooled) )
+        check( (len(warnings.messages)>0)==(rvcache is None),
+               "rvcache %s: warnings %s" % (rvcache,warnings.messages) )
+        check( pp.variable_values.get('G',None) is not None, "rvcache %s: no value for G" % rvcache )
+finally:
+    plotplan.multiprocessing.Pool = pool
+
+cleanup( args )
+finish()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Checks the pressures on hybrid levels and their cache: hybrid_pressure() computes every level and
+# time at once; the seasonal means of the surface pressure from one file get different cache
+# entries, so verticalize() gives the same results with the cache as without it; a pressure
+# computed for the mass weights or verticalize() is found by the other whenever its inputs are
+# the same; and the cache stays within pressure_cache_bytes.  Uses synthetic data, so needs no
+# arguments.
+
+import sys, os
+import numpy, cdms2
+from perfcheck import *
+import metrics
+import metrics.packages.amwg.derivations.massweighting as massweighting
+from metrics.packages.amwg.derivations.massweighting import hybrid_pressure, pressure_key, \
+    cached_pressure, rhodz_from_hybridlev
+from metrics.packages.amwg.derivations.vertical import verticalize
+
+args = parse_args( "Check the cache of pressures on hybrid levels" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+fname = write_monthly_files( datadir, first=(1,1), nmonths=12, months_per_file=12 )[0]
+f = cdms2.open( fname )
+PS, T = f('PS'), f('T')
+hyai, hybi, hyam, hybm, P0 = [ f(varid) for varid in [ 'hyai', 'hybi', 'hyam', 'hybm', 'P0' ] ]
+p0 = float( numpy.asarray(P0).ravel()[0] )
+
+def clear():
+    massweighting._pressure_cache.clear()
+    massweighting._pressure_cache_nbytes = 0
+
+# All times and levels at once.
+p = hybrid_pressure( PS, hyai, hybi, P0 )
+expected = numpy.array([ [ hyai[k]*p0 + hybi[k]*numpy.asarray(PS[t]) for k in range(len(hyai)) ]
+                         for t in range(PS.shape[0]) ])
+check( p.shape==expected.shape and numpy.allclose( p, expected, rtol=1.e-12 ),
+       "hybrid_pressure() differs from a loop over times and levels" )
+check( p.getTime() is not None and p.getLevel() is not None and len(p.getLevel())==len(hyai),
+       "the pressure should have the time axis of PS and the level axis of hybi" )
+
+def seasonal_mean( V, months ):
+    """The mean of V over the months, a list of indices, without a time axis, as from a seasonal
+    climatology."""
+    mean = cdms2.createVariable( numpy.ma.average( numpy.ma.asarray(V)[months], axis=0 ),
+                                 axes=V.getAxisList()[1:], id=V.id )
+    mean.units = V.units
+    mean.filename = fname
+    return mean
+seasons = { 'DJF':[11,0,1], 'JJA':[5,6,7] }
+
+# Seasonal means of PS from the same file have the same axes and file, but different pressures.
+clear()
+keys = [ pressure_key( seasonal_mean(PS,months), hyam, hybm, P0, T.getLevel() )
+         for months in seasons.values() ]
+check( keys[0]!=keys[1], "seasonal means of PS from one file should have different keys" )
+check( pressure_key( seasonal_mean(PS,seasons['DJF']), hyai, hybi, P0 )!=
+       pressure_key( seasonal_mean(PS,seasons['DJF']), hyam, hybm, P0 ),
+       "interface and mid-level pressures should have different keys" )
+results = {}
+for cached in [ False, True ]:
+    massweighting.pressure_cache_bytes = 2**28 if cached else None
+    clear()
+    for season, months in sorted( seasons.items() )*2:
+        ps, t = seasonal_mean( PS, months ), seasonal_mean( T, months )
+        results.setdefault( season, [] ).append( verticalize( t, hyam, hybm, ps ) )
+    check( len(massweighting._pressure_cache)==(2 if cached else 0),
+           "cached %s: %d pressures are cached" % (cached,len(massweighting._pressure_cache)) )
+for season, verticalized in results.items():
+    check( all([ same_values( v, verticalized[0] ) for v in verticalized[1:] ]),
+           "%s: verticalize() gives different results with the cache" % season )
+check( not same_values( results['DJF'][0], results['JJA'][0] ),
+       "verticalize() gives the same result in two seasons" )
+
+# A pressure is found by whoever needs it, whichever computed it.
+def not_computed( *args, **kwargs ):
+    raise AssertionError( "the pressure should have been cached" )
+ps0 = seasonal_mean( PS, [0] )   # the first time, as mass weights use
+t0 = seasonal_mean( T, [0] )
+massweighting.pressure_cache_bytes = None
+uncached = verticalize( t0, hyam, hybm, ps0 )
+massweighting.pressure_cache_bytes = 2**28
+clear()
+for hya, hyb, levax in [ (hyai, hybi, None), (hyam, hybm, T.getLevel()) ]:
+    cached_pressure( pressure_key( ps0, hya, hyb, P0, levax ),
+                     lambda: hybrid_pressure( ps0, hya, hyb, P0, levax ) )
+massweighting.hybrid_pressure = not_computed
+try:
+    rhodz = rhodz_from_hybridlev( PS(time=slice(0,1)), P0, hyai, hybi, T, f )
+    check( numpy.allclose( rhodz, numpy.diff( expected[0], axis=0 )/massweighting.AtmConst.g,
+                           rtol=1.e-12 ),
+           "mass weights from the cached interface pressures are wrong" )
+    check( same_values( verticalize( t0, hyam, hybm, ps0 ), uncached ),
+           "verticalize() with the cached mid-level pressures gives different results" )
+except AssertionError as e:
+    check( False, str(e) )
+finally:
+    massweighting.hybrid_pressure = hybrid_pressure
+
+# Least recently used pressures are dropped to keep within the cache size.
+massweighting.pressure_cache_bytes = 3*hybrid_pressure( ps0, hyai, hybi, P0 ).nbytes
+clear()
+for month in range(12):
+    ps = seasonal_mean( PS, [month] )
+    cached_pressure( pressure_key( ps, hyai, hybi, P0 ), lambda: hybrid_pressure( ps, hyai, hybi, P0 ) )
+check( len(massweighting._pressure_cache)==3 and
+       massweighting._pressure_cache_nbytes<=massweighting.pressure_cache_bytes,
+       "the cache holds %d pressures, %d bytes" %
+       (len(massweighting._pressure_cache),massweighting._pressure_cache_nbytes) )
+ps = seasonal_mean( PS, [11] )
+check( pressure_key( ps, hyai, hybi, P0 ) in massweighting._pressure_cache,
+       "the most recent pressure should be cached" )
+
+f.close()
+cleanup( args )
+finish()
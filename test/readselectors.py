@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Checks the read selectors of reduced variables: a reduced_variable which declares a read_region
+# or read_level reads only that region or level, and its result is the same as that of one which
+# reads everything; also when the variable is read by time chunks (with the numpy climatology
+# engine), or is mass weighted.  And
+# results for different read selectors get different keys in the reduced variable cache.  Uses
+# synthetic data, so needs no arguments.
+
+import sys, os
+import numpy, cdms2, cdtime, cdutil
+from unidata import udunits
+from perfcheck import *
+import metrics
+import metrics.computation.reductions as reductions
+from metrics.computation.reductions import reduced_variable, reduce2lat_seasonal, \
+    reduce_time_seasonal, select_lev
+
+args = parse_args( "Check that reduced variables read only what they need" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=12 )
+ft = make_datafiles( files, make_options(tempdir()) ).setup_filetable( 'synth' )
+season = cdutil.times.Seasons('JJA')
+
+shapes = []    # the shapes of the data the reduction functions get
+def recorded( fn ):
+    def reduction( x, vid=None ):
+        shapes.append( x.shape )
+        return fn( x, vid )
+    return reduction
+
+def reduce_region( ft, varid, read_region, chunked=False ):
+    del shapes[:]
+    rv = reduced_variable( variableid=varid, filetable=ft, season=season, region='Tropics',
+                           chunked=chunked, read_region=read_region,
+                           reduction_function=recorded(
+            lambda x,vid=None: reduce2lat_seasonal(x,season,'Tropics',vid) ) )
+    return rv.reduce()
+
+# Synthetic lats are -75,-45,-15,15,45,75; the tropics are -40 to 40.
+for varid in [ 'TS', 'MISSV', 'T' ]:
+    for chunked in [ False, True ]:
+        what = "%s%s" % (varid, ", chunked" if chunked else "")
+        if chunked:
+            reductions.chunked_reduction_bytes = 0
+            reductions.numpy_climatology = True
+        try:
+            everything = reduce_region( ft, varid, None, chunked )
+            check( [ shape[-2] for shape in shapes ]==[6]*len(shapes),
+                   "%s: without read_region, all latitudes should be read" % what )
+            tropics = reduce_region( ft, varid, 'Tropics', chunked )
+            check( len(shapes)>0 and [ shape[-2] for shape in shapes ]==[2]*len(shapes),
+                   "%s: with read_region, only the tropics should be read, not %s" % (what,shapes) )
+        finally:
+            reductions.chunked_reduction_bytes = 2**30
+            reductions.numpy_climatology = False
+        check( same_values( everything, tropics ) and same_axes( everything, tropics ),
+               "%s: the result differs when only the region is read" % what )
+
+# A level of data on pressure levels.
+plevdir = tempdir()
+f = cdms2.open( files[0] )
+lat, lon = f.getAxis('lat'), f.getAxis('lon')
+f.close()
+plev = cdms2.createAxis( numpy.array([ 1000., 850., 500., 300., 200. ]), id='plev' )
+plev.designateLevel()
+plev.units = 'mbar'
+time = cdms2.createAxis( numpy.arange(12)*30.+15., id='time' )
+time.setBounds( numpy.array([ [30.*m, 30.*(m+1)] for m in range(12) ]) )
+time.designateTime( calendar=cdtime.NoLeapCalendar )
+time.units = 'days since 0001-01-01'
+rs = numpy.random.RandomState( 0 )
+z3 = cdms2.createVariable( 1000.*rs.random_sample( (12,5,len(lat),len(lon)) ),
+                           axes=[time,plev,lat,lon], id='Z3' )
+z3.units = 'm'    # so it is area weighted
+plevfile = os.path.join( plevdir, 'plev_data.nc' )
+f = cdms2.open( plevfile, 'w' )
+f.write( z3 )
+f.close()
+pft = make_datafiles( [plevfile], make_options(tempdir()) ).setup_filetable( 'plev' )
+
+for mbar in [ 1000, 850, 400 ]:
+    pselect = udunits( mbar, 'mbar' )
+    results = []
+    for read_level in [ None, pselect ]:
+        del shapes[:]
+        rv = reduced_variable( variableid='Z3', filetable=pft, season=season, read_level=read_level,
+                               reduction_function=recorded(
+                lambda x,vid=None: reduce_time_seasonal( x, season, None, vid ) ) )
+        results.append( select_lev( rv.reduce(), pselect ) )
+        check( [ shape[1] for shape in shapes ]==[ 5 if read_level is None else 1 ],
+               "%d mbar, read_level %s: read levels %s" % (mbar,read_level,shapes) )
+    check( same_values( results[0], results[1] ) and same_axes( results[0], results[1] ),
+           "%d mbar: the result differs when only the level is read" % mbar )
+
+# The cache keys.
+cft = make_datafiles( files, make_options(tempdir(),rvcache=True) ).setup_filetable( 'synth' )
+keys = []
+for read_region, read_level in [ (None,None), ('Tropics',None),
+                                 (None,udunits(500,'mbar')), (None,udunits(850,'mbar')) ]:
+    rv = reduced_variable( variableid='TS', filetable=cft, season=season,
+                           read_region=read_region, read_level=read_level,
+                           reduction_function=(lambda x,vid=None: reduce2lat_seasonal(x,season,None,vid)) )
+    rv.get_variable_file( 'TS' )
+    keys.append( rv.rvcache_key() )
+check( None not in keys, "reduced variables with read selectors should have cache keys" )
+check( len(set(keys))==len(keys), "different read selectors should have different cache keys" )
+
+cleanup( args )
+finish()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Checks that reduce2any() gives the same results when it reads a variable by time chunks, through
+# chunked_read(), as when it is given the whole variable; for several chunk sizes, seasons, regions
+# and target axes; and that no chunk is bigger than reduction_chunk_bytes.  And that chunked_read()
+# reads nothing when the variable is to be read whole: with the cdutil climatology engine, or when
+# the variable is small.  Uses synthetic data, so needs no arguments.
+
+import sys, os
+from perfcheck import *
+import metrics, cdms2
+import metrics.computation.reductions as reductions
+from metrics.computation.reductions import reduce2any, chunked_read, chunked_variable
+
+args = parse_args( "Compare reduce2any() of chunked and whole variables" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+fname = write_monthly_files( datadir, first=(1,1), nmonths=26, months_per_file=26 )[0]
+
+class recorder:
+    """Wraps an open file, and records the number of times read by each call."""
+    def __init__( self, f ):
+        self.f = f
+        self.reads = []
+    def __getattr__( self, att ):
+        return getattr( self.f, att )
+    def __call__( self, *args, **kwargs ):
+        var = self.f( *args, **kwargs )
+        tax = var.getTime()
+        self.reads.append( 1 if tax is None else len(tax) )
+        return var
+
+f = cdms2.open( fname )
+saved = reductions.chunked_reduction_bytes, reductions.reduction_chunk_bytes, \
+    reductions.numpy_climatology
+try:
+    reductions.numpy_climatology = True
+    # T would be mass weighted, which needs a filetable; the weighting doesn't matter here.
+    for varid, target_axes, weights in [ ('TS',['y'],None), ('TS',['x','y'],None),
+                                         ('T',['y','z'],'area'), ('MISSV',['x'],None) ]:
+        whole = f( varid )
+        stepbytes = whole[0].size * whole.dtype.itemsize
+        for steps in [ 1, 2, 5, 100 ]:
+            reductions.chunked_reduction_bytes = 0   # so every variable is chunked
+            reductions.reduction_chunk_bytes = steps*stepbytes
+            for season in [ 'DJF', 'JJA', 'ANN' ]:
+                for region in [ None, 'Tropics' ]:
+                    what = "%s to %s, %d steps per chunk, %s, %s" %\
+                        ( varid, target_axes, steps, season, region )
+                    rf = recorder( f )
+                    chunked = chunked_read( rf, varid, season=season )
+                    if not check( isinstance( chunked, chunked_variable ),
+                                  "%s: the variable was not chunked" % what ):
+                        continue
+                    del rf.reads[:]
+                    a = reduce2any( chunked, target_axes, season=season, region=region,
+                                    weights=weights )
+                    b = reduce2any( whole, target_axes, season=season, region=region,
+                                    weights=weights )
+                    check( same_values( a, b, rtol=1.e-5 ) and same_axes( a, b ),
+                           "%s: chunked and whole results differ" % what )
+                    check( a.id==b.id, "%s: ids %s and %s differ" % (what,a.id,b.id) )
+                    check( max(rf.reads)<=steps,
+                           "%s: read %d times at once" % (what,max(rf.reads)) )
+    # A variable no bigger than chunked_reduction_bytes is simply read.
+    reductions.chunked_reduction_bytes = 2**30
+    rf = recorder( f )
+    check( chunked_read( rf, 'TS' ) is None and rf.reads==[],
+           "a small variable should not be chunked, or read by chunked_read()" )
+    # cdutil needs the whole variable, so it isn't chunked.
+    reductions.numpy_climatology = False
+    reductions.chunked_reduction_bytes = 0
+    rf = recorder( f )
+    check( chunked_read( rf, 'TS', season='DJF' ) is None and rf.reads==[],
+           "with cdutil, a variable should not be chunked, or read by chunked_read()" )
+finally:
+    reductions.chunked_reduction_bytes, reductions.reduction_chunk_bytes, \
+        reductions.numpy_climatology = saved
+    f.close()
+
+cleanup( args )
+finish()
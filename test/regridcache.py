@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Checks the cache of preprocessed map file weights: a WeightFileRegridder loaded from the cache is
+# the same as one built from the map file, and regrids the same; loading from the cache doesn't
+# read the map file; and a changed map file is not served stale weights.  Uses synthetic data, so
+# needs no arguments.
+
+import sys, os, time
+import numpy
+from perfcheck import *
+import metrics, cdms2
+from metrics.packages.acme_regridder.scripts.acme_regrid import WeightFileRegridder, \
+    load_weight_cache
+
+args = parse_args( "Compare regridders built from the weight cache and from the map file" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+cachedir = os.path.join( tempdir(), 'weights' )   # made when first needed
+f = cdms2.open( write_ncol_file( os.path.join(datadir,'data.nc') ) )
+variables = [ f(varid) for varid in [ 'TS', 'T', 'Q', 'MISSV' ] ]
+f.close()
+
+# Count the files opened.
+opened = []
+cdms2_open = cdms2.open
+def counting_open( fn, *args, **kwargs ):
+    opened.append( fn )
+    return cdms2_open( fn, *args, **kwargs )
+
+def same_regridder( a, b, what ):
+    for name in [ 'S', 'row', 'col' ]:
+        check( numpy.array_equal( getattr(a,name), getattr(b,name) ), "%s: %s differs" % (what,name) )
+        check( getattr(a,name).dtype==getattr(b,name).dtype, "%s: %s type differs" % (what,name) )
+    check( (a.mask_b is False and b.mask_b is False) or
+           (a.mask_b is not False and b.mask_b is not False and
+            numpy.array_equal( a.mask_b, b.mask_b )), "%s: mask_b differs" % what )
+    check( a.nb==b.nb and a.n_s==b.n_s, "%s: sizes differ" % what )
+    check( a.method==b.method, "%s: map method differs" % what )
+    check( numpy.array_equal( a.area_b, b.area_b ), "%s: area_b differs" % what )
+    for axis in [ 'lats', 'lons' ]:
+        ax, bx = getattr(a,axis), getattr(b,axis)
+        check( numpy.array_equal( ax[:], bx[:] ) and
+               numpy.array_equal( ax.getBounds(), bx.getBounds() ) and
+               ax.id==bx.id and ax.units==bx.units, "%s: %s differ" % (what,axis) )
+    for V in variables:
+        check( same_values( a.regrid(V), b.regrid(V), rtol=0., atol=0. ) and
+               same_axes( a.regrid(V), b.regrid(V) ), "%s: regridded %s differs" % (what,V.id) )
+
+for masked in [ False, True ]:
+    mapfile = write_map_file( os.path.join(datadir,'map%d.nc' % masked), masked=masked )
+    fresh = WeightFileRegridder( mapfile )
+    check( load_weight_cache( mapfile, cachedir ) is None, "the cache should be empty at first" )
+    first = WeightFileRegridder( mapfile, cachedir=cachedir )   # writes the cache
+    same_regridder( fresh, first, "map mask %s, regridder which wrote the cache" % masked )
+    weights = load_weight_cache( mapfile, cachedir )
+    check( weights is not None, "map mask %s: the cache was not written" % masked )
+    if weights is not None:
+        check( isinstance( weights['S'], numpy.memmap ),
+               "map mask %s: cached weights are not memory-mapped" % masked )
+    cdms2.open = counting_open
+    del opened[:]
+    try:
+        cached = WeightFileRegridder( mapfile, cachedir=cachedir )
+    finally:
+        cdms2.open = cdms2_open
+    check( opened==[], "map mask %s: the map file was read although it is cached" % masked )
+    same_regridder( fresh, cached, "map mask %s, regridder from the cache" % masked )
+    # Fixed bounds and regrid_many() work on the cached weights too.
+    same_regridder( WeightFileRegridder( mapfile, fix_bounds=True ),
+                    WeightFileRegridder( mapfile, fix_bounds=True, cachedir=cachedir ),
+                    "map mask %s, fixed bounds" % masked )
+    for a, b in zip( fresh.regrid_many(variables), cached.regrid_many(variables) ):
+        check( same_values( a, b, rtol=0., atol=0. ), "map mask %s: regrid_many differs" % masked )
+
+# A changed map file has a different checksum, so its weights are read again.
+mapfile = os.path.join( datadir, 'map0.nc' )
+os.remove( mapfile )
+write_map_file( mapfile, seed=1 )
+st = os.stat( mapfile )
+os.utime( mapfile, (st.st_atime, st.st_mtime+10) )
+same_regridder( WeightFileRegridder( mapfile ), WeightFileRegridder( mapfile, cachedir=cachedir ),
+                "changed map file" )
+
+cleanup( args )
+finish()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Checks that acme_regrid with --time-chunk, which reads and regrids each variable a few time steps
+# at a time, writes the same file as regridding whole variables, and as --batch-mb.  Also checks
+# that regrid_time_chunks() reads no more than a chunk at a time.  Uses synthetic data, so needs
+# no arguments.
+
+import sys, os
+import numpy
+from perfcheck import *
+import metrics, cdms2
+from metrics.packages.acme_regridder.scripts.acme_regrid import WeightFileRegridder, \
+    make_parser, regrid_file, regrid_time_chunks, set_netcdf_flags
+
+args = parse_args( "Compare time-chunked and whole-variable regridding" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+set_netcdf_flags()
+datadir = tempdir()
+ntimes = 5
+datafile = write_ncol_file( os.path.join(datadir,'data.nc'), ntimes=ntimes )
+
+def regridded( regdr, name, options ):
+    """Regrids datafile with acme_regrid and the options, and returns the output file name."""
+    out = os.path.join( datadir, name+'.nc' )
+    regrid_file( regdr, make_parser().parse_args( ['-i',datafile,'-w',mapfile,'-o',out,'-q']+
+                                                  options ) )
+    return out
+
+for masked in [ False, True ]:
+    mapfile = write_map_file( os.path.join(datadir,'map%d.nc' % masked), masked=masked )
+    regdr = WeightFileRegridder( mapfile )
+    whole = regridded( regdr, 'whole%d' % masked, [] )
+    for options in [ ['--time-chunk','1'], ['--time-chunk','2'], ['--time-chunk','5'],
+                     ['--time-chunk','7'], ['--time-chunk','2','--var','TS','MISSV'],
+                     ['--time-chunk','3','--batch-mb','100'] ]:
+        name = 'chunked%d_%s' % (masked, '_'.join(options).replace('-',''))
+        out = regridded( regdr, name, options )
+        if '--var' in options:
+            ref = regridded( regdr, name+'_whole', ['--var','TS','MISSV'] )
+        else:
+            ref = whole
+        check( same_files( out, ref ), "map mask %s, %s: output differs" % (masked,options) )
+    try:
+        import scipy.sparse
+        out = regridded( regdr, 'batched%d' % masked, ['--batch-mb','100'] )
+        check( same_files( out, whole ), "map mask %s, --batch-mb: output differs" % masked )
+    except ImportError:
+        pass
+
+    # Each chunk is read separately, and each result is the regridded chunk.
+    class recorder:
+        """a file variable which records the time steps read from it"""
+        def __init__( self, V ):
+            self.V = V
+            self.reads = []
+        def __getattr__( self, name ):
+            return getattr( self.V, name )
+        def __getitem__( self, key ):
+            self.reads.append( key )
+            return self.V[key]
+    f = cdms2.open( datafile )
+    for varid in [ 'TS', 'T', 'Q', 'MISSV' ]:
+        V = recorder( f[varid] )
+        wholedata = regdr.regrid( f(varid) )
+        for tslice, dat2 in regrid_time_chunks( regdr, V, 2 ):
+            check( same_values( dat2, wholedata[tslice] ),
+                   "map mask %s, %s %s: chunk differs" % (masked,varid,tslice) )
+        check( V.reads==[ slice(0,2), slice(2,4), slice(4,5) ],
+               "map mask %s, %s: read %s, not one chunk at a time" % (masked,varid,V.reads) )
+    f.close()
+
+cleanup( args )
+finish()
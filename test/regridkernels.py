@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Checks the C regridding kernels apply_weights and apply_weights_masked against a computation in
+# numpy, for float32 and float64 input and output, with missing values, with input whose leading
+# dimensions are strided, and with a caller-supplied output array.  Needs no arguments.
+
+import sys
+import numpy
+from perfcheck import *
+import metrics
+from metrics.packages.acme_regridder import _regrid
+
+args = parse_args( "Compare the C regridding kernels with numpy" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+rs = numpy.random.RandomState( 0 )
+n_a, n_b = 40, 25
+# Every destination point but the last has a few sources, some of them repeated.
+row = numpy.repeat( numpy.arange(n_b-1), 4 ).astype( numpy.int32 )
+col = rs.randint( 0, n_a, size=len(row) ).astype( numpy.int32 )
+col[::4] = col[1::4]
+S = rs.random_sample( len(row) )
+missing = 1.e20
+
+def reference( data, mask=None ):
+    """out[i,row[k]] += S[k]*data[i,col[k]], in float64; where all the sources of a destination
+    point are masked (or it has none), the result is missing."""
+    data = numpy.asarray( data, dtype=numpy.float64 ).reshape( -1, n_a )
+    out = numpy.zeros( (data.shape[0],n_b) )
+    nvalid = numpy.zeros( (data.shape[0],n_b) )
+    valid = numpy.ones( data.shape ) if mask is None else\
+        numpy.logical_not( mask ).reshape( -1, n_a ).astype( numpy.float64 )
+    for k in range( len(S) ):
+        out[:,row[k]] += S[k]*data[:,col[k]]*valid[:,col[k]]
+        nvalid[:,row[k]] += valid[:,col[k]]
+    if mask is not None:
+        out[nvalid==0] = missing
+    return out
+
+def close( a, b, dtype ):
+    rtol = 1.e-5 if dtype==numpy.float32 else 1.e-12
+    return a.shape==b.shape and numpy.allclose( a, b, rtol=rtol, atol=0. )
+
+full = rs.random_sample( (6,3,n_a) )
+mask = full>0.75
+mask[0,0,:] = True   # a slice with no valid values at all
+inputs = [ ( "contiguous", lambda x: x ),
+           ( "time-strided", lambda x: x[::2] ),
+           ( "level-strided", lambda x: x[:,1:] ),
+           ( "last axis strided", lambda x: numpy.repeat(x,2,axis=-1)[...,::2] ),
+           ( "2-D slice", lambda x: x[3] ) ]
+
+for intype in [ numpy.float32, numpy.float64 ]:
+    for single in [ False, True ]:
+        outtype = numpy.float32 if single else numpy.float64
+        for name, select in inputs:
+            what = "%s input, %s output, %s" % ( numpy.dtype(intype).name,
+                                                 numpy.dtype(outtype).name, name )
+            data = select( full.astype(intype) )
+            m = select( mask )
+            ref = reference( data )
+            out = _regrid.apply_weights( data, S, row, col, n_b, single=single )
+            check( out.dtype==outtype, "%s: apply_weights gave %s" % (what,out.dtype) )
+            check( close( out, ref, outtype ), "%s: apply_weights differs from numpy" % what )
+
+            filled = numpy.where( m, intype(missing), data )
+            ref = reference( data, m )
+            out = _regrid.apply_weights_masked( filled, S, row, col, n_b, missing, single=single )
+            check( out.dtype==outtype, "%s: apply_weights_masked gave %s" % (what,out.dtype) )
+            check( close( out, ref, outtype ),
+                   "%s: apply_weights_masked differs from numpy" % what )
+            # NaN is also treated as missing.
+            nans = numpy.where( m, numpy.nan, data ).astype( intype )
+            out = _regrid.apply_weights_masked( nans, S, row, col, n_b, missing, single=single )
+            check( close( out, ref, outtype ),
+                   "%s: apply_weights_masked with NaN differs from numpy" % what )
+
+            # The same output array, reused.
+            buf = numpy.empty( ref.shape, dtype=outtype )
+            for repeat in range( 2 ):
+                out = _regrid.apply_weights_masked( filled, S, row, col, n_b, missing, out=buf )
+                check( out is buf, "%s: the output array was not used" % what )
+                check( close( buf, ref, outtype ), "%s: reused output array differs" % what )
+
+# Other types are converted to float64.
+out = _regrid.apply_weights( (100*full).astype(numpy.int32), S, row, col, n_b )
+check( close( out, reference((100*full).astype(numpy.int32)), numpy.float64 ),
+       "integer input differs from numpy" )
+
+# Bad arguments are errors, not crashes.
+def fails( exception, *fargs, **fkwargs ):
+    try:
+        _regrid.apply_weights( *fargs, **fkwargs )
+    except exception:
+        return True
+    return False
+check( fails( IndexError, full, S, row, col, n_b-2 ), "a row index out of range was accepted" )
+check( fails( IndexError, full[...,:n_a-5], S, row, col, n_b ),
+       "a col index out of range was accepted" )
+check( fails( ValueError, full, S[1:], row, col, n_b ), "weights of different lengths were accepted" )
+check( fails( ValueError, full, S, row, col, n_b, out=numpy.empty((5,n_b)) ),
+       "an output array of the wrong shape was accepted" )
+check( fails( ValueError, full, S, row, col, n_b, out=numpy.empty((18,n_b),dtype=numpy.int32) ),
+       "an output array of the wrong type was accepted" )
+
+cleanup( args )
+finish()
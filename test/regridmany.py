@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Checks that WeightFileRegridder.regrid_many(), which regrids a batch of variables with one sparse
+# matrix product, gives the same results as regridding each variable with regrid(), for variables
+# with and without missing values, and map files with and without masked destination points.
+# Also checks the renormalized results against a dense-matrix computation.  Uses synthetic data,
+# so needs no arguments.
+
+import sys, os
+import numpy
+from perfcheck import *
+import metrics, cdms2
+from metrics.packages.acme_regridder.scripts.acme_regrid import WeightFileRegridder
+
+args = parse_args( "Compare batched and per-variable regridding" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+try:
+    import scipy.sparse
+except ImportError:
+    print "scipy is not available, so regrid_many() is regrid(); nothing to compare"
+    finish()
+
+datadir = tempdir()
+n_a = 30
+f = cdms2.open( write_ncol_file( os.path.join(datadir,'data.nc'), n_a=n_a ) )
+variables = dict([ (varid,f(varid)) for varid in [ 'TS', 'T', 'Q', 'MISSV' ] ])
+f.close()
+check( variables['MISSV'].mask.any(), "MISSV should have missing values" )
+
+def same( a, b, what ):
+    check( same_values(a,b) and same_axes(a,b), "%s: data or axes differ" % what )
+    if a.id=='MISSV':
+        check( a.getMissing()==b.getMissing(), "%s: missing values differ" % what )
+    check( a.id==b.id, "%s: ids differ" % what )
+
+for masked in [ False, True ]:
+    mapfile = write_map_file( os.path.join(datadir,'map%d.nc' % masked), n_a=n_a, masked=masked )
+    regdr = WeightFileRegridder( mapfile )
+    for varids in [ ['TS'], ['TS','T'], ['TS','T','Q'], ['MISSV'], ['T','MISSV','TS','Q'] ]:
+        inputs = [ variables[v] for v in varids ]
+        batched = regdr.regrid_many( inputs )
+        check( len(batched)==len(inputs), "one result per variable expected" )
+        for varid,input,result in zip( varids, inputs, batched ):
+            same( result, regdr.regrid(input),
+                  "map mask %s, batch %s, variable %s" % (masked,varids,varid) )
+    check( regdr.regrid_many([])==[], "an empty batch should give no results" )
+
+    # Renormalized: each value is divided by the total weight of its non-missing sources.
+    W = numpy.zeros( (regdr.nb,n_a) )
+    numpy.add.at( W, (regdr.row,regdr.col), regdr.S )
+    renorm = WeightFileRegridder( mapfile, renormalize=True )
+    result = renorm.regrid_many( [ variables['TS'], variables['MISSV'] ] )
+    same( result[0], regdr.regrid(variables['TS']), "map mask %s, renormalized TS" % masked )
+    missv = variables['MISSV']
+    M = float( missv.getMissing() )
+    valid = numpy.logical_not( numpy.ma.getmaskarray(missv) ).astype(numpy.float64)
+    total = numpy.dot( numpy.ma.filled(missv,0.), W.T )
+    wvalid = numpy.dot( valid, W.T )
+    nvalid = numpy.dot( valid, (W!=0).T )
+    expected = numpy.where( nvalid==0, M, total/numpy.where(wvalid==0,1.,wvalid) )
+    got = numpy.ma.filled( result[1], M ).reshape( expected.shape )
+    unmasked = numpy.logical_not( numpy.ma.getmaskarray(result[1]).reshape(expected.shape) )
+    check( numpy.allclose( got[unmasked], expected[unmasked] ),
+           "map mask %s, renormalized MISSV differs from the dense computation" % masked )
+
+cleanup( args )
+finish()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Checks the keys of the reduced variable cache: reduction functions which compute different
+# things, e.g. lambdas which differ only in the values they have captured, or functions with
+# different names, get different keys, as do the two climatology engines; functions which can't
+# be identified exactly get no key; and a reduced variable loaded from the cache is the same as
+# one computed without it.  Uses synthetic data, so needs no arguments.
+
+import sys, os, types
+import numpy, cdutil
+from perfcheck import *
+import metrics
+import metrics.fileio.rvcache as rvcache
+from metrics.fileio.rvcache import rvcache_key, function_identity, inexact_key
+import metrics.computation.reductions as reductions
+from metrics.computation.reductions import reduced_variable, reduce2lat_seasonal
+
+args = parse_args( "Check the keys of the reduced variable cache" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=12 )
+
+def key( fn, datafiles=files, extras=() ):
+    try:
+        return rvcache_key( ('rv','TS','JJA',None,None), datafiles, extras, fn )
+    except inexact_key:
+        return None
+
+def scaler( x ):
+    return lambda mv, vid=None: mv*x
+check( key(scaler(1.))==key(scaler(1.)), "equal closures should have the same key" )
+check( key(scaler(1.))!=key(scaler(2.)), "closures with different values have the same key" )
+
+class params:
+    def __init__( self, level ):
+        self.region = {'lat':(-30.,30.), 'levels':{'lev':level}}
+def with_params( p ):
+    return lambda mv, vid=None: mv(lat=p.region['lat'])
+check( key(with_params(params(500.)))!=key(with_params(params(850.))),
+       "closures with different nested values have the same key" )
+
+m1 = numpy.ma.array( [1.,2.,3.], mask=[0,0,0] )
+m2 = numpy.ma.array( [1.,2.,3.], mask=[0,1,0] )
+check( key(scaler(m1))!=key(scaler(m2)), "closures with different masks have the same key" )
+
+# Functions are identified by their names and lines, not by their code, which is identified by
+# the commit of the metrics package and by cache_version.
+source = "def reduce(mv,vid=None):\n    return mv*%s\n"
+ns1, ns2, ns3 = {'__name__':'synth'}, {'__name__':'synth'}, {'__name__':'synth2'}
+exec source % '1.' in ns1
+exec source % '2.' in ns2
+exec source % '1.' in ns3
+check( key(ns1['reduce'])==key(ns2['reduce']),
+       "the key of a function should not depend on its code" )
+check( key(ns1['reduce'])!=key(ns3['reduce']),
+       "functions in different modules have the same key" )
+once = lambda mv,vid=None: mv*1.
+twice = lambda mv,vid=None: mv*2.
+check( key(once)!=key(twice), "lambdas on different lines have the same key" )
+k0 = key( ns1['reduce'] )
+rvcache.cache_version += 1
+check( key(ns1['reduce'])!=k0, "changing cache_version should change the key" )
+rvcache.cache_version -= 1
+
+class opaque(object):
+    __slots__ = ['value']
+    def __init__( self, value ):
+        self.value = value
+check( key(scaler(opaque(1)))==None, "an object identified by its address should prevent a key" )
+class chain:
+    def __init__( self, n ):
+        self.next = chain(n-1) if n>0 else None
+def follower( c ):
+    return lambda mv, vid=None: mv if c.next is None else mv*2.
+check( key(follower(chain(2)))!=None, "a shallow object should have a key" )
+check( key(follower(chain(20)))==None, "an object nested too deeply should prevent a key" )
+
+k0 = key( scaler(1.) )
+st = os.stat( files[3] )
+os.utime( files[3], (st.st_atime, st.st_mtime+10) )
+check( key(scaler(1.))!=k0, "changing a data file should change the key" )
+check( key(scaler(1.),extras=(None,(-90.,0.)))!=key(scaler(1.),extras=(None,(0.,90.))),
+       "different ranges have the same key" )
+
+# Results computed, stored in the cache, and loaded from the cache.
+season = cdutil.times.Seasons('JJA')
+values = {}
+for use_cache in [ False, True, True ]:
+    opts = make_options( tempdir() if not use_cache else os.path.join(datadir,'cache'),
+                         rvcache=use_cache )
+    ft = make_datafiles( files, opts ).setup_filetable( 'synth' )
+    for varid in [ 'TS', 'MISSV', 'T' ]:
+        rv = reduced_variable( variableid=varid, filetable=ft, season=season,
+                               reduction_function=(lambda x,vid=None: reduce2lat_seasonal(x,season,None,vid)) )
+        values.setdefault( varid, [] ).append( rv.reduce() )
+for varid in values:
+    first = values[varid][0]
+    for value in values[varid][1:]:
+        check( same_values(first,value) and same_axes(first,value),
+               "%s from the cache differs from the computed value" % varid )
+cachefiles = os.listdir( os.path.join(datadir,'cache','rvcache') )
+check( len([ fn for fn in cachefiles if fn.endswith('.nc') ])==3, "all variables should be cached" )
+check( len([ fn for fn in cachefiles if fn.endswith('.lock') ])==0, "locks should be released" )
+
+# The climatology engines give different results for incomplete seasons, so different keys.
+rv.get_variable_file( rv.variableid )
+keys = []
+for numpy_climatology in [ False, True ]:
+    reductions.numpy_climatology = numpy_climatology
+    keys.append( rv.rvcache_key() )
+reductions.numpy_climatology = False
+check( None not in keys and keys[0]!=keys[1], "the climatology engines have the same key" )
+
+cleanup( args )
+finish()
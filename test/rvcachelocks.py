@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Checks the locks of the reduced variable cache, by which one process waits for another to
+# compute a reduced variable: the waiter gets the stored result; it stops waiting as soon as the
+# result is found not to be cacheable, or the other process has died, or the wait is too long;
+# reduced variables which can't be cached are marked so that nobody waits for them again; and a
+# mass-weighted variable is cached with the mass weights which computing it saved.
+# Uses synthetic data, so needs no arguments.
+
+import sys, os, time, socket, multiprocessing
+import numpy, cdms2, cdutil
+from perfcheck import *
+import metrics
+from metrics.fileio.rvcache import rvcache
+from metrics.computation.reductions import reduced_variable, reduce2lat_seasonal
+
+args = parse_args( "Check the locks of the reduced variable cache" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+cachedir = tempdir()
+cache = rvcache( cachedir, waittime=60 )
+data = cdms2.createVariable( numpy.arange(6.).reshape(2,3), id='synth' )
+
+def store_later( key ):
+    time.sleep( 1 )
+    cache.store( key, data )
+    cache.release( key )
+def refuse_and_hold( key ):
+    time.sleep( 1 )
+    cache.refuse( key )
+    time.sleep( 60 )
+    cache.release( key )
+
+check( cache.claim('k1'), "the first claim should succeed" )
+check( not cache.claim('k1'), "a second claim should fail" )
+p = multiprocessing.Process( target=store_later, args=('k1',) )
+p.start()
+waited, attributes = cache.wait( 'k1' )
+p.join()
+check( waited is not None and same_values( waited, data ), "the waiter should get the stored data" )
+
+check( cache.claim('k2'), "claim of k2 should succeed" )
+p = multiprocessing.Process( target=refuse_and_hold, args=('k2',) )
+p.start()
+t0 = time.time()
+waited, attributes = cache.wait( 'k2' )
+check( waited is None and time.time()-t0<30,
+       "the waiter should stop waiting when the data is found not cacheable" )
+p.terminate()
+p.join()
+cache.release( 'k2' )
+check( cache.refused('k2'), "k2 should be marked as not cacheable" )
+
+# A lock left by a process which has died.
+p = multiprocessing.Process( target=time.sleep, args=(0,) )
+p.start()
+p.join()
+open( cache._lockname('k3'), 'w' ).write( '%s %d' % (socket.gethostname(), p.pid) )
+t0 = time.time()
+cache.wait( 'k3' )
+check( time.time()-t0<30 and not os.path.exists(cache._lockname('k3')),
+       "a stale lock should be removed without waiting" )
+
+# A lock held too long.
+impatient = rvcache( cachedir, waittime=1 )
+check( impatient.claim('k4'), "claim of k4 should succeed" )
+t0 = time.time()
+impatient.wait( 'k4' )
+check( 1<=time.time()-t0<30, "the waiter should give up after waittime" )
+impatient.release( 'k4' )
+
+# Reduced variables: TS and T, which is mass-weighted, can be cached; data which is all missing
+# can't.
+datadir = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=12 )
+season = cdutil.times.Seasons('JJA')
+def reduced( ft, varid ):
+    if varid=='missing':
+        return reduced_variable( variableid='TS', filetable=ft, season=season,
+                                 reduction_function=(lambda x,vid=None: cdms2.createVariable(
+                    numpy.ma.masked_all((3,)), id='missing' )) )
+    return reduced_variable( variableid=varid, filetable=ft, season=season,
+                             reduction_function=(lambda x,vid=None: reduce2lat_seasonal(x,season,None,vid)) )
+plain = make_datafiles( files, make_options(tempdir()) ).setup_filetable( 'synth' )
+cachepath = tempdir()
+cached = make_datafiles( files, make_options(cachepath,rvcache=True) ).setup_filetable( 'synth' )
+for varid,cacheable in [ ('TS',True), ('T',True), ('missing',False) ]:
+    expected = reduced( plain, varid ).reduce()
+    for n in range(2):
+        rv = reduced( cached, varid )
+        value = rv.reduce()
+        check( (value is None and expected is None) or same_values( value, expected ),
+               "%s differs with the cache" % varid )
+        key = rv.rvcache_key()
+        check( key is not None, "%s should have a cache key" % varid )
+        if key is not None:
+            check( cached.rvcache.refused(key)==(not cacheable),
+                   "%s should %sbe marked as not cacheable" % (varid, '' if not cacheable else 'not ') )
+            check( os.path.exists( cached.rvcache._filename(key) )==cacheable,
+                   "%s should %sbe stored" % (varid, '' if cacheable else 'not ') )
+            check( not os.path.exists( cached.rvcache._lockname(key) ),
+                   "the lock for %s should have been released" % varid )
+
+# The mass weights saved while T was computed are restored when it is loaded, in a later run.
+weights = dict( cached.massweights._weights )
+check( len(weights)>0, "computing T should have saved mass weights" )
+later = make_datafiles( files, make_options(cachepath,rvcache=True) ).setup_filetable( 'synth' )
+value = reduced( later, 'T' ).reduce()
+check( same_values( value, reduced( plain, 'T' ).reduce() ), "T from the cache differs" )
+check( sorted(later.massweights._weights.keys())==sorted(weights.keys()) and
+       all([ same_values( later.massweights._weights[k], weights[k] ) for k in weights ]),
+       "loading T from the cache should restore its mass weights" )
+
+cleanup( args )
+finish()
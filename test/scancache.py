@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Checks the per-file cache of filetable header scans: a filetable built with the cache is the
+# same as one built by scanning every file; unchanged files are not scanned again; and changed,
+# new, and removed files are accounted for.  Uses synthetic data, so needs no arguments.
+
+import sys, os, pickle
+from perfcheck import *
+import metrics
+import metrics.fileio.filetable as filetable
+from metrics.fileio.filetable import basic_filetable
+
+args = parse_args( "Check the cache of filetable header scans" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+cachepath = tempdir()
+files = write_monthly_files( datadir, first=(1,1), nmonths=4 )
+opts = make_options( cachepath )
+
+# Count the files scanned.
+scanned = []
+scan_datafile = filetable.scan_datafile
+def counting_scan( filep, *args, **kwargs ):
+    scanned.append( filep )
+    return scan_datafile( filep, *args, **kwargs )
+filetable.scan_datafile = counting_scan
+
+def uncached( files ):
+    """a filetable built without the cache"""
+    return basic_filetable( make_datafiles(files,opts), opts, 'synth' )
+
+def cache_entries( datafiles ):
+    cachefile = datafiles._cachefile( 'synth' )[0]
+    return pickle.load( open(cachefile,'rb') )
+
+datafiles = make_datafiles( files, opts )
+ft = datafiles.setup_filetable( 'synth' )
+check( sorted(scanned)==sorted(files), "first build should scan every file" )
+check( filetable_rows(ft)==filetable_rows(uncached(files)), "first build differs from a fresh scan" )
+check( sorted(cache_entries(datafiles).keys())==sorted(files), "cache should have one entry per file" )
+
+del scanned[:]
+ft = make_datafiles( files, opts ).setup_filetable( 'synth' )
+check( scanned==[], "unchanged files were scanned again: %s" % scanned )
+check( filetable_rows(ft)==filetable_rows(uncached(files)), "cached build differs from a fresh scan" )
+
+# Change a file: rewrite it without the variable MISSV, with a later modification time.
+os.remove( files[1] )
+write_monthly_files( datadir, first=(1,2), nmonths=1, missing=False )
+st = os.stat( files[1] )
+os.utime( files[1], (st.st_atime, st.st_mtime+10) )
+# ... and add a file.
+newfiles = files + write_monthly_files( datadir, first=(1,5), nmonths=1 )
+del scanned[:]
+ft = make_datafiles( newfiles, opts ).setup_filetable( 'synth' )
+check( sorted(scanned)==sorted([files[1],newfiles[-1]]),
+       "only the changed and new files should be scanned, not %s" % scanned )
+check( filetable_rows(ft)==filetable_rows(uncached(newfiles)),
+       "build after changes differs from a fresh scan" )
+check( 'MISSV' not in [ r.variableid for r in ft._table if r.fileid==files[1] ],
+       "the changed file's old rows were used" )
+
+# Remove a file.
+fewerfiles = newfiles[1:]
+ft = make_datafiles( fewerfiles, opts ).setup_filetable( 'synth' )
+check( filetable_rows(ft)==filetable_rows(uncached(fewerfiles)),
+       "build after removing a file differs from a fresh scan" )
+check( sorted(cache_entries(make_datafiles(fewerfiles,opts)).keys())==sorted(fewerfiles),
+       "the removed file's cache entry should be dropped" )
+
+filetable.scan_datafile = scan_datafile
+cleanup( args )
+finish()
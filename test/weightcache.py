@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Checks the mass weight cache: find() returns weights only from the same file as the variable,
+# matching just the axes the variable has, and none if the variable's file is unknown; weights
+# saved on disk are found by a later cache; keys change when the file changes; and the cache
+# stays within its size.  Uses synthetic weights, so needs no arguments.
+
+import sys, os, time
+import numpy, cdms2
+from perfcheck import *
+import metrics
+from metrics.fileio.weightcache import weightcache, source_fingerprint, axis_fingerprint
+
+args = parse_args( "Check the mass weight cache" )
+print "TEST is using metrics version:",metrics.git.commit,metrics.git.branch,metrics.git.closest_tag
+
+datadir = tempdir()
+djf = os.path.join( datadir, 'model_DJF_climo.nc' )
+jja = os.path.join( datadir, 'model_JJA_climo.nc' )
+for fn in [ djf, jja ]:
+    open( fn, 'w' ).write( fn )
+
+lev, lat, lon = 'lev', 'lat', 'lon'   # stand-ins for axis fingerprints
+def weights( value, n=10 ):
+    return cdms2.createVariable( numpy.ones(n)*value, id='mass_weights' )
+
+def same( a, b ):
+    return a is not None and b is not None and numpy.array_equal( numpy.asarray(a), numpy.asarray(b) )
+
+for cachedir in [ None, tempdir() ]:
+    what = "on disk" if cachedir else "in memory"
+    cache = weightcache( None, cachedir )
+    fdjf, fjja = source_fingerprint(djf), source_fingerprint(jja)
+    cache.put( (lev,lat,lon,fdjf), weights(1.) )
+    cache.put( ('lev2',lat,lon,fdjf), weights(2.) )
+    if cachedir is not None:
+        cache = weightcache( None, cachedir )   # a later run
+    check( same( cache.find( (lev,lat,lon,fdjf) ), weights(1.) ), "%s: the same key" % what )
+    check( same( cache.find( (lev,lat,None,fdjf) ), weights(1.) ) and
+           same( cache.find( (None,lat,lon,fdjf) ), cache.find( (None,lat,lon,fdjf) ) ),
+           "%s: a variable lacking an axis should get weights from its file" % what )
+    check( same( cache.find( (None,lat,None,fdjf) ), cache.find( (None,lat,None,fdjf) ) ),
+           "%s: the choice among several weights should always be the same" % what )
+    # Another season's file has another surface pressure, so its weights would be wrong.
+    check( cache.find( (lev,lat,lon,fjja) ) is None, "%s: weights from another file" % what )
+    check( cache.find( (None,lat,None,fjja) ) is None,
+           "%s: weights from another file, for a variable lacking axes" % what )
+    check( cache.find( (lev,lat,lon,None) ) is None and cache.find( (None,lat,lon,None) ) is None,
+           "%s: a variable from an unknown file should get no cached weights" % what )
+    check( cache.find( (lev,'lat2',None,fdjf) ) is None, "%s: weights for other axes" % what )
+    cache.put( (lev,lat,lon,fjja), weights(3.) )
+    check( same( cache.find( (None,lat,lon,fjja) ), weights(3.) ),
+           "%s: each file should get its own weights" % what )
+    # Nothing is stored under an incomplete key.
+    cache.put( (lev,lat,lon,None), weights(4.) )
+    check( cache.find( (lev,lat,lon,None) ) is None, "%s: weights stored for an unknown file" % what )
+
+# A changed file has another fingerprint.
+fdjf = source_fingerprint( djf )
+st = os.stat( djf )
+os.utime( djf, (st.st_atime, st.st_mtime+10) )
+check( source_fingerprint( djf )!=fdjf, "a changed file should have another fingerprint" )
+check( source_fingerprint( None ) is None, "an unknown file should have no fingerprint" )
+ax32 = cdms2.createAxis( numpy.linspace(-80.,80.,9).astype(numpy.float32), id='lat' )
+ax64 = cdms2.createAxis( numpy.linspace(-80.,80.,9), id='lat' )
+check( axis_fingerprint(ax32)==axis_fingerprint(ax64),
+       "an axis should have the same fingerprint in single and double precision" )
+
+# The least recently used weights are dropped to keep within the size.
+cache = weightcache( 2.5*weights(0.).nbytes )
+for i in range(3):
+    cache.put( (lev,lat,lon,'file%d' % i), weights(float(i)) )
+check( cache.find( (lev,lat,lon,'file0') ) is None and
+       same( cache.find( (lev,lat,lon,'file2') ), weights(2.) ),
+       "the least recently used weights should be dropped" )
+
+cleanup( args )
+finish()